@@ -0,0 +1,244 @@
+"""デバッグ用の計測ログ（NDJSON。main / media_downloader / media_only / twitter_video_api が共有する）
+
+以前は呼び出しのたびにログファイルを開いて1行追記していたため、HLSのセグメントごとの
+ダウンロードなどでは記録そのものが無視できないコストになっていた。ここでは
+
+- 呼び出し側はキューに積むだけ（JSON化とファイル書き込みはバックグラウンドのスレッド）
+- 書き込みは batch_size 件ごとにまとめて1回
+- レベル（off / error / info / debug / trace）とサンプリング率で記録量を絞る
+- ファイルが max_bytes を超えたらローテーション（.1, .2, ...）
+- 無効（off）なら agent_log() はレベル比較1回で戻り、スレッドもファイルも作らない
+
+とする。設定は環境変数（AGENT_LOG / AGENT_LOG_SAMPLE / AGENT_LOG_PATHS / AGENT_LOG_MAX_MB /
+AGENT_LOG_BACKUPS）か configure() で行う。既定は off。
+"""
+
+from __future__ import annotations
+
+import atexit
+import json
+import os
+import queue
+import random
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence
+
+LEVELS = {"off": 0, "error": 1, "info": 2, "debug": 3, "trace": 4}
+
+_PROJECT_DIR = Path(__file__).resolve().parent
+# 開発環境（Windows）のエディタが読むログ
+_EDITOR_DEBUG_LOG = r"h:\document\program\project\getTweet\.cursor\debug.log"
+
+
+def default_paths() -> List[Path]:
+    paths = [_PROJECT_DIR / "debug.ndjson", _PROJECT_DIR / ".cursor" / "debug.log"]
+    if os.name == "nt":
+        paths.insert(0, Path(_EDITOR_DEBUG_LOG))
+    return paths
+
+
+class AgentLogWriter:
+    """キューに積まれた記録をまとめてファイルに追記するバックグラウンドライター"""
+
+    def __init__(
+        self,
+        paths: Sequence[Path],
+        max_bytes: int = 50 * 2**20,
+        backups: int = 3,
+        batch_size: int = 256,
+        flush_interval: float = 0.5,
+        queue_size: int = 100_000,
+    ):
+        self.paths = [Path(p) for p in paths]
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval
+        self.written = 0
+        self.dropped = 0
+        self._queue: "queue.Queue[Optional[Dict]]" = queue.Queue(maxsize=queue_size)
+        self._thread = threading.Thread(target=self._run, name="agent-log", daemon=True)
+        self._thread.start()
+
+    def put(self, payload: Dict) -> None:
+        try:
+            self._queue.put_nowait(payload)
+        except queue.Full:
+            # 書き込みが追いつかないときは記録を捨てる（呼び出し側を待たせない）
+            self.dropped += 1
+
+    def _run(self) -> None:
+        while True:
+            try:
+                item = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                continue
+            stop = item is None
+            batch = [] if stop else [item]
+            while len(batch) < self.batch_size:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+            if batch:
+                self._write(batch)
+            if stop:
+                return
+
+    def _write(self, batch: List[Dict]) -> None:
+        lines = []
+        for payload in batch:
+            try:
+                lines.append(json.dumps(payload, ensure_ascii=False, default=str))
+            except Exception:
+                continue
+        if not lines:
+            return
+        text = "\n".join(lines) + "\n"
+        for path in self.paths:
+            try:
+                path.parent.mkdir(parents=True, exist_ok=True)
+                self._rotate_if_needed(path)
+                with open(path, "a", encoding="utf-8") as f:
+                    f.write(text)
+            except Exception:
+                pass
+        self.written += len(lines)
+
+    def _rotate_if_needed(self, path: Path) -> None:
+        if not self.max_bytes or not path.exists() or path.stat().st_size < self.max_bytes:
+            return
+        if self.backups <= 0:
+            path.unlink()
+            return
+        for i in range(self.backups - 1, 0, -1):
+            older = path.with_name(f"{path.name}.{i}")
+            if older.exists():
+                os.replace(older, path.with_name(f"{path.name}.{i + 1}"))
+        os.replace(path, path.with_name(f"{path.name}.1"))
+
+    def close(self, timeout: float = 5.0) -> None:
+        """キューに残っている記録を書き切って止める"""
+        if not self._thread.is_alive():
+            return
+        try:
+            self._queue.put(None, timeout=timeout)
+        except queue.Full:
+            return
+        self._thread.join(timeout)
+
+
+_lock = threading.Lock()
+_level = LEVELS["off"]
+_sample = 1.0
+_writer: Optional[AgentLogWriter] = None
+_writer_options: Dict = {}
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, default))
+    except ValueError:
+        return default
+
+
+def configure(
+    level: Optional[str] = None,
+    sample: Optional[float] = None,
+    paths: Optional[Sequence[Path]] = None,
+    max_bytes: Optional[int] = None,
+    backups: Optional[int] = None,
+) -> None:
+    """記録のレベル・サンプリング率・出力先を設定する（省略した項目は環境変数か既定値）"""
+    global _level, _sample, _writer_options
+    if level is None:
+        level = os.getenv("AGENT_LOG", "off")
+    level = str(level).strip().lower() or "off"
+    if level not in LEVELS:
+        level = "debug" if level in ("1", "true", "on", "yes") else "off"
+    if sample is None:
+        sample = _env_float("AGENT_LOG_SAMPLE", 1.0)
+    if paths is None:
+        env_paths = os.getenv("AGENT_LOG_PATHS", "")
+        paths = [Path(p) for p in env_paths.split(os.pathsep) if p] or default_paths()
+    if max_bytes is None:
+        max_bytes = int(_env_float("AGENT_LOG_MAX_MB", 50) * 2**20)
+    if backups is None:
+        backups = int(_env_float("AGENT_LOG_BACKUPS", 3))
+    with _lock:
+        _close_writer()
+        _level = LEVELS[level]
+        _sample = min(1.0, max(0.0, sample))
+        _writer_options = {"paths": list(paths), "max_bytes": max_bytes, "backups": backups}
+
+
+def _close_writer(timeout: float = 5.0) -> None:
+    global _writer
+    if _writer is not None:
+        _writer.close(timeout)
+        _writer = None
+
+
+def _get_writer() -> AgentLogWriter:
+    global _writer
+    if _writer is None:
+        with _lock:
+            if _writer is None:
+                _writer = AgentLogWriter(**_writer_options)
+    return _writer
+
+
+def enabled(level: str = "debug") -> bool:
+    """そのレベルの記録が有効か（記録内容の組み立てが重い箇所で先に判定する）"""
+    return _level >= LEVELS[level]
+
+
+def agent_log(
+    hypothesisId: str,
+    location: str,
+    message: str,
+    data: Optional[Dict] = None,
+    runId: str = "pre",
+    level: str = "debug",
+) -> None:
+    """1件記録する（キューに積むだけ。無効なレベルやサンプリングで外れた分は何もしない）
+
+    data のJSON化はバックグラウンドで行うので、呼び出し後に data を書き換えないこと。
+    """
+    if _level < LEVELS[level]:
+        return
+    if _sample < 1.0 and level != "error" and random.random() >= _sample:
+        return
+    _get_writer().put({
+        "sessionId": "debug-session",
+        "runId": runId,
+        "hypothesisId": hypothesisId,
+        "location": location,
+        "message": message,
+        "data": data or {},
+        "timestamp": int(time.time() * 1000),
+    })
+
+
+def flush(timeout: float = 5.0) -> None:
+    """キューに残っている記録を書き切る（テストや終了前の確認用。次の記録で新しいライターを作る）"""
+    with _lock:
+        _close_writer(timeout)
+
+
+def safe_url_tag(url: Optional[str], limit: int = 160) -> str:
+    """記録用にURLを切り詰める"""
+    try:
+        return str(url)[:limit] if url else ""
+    except Exception:
+        return ""
+
+
+configure()
+atexit.register(flush)
@@ -0,0 +1,63 @@
+"""HLSプレイリスト解析のベンチマーク
+
+使い方:
+    python bench_hls_playlist.py [--iterations 2000] [--segments 1200]
+"""
+
+import argparse
+import time
+from pathlib import Path
+
+from hls_playlist import PlaylistCache, parse_playlist
+
+FIXTURES = Path(__file__).resolve().parent / "fixtures" / "hls"
+BASE_URL = "https://video.twimg.com/ext_tw_video/1234567890/pu/pl/master.m3u8"
+
+
+def _long_media_playlist(segments: int) -> str:
+    """長尺動画を想定したfMP4のmedia playlist"""
+    lines = [
+        "#EXTM3U",
+        "#EXT-X-VERSION:6",
+        "#EXT-X-TARGETDURATION:3",
+        '#EXT-X-MAP:URI="/ext_tw_video/1234567890/pu/vid/avc1/0/0/1280x720/init.mp4"',
+    ]
+    for i in range(segments):
+        lines.append("#EXTINF:3.000,")
+        lines.append(f"/ext_tw_video/1234567890/pu/vid/avc1/{i * 3000}/{(i + 1) * 3000}/1280x720/seg{i}.m4s")
+    lines.append("#EXT-X-ENDLIST")
+    return "\n".join(lines) + "\n"
+
+
+def _bench(name: str, func, iterations: int) -> None:
+    func()  # ウォームアップ
+    start = time.perf_counter()
+    for _ in range(iterations):
+        func()
+    elapsed = time.perf_counter() - start
+    print(f"{name:<28} {iterations:>6}回  {elapsed * 1e6 / iterations:>10.1f} µs/回")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="HLSプレイリスト解析のベンチマーク")
+    parser.add_argument("--iterations", type=int, default=2000, help="各ケースの繰り返し回数")
+    parser.add_argument("--segments", type=int, default=1200, help="長尺media playlistのセグメント数")
+    args = parser.parse_args()
+
+    cases = {
+        "master": (FIXTURES / "master.m3u8").read_text(encoding="utf-8"),
+        "media_fmp4": (FIXTURES / "media_fmp4.m3u8").read_text(encoding="utf-8"),
+        "media_byterange": (FIXTURES / "media_byterange.m3u8").read_text(encoding="utf-8"),
+        f"media_long({args.segments})": _long_media_playlist(args.segments),
+    }
+    for name, text in cases.items():
+        iterations = args.iterations if "long" not in name else max(1, args.iterations // 20)
+        _bench(f"parse {name}", lambda text=text: parse_playlist(text, BASE_URL), iterations)
+
+    cache = PlaylistCache()
+    cache.put(BASE_URL, parse_playlist(cases["master"], BASE_URL))
+    _bench("cache hit", lambda: cache.get(BASE_URL), args.iterations)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,205 @@
+"""保存済みタイムラインHTMLでのTweet解析ベンチマーク（オフライン）
+
+fixtures/timeline/*.html をヘッドレスChromiumにローカルファイルとして読み込み、
+TwitterScraper._extract_tweets() をそのまま走らせて次を出す:
+
+- 1秒あたりに解析できた article 要素の数
+- article 1件あたりの Playwright 呼び出し回数（メソッド別。1回ごとにブラウザとのIPCが発生する）
+- 出力と <name>.golden.json（期待するTweetのdict）の一致（不一致なら終了コード1）
+
+ネットワークには出ない（file: 以外のリクエストは中断し、動画URLの解決は要素内HTMLからのみ）。
+解析結果を意図して変えたときは --update-golden で期待値を書き直す。
+playwright install していない環境では --executable-path（または環境変数 CHROMIUM_EXECUTABLE_PATH）で
+Chromium の実行ファイルを指定する。
+
+使い方:
+    python bench_tweet_parsing.py [--iterations 20] [--copies 20] [--fixture fixtures/timeline/timeline.html]
+    python bench_tweet_parsing.py --update-golden
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from collections import Counter
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterator, List
+
+from playwright.sync_api import ElementHandle, Page, sync_playwright
+
+from twitter_scraper import TwitterScraper
+from video_resolvers import ResolverRegistry
+
+FIXTURES = Path(__file__).resolve().parent / "fixtures" / "timeline"
+EXECUTABLE_PATH_ENV = "CHROMIUM_EXECUTABLE_PATH"
+ARTICLE_SELECTOR = 'article[data-testid="tweet"]'
+
+# 数える Playwright の呼び出し（解析で使うもの）
+_COUNTED = {
+    Page: ("query_selector_all",),
+    ElementHandle: ("query_selector", "query_selector_all", "get_attribute", "inner_text", "inner_html", "evaluate"),
+}
+
+
+@contextmanager
+def _count_calls() -> Iterator[Counter]:
+    """with ブロックの間の Playwright 呼び出しをメソッド別に数える"""
+    calls: Counter = Counter()
+    originals = []
+    for cls, names in _COUNTED.items():
+        for name in names:
+            original = getattr(cls, name)
+            originals.append((cls, name, original))
+
+            def counted(self, *args, _original=original, _label=f"{cls.__name__}.{name}", **kwargs):
+                calls[_label] += 1
+                return _original(self, *args, **kwargs)
+
+            setattr(cls, name, counted)
+    try:
+        yield calls
+    finally:
+        for cls, name, original in originals:
+            setattr(cls, name, original)
+
+
+def _offline_scraper(page: Page, stats_dir: Path) -> TwitterScraper:
+    """ページだけ差し替えたスクレイパー（動画URLの解決は要素内HTMLのみ。統計は一時ディレクトリ）"""
+    scraper = TwitterScraper()
+    scraper.page = page
+    resolvers = ResolverRegistry(stats_path=stats_dir / "resolver_stats.json")
+    resolvers.register("dom_html", lambda tweet_id, element: scraper._pick_video_url_from_html(element.inner_html() or ""))
+    scraper.video_resolvers = resolvers
+    return scraper
+
+
+def launch_offline_page(p, channel: str = None, executable_path: str = None):
+    """ヘッドレスChromiumを起動し、file: 以外のリクエストを中断するページを返す（(browser, page)）"""
+    launch_opts = {"headless": True}
+    if channel:
+        launch_opts["channel"] = channel
+    executable_path = executable_path or os.getenv(EXECUTABLE_PATH_ENV)
+    if executable_path:
+        launch_opts["executable_path"] = executable_path
+    browser = p.chromium.launch(**launch_opts)
+    context = browser.new_context()
+    # 画像・動画などの外部リクエストは出さない
+    context.route("**/*", lambda route: route.continue_() if route.request.url.startswith("file:") else route.abort())
+    return browser, context.new_page()
+
+
+def _golden_path(fixture: Path) -> Path:
+    return fixture.with_name(f"{fixture.stem}.golden.json")
+
+
+def _diff(expected: List[Dict], actual: List[Dict]) -> List[str]:
+    """期待値との違い（Tweet単位・キー単位）"""
+    lines = []
+    if len(expected) != len(actual):
+        lines.append(f"件数: 期待 {len(expected)} / 実際 {len(actual)}")
+    for i, (want, got) in enumerate(zip(expected, actual)):
+        if want == got:
+            continue
+        for key in list(dict.fromkeys(list(want) + list(got))):
+            if want.get(key) != got.get(key):
+                lines.append(f"[{i}] {want.get('tweet_id')} {key}: 期待 {want.get(key)!r} / 実際 {got.get(key)!r}")
+    return lines
+
+
+def _multiply_articles(page: Page, copies: int) -> int:
+    """article 要素を copies 倍に複製し、複製後の件数を返す"""
+    return page.evaluate(
+        """([selector, copies]) => {
+            const articles = Array.from(document.querySelectorAll(selector));
+            for (let i = 1; i < copies; i++) {
+                for (const article of articles) {
+                    article.parentNode.appendChild(article.cloneNode(true));
+                }
+            }
+            return document.querySelectorAll(selector).length;
+        }""",
+        [ARTICLE_SELECTOR, copies],
+    )
+
+
+def _bench_fixture(page: Page, fixture: Path, stats_dir: Path, args) -> bool:
+    page.goto(fixture.as_uri())
+    scraper = _offline_scraper(page, stats_dir)
+    articles = len(page.query_selector_all(ARTICLE_SELECTOR))
+
+    with _count_calls() as calls:
+        tweets = scraper._extract_tweets()
+
+    golden = _golden_path(fixture)
+    if args.update_golden:
+        with open(golden, "w", encoding="utf-8") as f:
+            json.dump(tweets, f, ensure_ascii=False, indent=2)
+            f.write("\n")
+        print(f"{fixture.name}: 期待値を書き直しました（{len(tweets)}件）: {golden}")
+        ok = True
+    elif not golden.exists():
+        print(f"{fixture.name}: 期待値がありません（--update-golden で作成）: {golden}")
+        ok = False
+    else:
+        differences = _diff(json.loads(golden.read_text(encoding="utf-8")), tweets)
+        ok = not differences
+        print(f"{fixture.name}: article {articles}件 → Tweet {len(tweets)}件  期待値と{'一致' if ok else '不一致'}")
+        for line in differences:
+            print(f"  {line}")
+
+    total_calls = sum(calls.values())
+    print(f"  Playwright呼び出し: {total_calls}回（article 1件あたり {total_calls / max(1, articles):.1f}回）")
+    for label, count in calls.most_common():
+        print(f"    {label:<34} {count:>6}回  {count / max(1, articles):>6.2f}回/article")
+
+    if args.copies > 1:
+        articles = _multiply_articles(page, args.copies)
+    scraper._extract_tweets()  # ウォームアップ
+    start = time.perf_counter()
+    for _ in range(args.iterations):
+        scraper._extract_tweets()
+    elapsed = time.perf_counter() - start
+    parsed = articles * args.iterations
+    print(
+        f"  解析: article {articles}件 × {args.iterations}回  {elapsed:.2f}秒  "
+        f"{parsed / elapsed:.1f} article/秒  {elapsed * 1e3 / parsed:.2f} ms/article"
+    )
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description="保存済みタイムラインHTMLでのTweet解析ベンチマーク")
+    parser.add_argument("--fixture", type=Path, action="append", help="対象のHTML（複数指定可。省略時は fixtures/timeline/*.html）")
+    parser.add_argument("--iterations", type=int, default=20, help="計測で繰り返す回数")
+    parser.add_argument("--copies", type=int, default=20, help="計測前に article 要素を何倍に複製するか")
+    parser.add_argument("--update-golden", action="store_true", help="現在の解析結果で期待値（*.golden.json）を書き直す")
+    parser.add_argument("--channel", default=None, help="Chromiumの代わりに使うブラウザ（例: chrome）")
+    parser.add_argument(
+        "--executable-path", default=None,
+        help=f"使うChromiumの実行ファイル（playwright install していない環境用。省略時は環境変数 {EXECUTABLE_PATH_ENV}）",
+    )
+    args = parser.parse_args()
+
+    fixtures = args.fixture or sorted(FIXTURES.glob("*.html"))
+    if not fixtures:
+        print(f"HTMLが見つかりません: {FIXTURES}")
+        sys.exit(1)
+
+    ok = True
+    with sync_playwright() as p, tempfile.TemporaryDirectory() as tmp:
+        browser, page = launch_offline_page(p, args.channel, args.executable_path)
+        try:
+            for fixture in fixtures:
+                ok = _bench_fixture(page, Path(fixture).resolve(), Path(tmp), args) and ok
+        finally:
+            browser.close()
+
+    if not ok:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""Tweetをdictのまま保持した場合と CompactTweets のメモリ使用量の比較
+
+使い方:
+    python bench_tweet_records.py [--tweets 100000] [--authors 20]
+"""
+
+import argparse
+import gc
+import json
+import random
+import time
+import tracemalloc
+
+from tweet_records import CompactTweets
+
+
+def _synthetic_tweets(count: int, authors: int):
+    """スクレイパーの出力と同じ形のTweet（1件ずつJSONを経由させ、文字列を共有させない）"""
+    rng = random.Random(0)
+    names = [f"user_{i:03d}" for i in range(authors)]
+    base_id = 1_750_000_000_000_000_000
+    for i in range(count):
+        author = rng.choice(names)
+        tweet_id = str(base_id + i * 4096)
+        media = []
+        for j in range(rng.choice((0, 0, 1, 1, 2, 4))):
+            media.append({
+                "type": "photo",
+                "url": f"https://pbs.twimg.com/media/G{tweet_id[-10:]}{j}?format=jpg&name=orig",
+                "media_index": j,
+                "tweet_url": f"https://twitter.com/{author}/status/{tweet_id}",
+                "local_path": f"output/20240101_000000/images/{tweet_id}_{j}.jpg",
+                "file_size": rng.randint(50_000, 2_000_000),
+            })
+        tweet = {
+            "tweet_id": tweet_id,
+            "created_at": f"2024-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}T{rng.randint(0, 23):02d}:00:00.000Z",
+            "text": "サンプルの本文です。" * rng.randint(1, 8),
+            "author_username": author,
+            "public_metrics": {
+                "like_count": rng.randint(0, 5000),
+                "retweet_count": rng.randint(0, 500),
+                "reply_count": rng.randint(0, 100),
+                "quote_count": rng.randint(0, 50),
+            },
+            "media": media,
+            "url": f"https://twitter.com/{author}/status/{tweet_id}",
+        }
+        yield json.loads(json.dumps(tweet, ensure_ascii=False))
+
+
+def _measure(build):
+    """build() の結果と、それが確保したままのバイト数・構築秒数（計測の影響を避けて別々に測る）"""
+    start = time.perf_counter()
+    obj = build()
+    elapsed = time.perf_counter() - start
+    del obj
+    gc.collect()
+    tracemalloc.start()
+    obj = build()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return obj, size, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tweet保持形式のメモリ比較")
+    parser.add_argument("--tweets", type=int, default=100_000, help="Tweet件数")
+    parser.add_argument("--authors", type=int, default=20, help="作者の種類")
+    args = parser.parse_args()
+
+    dicts, dict_bytes, dict_time = _measure(lambda: list(_synthetic_tweets(args.tweets, args.authors)))
+    del dicts
+    compact, compact_bytes, compact_time = _measure(lambda: CompactTweets(_synthetic_tweets(args.tweets, args.authors)))
+
+    start = time.perf_counter()
+    restored = sum(1 for _ in compact)
+    export_time = time.perf_counter() - start
+
+    print(f"Tweet件数: {args.tweets}（作者{args.authors}種類）")
+    print(f"dictのlist     {dict_bytes / 2**20:>9.1f} MB  {dict_bytes / args.tweets:>7.0f} B/件  構築{dict_time:.2f}秒")
+    print(f"CompactTweets  {compact_bytes / 2**20:>9.1f} MB  {compact_bytes / args.tweets:>7.0f} B/件  構築{compact_time:.2f}秒")
+    print(f"削減率: {1 - compact_bytes / dict_bytes:.0%}  dictへの書き戻し: {restored}件 {export_time:.2f}秒")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,312 @@
+"""複数の実行結果（tweets*.json / tweets.ndjson）を1つの重複なしデータセットにまとめるツール
+
+同じTweetが複数の実行に含まれる場合は tweet_id ごとに1件にし、メトリクス等は一番新しい実行の値を、
+メディアの local_path / file_size は新しい版に無ければ古い版の値を残す。
+
+全件をメモリに載せない外部ソート・マージで処理する:
+
+1. 入力を1件ずつ読み、(tweet_id, 実行の新しさ) でソートした一時ファイル（ラン）を
+   buffer_bytes ごとに書き出す
+2. ランを heapq.merge で併合し（一度に開くのは fan_in 個まで。超えれば多段で併合）、
+   同じ tweet_id の版を1件にまとめて出力する
+
+使い方:
+    python consolidate.py output/ -o merged.json.gz
+    python consolidate.py output/20240101_000000/tweets.json output/20240102_000000/tweets_partial.json -o merged.ndjson
+"""
+
+from __future__ import annotations
+
+import argparse
+import heapq
+import json
+import logging
+import re
+import sys
+import tempfile
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional
+
+from data_saver import DataSaver
+from media_only import iter_tweets_from_result_json
+from output_files import compression_from_suffix, open_output, strip_compression_suffix
+
+logger = logging.getLogger(__name__)
+
+# 実行ディレクトリ内の取得結果（tweets.json / tweets_partial.json / tweets_error.json / tweets.ndjson 等。圧縮含む）
+RUN_FILE_PATTERN = "tweets*.*json*"
+_RUN_ID_RE = re.compile(r"^\d{8}_\d{6}$")
+_NDJSON_SUFFIXES = {".ndjson", ".jsonl"}
+
+# ランの1行: <tweet_id 20桁ゼロ詰め>\t<入力の新しさ 6桁>\t<入力内の順番 12桁>\t<Tweet JSON>
+# 文字列としてそのまま比較すれば (tweet_id, 新しさ, 順番) の順になる
+_ID_WIDTH = 20
+_EMPTY = (None, "", [], {})
+
+
+@dataclass
+class ConsolidateStats:
+    inputs: int = 0
+    read: int = 0
+    written: int = 0
+    skipped: int = 0
+    runs: int = 0
+    merge_passes: int = 0
+
+    @property
+    def duplicates(self) -> int:
+        return self.read - self.skipped - self.written
+
+
+def find_run_files(directory: Path) -> List[Path]:
+    """ディレクトリ直下と1階層下（output/<RUN_ID>/）の取得結果ファイル"""
+    directory = Path(directory)
+    found = list(directory.glob(RUN_FILE_PATTERN)) + list(directory.glob(f"*/{RUN_FILE_PATTERN}"))
+    return sorted(p for p in found if p.is_file())
+
+
+def _recency(path: Path) -> tuple:
+    """入力の新しさ（親ディレクトリがRUN_IDならその日時、同じ実行内や不明ならmtimeで比べる）"""
+    run_id = path.parent.name if _RUN_ID_RE.match(path.parent.name) else ""
+    try:
+        mtime = path.stat().st_mtime
+    except OSError:
+        mtime = 0.0
+    return (run_id, mtime, str(path))
+
+
+def _sort_key(tweet_id) -> Optional[str]:
+    tweet_id = str(tweet_id) if tweet_id is not None else ""
+    if not tweet_id.isdigit() or len(tweet_id) > _ID_WIDTH:
+        return None
+    return tweet_id.zfill(_ID_WIDTH)
+
+
+def _media_key(media: Dict) -> tuple:
+    return (media.get("media_index", 0), media.get("type") or "")
+
+
+def merge_versions(versions: List[Dict]) -> Dict:
+    """同じtweet_idの版（古い順）を1件にまとめる
+
+    一番新しい版を基にし、そこで空の項目は古い版の値で埋める。メディアの local_path / file_size は
+    新しい版に無ければ、(media_index, type) かURLが一致する古い版のメディアから引き継ぐ。
+    """
+    merged = versions[-1]
+    if len(versions) == 1:
+        return merged
+    downloaded: Dict[tuple, Dict] = {}
+    downloaded_by_url: Dict[str, Dict] = {}
+    for version in versions:
+        for media in version.get("media") or []:
+            if isinstance(media, dict) and media.get("local_path"):
+                downloaded[_media_key(media)] = media
+                if media.get("url"):
+                    downloaded_by_url[media["url"]] = media
+
+    for older in reversed(versions[:-1]):
+        for key, value in older.items():
+            if merged.get(key) in _EMPTY and value not in _EMPTY:
+                merged[key] = value
+
+    for media in merged.get("media") or []:
+        if not isinstance(media, dict) or media.get("local_path"):
+            continue
+        source = downloaded.get(_media_key(media)) or downloaded_by_url.get(media.get("url"))
+        if source is None:
+            continue
+        media["local_path"] = source["local_path"]
+        if media.get("file_size") is None and source.get("file_size") is not None:
+            media["file_size"] = source["file_size"]
+    return merged
+
+
+class _RunWriter:
+    """ソート済みのランを一時ディレクトリに書き出す"""
+
+    def __init__(self, tmp_dir: Path):
+        self.tmp_dir = tmp_dir
+        self.paths: List[Path] = []
+
+    def new_path(self) -> Path:
+        path = self.tmp_dir / f"run_{len(self.paths):06d}.txt"
+        self.paths.append(path)
+        return path
+
+    def write(self, lines: Iterable[str]) -> Path:
+        path = self.new_path()
+        with open(path, "w", encoding="utf-8", newline="\n") as f:
+            f.writelines(lines)
+        return path
+
+
+def _open_run(path: Path):
+    return open(path, "r", encoding="utf-8", newline="\n")
+
+
+def _spill_runs(inputs: List[Path], runs: _RunWriter, buffer_bytes: int, stats: ConsolidateStats) -> List[Path]:
+    """入力を読み、buffer_bytes ごとにソートしたランを書く"""
+    ordered = sorted(inputs, key=_recency)
+    run_paths: List[Path] = []
+    buffer: List[str] = []
+    buffered = 0
+    for rank, path in enumerate(ordered):
+        logger.info(f"読み込み中 ({rank + 1}/{len(ordered)}): {path}")
+        try:
+            for seq, tweet in enumerate(iter_tweets_from_result_json(path)):
+                stats.read += 1
+                key = _sort_key(tweet.get("tweet_id")) if isinstance(tweet, dict) else None
+                if key is None:
+                    stats.skipped += 1
+                    continue
+                line = f"{key}\t{rank:06d}\t{seq:012d}\t{json.dumps(tweet, ensure_ascii=False)}\n"
+                buffer.append(line)
+                buffered += len(line)
+                if buffered >= buffer_bytes:
+                    buffer.sort()
+                    run_paths.append(runs.write(buffer))
+                    buffer, buffered = [], 0
+        except ValueError as e:
+            logger.warning(f"取得結果として読めないためスキップします: {path}: {e}")
+    if buffer:
+        buffer.sort()
+        run_paths.append(runs.write(buffer))
+    return run_paths
+
+
+def _merge_runs(paths: List[Path], runs: _RunWriter, fan_in: int, stats: ConsolidateStats) -> List[Path]:
+    """ランが fan_in 個以下になるまで、fan_in 個ずつ併合する"""
+    while len(paths) > fan_in:
+        stats.merge_passes += 1
+        merged: List[Path] = []
+        for i in range(0, len(paths), fan_in):
+            group = paths[i:i + fan_in]
+            if len(group) == 1:
+                merged.append(group[0])
+                continue
+            files = [_open_run(p) for p in group]
+            try:
+                merged.append(runs.write(heapq.merge(*files)))
+            finally:
+                for f in files:
+                    f.close()
+            for p in group:
+                p.unlink()
+        paths = merged
+    return paths
+
+
+def _iter_merged(paths: List[Path], stats: ConsolidateStats) -> Iterator[Dict]:
+    """ランを併合しながら、tweet_idごとに版をまとめて返す（tweet_idの昇順）"""
+    files = [_open_run(p) for p in paths]
+    try:
+        current = None
+        versions: List[Dict] = []
+        for line in heapq.merge(*files):
+            key = line[:_ID_WIDTH]
+            tweet = json.loads(line.split("\t", 3)[3])
+            if key != current and versions:
+                stats.written += 1
+                yield merge_versions(versions)
+                versions = []
+            current = key
+            versions.append(tweet)
+        if versions:
+            stats.written += 1
+            yield merge_versions(versions)
+    finally:
+        for f in files:
+            f.close()
+
+
+def consolidate(
+    inputs: Iterable[Path],
+    output_path: Path,
+    buffer_bytes: int = 128 * 2**20,
+    fan_in: int = 64,
+    tmp_dir: Optional[Path] = None,
+) -> ConsolidateStats:
+    """inputs（取得結果ファイル）を tweet_id で重複排除して output_path に書く
+
+    出力形式は拡張子で決める（.ndjson / .jsonl ならNDJSON、それ以外は {metadata, tweets}。
+    さらに .gz / .zst を付ければ圧縮）。Tweetは tweet_id の昇順に並ぶ。
+    """
+    output_path = Path(output_path)
+    inputs = [Path(p) for p in inputs if Path(p).resolve() != output_path.resolve()]
+    stats = ConsolidateStats(inputs=len(inputs))
+    compression = compression_from_suffix(output_path)
+    ndjson = strip_compression_suffix(output_path).suffix in _NDJSON_SUFFIXES
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+
+    with tempfile.TemporaryDirectory(prefix="consolidate_", dir=tmp_dir) as tmp:
+        runs = _RunWriter(Path(tmp))
+        paths = _spill_runs(inputs, runs, max(1, buffer_bytes), stats)
+        stats.runs = len(paths)
+        paths = _merge_runs(paths, runs, max(2, fan_in), stats)
+
+        if ndjson:
+            with open_output(output_path, compression=compression) as f:
+                for tweet in _iter_merged(paths, stats):
+                    f.write(json.dumps(tweet, ensure_ascii=False) + "\n")
+        else:
+            # metadata.total_tweets を先頭に書くため、一度NDJSONに書いて件数を確定させる
+            merged_path = runs.new_path()
+            with open(merged_path, "w", encoding="utf-8", newline="\n") as f:
+                for tweet in _iter_merged(paths, stats):
+                    f.write(json.dumps(tweet, ensure_ascii=False) + "\n")
+
+            def _read_merged():
+                with _open_run(merged_path) as f:
+                    for line in f:
+                        yield json.loads(line)
+
+            DataSaver().write_tweets_json(
+                output_path,
+                _read_merged(),
+                stats.written,
+                compression=compression,
+                extra_metadata={"consolidated_from": len(inputs)},
+            )
+
+    logger.info(
+        f"統合しました: {output_path}（入力{stats.inputs}ファイル・{stats.read}件 → {stats.written}件、"
+        f"重複{stats.duplicates}件、スキップ{stats.skipped}件、ラン{stats.runs}個）"
+    )
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="複数の実行結果をtweet_idで重複排除して1つにまとめる")
+    parser.add_argument("inputs", nargs="+", help="取得結果ファイル、または output/ などのディレクトリ（tweets*.json等を探す）")
+    parser.add_argument("-o", "--output", required=True, help="出力先（.json / .ndjson。.gz / .zst を付ければ圧縮）")
+    parser.add_argument("--buffer-mb", type=int, default=128, help="ソート用バッファの上限（MB）")
+    parser.add_argument("--fan-in", type=int, default=64, help="一度に併合する一時ファイル数の上限")
+    parser.add_argument("--tmp-dir", default=None, help="一時ファイルの置き場所（既定はシステムの一時ディレクトリ）")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", stream=sys.stdout)
+
+    inputs: List[Path] = []
+    for raw in args.inputs:
+        path = Path(raw)
+        if path.is_dir():
+            inputs.extend(find_run_files(path))
+        elif path.exists():
+            inputs.append(path)
+        else:
+            parser.error(f"入力が見つかりません: {path}")
+    if not inputs:
+        parser.error("統合する取得結果ファイルが見つかりませんでした")
+
+    consolidate(
+        inputs,
+        Path(args.output),
+        buffer_bytes=args.buffer_mb * 2**20,
+        fan_in=args.fan_in,
+        tmp_dir=Path(args.tmp_dir) if args.tmp_dir else None,
+    )
+
+
+if __name__ == "__main__":
+    main()
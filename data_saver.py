@@ -1,56 +1,164 @@
 """データ保存モジュール"""
-import json
 import csv
 from pathlib import Path
-from typing import List, Dict
+from typing import Dict, Iterable, Optional
 import logging
 from datetime import datetime
 
 from config import Config
+from output_files import open_output, resolve_output_path, write_json_object
+from run_metrics import METRICS
+from run_profiler import PROFILER
+from tweet_log import iter_logged_tweets, scan_log
 
 logger = logging.getLogger(__name__)
 
+_SAVE_SECONDS = METRICS.histogram("saver_seconds", "保存1回の所要時間", ("format",))
+_SAVED_TWEETS = METRICS.counter("saver_tweets_total", "保存したTweet数", ("format",))
+_SAVED_BYTES = METRICS.counter("saver_bytes_total", "書き出したファイルのバイト数", ("format",))
+
+
+def _record_file(fmt: str, path: Path, count: int) -> None:
+    _SAVED_TWEETS.inc(count, format=fmt)
+    try:
+        _SAVED_BYTES.inc(Path(path).stat().st_size, format=fmt)
+    except OSError:
+        pass
+
 
 class DataSaver:
     """データ保存クラス"""
     
     def __init__(self):
         self.config = Config
+
+    def output_path(self, filename: str) -> Path:
+        """RUN_DIR内の出力先（圧縮する設定なら .gz / .zst 付き）"""
+        return resolve_output_path(self.config.RUN_DIR / filename)
     
-    def save_tweets_json(self, tweets: List[Dict], filename: str = "tweets.json"):
-        """TweetデータをJSON形式で保存"""
-        output_path = self.config.RUN_DIR / filename
-        
-        # メタデータを追加
-        data = {
-            'metadata': {
-                'total_tweets': len(tweets),
-                'exported_at': datetime.now().isoformat(),
-                'version': '1.0'
-            },
-            'tweets': tweets
-        }
+    def save_tweets_json(self, tweets: Iterable[Dict], filename: str = "tweets.json", total: Optional[int] = None):
+        """TweetデータをJSON形式で保存（1件ずつ書き出すので、tweetsはイテレータでもよい）
+
+        Config.OUTPUT_COMPACT ならインデントせず1Tweet1行で、Config.OUTPUT_COMPRESSION なら圧縮して書く。
+
+        Args:
+            total: tweetsがイテレータの場合の件数（metadata.total_tweets に使う）
+        """
+        output_path = self.output_path(filename)
+        if total is None:
+            # len()が取れるもの（list / CompactTweets）はそのまま、イテレータだけ読み切る
+            tweets = tweets if hasattr(tweets, '__len__') else list(tweets)
+            total = len(tweets)
         
         try:
-            with open(output_path, 'w', encoding='utf-8') as f:
-                json.dump(data, f, ensure_ascii=False, indent=2)
-            
+            with PROFILER.stage("save"), _SAVE_SECONDS.time(format="json"):
+                self.write_tweets_json(output_path, tweets, total)
+            _record_file("json", output_path, total)
             logger.info(f"JSONファイルを保存しました: {output_path}")
             return output_path
         except Exception as e:
             logger.error(f"JSON保存エラー: {e}")
             raise
+
+    def write_tweets_json(
+        self,
+        output_path: Path,
+        tweets: Iterable[Dict],
+        total: int,
+        compression: Optional[str] = None,
+        extra_metadata: Optional[Dict] = None,
+    ) -> None:
+        """{metadata, tweets} 形式で output_path に書く（RUN_DIR以外に書く場合用。compression省略時は設定に従う）"""
+        # メタデータを追加
+        metadata = {
+            'total_tweets': total,
+            'exported_at': datetime.now().isoformat(),
+            'version': '1.0'
+        }
+        if extra_metadata:
+            metadata.update(extra_metadata)
+
+        with open_output(output_path, compression=compression) as f:
+            write_json_object(f, (('metadata', metadata), ('tweets', tweets)))
+
+    def export_from_log(
+        self,
+        log_path: Path,
+        json_filename: str = "tweets.json",
+        csv_filename: Optional[str] = "tweets_summary.csv",
+        parquet_dirname: Optional[str] = None,
+        sqlite_path: Optional[Path] = None,
+    ):
+        """追記ログ（tweets.ndjson）からJSON/CSV（/Parquet/SQLite）を逐次書き出す
+
+        Tweet本体は全件をメモリに載せない（tweet_id・メディアごとの小さな記録だけ全件分持つ。tweet_log.scan_log）。
+
+        Returns:
+            書き出したTweet件数
+        """
+        scanned = scan_log(log_path)
+        total = len(scanned[0])
+        if not total:
+            logger.warning(f"ログに保存するTweetがありません: {log_path}")
+            return 0
+        self.save_tweets_json(iter_logged_tweets(log_path, scanned), filename=json_filename, total=total)
+        if csv_filename:
+            self.save_tweets_csv(iter_logged_tweets(log_path, scanned), filename=csv_filename)
+        if parquet_dirname:
+            self.save_tweets_parquet(iter_logged_tweets(log_path, scanned), dirname=parquet_dirname)
+        if sqlite_path:
+            self.save_tweets_sqlite(iter_logged_tweets(log_path, scanned), db_path=sqlite_path)
+        return total
+
+    def save_tweets_sqlite(self, tweets: Iterable[Dict], db_path: Optional[Path] = None) -> int:
+        """TweetデータをSQLiteストアに追加/更新（既定: OUTPUT_DIR/tweets.sqlite3。実行を跨いで蓄積）
+
+        Returns:
+            書き込んだTweet件数
+        """
+        from tweet_store import TweetStore
+
+        try:
+            with PROFILER.stage("save"), _SAVE_SECONDS.time(format="sqlite"), TweetStore(db_path) as store:
+                count = store.upsert_tweets(tweets)
+                _SAVED_TWEETS.inc(count, format="sqlite")
+                logger.info(f"SQLiteに保存しました: {store.db_path}（{count}件、累計{store.count()}件）")
+                if store.skipped:
+                    logger.warning(f"tweet_idが数値でないTweetをSQLiteに書きませんでした: {store.skipped}件")
+            return count
+        except Exception as e:
+            logger.error(f"SQLite保存エラー: {e}")
+            raise
+
+    def save_tweets_parquet(self, tweets: Iterable[Dict], dirname: str = "parquet", batch_size: int = 5000):
+        """TweetデータをParquetで保存（tweets/mediaの2テーブル、作者と月でパーティション分割。要pyarrow）"""
+        from parquet_export import ParquetWriter
+
+        output_dir = self.config.RUN_DIR / dirname
+        try:
+            with PROFILER.stage("save"), _SAVE_SECONDS.time(format="parquet"), ParquetWriter(output_dir, batch_size=batch_size) as writer:
+                for tweet in tweets:
+                    writer.write(tweet)
+            _SAVED_TWEETS.inc(writer.count, format="parquet")
+            logger.info(f"Parquetを保存しました: {output_dir}（{writer.count}件）")
+            if writer.skipped:
+                logger.warning(f"tweet_idが数値でないTweetをParquetに書きませんでした: {writer.skipped}件")
+            return output_dir
+        except Exception as e:
+            logger.error(f"Parquet保存エラー: {e}")
+            raise
     
-    def save_tweets_csv(self, tweets: List[Dict], filename: str = "tweets_summary.csv"):
-        """TweetデータをCSV形式で保存（サマリー）"""
-        output_path = self.config.RUN_DIR / filename
+    def save_tweets_csv(self, tweets: Iterable[Dict], filename: str = "tweets_summary.csv"):
+        """TweetデータをCSV形式で保存（サマリー。Config.OUTPUT_COMPRESSION なら圧縮）"""
+        output_path = self.output_path(filename)
         
-        if not tweets:
+        if isinstance(tweets, list) and not tweets:
             logger.warning("保存するTweetがありません")
             return None
         
+        rows = 0
         try:
-            with open(output_path, 'w', encoding='utf-8', newline='') as f:
+            with PROFILER.stage("save"), _SAVE_SECONDS.time(format="csv"), open_output(output_path, newline='') as f:
                 writer = csv.DictWriter(f, fieldnames=[
                     'tweet_id', 'created_at', 'text', 'author_username',
                     'like_count', 'retweet_count', 'reply_count', 'quote_count',
@@ -76,6 +184,8 @@ class DataSaver:
                         'url': tweet.get('url', '')
                     }
                     writer.writerow(row)
+                    rows += 1
+            _record_file("csv", output_path, rows)
             
             logger.info(f"CSVファイルを保存しました: {output_path}")
             return output_path
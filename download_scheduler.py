@@ -0,0 +1,284 @@
+"""サイズ見積もりに基づくダウンロードスケジューラ（画像と動画でワーカープールを分ける）"""
+
+from __future__ import annotations
+
+import heapq
+import itertools
+import re
+import threading
+import time
+from queue import Empty, PriorityQueue
+from typing import Callable, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+
+from media_only import is_target_author
+
+PHOTO_POOL = "photo"
+VIDEO_POOL = "video"
+POOLS = (PHOTO_POOL, VIDEO_POOL)
+
+PRIORITIES = ("size", "newest", "author")
+
+# pbs.twimg.com のサイズ指定ごとのおおよそのバイト数
+_PHOTO_VARIANT_BYTES = {
+    "orig": 1_500_000,
+    "4096x4096": 1_500_000,
+    "large": 400_000,
+    "medium": 150_000,
+    "small": 60_000,
+    "thumb": 10_000,
+}
+_DEFAULT_PHOTO_BYTES = 250_000
+_DEFAULT_VIDEO_BYTES = 10_000_000
+_DEFAULT_HLS_BYTES = 20_000_000
+# 解像度しか分からない動画の、1ピクセルあたりのおおよそのバイト数（30秒前後のクリップ想定）
+_VIDEO_BYTES_PER_PIXEL = 12
+
+
+def media_pool(media: Dict) -> str:
+    """メディアをどのプールで処理するか"""
+    url = str(media.get("url") or "")
+    if media.get("type") in ("video", "animated_gif") or ".m3u8" in url:
+        return VIDEO_POOL
+    return PHOTO_POOL
+
+
+def estimate_cost(media: Dict, probe: Optional[Callable[[str], Optional[int]]] = None) -> int:
+    """メディア種別・URLのvariant・（あれば）Content-Lengthからバイト数を見積もる"""
+    url = str(media.get("url") or "")
+    if probe and url:
+        size = probe(url)
+        if size:
+            return size
+
+    if media_pool(media) == PHOTO_POOL:
+        parsed = urlparse(url)
+        variant = (parse_qs(parsed.query).get("name") or [""])[0]
+        if not variant and ":" in parsed.path.rsplit("/", 1)[-1]:
+            variant = parsed.path.rsplit(":", 1)[-1]
+        return _PHOTO_VARIANT_BYTES.get(variant, _DEFAULT_PHOTO_BYTES)
+
+    if ".m3u8" in url:
+        return _DEFAULT_HLS_BYTES
+    # video.twimg.com/.../vid/1280x720/xxx.mp4 のような解像度入りパス
+    m = re.search(r"/(\d{2,5})x(\d{2,5})/", url)
+    if m:
+        return int(m.group(1)) * int(m.group(2)) * _VIDEO_BYTES_PER_PIXEL
+    return _DEFAULT_VIDEO_BYTES
+
+
+def _attempt_key(tweet_id: Optional[str], media: Dict) -> Tuple:
+    """再試行回数を数える単位（id(media) は解放後に別のdictで再利用されるので使わない）"""
+    return (tweet_id, media.get("media_index", 0), media.get("type"), media.get("url"))
+
+
+class DownloadScheduler:
+    """プールごとの優先度付きキュー
+
+    priority:
+        size: 大きいものから（LPT順。並行ワーカー全体の完了時間を短くする）
+        newest: 新しいツイートから（同じツイート内では大きいものから）
+        author: target_username本人の投稿から（その中では大きいものから）
+
+    max_pending を指定すると、未着手のタスクがその数に達している間 put() は空きが出るまで待つ
+    （スクレイピングが速すぎてもキューとメディア情報がメモリに溜まり続けないように）。
+    再試行待ちは上限に数えない。
+    """
+
+    def __init__(
+        self,
+        priority: str = "size",
+        target_username: Optional[str] = None,
+        probe: Optional[Callable[[str], Optional[int]]] = None,
+        max_pending: int = 0,
+    ):
+        if priority not in PRIORITIES:
+            raise ValueError(f"不明な優先度です: {priority}（{', '.join(PRIORITIES)}のいずれか）")
+        self.priority = priority
+        self.target_username = target_username
+        self.probe = probe
+        self._queues: Dict[str, PriorityQueue] = {pool: PriorityQueue() for pool in POOLS}
+        self._seq = itertools.count()
+        self._seq_lock = threading.Lock()
+        # 再試行待ち: (実行可能時刻, seq, pool, tweet_id, media) のヒープ
+        self._deferred: List[Tuple[float, int, str, Optional[str], Dict]] = []
+        self._deferred_lock = threading.Lock()
+        # 再試行待ちに入った回数（_attempt_key ごと。タスクが終わったら forget() で消す）
+        self._attempts: Dict[Tuple, int] = {}
+        self.max_pending = max(0, max_pending)
+        self._pending = 0
+        self._space = threading.Condition()
+        # 上限で put() が待たされた累計秒数
+        self.blocked_seconds = 0.0
+        # put() されてまだ task_done() されていないタスク（キュー・再試行待ち・ワーカーが処理中のもの）
+        self._unfinished = 0
+        self._all_done = threading.Condition()
+
+    def _hint_key(self, tweet_id: Optional[str], tweet: Optional[Dict]) -> int:
+        if self.priority == "newest":
+            # ツイートIDは時系列に増える（Snowflake）ので大きいほど新しい
+            return -int(tweet_id) if tweet_id and str(tweet_id).isdigit() else 0
+        if self.priority == "author" and self.target_username:
+            return 0 if tweet and is_target_author(tweet, self.target_username) else 1
+        return 0
+
+    def put(self, tweet_id: Optional[str], media: Dict, tweet: Optional[Dict] = None) -> None:
+        pool = media_pool(media)
+        # 動画だけHEADで実サイズを確認（画像はURLから十分見積もれる）
+        probe = self.probe if pool == VIDEO_POOL else None
+        cost = estimate_cost(media, probe)
+        with self._seq_lock:
+            seq = next(self._seq)
+        self._wait_for_space()
+        with self._all_done:
+            self._unfinished += 1
+        self._queues[pool].put(((self._hint_key(tweet_id, tweet), -cost, seq), tweet_id, media))
+
+    def task_done(self, count: int = 1) -> None:
+        """取り出したタスクが終わった（取得できた / 諦めた）ことを知らせる。再試行待ちに戻すときは呼ばない"""
+        with self._all_done:
+            self._unfinished = max(0, self._unfinished - count)
+            if not self._unfinished:
+                self._all_done.notify_all()
+
+    def join(self, timeout: Optional[float] = None) -> bool:
+        """全てのタスクが task_done() されるまで待つ（timeout 内に終わればTrue）"""
+        with self._all_done:
+            return self._all_done.wait_for(lambda: not self._unfinished, timeout=timeout)
+
+    def unfinished(self) -> int:
+        with self._all_done:
+            return self._unfinished
+
+    def _wait_for_space(self) -> None:
+        with self._space:
+            if self.max_pending and self._pending >= self.max_pending:
+                start = time.time()
+                while self._pending >= self.max_pending:
+                    self._space.wait(timeout=1.0)
+                self.blocked_seconds += time.time() - start
+            self._pending += 1
+
+    def _release(self) -> None:
+        with self._space:
+            self._pending = max(0, self._pending - 1)
+            self._space.notify()
+
+    def defer(self, tweet_id: Optional[str], media: Dict, delay: float, count_attempt: bool = True) -> None:
+        """delay秒後に再び取り出せるよう再試行待ちに入れる"""
+        with self._seq_lock:
+            seq = next(self._seq)
+        with self._deferred_lock:
+            if count_attempt:
+                key = _attempt_key(tweet_id, media)
+                self._attempts[key] = self._attempts.get(key, 0) + 1
+            heapq.heappush(self._deferred, (time.time() + delay, seq, media_pool(media), tweet_id, media))
+
+    def attempts(self, tweet_id: Optional[str], media: Dict) -> int:
+        """これまでに失敗して再試行待ちに入った回数"""
+        with self._deferred_lock:
+            return self._attempts.get(_attempt_key(tweet_id, media), 0)
+
+    def forget(self, tweet_id: Optional[str], media: Dict) -> None:
+        """終わった（取得できた / 諦めた）タスクの再試行回数を消す"""
+        with self._deferred_lock:
+            self._attempts.pop(_attempt_key(tweet_id, media), None)
+
+    def _pop_ready(self, pool: str) -> Optional[Tuple[Optional[str], Dict]]:
+        now = time.time()
+        with self._deferred_lock:
+            for i, (ready_at, _, item_pool, tweet_id, media) in enumerate(self._deferred):
+                if item_pool == pool and ready_at <= now:
+                    self._deferred.pop(i)
+                    heapq.heapify(self._deferred)
+                    return tweet_id, media
+        return None
+
+    def get(self, pool: str, timeout: float = 1.0) -> Tuple[Optional[str], Dict]:
+        """次のタスクを取り出す（再試行時刻に達したものを優先。無ければ queue.Empty）"""
+        ready = self._pop_ready(pool)
+        if ready:
+            return ready
+        _, tweet_id, media = self._queues[pool].get(timeout=timeout)
+        self._release()
+        return tweet_id, media
+
+    def drain(self) -> List[Tuple[Optional[str], Dict, bool]]:
+        """未着手のタスクと再試行待ちを全て取り出す（中断時）。(tweet_id, media, 再試行待ちだったか) のリスト"""
+        items = []
+        for pool in POOLS:
+            while True:
+                try:
+                    _, tweet_id, media = self._queues[pool].get_nowait()
+                except Empty:
+                    break
+                self._release()
+                items.append((tweet_id, media, False))
+        with self._deferred_lock:
+            items.extend((tweet_id, media, True) for _, _, _, tweet_id, media in self._deferred)
+            self._deferred = []
+        self.task_done(len(items))
+        return items
+
+    def deferred_size(self) -> int:
+        with self._deferred_lock:
+            return len(self._deferred)
+
+    def qsize(self, pool: Optional[str] = None) -> int:
+        pools = (pool,) if pool else POOLS
+        with self._deferred_lock:
+            deferred = sum(1 for item in self._deferred if item[2] in pools)
+        return sum(self._queues[p].qsize() for p in pools) + deferred
+
+    def empty(self, pool: Optional[str] = None) -> bool:
+        return self.qsize(pool) == 0
+
+
+class DeferredRetry(Exception):
+    """ワーカー内で待たずに、時間を置いて再試行すべき失敗（429や一時的エラー）"""
+
+    def __init__(self, reason: str, rate_limited: bool = False):
+        super().__init__(reason)
+        self.reason = reason
+        self.rate_limited = rate_limited
+
+
+class HostBackoff:
+    """ホストごとのバックオフ状態
+
+    429はホスト全体を止める（同じホストの他のメディアも待たせる）。
+    一時的エラーはそのメディアだけを遅らせる。
+    """
+
+    RATE_LIMIT_MIN = 900  # 429は一般的に15分ウィンドウ
+    RATE_LIMIT_MAX = 3600
+    TRANSIENT_MIN = 60
+    TRANSIENT_MAX = 300
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._state: Dict[str, Dict[str, float]] = {}
+
+    def remaining(self, host: str) -> float:
+        """ホストが429で止まっている残り秒数"""
+        with self._lock:
+            until = self._state.get(host, {}).get("until", 0.0)
+        return max(0.0, until - time.time())
+
+    def penalize(self, host: str, rate_limited: bool) -> float:
+        """失敗を記録して次の再試行までの秒数を返す"""
+        with self._lock:
+            state = self._state.setdefault(host, {})
+            if rate_limited:
+                delay = min(max(state.get("rate", 0) * 2, self.RATE_LIMIT_MIN), self.RATE_LIMIT_MAX)
+                state["rate"] = delay
+                state["until"] = time.time() + delay
+            else:
+                delay = min(max(state.get("transient", 0) * 2, self.TRANSIENT_MIN), self.TRANSIENT_MAX)
+                state["transient"] = delay
+            return delay
+
+    def reset(self, host: str) -> None:
+        """成功したらバックオフを解除"""
+        with self._lock:
+            self._state.pop(host, None)
@@ -0,0 +1,277 @@
+"""HLS(m3u8)プレイリストの解析とvariant選択（master/mediaの両方・実行中はURLごとにキャッシュ）"""
+
+from __future__ import annotations
+
+import re
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple, Union
+from urllib.parse import urljoin, urlsplit
+
+import requests
+
+from quality_profiles import QualityProfile, get_profile, pick_hls_variant
+
+VARIANT_POLICIES = ("profile", "highest", "lowest")
+
+# KEY=VALUE / KEY="VALUE" 形式の属性リスト（CODECS="avc1,mp4a" のような引用符内のカンマに対応）
+_ATTR_RE = re.compile(r'([A-Z0-9-]+)=("[^"]*"|[^,]*)')
+
+
+@dataclass
+class Variant:
+    """master playlist の #EXT-X-STREAM-INF 1件"""
+
+    bandwidth: int
+    uri: str
+    resolution: Optional[Tuple[int, int]] = None
+    codecs: Optional[str] = None
+
+
+@dataclass
+class Segment:
+    """media playlist のセグメント（または #EXT-X-MAP の初期化セグメント）
+
+    byte_range は (offset, length)。指定が無ければ None（ファイル全体）
+    """
+
+    uri: str
+    duration: float = 0.0
+    byte_range: Optional[Tuple[int, int]] = None
+
+    def range_header(self) -> Optional[str]:
+        """Rangeヘッダ値（byte_rangeが無ければ None）"""
+        if not self.byte_range:
+            return None
+        offset, length = self.byte_range
+        return f"bytes={offset}-{offset + length - 1}"
+
+
+@dataclass
+class MasterPlaylist:
+    url: str
+    variants: List[Variant] = field(default_factory=list)
+
+
+@dataclass
+class MediaPlaylist:
+    url: str
+    segments: List[Segment] = field(default_factory=list)
+    init_segment: Optional[Segment] = None
+    target_duration: Optional[float] = None
+
+    @property
+    def total_duration(self) -> float:
+        return sum(s.duration for s in self.segments)
+
+    def all_segments(self) -> List[Segment]:
+        """初期化セグメント（あれば）を先頭にした、結合順のセグメント一覧"""
+        return ([self.init_segment] if self.init_segment else []) + self.segments
+
+
+Playlist = Union[MasterPlaylist, MediaPlaylist]
+
+
+def _parse_attributes(text: str) -> Dict[str, str]:
+    return {k: v.strip('"') for k, v in _ATTR_RE.findall(text)}
+
+
+def _resolver(base_url: str):
+    """base_url基準のURI解決関数（よくある「/」始まりのパスはurljoinを通さず連結する）"""
+    parsed = urlsplit(base_url)
+    origin = f"{parsed.scheme}://{parsed.netloc}"
+
+    def resolve(uri: str) -> str:
+        if uri.startswith("/") and not uri.startswith("//"):
+            return origin + uri
+        if uri.startswith(("http://", "https://")):
+            return uri
+        return urljoin(base_url, uri)
+
+    return resolve
+
+
+def _parse_byte_range(value: str, next_offset: int) -> Tuple[int, int]:
+    """<length>[@<offset>] を (offset, length) にする（offset省略時は直前のセグメントの続き）"""
+    length, _, offset = value.partition("@")
+    return (int(offset) if offset else next_offset, int(length))
+
+
+def parse_playlist(text: str, url: str) -> Playlist:
+    """m3u8テキストを解析する（#EXT-X-STREAM-INF があれば master、無ければ media）
+
+    URIは全て url を基準に絶対URLへ解決する。
+    """
+    lines = [ln.strip() for ln in (text or "").splitlines()]
+    resolve = _resolver(url)
+    if any(ln.startswith("#EXT-X-STREAM-INF") for ln in lines):
+        master = MasterPlaylist(url=url)
+        pending: Optional[Dict[str, str]] = None
+        for ln in lines:
+            if not ln:
+                continue
+            if ln.startswith("#EXT-X-STREAM-INF:"):
+                pending = _parse_attributes(ln.split(":", 1)[1])
+            elif ln.startswith("#"):
+                continue
+            elif pending is not None:
+                resolution = None
+                m = re.match(r"(\d+)x(\d+)$", pending.get("RESOLUTION", ""))
+                if m:
+                    resolution = (int(m.group(1)), int(m.group(2)))
+                try:
+                    bandwidth = int(pending.get("BANDWIDTH", -1))
+                except ValueError:
+                    bandwidth = -1
+                master.variants.append(Variant(bandwidth, resolve(ln), resolution, pending.get("CODECS")))
+                pending = None
+        return master
+
+    media = MediaPlaylist(url=url)
+    duration: Optional[float] = None
+    byte_range: Optional[str] = None
+    next_offset: Dict[str, int] = {}
+    for ln in lines:
+        if not ln:
+            continue
+        if ln.startswith("#EXTINF:"):
+            try:
+                duration = float(ln.split(":", 1)[1].split(",", 1)[0])
+            except ValueError:
+                duration = 0.0
+        elif ln.startswith("#EXT-X-BYTERANGE:"):
+            byte_range = ln.split(":", 1)[1]
+        elif ln.startswith("#EXT-X-TARGETDURATION:"):
+            try:
+                media.target_duration = float(ln.split(":", 1)[1])
+            except ValueError:
+                pass
+        elif ln.startswith("#EXT-X-MAP:"):
+            attrs = _parse_attributes(ln.split(":", 1)[1])
+            if attrs.get("URI"):
+                init_range = _parse_byte_range(attrs["BYTERANGE"], 0) if attrs.get("BYTERANGE") else None
+                media.init_segment = Segment(resolve(attrs["URI"]), 0.0, init_range)
+        elif ln.startswith("#"):
+            continue
+        elif duration is not None:
+            uri = resolve(ln)
+            seg_range = None
+            if byte_range:
+                seg_range = _parse_byte_range(byte_range, next_offset.get(uri, 0))
+                next_offset[uri] = seg_range[0] + seg_range[1]
+            media.segments.append(Segment(uri, duration, seg_range))
+            duration = None
+            byte_range = None
+    return media
+
+
+def select_variant(
+    variants: List[Variant],
+    policy: str = "profile",
+    profile: Optional[QualityProfile] = None,
+) -> Optional[Variant]:
+    """variantを選ぶ
+
+    policy:
+        profile: 画質プロファイルの上限ビットレート以下で最大（未指定なら最高帯域）
+        highest: 最高帯域
+        lowest: 最低帯域
+    """
+    if not variants:
+        return None
+    if policy == "highest":
+        return max(variants, key=lambda v: v.bandwidth)
+    if policy == "lowest":
+        return min(variants, key=lambda v: v.bandwidth)
+    if policy != "profile":
+        raise ValueError(f"不明なvariant選択方針です: {policy}（{', '.join(VARIANT_POLICIES)}のいずれか）")
+    picked = pick_hls_variant([(v.bandwidth, v.uri) for v in variants], profile or get_profile())
+    return next(v for v in variants if (v.bandwidth, v.uri) == picked)
+
+
+class PlaylistCache:
+    """解析済みプレイリストのURL単位キャッシュ（動画URL解決とダウンロードで同じmasterを二度取得しない）
+
+    解決からダウンロードまでの間だけ効けばよいので、max_entries を超えたら最も長く使っていないものから捨てる
+    （長時間の実行でも動画数に比例して増え続けない）。
+    """
+
+    def __init__(self, max_entries: int = 256):
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, Playlist]" = OrderedDict()
+        self.max_entries = max(1, max_entries)
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+    def get(self, url: str) -> Optional[Playlist]:
+        with self._lock:
+            playlist = self._entries.get(url)
+            if playlist is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._entries.move_to_end(url)
+            return playlist
+
+    def put(self, url: str, playlist: Playlist) -> None:
+        with self._lock:
+            self._entries[url] = playlist
+            self._entries.move_to_end(url)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = 0
+
+
+_cache = PlaylistCache()
+
+
+def get_cache() -> PlaylistCache:
+    """実行全体で共有するキャッシュ"""
+    return _cache
+
+
+def fetch_playlist(
+    url: str,
+    sess: Optional[requests.Session] = None,
+    referer: Optional[str] = None,
+    cache: Optional[PlaylistCache] = None,
+    timeout: float = 20,
+) -> Playlist:
+    """プレイリストを取得して解析する（キャッシュにあればネットワークに触れない）"""
+    cache = cache if cache is not None else _cache
+    playlist = cache.get(url)
+    if playlist is not None:
+        return playlist
+    headers = {"Referer": referer} if referer else {}
+    response = (sess or requests).get(url, timeout=timeout, headers=headers)
+    response.raise_for_status()
+    playlist = parse_playlist(response.text or "", url)
+    cache.put(url, playlist)
+    return playlist
+
+
+def resolve_media_playlist(
+    url: str,
+    sess: Optional[requests.Session] = None,
+    referer: Optional[str] = None,
+    policy: str = "profile",
+    cache: Optional[PlaylistCache] = None,
+) -> Tuple[str, Optional[MediaPlaylist]]:
+    """masterならvariantを選んでmedia playlistまで辿る。(media playlistのURL, 解析結果) を返す"""
+    playlist = fetch_playlist(url, sess, referer, cache)
+    if isinstance(playlist, MasterPlaylist):
+        variant = select_variant(playlist.variants, policy)
+        if variant is None:
+            return url, None
+        url = variant.uri
+        playlist = fetch_playlist(url, sess, referer, cache)
+    return url, playlist if isinstance(playlist, MediaPlaylist) else None
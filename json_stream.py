@@ -0,0 +1,114 @@
+"""大きなJSONを全体を読み込まずに1要素ずつ読むストリームリーダー
+
+DataSaverの出力（{"metadata": ..., "tweets": [...]}）と、トップレベルが配列のJSONに対応する。
+ファイルは chunk_size ずつ読み、json.JSONDecoder.raw_decode で要素を1つずつ切り出すので、
+メモリ使用量はファイルサイズではなく最大の要素1件分で決まる。
+"""
+
+from __future__ import annotations
+
+import json
+from typing import IO, Iterator, Optional
+
+_WHITESPACE = " \t\r\n"
+
+
+class JsonStream:
+    """テキストストリーム上の逐次JSONパーサ（トップレベル構造を辿るための最小限の操作だけ持つ）"""
+
+    def __init__(self, f: IO[str], chunk_size: int = 1 << 20):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+        self._decoder = json.JSONDecoder()
+
+    def _fill(self) -> bool:
+        """読み足す（読み終わっていれば False）"""
+        if self.eof:
+            return False
+        chunk = self.f.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+        # 読み終えた部分は捨てる（バッファを要素1件分程度に保つ）
+        self.buf = self.buf[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self) -> Optional[str]:
+        """空白を読み飛ばして次の1文字を返す（終端なら None）"""
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in _WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buf):
+                if self.pos == 0 and self.buf.startswith("\ufeff"):
+                    self.pos = 1  # BOM
+                    continue
+                return self.buf[self.pos]
+            if not self._fill():
+                return None
+
+    def expect(self, char: str) -> None:
+        found = self.peek()
+        if found != char:
+            raise ValueError(f"JSONの形式が不正です（'{char}' の位置に {found!r}）")
+        self.pos += 1
+
+    def value(self):
+        """次の値を1つ読む（途中で切れていれば読み足して再試行）"""
+        self.peek()
+        while True:
+            try:
+                obj, end = self._decoder.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError:
+                if self._fill():
+                    continue
+                raise
+            if end == len(self.buf) and self._fill():
+                # 数値などは末尾で切れていても読めてしまうので、続きがあれば読み直す
+                continue
+            self.pos = end
+            return obj
+
+    def iter_array(self) -> Iterator:
+        """現在位置の配列の要素を順に返す（'[' から ']' まで読み進める）"""
+        self.expect("[")
+        if self.peek() == "]":
+            self.pos += 1
+            return
+        while True:
+            yield self.value()
+            sep = self.peek()
+            if sep == ",":
+                self.pos += 1
+            elif sep == "]":
+                self.pos += 1
+                return
+            else:
+                raise ValueError(f"JSONの形式が不正です（配列の区切りに {sep!r}）")
+
+    def iter_object_keys(self) -> Iterator[str]:
+        """現在位置のオブジェクトのキーを順に返す
+
+        キーを受け取った側は、次に value() か iter_array() でその値を読み進めること。
+        """
+        self.expect("{")
+        if self.peek() == "}":
+            self.pos += 1
+            return
+        while True:
+            key = self.value()
+            if not isinstance(key, str):
+                raise ValueError("JSONの形式が不正です（オブジェクトのキーが文字列ではありません）")
+            self.expect(":")
+            yield key
+            sep = self.peek()
+            if sep == ",":
+                self.pos += 1
+            elif sep == "}":
+                self.pos += 1
+                return
+            else:
+                raise ValueError(f"JSONの形式が不正です（オブジェクトの区切りに {sep!r}）")
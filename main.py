@@ -2,44 +2,39 @@
 import argparse
 import sys
 import logging
+from datetime import datetime
 from pathlib import Path
 
-from typing import Dict
+from typing import Dict, Optional
 from config import Config
 from twitter_scraper import TwitterScraper
 from media_downloader import MediaDownloader
+from media_index import build_media_index
+from media_store import MediaStore
+from parquet_export import pyarrow_available
+from quality_profiles import PROFILES, get_profile
 from data_saver import DataSaver
+from tweet_log import LOG_FILENAME as TWEET_LOG_FILENAME, TweetLog, iter_logged_tweets
+from tweet_sinks import DownloadSink, LogSink
+from tweet_store import DB_FILENAME as TWEET_DB_FILENAME
+from download_scheduler import PRIORITIES
+from run_catalog import RunCatalog, RunSummary
+from run_metrics import JSON_FILENAME as METRICS_JSON_FILENAME, METRICS, PROMETHEUS_FILENAME, MetricsReporter
+from run_profiler import PROFILE_DIRNAME, PROFILER, STAGES as PROFILE_STAGES
+from tweet_trace import TRACE_FILENAME, TRACER
+from agent_log import agent_log as _agent_log
 from media_only import (
-    is_target_author,
     filter_tweets_by_author,
     save_media_manifest_from_tweets,
-    load_tweets_from_result_json,
+    is_target_author,
+    iter_tweets_from_result_json,
     ensure_media_has_tweet_url,
-    enrich_tweets_with_resolved_videos_from_thumbnails,
+    EnrichStats,
+    iter_tweets_with_resolved_videos,
 )
 
-# region agent log
-_LOCAL_DEBUG_NDJSON = str((Path.cwd() / "debug.ndjson"))
-
-
-def _agent_log(hypothesisId: str, location: str, message: str, data: dict = None, runId: str = "pre") -> None:
-    try:
-        import json as _json
-        import time as _time
-
-        payload = {
-            "sessionId": "debug-session",
-            "runId": runId,
-            "hypothesisId": hypothesisId,
-            "location": location,
-            "message": message,
-            "data": data or {},
-            "timestamp": int(_time.time() * 1000),
-        }
-        with open(_LOCAL_DEBUG_NDJSON, "a", encoding="utf-8") as f:
-            f.write(_json.dumps(payload, ensure_ascii=False) + "\n")
-    except Exception:
-        pass
+# JSONモードの同期ダウンロードで一度に扱うTweet数（これ以上はメモリに載せない）
+JSON_MODE_BATCH_SIZE = 200
 
 
 def _looks_like_video_thumb(url: str) -> bool:
@@ -50,7 +45,98 @@ def _looks_like_video_thumb(url: str) -> bool:
     except Exception:
         return False
 
-# endregion
+
+def _record_run(args, mode: str, status: Optional[str], summary: RunSummary, started_at: str) -> None:
+    """今回の実行を実行カタログに記録する（失敗しても実行自体は失敗させない。status=Noneなら記録しない）"""
+    if status is None:
+        return
+    try:
+        # 実際に使った画質（--quality 未指定なら設定の既定値。索引が取得した版を見分けるのに使う）
+        profile = get_profile()
+        options = {
+            "media_only": args.media_only,
+            "download_media": args.download_media,
+            "since": args.since,
+            "until": args.until,
+            "quality": profile.name if profile else "",
+            "source_json": args.download_media_from_json,
+        }
+        with RunCatalog() as catalog:
+            catalog.record_run(
+                Config.RUN_ID, Config.RUN_DIR, mode=mode, status=status, summary=summary,
+                username=args.username, started_at=started_at, options=options,
+            )
+    except Exception as e:
+        logging.getLogger(__name__).warning(f"実行カタログに記録できませんでした: {e}")
+
+
+def _start_metrics(args) -> Optional[MetricsReporter]:
+    """実行中の計測値を RUN_DIR/metrics.prom に定期的に書く（--metrics-port 指定時はHTTPでも公開）"""
+    if args.metrics_interval <= 0 and args.metrics_port is None:
+        return None
+    path = Config.RUN_DIR / PROMETHEUS_FILENAME if args.metrics_interval > 0 else None
+    try:
+        return MetricsReporter(METRICS, path=path, interval=args.metrics_interval, port=args.metrics_port).start()
+    except OSError as e:
+        logging.getLogger(__name__).warning(f"計測値の公開を開始できませんでした: {e}")
+        return None
+
+
+def _finish_metrics(reporter: Optional[MetricsReporter], status: Optional[str]) -> None:
+    """計測値の定期出力を止め、RUN_DIR/run_metrics.json に最終値を書く（status=Noneなら書かない）"""
+    if reporter is not None:
+        reporter.stop()
+    if status is None:
+        return
+    try:
+        path = METRICS.write_json(Config.RUN_DIR / METRICS_JSON_FILENAME)
+        logging.getLogger(__name__).info(f"計測値を保存しました: {path}")
+    except Exception as e:
+        logging.getLogger(__name__).warning(f"計測値を保存できませんでした: {e}")
+
+
+def _finish_trace(status: Optional[str]) -> None:
+    """--trace の記録を RUN_DIR/trace.json（Chrome Trace Event形式）に書き、ステージ別の所要時間を出す"""
+    if not TRACER.enabled:
+        return
+    TRACER.disable()
+    if status is None:
+        return
+    logger = logging.getLogger(__name__)
+    try:
+        path = TRACER.export_chrome(Config.RUN_DIR / TRACE_FILENAME)
+        logger.info(f"トレースを保存しました: {path}（chrome://tracing / Perfetto で開けます）")
+        TRACER.log_summary()
+    except Exception as e:
+        logger.warning(f"トレースを保存できませんでした: {e}")
+
+
+def _finish_profile(args, status: Optional[str]) -> None:
+    """--profile の結果を RUN_DIR/profile/ に書く（ステージごとの .prof・サンプラー・上位N件の要約）"""
+    if not PROFILER.enabled:
+        return
+    PROFILER.disable()
+    if status is None:
+        return
+    logger = logging.getLogger(__name__)
+    try:
+        summary = PROFILER.write(Config.RUN_DIR / PROFILE_DIRNAME, top=args.profile_top)
+        logger.info(f"プロファイルを保存しました: {summary}")
+    except Exception as e:
+        logger.warning(f"プロファイルを保存できませんでした: {e}")
+
+
+def _save_partial_tweets(tweets_to_save, tweet_log, stem: str, no_csv: bool) -> Path:
+    """途中データを保存する（追記ログがあればログから逐次書き出す。メモリ上のリストより取りこぼしが少ない）"""
+    saver = DataSaver()
+    if tweet_log is not None and tweet_log.count:
+        tweet_log.flush()
+        saver.export_from_log(tweet_log.path, json_filename=f"{stem}.json", csv_filename=None if no_csv else f"{stem}.csv")
+        return saver.output_path(f"{stem}.json")
+    path = saver.save_tweets_json(tweets_to_save, filename=f"{stem}.json")
+    if not no_csv:
+        saver.save_tweets_csv(tweets_to_save, filename=f"{stem}.csv")
+    return path
 
 
 def setup_logging():
@@ -111,11 +197,73 @@ def main():
         action='store_true',
         help='--download-media-from-json時、photoでも動画サムネならツイートHTMLから動画URLを探して保存する'
     )
+    parser.add_argument(
+        '--resolve-workers',
+        type=int,
+        default=4,
+        help='--resolve-videos-from-thumbnails時に同時に解決するツイート数（デフォルト4）'
+    )
     parser.add_argument(
         '--video-only',
         action='store_true',
         help='動画だけ保存する（video/animated_gifのみ。サムネや画像は保存しない）'
     )
+    parser.add_argument(
+        '--segmented-download-mb',
+        type=float,
+        default=0,
+        help='このサイズ(MB)以上の動画をRange分割で並行ダウンロードする（0で無効）'
+    )
+    parser.add_argument(
+        '--segment-connections',
+        type=int,
+        default=4,
+        help='分割ダウンロード時の1ファイルあたり最大コネクション数（デフォルト4）'
+    )
+    parser.add_argument(
+        '--media-store',
+        action='store_true',
+        help='OUTPUT_DIR/media_storeで実行を跨いでメディアを重複排除する（既知のメディアは再ダウンロードしない）'
+    )
+    parser.add_argument(
+        '--skip-known-media',
+        action='store_true',
+        help='過去の実行のマニフェスト/tweets JSONにあるダウンロード済みメディアはリクエストせずに再利用する'
+    )
+    parser.add_argument(
+        '--quality',
+        choices=sorted(PROFILES),
+        default=None,
+        help='画質プロファイル（archive: 原寸画像・最高ビットレート / balanced / lean: 中サイズ画像・ビットレート上限・動画のサムネ無し）。未指定なら設定の QUALITY_PROFILE（既定 balanced）'
+    )
+    parser.add_argument(
+        '--video-workers',
+        type=int,
+        default=None,
+        help='並行ダウンロード時の動画/HLS用ワーカー数（画像用とは別プール。未指定なら画像用の半分）'
+    )
+    parser.add_argument(
+        '--max-pending-downloads',
+        type=int,
+        default=200,
+        help='並行ダウンロードの待ちの上限。超えるとダウンロードが追いつくまでスクロールを待たせる（0で無制限、デフォルト200）'
+    )
+    parser.add_argument(
+        '--no-keep-tweets',
+        action='store_true',
+        help='取得したTweetをメモリに保持せず、追記ログ（tweets.ndjson）から書き出す（長時間の取得向け。--media-onlyとは併用不可）'
+    )
+    parser.add_argument(
+        '--download-priority',
+        choices=list(PRIORITIES),
+        default='size',
+        help='並行ダウンロードの順序（size: 大きい順で全体の完了を早める / newest: 新しいツイート優先 / author: 本人投稿優先）'
+    )
+    parser.add_argument(
+        '--probe-media-size',
+        action='store_true',
+        help='動画のサイズ見積もりにHEADリクエストでContent-Lengthを使う'
+    )
     parser.add_argument(
         '--max-tweets',
         type=int,
@@ -127,6 +275,30 @@ def main():
         action='store_true',
         help='CSVファイルを生成しない'
     )
+    parser.add_argument(
+        '--parquet',
+        action='store_true',
+        help='Parquet（tweets/mediaテーブル、作者・月でパーティション分割）も RUN_DIR/parquet に書き出す（要pyarrow）'
+    )
+    parser.add_argument(
+        '--sqlite',
+        nargs='?',
+        const='',
+        default=None,
+        metavar='PATH',
+        help='実行を跨いで蓄積するSQLiteにもTweetを追加/更新する（PATH省略時は OUTPUT_DIR/tweets.sqlite3）'
+    )
+    parser.add_argument(
+        '--compact-output',
+        action='store_true',
+        help='JSON（tweets.json/マニフェスト）をインデントせずに書く（1Tweet1行）'
+    )
+    parser.add_argument(
+        '--compress',
+        choices=['gzip', 'zstd'],
+        default=None,
+        help='JSON/CSV/マニフェストを圧縮して書く（.gz / .zst。zstdは要zstandard、無ければgzip）'
+    )
     parser.add_argument(
         '--use-search',
         action='store_true',
@@ -150,8 +322,47 @@ def main():
         default=None,
         help='検索モード時のチャンク日数（未指定なら環境変数SEARCH_DAYS_PER_CHUNK、デフォルト7日）'
     )
+    parser.add_argument(
+        '--trace',
+        action='store_true',
+        help='Tweet/メディアごとの発見・動画URL解決・キュー待ち・転送・反映を記録し、RUN_DIR/trace.json に書き出す'
+    )
+    parser.add_argument(
+        '--profile',
+        nargs='?',
+        const='all',
+        default=None,
+        choices=['all', *PROFILE_STAGES],
+        help='cProfileでステージ（scrape/enrich/download/save）ごとに計測し RUN_DIR/profile/ に書く（ステージ名を付ければそれだけ。Python 3.12以降はサンプラーのみ）'
+    )
+    parser.add_argument(
+        '--profile-sample-ms',
+        type=float,
+        default=0,
+        help='--profile 時に全スレッドのスタックをこの間隔（ミリ秒）で採るサンプラーも動かす（0で使わない。cProfileを使えないときは既定の間隔で動かす）'
+    )
+    parser.add_argument(
+        '--profile-top',
+        type=int,
+        default=25,
+        help='プロファイル要約（summary.txt）に載せる関数の数'
+    )
+    parser.add_argument(
+        '--metrics-interval',
+        type=float,
+        default=15.0,
+        help='実行中の計測値（Prometheusテキスト形式）を RUN_DIR/metrics.prom に書く間隔（秒。0で書かない）'
+    )
+    parser.add_argument(
+        '--metrics-port',
+        type=int,
+        default=None,
+        help='計測値を http://127.0.0.1:PORT/metrics でも公開する'
+    )
     
     args = parser.parse_args()
+    if args.parquet and not pyarrow_available():
+        parser.error("--parquet には pyarrow が必要です（pip install pyarrow）")
     
     # ログ設定
     setup_logging()
@@ -174,6 +385,17 @@ def main():
     since = args.since if args.since is not None else (Config.SEARCH_SINCE or None)
     until = args.until if args.until is not None else (Config.SEARCH_UNTIL or None)
     days_per_chunk = args.days_per_chunk if args.days_per_chunk is not None else Config.SEARCH_DAYS_PER_CHUNK
+    # SQLiteストア（--sqlite 指定時のみ。PATH省略時は実行を跨いで共有する既定のファイル）
+    sqlite_path = None
+    if args.sqlite is not None:
+        sqlite_path = Path(args.sqlite) if args.sqlite else Config.OUTPUT_DIR / TWEET_DB_FILENAME
+
+    # 実行カタログ用の集計（終了時に状態と一緒に記録する）
+    run_summary = RunSummary()
+    run_started_at = datetime.now().isoformat(timespec="seconds")
+    run_mode = "json" if args.download_media_from_json else ("search" if use_search else "profile")
+    run_status = "completed"
+    metrics_reporter = None
     
     try:
         # 設定検証（スクレイピングを行う場合のみ必須）
@@ -185,6 +407,14 @@ def main():
         # 最大Tweet数設定
         if args.max_tweets > 0:
             Config.MAX_TWEETS = args.max_tweets
+
+        # 画質プロファイル（スクレイパー/動画解決/ダウンローダーが参照する）
+        if args.quality:
+            Config.QUALITY_PROFILE = args.quality
+
+        # 出力形式（DataSaver/マニフェストが参照する）
+        Config.OUTPUT_COMPACT = args.compact_output
+        Config.OUTPUT_COMPRESSION = args.compress or ""
         
         logger.info("=" * 60)
         logger.info("Twitter Tweet取得システム")
@@ -192,6 +422,8 @@ def main():
         logger.info(f"ユーザー名: {args.username or '(from json)'}")
         logger.info(f"最大Tweet数: {args.max_tweets if args.max_tweets > 0 else '無制限'}")
         logger.info(f"メディアダウンロード: {'有効（並行）' if args.download_media else '無効'}")
+        if args.quality:
+            logger.info(f"画質プロファイル: {args.quality}")
         if args.media_only:
             logger.info("メディアのみ保存: ON（tweets.json/CSVは保存しません）")
         if args.download_media_from_json:
@@ -202,118 +434,182 @@ def main():
         if use_search:
             logger.info(f"since: {since or 'default(1年前/環境変数なし)'} / until: {until or 'today/環境変数なし'} / days_per_chunk: {days_per_chunk}")
         logger.info("=" * 60)
+        metrics_reporter = _start_metrics(args)
+        if args.trace:
+            TRACER.enable()
+        if args.profile:
+            PROFILER.enable(
+                stages=None if args.profile == 'all' else [args.profile],
+                sample_interval=args.profile_sample_ms / 1000,
+            )
+
+        media_store = MediaStore() if args.media_store else None
+        media_index = None
+        if args.skip_known_media:
+            extra_manifests = []
+            if args.download_media_from_json and Path(args.download_media_from_json).exists():
+                extra_manifests.append(Path(args.download_media_from_json))
+            with RunCatalog() as catalog:
+                media_index = build_media_index(
+                    Config.OUTPUT_DIR,
+                    scan_dirs=[(Config.IMAGES_DIR, "image"), (Config.VIDEOS_DIR, "video")],
+                    extra_manifests=extra_manifests,
+                    catalog=catalog,
+                )
 
         # 取得結果JSONからメディアだけダウンロードするモード（スクレイピングしない）
         if args.download_media_from_json:
             json_path = Path(args.download_media_from_json)
             if not json_path.exists():
-                # 候補を提示（output/<RUN_ID>/tweets*.json を探す）
+                # 候補を提示（実行カタログに記録された過去の取得結果、新しい実行から）
+                run_status = None  # 出力が無いので記録しない
                 candidates = []
                 try:
-                    for p in Config.OUTPUT_DIR.glob("*/tweets_partial.json"):
-                        candidates.append(p)
-                    for p in Config.OUTPUT_DIR.glob("*/tweets.json"):
-                        candidates.append(p)
-                except Exception:
-                    candidates = []
-
-                try:
-                    candidates = sorted(
-                        candidates,
-                        key=lambda p: p.stat().st_mtime if p.exists() else 0,
-                        reverse=True,
-                    )
-                except Exception:
-                    pass
+                    with RunCatalog() as catalog:
+                        candidates = catalog.files(kinds=("tweets",), username=args.username, limit=10)
+                except Exception as e:
+                    logger.debug(f"実行カタログを読めませんでした: {e}")
 
                 logger.error(f"指定されたJSONが見つかりません: {json_path}")
                 if candidates:
                     logger.error("見つかったJSON候補（新しい順）:")
-                    for p in candidates[:10]:
+                    for p in candidates:
                         logger.error(f"  - {p}")
                 else:
-                    logger.error("output配下に tweets.json / tweets_partial.json が見つかりませんでした。")
+                    logger.error("実行カタログに tweets.json / tweets_partial.json が見つかりませんでした。")
+                    logger.error("カタログ導入前の実行は python run_catalog.py --rebuild で取り込めます。")
                 return
             logger.info("取得結果JSONを読み込みます...")
-            tweets = load_tweets_from_result_json(json_path)
-            ensure_media_has_tweet_url(tweets)
+            if args.media_only and not args.username:
+                raise ValueError("--media-only を使う場合は username も指定してください")
+
+            # 読み込み → 集計 → 作者フィルタ → (動画解決) → ダウンロード → 追記ログ、をTweet1件ずつ流す。
+            # 出力は追記ログから書き出すので、Tweet本体は全件をメモリに載せない
+            # （重複排除用の tweet_id・メディアごとの小さな記録だけは件数に比例する）
+            input_stats = {"tweets": 0, "media_total": 0, "video_total": 0, "thumb_total": 0, "targets": 0}
+            sample_authors = set()
+
+            def read_tweets():
+                for t in iter_tweets_from_result_json(json_path):
+                    ensure_media_has_tweet_url([t])
+                    medias = [m for m in (t.get("media", []) or []) if isinstance(m, dict)]
+                    input_stats["tweets"] += 1
+                    input_stats["media_total"] += len(t.get("media", []) or [])
+                    input_stats["video_total"] += sum(1 for m in medias if m.get("type") in ("video", "animated_gif"))
+                    input_stats["thumb_total"] += sum(1 for m in medias if _looks_like_video_thumb(str(m.get("url", ""))))
+                    run_summary.accept(t)
+                    yield t
+
+            json_log = TweetLog(Config.RUN_DIR / TWEET_LOG_FILENAME)
+
+            def download_targets(tweets_in):
+                """ダウンロード対象だけを返す（対象外のTweetはそのまま追記ログへ）"""
+                for t in tweets_in:
+                    if args.media_only and not is_target_author(t, args.username):
+                        if len(sample_authors) < 10 and t.get("author_username"):
+                            sample_authors.add(t.get("author_username"))
+                        json_log.append(t)
+                        continue
+                    input_stats["targets"] += 1
+                    yield t
+
+            def apply_video_only(t: Dict) -> None:
+                # video-only は「解決後」に適用（先に消すとサムネ判定できない）
+                medias = t.get("media", []) or []
+                t["media"] = [m for m in medias if isinstance(m, dict) and m.get("type") in ("video", "animated_gif")]
 
-            # デバッグ: JSON内のメディア状況を集計
             try:
-                media_total = sum(len(t.get("media", []) or []) for t in tweets)
-                video_total = sum(
-                    1
-                    for t in tweets
-                    for m in (t.get("media", []) or [])
-                    if isinstance(m, dict) and m.get("type") in ("video", "animated_gif")
-                )
-                thumb_total = sum(
-                    1
-                    for t in tweets
-                    for m in (t.get("media", []) or [])
-                    if isinstance(m, dict) and _looks_like_video_thumb(str(m.get("url", "")))
-                )
-                _agent_log("H2", "main.py:json_mode", "input media stats", {"tweets": len(tweets), "media_total": media_total, "video_total": video_total, "thumb_total": thumb_total})
-            except Exception:
-                pass
+                if args.resolve_videos_from_thumbnails:
+                    # サムネ（ext_tw_video_thumb等）から実動画URLを並行に解決し、解決できた順にダウンロードへ流す
+                    logger.info("動画サムネから実動画URLの解決を試みます（解決済みのものから並行ダウンロード）...")
+                    downloader = MediaDownloader(
+                        max_workers=3,
+                        video_workers=args.video_workers,
+                        priority=args.download_priority,
+                        target_username=args.username,
+                        probe_sizes=args.probe_media_size,
+                        segmented_threshold_mb=args.segmented_download_mb,
+                        segment_connections=args.segment_connections,
+                        media_store=media_store,
+                        media_index=media_index,
+                        max_pending=args.max_pending_downloads,
+                    )
+                    # ダウンロード結果は完了ごとに追記ログへ（Tweet本体は解決直後に追記する）
+                    def on_json_media_downloaded(tweet_id, media: Dict) -> None:
+                        json_log.log_media(tweet_id, media)
+                        run_summary.record_media(tweet_id, media)
 
-            tweets_for_download = tweets
-            if args.media_only:
-                if not args.username:
-                    raise ValueError("--media-only を使う場合は username も指定してください")
-                tweets_for_download = filter_tweets_by_author(tweets, args.username)
-                if not tweets_for_download:
-                    # よくある原因: usernameの指定ミス or author_usernameが想定と一致しない
-                    authors = []
+                    downloader.on_media_downloaded = on_json_media_downloaded
+                    enrich_stats = EnrichStats()
+                    downloader.start_parallel_download()
                     try:
-                        authors = sorted({t.get("author_username") for t in tweets if t.get("author_username")})[:10]
-                    except Exception:
-                        authors = []
-                    logger.warning("media-onlyフィルタ後のTweetが0件です（usernameの指定ミスの可能性）。")
-                    if authors:
-                        logger.warning(f"JSON内のauthor_username例: {', '.join(authors)}")
-
-            # サムネ（ext_tw_video_thumb等）から実動画URLを解決して追加
-            if args.resolve_videos_from_thumbnails:
-                logger.info("動画サムネから実動画URLの解決を試みます（ツイートHTMLを取得）...")
-                resolved = enrich_tweets_with_resolved_videos_from_thumbnails(tweets_for_download)
-                logger.info(f"動画URLを追加できた件数: {resolved}件")
-                _agent_log("H2", "main.py:json_mode", "resolved videos from thumbnails", {"resolved": resolved})
-
-            # video-only は「解決後」に適用（先に消すとサムネ判定できない）
-            if args.video_only:
-                for t in tweets_for_download:
-                    medias = t.get("media", []) or []
-                    t["media"] = [m for m in medias if isinstance(m, dict) and m.get("type") in ("video", "animated_gif")]
-                try:
-                    remaining = sum(len(t.get("media", []) or []) for t in tweets_for_download)
-                    _agent_log("H2", "main.py:json_mode", "after video-only filter", {"remaining_media": remaining})
-                except Exception:
-                    pass
-
-            logger.info("メディアダウンロードを開始します（同期）...")
-            downloader = MediaDownloader()
-            downloaded_tweets = downloader.download_media(tweets_for_download)
+                        for t in iter_tweets_with_resolved_videos(
+                            download_targets(read_tweets()), workers=args.resolve_workers, stats=enrich_stats
+                        ):
+                            if args.video_only:
+                                apply_video_only(t)
+                            json_log.append(t)
+                            downloader.add_tweet_for_download(t)
+                    except KeyboardInterrupt:
+                        # 中断時は処理中のものだけ待ち、残りはdead letterへ
+                        downloader.stop_parallel_download(wait_for_completion=False)
+                        raise
+                    finally:
+                        if downloader.is_downloading:
+                            # 全て取得できるか再試行を使い切り、ワーカーが書き戻しを終えるまで待ってから書き出す
+                            downloader.stop_parallel_download(wait_for_completion=True)
+                    logger.info(f"動画URL解決: {enrich_stats.summary()}")
+                    _agent_log("H2", "main.py:json_mode", "resolved videos from thumbnails", {"resolved": enrich_stats.resolved, "hit_rates": enrich_stats.hit_rates()})
+                else:
+                    logger.info("メディアダウンロードを開始します（同期）...")
+                    downloader = MediaDownloader(
+                        segmented_threshold_mb=args.segmented_download_mb,
+                        segment_connections=args.segment_connections,
+                        media_store=media_store,
+                        media_index=media_index,
+                    )
+                    downloader.on_media_downloaded = run_summary.record_media
+                    # 一定件数ずつダウンロードし、終わったものから追記ログへ
+                    batch = []
+                    for t in download_targets(read_tweets()):
+                        if args.video_only:
+                            apply_video_only(t)
+                        batch.append(t)
+                        if len(batch) >= JSON_MODE_BATCH_SIZE:
+                            for done in downloader.download_media(batch):
+                                json_log.append(done)
+                            batch = []
+                    if batch:
+                        for done in downloader.download_media(batch):
+                            json_log.append(done)
+            finally:
+                json_log.close()
 
-            # 元tweetsへlocal_path等を書き戻す
-            downloaded_map = {t.get("tweet_id"): t for t in downloaded_tweets}
-            for t in tweets:
-                tid = t.get("tweet_id")
-                if tid in downloaded_map:
-                    t["media"] = downloaded_map[tid].get("media", [])
+            _agent_log("H2", "main.py:json_mode", "input media stats", dict(input_stats))
+            if args.media_only and not input_stats["targets"]:
+                # よくある原因: usernameの指定ミス or author_usernameが想定と一致しない
+                logger.warning("media-onlyフィルタ後のTweetが0件です（usernameの指定ミスの可能性）。")
+                if sample_authors:
+                    logger.warning(f"JSON内のauthor_username例: {', '.join(sorted(sample_authors))}")
 
-            # 更新版JSONとマニフェストを保存
+            # 更新版JSONとマニフェストを保存（追記ログから逐次書き出す）
             saver = DataSaver()
-            saver.save_tweets_json(tweets, filename="tweets_with_media.json")
-            if not args.no_csv and not args.media_only:
-                saver.save_tweets_csv(tweets, filename="tweets_with_media.csv")
+            saver.export_from_log(
+                json_log.path,
+                json_filename="tweets_with_media.json",
+                csv_filename="tweets_with_media.csv" if not args.no_csv and not args.media_only else None,
+                parquet_dirname="parquet" if args.parquet and not args.media_only else None,
+                sqlite_path=sqlite_path if not args.media_only else None,
+            )
 
-            manifest_tweets = tweets
+            manifest_tweets = iter_logged_tweets(json_log.path)
             manifest_name = "media_from_json_manifest.json"
             if args.media_only:
-                manifest_tweets = filter_tweets_by_author(tweets, args.username)
+                manifest_tweets = (t for t in manifest_tweets if is_target_author(t, args.username))
                 manifest_name = "media_only_from_json_manifest.json"
-            manifest_path = save_media_manifest_from_tweets(manifest_tweets, filename=manifest_name)
+            manifest_path = save_media_manifest_from_tweets(
+                manifest_tweets, filename=manifest_name, dead_letters=downloader.dead_letters
+            )
 
             logger.info("=" * 60)
             logger.info("取得結果JSONからのメディアダウンロードが完了しました！")
@@ -324,7 +620,16 @@ def main():
         
         # スクレイパー初期化
         scraper = TwitterScraper()
+        scraper.add_sink(run_summary)
         downloader = None
+        # 受け付けたTweetを逐次追記する（メディアのみ保存モードではtweets系の出力を作らない）
+        tweet_log = None
+        if not args.media_only:
+            tweet_log = TweetLog(Config.RUN_DIR / TWEET_LOG_FILENAME)
+            scraper.add_sink(LogSink(tweet_log))
+            scraper.keep_tweets = not args.no_keep_tweets
+        elif args.no_keep_tweets:
+            logger.warning("--media-onlyではマニフェスト作成のためTweetを保持します（--no-keep-tweetsは無視）")
         
         try:
             # メディアダウンロードの設定
@@ -334,21 +639,41 @@ def main():
             if args.download_media:
                 if use_parallel_download:
                     # プロフィールスクロールモード: 並行ダウンロードを使用
-                    downloader = MediaDownloader(max_workers=3)
+                    downloader = MediaDownloader(
+                        max_workers=3,
+                        video_workers=args.video_workers,
+                        priority=args.download_priority,
+                        target_username=args.username,
+                        probe_sizes=args.probe_media_size,
+                        segmented_threshold_mb=args.segmented_download_mb,
+                        segment_connections=args.segment_connections,
+                        media_store=media_store,
+                        media_index=media_index,
+                        max_pending=args.max_pending_downloads,
+                    )
                     downloader.start_parallel_download()
                     
-                    # コールバック関数: ツイート取得時にメディアダウンロードキューに追加
-                    def on_tweet_fetched(tweet: Dict):
-                        if args.media_only and not is_target_author(tweet, args.username):
-                            return
-                        downloader.add_tweet_for_download(tweet)
+                    # ツイート取得時にメディアダウンロードキューに追加（待ちが上限ならスクロールを待たせる）
+                    scraper.add_sink(DownloadSink(downloader, author_filter=args.username if args.media_only else None))
                 else:
                     # 検索モード: 同期的にダウンロード（チャンクごとに完了させる）
-                    downloader = MediaDownloader()
-                    on_tweet_fetched = None
+                    downloader = MediaDownloader(
+                        segmented_threshold_mb=args.segmented_download_mb,
+                        segment_connections=args.segment_connections,
+                        media_store=media_store,
+                        media_index=media_index,
+                    )
                     # RT等で作者がズレるケースを除外（検索モードのチャンクダウンロード側で適用）
                     if args.media_only:
                         scraper.media_author_filter = args.username
+                # ダウンロード結果を追記ログと、スクレイパーが保持しているTweetに反映する
+                def on_media_downloaded(tweet_id, media: Dict) -> None:
+                    if tweet_log is not None:
+                        tweet_log.log_media(tweet_id, media)
+                    scraper.record_media(tweet_id, media)
+                    run_summary.record_media(tweet_id, media)
+
+                downloader.on_media_downloaded = on_media_downloaded
             
             # Tweet取得
             logger.info("Tweet取得を開始します...")
@@ -373,14 +698,14 @@ def main():
                     since=since,
                     until=until,
                     days_per_chunk=days_per_chunk,
-                    on_tweet_fetched=on_tweet_fetched if use_parallel_download else None,
                 )
             
-            if not tweets:
+            if not scraper.tweet_count:
                 logger.warning("Tweetが取得できませんでした")
+                run_status = "empty"
                 return
             
-            logger.info(f"{len(tweets)}件のTweetを取得しました")
+            logger.info(f"{scraper.tweet_count}件のTweetを取得しました")
             
             # メディアダウンロード（検索モードではチャンクごとに既にダウンロード済み）
             if args.download_media:
@@ -395,7 +720,9 @@ def main():
                 # 念のため: 最終的な集計も本人投稿のみに揃える
                 tweets_for_manifest = filter_tweets_by_author(tweets, args.username)
                 manifest_path = save_media_manifest_from_tweets(
-                    tweets_for_manifest, filename="media_only_manifest.json"
+                    tweets_for_manifest,
+                    filename="media_only_manifest.json",
+                    dead_letters=downloader.dead_letters if downloader else None,
                 )
                 logger.info("=" * 60)
                 logger.info("メディアのみ保存が完了しました！")
@@ -404,13 +731,24 @@ def main():
                 logger.info("=" * 60)
                 return
             
-            # データ保存
+            # データ保存（追記ログから逐次書き出す）
             logger.info("データを保存します...")
             saver = DataSaver()
-            saver.save_tweets_json(tweets)
-            
-            if not args.no_csv:
-                saver.save_tweets_csv(tweets)
+            tweet_log.flush()
+            saver.export_from_log(
+                tweet_log.path,
+                csv_filename=None if args.no_csv else "tweets_summary.csv",
+                parquet_dirname="parquet" if args.parquet else None,
+                sqlite_path=sqlite_path,
+            )
+
+            # 再試行を使い切ったメディアがあればマニフェストに残す
+            if downloader and downloader.dead_letters:
+                manifest_path = save_media_manifest_from_tweets(
+                    tweets if scraper.keep_tweets else iter_logged_tweets(tweet_log.path),
+                    dead_letters=downloader.dead_letters,
+                )
+                logger.warning(f"{len(downloader.dead_letters)}件のメディアを取得できませんでした: {manifest_path}")
             
             logger.info("=" * 60)
             logger.info("処理が完了しました！")
@@ -431,16 +769,13 @@ def main():
                     tweets_to_save = scraper.tweets
                 
                 # まだ保存されていない場合のみ保存
-                if tweets_to_save and not args.media_only:
-                    run_dir = Config.RUN_DIR
-                    json_path = run_dir / "tweets.json"
-                    partial_path = run_dir / "tweets_partial.json"
+                if (tweets_to_save or (tweet_log and tweet_log.count)) and not args.media_only:
+                    saver = DataSaver()
+                    json_path = saver.output_path("tweets.json")
+                    partial_path = saver.output_path("tweets_partial.json")
                     if not json_path.exists() and not partial_path.exists():  # 既に保存済みでない場合のみ
                         logger.info("途中データを保存しています...")
-                        saver = DataSaver()
-                        saver.save_tweets_json(tweets_to_save, filename="tweets_partial.json")
-                        if not args.no_csv:
-                            saver.save_tweets_csv(tweets_to_save, filename="tweets_partial.csv")
+                        _save_partial_tweets(tweets_to_save, tweet_log, "tweets_partial", args.no_csv)
             except Exception as save_error:
                 logger.error(f"途中データの保存中にエラー: {save_error}")
             
@@ -449,6 +784,8 @@ def main():
                     downloader.stop_parallel_download(wait_for_completion=False)
                 except:
                     pass
+            if tweet_log:
+                tweet_log.close()
             if scraper:
                 try:
                     scraper.close()
@@ -457,11 +794,12 @@ def main():
             
     except KeyboardInterrupt:
         logger.info("\n処理が中断されました")
+        run_status = "interrupted"
         
         # 中断時にもメディアダウンロードを停止（進行中のダウンロードは少し待機）
         if 'downloader' in locals() and downloader:
             logger.info("メディアダウンロードを停止しています（進行中のダウンロードを完了させます）...")
-            downloader.stop_parallel_download(wait_for_completion=True)
+            downloader.stop_parallel_download(wait_for_completion=False)
         
         # 中断時にも途中までのデータを保存（メディアのみ保存モードでは保存しない）
         tweets_to_save = None
@@ -470,24 +808,23 @@ def main():
         elif 'scraper' in locals() and scraper and scraper.tweets:
             tweets_to_save = scraper.tweets
         
-        if tweets_to_save and not args.media_only:
+        # --no-keep-tweets ではメモリにTweetが無いので、追記ログから書き出す
+        partial_log = locals().get('tweet_log')
+        if (tweets_to_save or (partial_log and partial_log.count)) and not args.media_only:
             logger.info("途中までのデータを保存しています...")
             try:
-                saver = DataSaver()
-                partial_path = saver.save_tweets_json(tweets_to_save, filename="tweets_partial.json")
-                if not args.no_csv:
-                    saver.save_tweets_csv(tweets_to_save, filename="tweets_partial.csv")
+                partial_path = _save_partial_tweets(tweets_to_save, partial_log, "tweets_partial", args.no_csv)
                 logger.info(f"途中データを保存しました: {partial_path}")
-                logger.info(f"取得済みTweet数: {len(tweets_to_save)}")
+                logger.info(f"取得済みTweet数: {len(tweets_to_save) if tweets_to_save else partial_log.count}")
                 
                 # ダウンロード済みメディアの数を確認
                 if args.download_media:
-                    downloaded_media = sum(
-                        1 for tweet in tweets_to_save 
-                        for media in tweet.get('media', []) 
-                        if media.get('local_path')
-                    )
-                    total_media = sum(len(tweet.get('media', [])) for tweet in tweets_to_save)
+                    downloaded_media = total_media = 0
+                    for tweet in tweets_to_save or iter_logged_tweets(partial_log.path):
+                        for media in tweet.get('media', []):
+                            total_media += 1
+                            if media.get('local_path'):
+                                downloaded_media += 1
                     logger.info(f"ダウンロード済みメディア: {downloaded_media}/{total_media}件")
                 
                 logger.info(f"出力ディレクトリ: {Config.RUN_DIR}")
@@ -504,6 +841,7 @@ def main():
         sys.exit(1)
     except Exception as e:
         logger.error(f"エラーが発生しました: {e}", exc_info=True)
+        run_status = "error"
         
         # エラー時にも途中までのデータを保存（メディアのみ保存モードでは保存しない）
         tweets_to_save = None
@@ -512,15 +850,14 @@ def main():
         elif 'scraper' in locals() and scraper and scraper.tweets:
             tweets_to_save = scraper.tweets
         
-        if tweets_to_save and not args.media_only:
+        # --no-keep-tweets ではメモリにTweetが無いので、追記ログから書き出す
+        partial_log = locals().get('tweet_log')
+        if (tweets_to_save or (partial_log and partial_log.count)) and not args.media_only:
             logger.info("エラー発生時の途中データを保存しています...")
             try:
-                saver = DataSaver()
-                partial_path = saver.save_tweets_json(tweets_to_save, filename="tweets_error.json")
-                if not args.no_csv:
-                    saver.save_tweets_csv(tweets_to_save, filename="tweets_error.csv")
+                partial_path = _save_partial_tweets(tweets_to_save, partial_log, "tweets_error", args.no_csv)
                 logger.info(f"途中データを保存しました: {partial_path}")
-                logger.info(f"取得済みTweet数: {len(tweets_to_save)}")
+                logger.info(f"取得済みTweet数: {len(tweets_to_save) if tweets_to_save else partial_log.count}")
             except Exception as save_error:
                 logger.error(f"途中データの保存中にエラー: {save_error}")
         
@@ -533,6 +870,12 @@ def main():
         
         logger.error("問題が発生しました。再度実行してください。")
         sys.exit(1)
+    finally:
+        # 出力ファイルが揃った後（途中保存を含む）に記録する
+        _record_run(args, run_mode, run_status, run_summary, run_started_at)
+        _finish_trace(run_status)
+        _finish_profile(args, run_status)
+        _finish_metrics(metrics_reporter, run_status)
 
 
 if __name__ == "__main__":
@@ -1,12 +1,15 @@
 """メディアダウンロードモジュール"""
 import os
+import re
+import json
 import requests
 from pathlib import Path
-from typing import Dict, List, Optional, Callable
+from urllib.parse import urlparse
+from typing import Dict, List, Optional, Callable, Tuple
 import logging
 from tqdm import tqdm
 import time
-from queue import Queue
+from queue import Empty
 from threading import Thread
 import threading
 from concurrent.futures import ThreadPoolExecutor, as_completed
@@ -15,71 +18,92 @@ import subprocess
 import tempfile
 
 from config import Config
+from download_scheduler import DeferredRetry, DownloadScheduler, HostBackoff, PHOTO_POOL, VIDEO_POOL, media_pool
+from media_index import MediaIndex, media_category, media_variant
+from media_store import MediaStore, link_or_copy
+from hls_playlist import Segment, resolve_media_playlist
+from quality_profiles import get_profile, photo_url, should_skip_media
+from agent_log import agent_log as _agent_log, enabled as agent_log_enabled, safe_url_tag as _safe_url_tag
+from run_metrics import METRICS, THROUGHPUT_BUCKETS
+from run_profiler import PROFILER
+from tweet_trace import TRACER
 
 logger = logging.getLogger(__name__)
 
-# region agent log
-_DEBUG_LOG_PATH = r"h:\document\program\project\getTweet\.cursor\debug.log"
-from pathlib import Path as _AgentPath
-_LOCAL_DEBUG_NDJSON = str((_AgentPath(__file__).resolve().parent / "debug.ndjson"))
-_LOCAL_CURSOR_DEBUG = str((_AgentPath(__file__).resolve().parent / ".cursor" / "debug.log"))
-
-
-def _agent_log(hypothesisId: str, location: str, message: str, data: dict = None, runId: str = "pre") -> None:
-    try:
-        import json as _json
-        import time as _time
-
-        payload = {
-            "sessionId": "debug-session",
-            "runId": runId,
-            "hypothesisId": hypothesisId,
-            "location": location,
-            "message": message,
-            "data": data or {},
-            "timestamp": int(_time.time() * 1000),
-        }
-        line = _json.dumps(payload, ensure_ascii=False) + "\n"
-        try:
-            _AgentPath(_DEBUG_LOG_PATH).parent.mkdir(parents=True, exist_ok=True)
-            with open(_DEBUG_LOG_PATH, "a", encoding="utf-8") as f:
-                f.write(line)
-        except Exception:
-            pass
-        try:
-            with open(_LOCAL_DEBUG_NDJSON, "a", encoding="utf-8") as f:
-                f.write(line)
-        except Exception:
-            pass
-        try:
-            _AgentPath(_LOCAL_CURSOR_DEBUG).parent.mkdir(parents=True, exist_ok=True)
-            with open(_LOCAL_CURSOR_DEBUG, "a", encoding="utf-8") as f:
-                f.write(line)
-        except Exception:
-            pass
-    except Exception:
-        pass
+_MEDIA_RESULTS = METRICS.counter("downloader_media_total", "メディアの処理結果（result=fetched/cached/failed）", ("type", "result"))
+_FETCH_SECONDS = METRICS.histogram("downloader_fetch_seconds", "ネットワークからの取得1件の所要時間", ("type",))
+_FETCH_BYTES = METRICS.counter("downloader_bytes_total", "ネットワークから取得したメディアのバイト数", ("type",))
+_THROUGHPUT = METRICS.histogram("downloader_throughput_bytes_per_second", "取得1件あたりのスループット", ("type",), buckets=THROUGHPUT_BUCKETS)
+_RETRIES = METRICS.counter("downloader_retries_total", "再試行の回数（reason=rate_limited/error/deferred）", ("reason",))
+_DEAD_LETTERS = METRICS.counter("downloader_dead_letters_total", "再試行を使い切ったメディアの数")
+_QUEUE_DEPTH = METRICS.gauge("downloader_queue_depth", "ダウンロード待ちのメディア数（再試行待ちを含む）", ("pool",))
+_PRODUCER_BLOCKED = METRICS.gauge("downloader_producer_blocked_seconds", "ダウンロード待ちが上限に達して取得を待たせた秒数")
+
+
+class _ConnectionBudget:
+    """分割ダウンロードで使う追加コネクション数の共有枠
 
+    各ワーカーは自分の1本を常に持っているので、ここから借りられなくても
+    ダウンロード自体は進む（大きな動画1本が他のメディアを止めないようにする）。
+    """
 
-def _safe_url_tag(url: str) -> str:
-    try:
-        return (url or "")[:160]
-    except Exception:
-        return ""
+    def __init__(self, total: int):
+        self._available = max(0, total)
+        self._lock = threading.Lock()
 
-# endregion
+    def acquire_up_to(self, n: int) -> int:
+        """最大n本を借りる（空きが無ければ0）"""
+        with self._lock:
+            granted = max(0, min(n, self._available))
+            self._available -= granted
+            return granted
+
+    def release(self, n: int) -> None:
+        with self._lock:
+            self._available += n
 
 
 class MediaDownloader:
     """メディアファイルダウンローダー"""
     
-    def __init__(self, max_workers: int = 3):
+    def __init__(
+        self,
+        max_workers: int = 3,
+        segmented_threshold_mb: float = 0,
+        segment_connections: int = 4,
+        media_store: Optional[MediaStore] = None,
+        media_index: Optional[MediaIndex] = None,
+        video_workers: Optional[int] = None,
+        priority: str = "size",
+        target_username: Optional[str] = None,
+        probe_sizes: bool = False,
+        max_pending: int = 0,
+    ):
         """
         Args:
-            max_workers: 並行ダウンロードの最大スレッド数
+            max_workers: 並行ダウンロードの画像用ワーカー数
+            video_workers: 動画/HLS用ワーカー数（Noneならmax_workersの半分、最低1）
+            priority: キューの優先度（size: 大きい順 / newest: 新しい順 / author: 本人投稿優先）
+            target_username: priority="author" のときの対象ユーザー
+            probe_sizes: 動画のサイズ見積もりにHEADリクエストでContent-Lengthを使う
+            max_pending: 並行ダウンロードの待ちの上限（達するとadd_tweet_for_downloadが空くまで待つ。0で無制限）
+            segmented_threshold_mb: このサイズ(MB)以上のMP4をRange分割で並行取得する（0で無効）
+            segment_connections: 分割ダウンロード時の1ファイルあたり最大コネクション数
+            media_store: 実行を跨いで重複排除するメディアストア（Noneで無効）
+            media_index: ダウンロード済みメディアの索引（Noneなら今回の保存先だけを走査して作る）
         """
         self.config = Config
         self.max_workers = max_workers
+        self.media_store = media_store
+        if media_index is None:
+            media_index = MediaIndex()
+            media_index.scan_dir(self.config.IMAGES_DIR, "image")
+            media_index.scan_dir(self.config.VIDEOS_DIR, "video")
+        self.media_index = media_index
+        self.segmented_threshold = int(segmented_threshold_mb * 1024 * 1024)
+        self.segment_connections = max(1, segment_connections)
+        # 全ワーカーで共有する追加コネクション枠（ワーカー数を超えて膨らませない）
+        self._segment_budget = _ConnectionBudget(min(self.segment_connections - 1, max_workers))
         # requests.Sessionはスレッドセーフではないため、スレッドローカルで管理
         self._thread_local = threading.local()
 
@@ -93,13 +117,31 @@ class MediaDownloader:
         if self.config.TWITTER_COOKIES:
             self._base_headers['Cookie'] = self.config.TWITTER_COOKIES
         
-        # 並行ダウンロード用のキューとスレッド
-        self.download_queue: Queue = Queue()
-        self.download_thread: Optional[Thread] = None
+        # 並行ダウンロード用のキュー（画像/動画でプールを分け、見積もりサイズ順に処理）とスレッド
+        self.video_workers = video_workers if video_workers is not None else max(1, max_workers // 2)
+        self.download_queue = DownloadScheduler(
+            priority=priority,
+            target_username=target_username,
+            probe=self._probe_size if probe_sizes else None,
+            max_pending=max_pending,
+        )
+        self.download_threads: List[Thread] = []
+        self._progress_lock = threading.Lock()
+        # 429/一時的エラーのホスト別バックオフと、再試行を使い切ったメディア
+        self.host_backoff = HostBackoff()
+        self.max_attempts = 3
+        self.dead_letters: List[Dict] = []
+        # ダウンロード結果ごとに (tweet_id, media) で呼ばれる（TweetLog.log_media 等）。
+        # 失敗・中断時も local_path=None で呼ぶ（保持しているTweetへ結果を反映するため）
+        self.on_media_downloaded: Optional[Callable[[Optional[str], Dict], None]] = None
         self.is_downloading = False
+        # 中断時に立てる（ワーカーは手元のメディアを終えたら抜ける）
+        self._aborted = False
         self.downloaded_count = 0
         self.total_media = 0
         self.pbar: Optional[tqdm] = None
+        # 転送途中で切断された場合の再開までの待機秒数
+        self.resume_retry_wait = 5
 
     def _get_session(self) -> requests.Session:
         """スレッドごとのSessionを返す"""
@@ -121,26 +163,37 @@ class MediaDownloader:
         logger.info(f"{total_media}件のメディアをダウンロードします")
         
         downloaded_count = 0
-        with tqdm(total=total_media, desc="メディアダウンロード", unit="件") as pbar:
+        profile = get_profile()
+        with PROFILER.stage("download"), tqdm(total=total_media, desc="メディアダウンロード", unit="件") as pbar:
             for tweet in tweets:
                 tweet_id = tweet.get('tweet_id')
                 tweet_url = tweet.get('url')
                 media_list = tweet.get('media', [])
                 
                 for media in media_list:
+                    if should_skip_media(media, media_list, profile):
+                        pbar.update(1)
+                        continue
                     try:
                         # Refererとして使えるように保持（ダウンロードの403回避に効くことがある）
                         if tweet_url and isinstance(media, dict) and 'tweet_url' not in media:
                             media['tweet_url'] = tweet_url
-                        local_path = self._download_single_media(media, tweet_id)
+                        media_index = media.get('media_index', 0)
+                        with TRACER.span("transfer", tweet_id, media_index, pool="sync") as span:
+                            local_path = self._download_single_media(media, tweet_id)
+                            span["ok"] = bool(local_path)
+                        media['local_path'] = str(local_path) if local_path else None
                         if local_path:
-                            media['local_path'] = str(local_path)
                             downloaded_count += 1
+                        if self.on_media_downloaded:
+                            with TRACER.span("writeback", tweet_id, media_index):
+                                self.on_media_downloaded(tweet_id, media)
                         pbar.update(1)
                         time.sleep(0.5)  # レート制限回避
                     except Exception as e:
                         logger.error(f"メディアダウンロードエラー: {e}")
                         media['local_path'] = None
+                        self._notify_failed(tweet_id, media)
                         pbar.update(1)
         
         logger.info(f"{downloaded_count}件のメディアをダウンロードしました")
@@ -153,103 +206,116 @@ class MediaDownloader:
             return
         
         self.is_downloading = True
+        self._aborted = False
         self.downloaded_count = 0
         self.total_media = 0
         self.pbar = tqdm(desc="メディアダウンロード（並行）", unit="件", position=1, leave=True)
-        
-        def download_worker():
-            """ダウンロードワーカースレッド"""
-            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
-                futures = {}
-                
-                while self.is_downloading or not self.download_queue.empty():
-                    # キューからタスクを取得（タイムアウト付き）
-                    try:
-                        task = self.download_queue.get(timeout=1.0)
-                    except:
-                        # 完了したタスクを処理
-                        completed_futures = []
-                        for future in list(futures.keys()):
-                            if future.done():
-                                completed_futures.append(future)
-                        
-                        for future in completed_futures:
-                            tweet_id, media = futures.pop(future)
-                            try:
-                                local_path = future.result()
-                                if local_path:
-                                    media['local_path'] = str(local_path)
-                                    self.downloaded_count += 1
-                                else:
-                                    media['local_path'] = None
-                            except Exception as e:
-                                logger.error(f"メディアダウンロードエラー: {e}")
-                                media['local_path'] = None
-                            
-                            self.pbar.update(1)
-                            if progress_callback:
-                                progress_callback(self.downloaded_count, self.total_media)
-                            
-                            self.download_queue.task_done()
-                            time.sleep(0.3)  # レート制限回避
-                        continue
-                    
-                    tweet_id, media = task
-                    
-                    # ダウンロードを実行
-                    future = executor.submit(self._download_single_media, media, tweet_id)
-                    futures[future] = (tweet_id, media)
-                    
-                    # 完了したタスクを処理
-                    completed_futures = []
-                    for future in list(futures.keys()):
-                        if future.done():
-                            completed_futures.append(future)
-                    
-                    for future in completed_futures:
-                        tweet_id, media = futures.pop(future)
-                        try:
-                            local_path = future.result()
-                            if local_path:
-                                media['local_path'] = str(local_path)
-                                self.downloaded_count += 1
-                            else:
-                                media['local_path'] = None
-                        except Exception as e:
-                            logger.error(f"メディアダウンロードエラー: {e}")
-                            media['local_path'] = None
-                        
-                        self.pbar.update(1)
-                        if progress_callback:
-                            progress_callback(self.downloaded_count, self.total_media)
-                        
-                        self.download_queue.task_done()
-                        time.sleep(0.3)  # レート制限回避
-                
-                # 残りのタスクを処理
-                for future in as_completed(list(futures.keys())):
-                    tweet_id, media = futures.pop(future)
-                    try:
-                        local_path = future.result()
-                        if local_path:
-                            media['local_path'] = str(local_path)
-                            self.downloaded_count += 1
-                        else:
-                            media['local_path'] = None
-                    except Exception as e:
-                        logger.error(f"メディアダウンロードエラー: {e}")
-                        media['local_path'] = None
-                    
-                    self.pbar.update(1)
-                    if progress_callback:
-                        progress_callback(self.downloaded_count, self.total_media)
-            
-            self.pbar.close()
-            logger.info(f"{self.downloaded_count}件のメディアをダウンロードしました（並行）")
-        
-        self.download_thread = Thread(target=download_worker, daemon=True)
-        self.download_thread.start()
-        logger.info("並行メディアダウンロードを開始しました")
+
+        # 画像と動画で別々のワーカープールを持つ（大きな動画が画像の後ろ詰まりを起こさないように）
+        self.download_threads = []
+        for pool, count in ((PHOTO_POOL, self.max_workers), (VIDEO_POOL, self.video_workers)):
+            for i in range(count):
+                t = Thread(target=PROFILER.wrap("download", self._pool_worker), args=(pool, progress_callback), name=f"media-{pool}-{i}", daemon=True)
+                t.start()
+                self.download_threads.append(t)
+        for pool in (PHOTO_POOL, VIDEO_POOL):
+            _QUEUE_DEPTH.set_function(lambda pool=pool: self.download_queue.qsize(pool), pool=pool)
+        _PRODUCER_BLOCKED.set_function(lambda: self.download_queue.blocked_seconds)
+        logger.info(f"並行メディアダウンロードを開始しました（画像{self.max_workers}並行 / 動画{self.video_workers}並行）")
+
+    def _pool_worker(self, pool: str, progress_callback: Optional[Callable] = None):
+        """ダウンロードワーカースレッド（担当プールのキューから優先度順に取り出す）
+
+        429や一時的エラーではその場で待たずに再試行待ちへ回し、すぐ次のメディアに進む。
+        """
+        while not self._aborted and (self.is_downloading or not self.download_queue.empty(pool)):
+            try:
+                tweet_id, media = self.download_queue.get(pool, timeout=1.0)
+            except Empty:
+                continue
+
+            media_index = media.get('media_index', 0)
+            TRACER.end("queue", tweet_id, media_index, media.get('type'))
+            host = urlparse(str(media.get('url') or '')).netloc
+            blocked = self.host_backoff.remaining(host)
+            if blocked > 0:
+                # ホストが429で止まっている間は、リクエストせずに後回し
+                TRACER.begin("queue", tweet_id, media_index, media.get('type'), pool=pool, deferred="host_backoff")
+                self.download_queue.defer(tweet_id, media, blocked, count_attempt=False)
+                continue
+
+            try:
+                with TRACER.span("transfer", tweet_id, media_index, pool=pool) as span:
+                    local_path = self._download_single_media(media, tweet_id, defer_retries=True)
+                    span["ok"] = bool(local_path)
+                media['local_path'] = str(local_path) if local_path else None
+                if local_path:
+                    self.host_backoff.reset(host)
+                    with self._progress_lock:
+                        self.downloaded_count += 1
+                if self.on_media_downloaded:
+                    with TRACER.span("writeback", tweet_id, media_index):
+                        self.on_media_downloaded(tweet_id, media)
+            except DeferredRetry as e:
+                delay = self.host_backoff.penalize(host, e.rate_limited)
+                attempts = self.download_queue.attempts(tweet_id, media) + 1
+                if attempts < self.max_attempts:
+                    _RETRIES.inc(reason="deferred")
+                    TRACER.begin("queue", tweet_id, media_index, media.get('type'), pool=pool, deferred=e.reason)
+                    logger.warning(f"後で再試行します（{delay:.0f}秒後, {attempts}/{self.max_attempts}）: {media.get('url')} - {e.reason}")
+                    self.download_queue.defer(tweet_id, media, delay)
+                    continue
+                logger.error(f"再試行上限に達しました: {media.get('url')} - {e.reason}")
+                self._add_dead_letter(tweet_id, media, e.reason, attempts)
+                media['local_path'] = None
+                self._notify_failed(tweet_id, media)
+            except Exception as e:
+                logger.error(f"メディアダウンロードエラー: {e}")
+                media['local_path'] = None
+                self._notify_failed(tweet_id, media)
+            # 再試行待ちに戻したもの（continue）以外はここで終わり
+            self.download_queue.forget(tweet_id, media)
+            self.download_queue.task_done()
+
+            if self.pbar is not None:
+                self.pbar.update(1)
+            if progress_callback:
+                progress_callback(self.downloaded_count, self.total_media)
+            time.sleep(0.3)  # レート制限回避
+
+    def _notify_failed(self, tweet_id: Optional[str], media: Dict) -> None:
+        """失敗したメディア（local_path=None）を on_media_downloaded に伝える（コールバックの例外は記録のみ）"""
+        if not self.on_media_downloaded:
+            return
+        try:
+            with TRACER.span("writeback", tweet_id, media.get('media_index', 0)):
+                self.on_media_downloaded(tweet_id, media)
+        except Exception as e:
+            logger.error(f"ダウンロード結果の反映エラー: {e}")
+
+    def _add_dead_letter(self, tweet_id: Optional[str], media: Dict, reason: str, attempts: int) -> None:
+        """再試行を使い切ったメディアを記録する（マニフェストのdead_lettersに出力）"""
+        with self._progress_lock:
+            self.dead_letters.append({
+                'tweet_id': tweet_id,
+                'media_index': media.get('media_index', 0),
+                'type': media.get('type'),
+                'url': media.get('url'),
+                'reason': reason,
+                'attempts': attempts,
+            })
+        _DEAD_LETTERS.inc()
+
+    def _probe_size(self, url: str) -> Optional[int]:
+        """HEADでContent-Lengthを調べる（スケジューリング用。失敗時はNone）"""
+        if not url or url.startswith("blob:") or ".m3u8" in url:
+            return None
+        try:
+            resp = self._get_session().head(url, timeout=5, allow_redirects=True)
+            length = resp.headers.get('Content-Length', '')
+            return int(length) if resp.status_code == 200 and length.isdigit() else None
+        except Exception:
+            return None
     
     def add_tweet_for_download(self, tweet: Dict):
         """ダウンロードキューにツイートを追加"""
@@ -260,12 +326,16 @@ class MediaDownloader:
         tweet_id = tweet.get('tweet_id')
         tweet_url = tweet.get('url')  # Referer用
         media_list = tweet.get('media', [])
+        profile = get_profile()
         
         for media in media_list:
+            if should_skip_media(media, media_list, profile):
+                continue
             # Refererとして使えるように保持（ダウンロードの403回避に効くことがある）
             if tweet_url and isinstance(media, dict) and 'tweet_url' not in media:
                 media['tweet_url'] = tweet_url
-            self.download_queue.put((tweet_id, media))
+            TRACER.begin("queue", tweet_id, media.get('media_index', 0), media.get('type'), pool=media_pool(media))
+            self.download_queue.put(tweet_id, media, tweet)
             self.total_media += 1
         
         if self.pbar is not None:
@@ -276,36 +346,93 @@ class MediaDownloader:
         """並行ダウンロードを停止
         
         Args:
-            wait_for_completion: Trueの場合、進行中のダウンロードが完了するまで待機
+            wait_for_completion: Trueの場合、再試行待ちも含めて全てのメディアが終わる（取得できるか
+                再試行を使い切る）まで待機する。Falseの場合（中断時）は未着手・再試行待ちのメディアを
+                dead letterとして残し、進行中のダウンロードだけ少し待つ
         """
         self.is_downloading = False
         
-        if self.download_thread:
-            if wait_for_completion:
-                # キューが空になるまで待機（最大60秒）
-                logger.info("進行中のメディアダウンロードの完了を待機しています...")
-                timeout = 60
-                elapsed = 0
-                while not self.download_queue.empty() and elapsed < timeout:
-                    time.sleep(1)
-                    elapsed += 1
-                
-                if not self.download_queue.empty():
-                    logger.warning(f"一部のメディアダウンロードが完了しませんでした（{len(self.download_queue.queue)}件残り）")
-            
-            # スレッドの終了を待つ
-            self.download_thread.join(timeout=30)  # 最大30秒待機
-        
-        if self.pbar is not None:
-            self.pbar.close()
+        try:
+            if self.download_threads:
+                if wait_for_completion:
+                    logger.info("進行中のメディアダウンロードの完了を待機しています...")
+                    try:
+                        if not self._wait_until_drained():
+                            self._abandon_pending()
+                    except KeyboardInterrupt:
+                        logger.warning("待機が中断されたため、残りのメディアはdead letterとして残します")
+                        self._abandon_pending()
+                        raise
+                else:
+                    self._abandon_pending()
+
+                if self._aborted:
+                    # 進行中のダウンロードだけ待つ（全体で最大30秒）
+                    deadline = time.time() + 30
+                    for t in self.download_threads:
+                        t.join(timeout=max(0.0, deadline - time.time()))
+                else:
+                    # 全て終わっているので、ワーカーは次の取り出しのタイムアウトで抜ける
+                    for t in self.download_threads:
+                        t.join()
+                if self._aborted:
+                    # 止める直前に進行中のワーカーが再試行待ちへ戻したもの
+                    self._abandon_pending()
+        finally:
+            if self.pbar is not None:
+                self.pbar.close()
+            # 停止時点の値を残す
+            for pool in (PHOTO_POOL, VIDEO_POOL):
+                _QUEUE_DEPTH.set_function(None, pool=pool)
+            _PRODUCER_BLOCKED.set_function(None)
         
         logger.info(f"並行メディアダウンロードを停止しました（{self.downloaded_count}/{self.total_media}件完了）")
+        if self.download_queue.blocked_seconds >= 1:
+            logger.info(f"ダウンロード待ちが上限に達していたため、取得を計{self.download_queue.blocked_seconds:.0f}秒待たせました")
+
+    def _wait_until_drained(self, log_interval: float = 60.0) -> bool:
+        """キュー・再試行待ち・ワーカーが処理中のメディアが全て終わるまで待つ
+
+        429の再試行待ちは15分以上かかることがあるので上限は設けない。
+        ワーカーが全て落ちたプールに残りがある場合だけ、待つのをやめてFalseを返す。
+        """
+        next_log = time.time() + log_interval
+        while not self.download_queue.join(timeout=0.5):
+            dead = [
+                pool for pool in (PHOTO_POOL, VIDEO_POOL)
+                if not self.download_queue.empty(pool)
+                and not any(t.is_alive() for t in self.download_threads if t.name.startswith(f"media-{pool}-"))
+            ]
+            if dead:
+                logger.error(f"ワーカーが停止しているため完了を待てません（{', '.join(dead)}）")
+                return False
+            if time.time() >= next_log:
+                next_log += log_interval
+                logger.info(
+                    f"メディアダウンロードの完了待ち: 残り{self.download_queue.unfinished()}件"
+                    f"（うち再試行待ち{self.download_queue.deferred_size()}件）"
+                )
+        return True
+
+    def _abandon_pending(self) -> None:
+        """未着手・再試行待ちのメディアを諦めてdead letterに残し、ワーカーを止める（中断時）"""
+        self._aborted = True
+        for tweet_id, media, deferred in self.download_queue.drain():
+            TRACER.end("queue", tweet_id, media.get('media_index', 0), media.get('type'), abandoned=True)
+            media['local_path'] = None
+            reason = "停止時に再試行待ちでした" if deferred else "停止時に未着手でした"
+            self._add_dead_letter(tweet_id, media, reason, self.download_queue.attempts(tweet_id, media))
+            self.download_queue.forget(tweet_id, media)
+            self._notify_failed(tweet_id, media)
     
-    def _download_single_media(self, media: Dict, tweet_id: str) -> Optional[Path]:
-        """単一のメディアファイルをダウンロード（429時にリトライ）"""
-        media_type = media.get('type')
-        url = media.get('url')
+    def _download_single_media(self, media: Dict, tweet_id: str, defer_retries: bool = False) -> Optional[Path]:
+        """単一のメディアファイルをダウンロード（429時にリトライ）
+
+        Args:
+            defer_retries: Trueなら429/一時的エラーで待機せず DeferredRetry を送出する（並行ダウンロード用）
+        """
         media_index = media.get('media_index', 0)
+        url = self._effective_url(media)
         
         if not url:
             return None
@@ -315,42 +442,161 @@ class MediaDownloader:
             logger.warning(f"blob URLのためスキップします: {tweet_id} idx={media_index}")
             return None
 
+        category = media_category(media.get('type'))
+        save_dir = self._media_save_dir(media.get('type'))
+        stem = f"{tweet_id}_{media_index}"
+
+        # ダウンロード済みの索引を先に引く（既存ファイルにはHTTPリクエストを出さない）
+        # 画像は画質プロファイルでサイズが変わるので、実際に取得するURL（版）で引く
+        variant = media_variant(url)
+        known = self.media_index.lookup((url,), tweet_id, media_index, category, variant=variant)
+        if known:
+            if known.parent != save_dir or known.stem != stem:
+                # 以前の実行やRT元のファイルは今回の保存先にリンクする
+                dest = save_dir / f"{stem}{known.suffix}"
+                if not (dest.exists() and dest.stat().st_size > 0):
+                    link_or_copy(known, dest)
+                known = dest
+        path = known
+
+        # メディアストアに既にあればネットワークに触れずにリンクするだけ
+        if not path and self.media_store:
+            path = self.media_store.link_existing(url, save_dir, stem)
+
+        media_type = media.get('type') or 'unknown'
+        if path:
+            _MEDIA_RESULTS.inc(type=media_type, result="cached")
+        else:
+            path = self._timed_fetch(media, tweet_id, url, defer_retries)
+            if path and self.media_store:
+                try:
+                    self.media_store.put(url, path)
+                except Exception as e:
+                    logger.warning(f"メディアストアへの登録に失敗: {path}: {e}")
+
+        if path:
+            media['file_size'] = path.stat().st_size
+            self.media_index.add(path, urls=(url,), tweet_id=tweet_id, media_index=media_index, category=category, variant=variant)
+        return path
+
+    def _timed_fetch(self, media: Dict, tweet_id: str, url: str, defer_retries: bool) -> Optional[Path]:
+        """_fetch_single_media の所要時間・バイト数・スループットを計測する"""
+        media_type = media.get('type') or 'unknown'
+        start = time.perf_counter()
+        path = None
+        try:
+            path = self._fetch_single_media(media, tweet_id, url, defer_retries)
+        finally:
+            elapsed = time.perf_counter() - start
+            _FETCH_SECONDS.observe(elapsed, type=media_type)
+            _MEDIA_RESULTS.inc(type=media_type, result="fetched" if path else "failed")
+        if not path:
+            return None
+        size = path.stat().st_size
+        _FETCH_BYTES.inc(size, type=media_type)
+        if elapsed > 0:
+            _THROUGHPUT.observe(size / elapsed, type=media_type)
+        return path
+
+    def _effective_url(self, media: Dict) -> Optional[str]:
+        """実際に取得するURL（画像は画質プロファイルに応じたサイズに変換）"""
+        url = media.get('url')
+        if url and media.get('type') == 'photo':
+            url = photo_url(url, get_profile())
+        return url
+
+    def _fetch_single_media(self, media: Dict, tweet_id: str, url: str, defer_retries: bool = False) -> Optional[Path]:
+        """ネットワークから単一のメディアを取得する"""
+        media_type = media.get('type')
+        media_index = media.get('media_index', 0)
+
         # Referer（あると403回避に効くことがある）
         referer = None
         if isinstance(media, dict):
             referer = media.get("tweet_url") or None
         if not referer:
             referer = "https://twitter.com/"
-        
-        # URLを高解像度版に変換（画像の場合）
-        if media_type == 'photo' and '?format=' not in url:
-            # 高解像度版を取得
-            url = url.replace(':small', ':large').replace(':thumb', ':large')
 
         # HLS(m3u8)はrequestsで素直に落としても動画にならないので、ffmpegがあれば変換する
         if isinstance(url, str) and ".m3u8" in url:
             _agent_log("H1", "media_downloader.py:_download_single_media", "m3u8 detected", {"tweet_id": tweet_id, "url": _safe_url_tag(url)})
             return self._download_hls_by_segments(url, tweet_id, media_index, referer)
-        
+
+        # 大きなMP4はRange分割で並行取得（失敗時は通常の逐次ダウンロードにフォールバック）
+        if self.segmented_threshold > 0 and media_type in ('video', 'animated_gif'):
+            segmented_path = self._download_segmented(media, url, tweet_id, media_index, referer)
+            if segmented_path:
+                return segmented_path
+            path = self._download_sequential(media, url, tweet_id, media_index, referer, defer_retries)
+            if path:
+                # 通常ダウンロードで揃ったので、分割ダウンロードの途中ファイルはもう使わない
+                self._clear_partial(*self._segment_paths(tweet_id, media_index))
+            return path
+        return self._download_sequential(media, url, tweet_id, media_index, referer, defer_retries)
+
+    def _download_sequential(
+        self, media: Dict, url: str, tweet_id: str, media_index: int, referer: str, defer_retries: bool
+    ) -> Optional[Path]:
+        """1本のコネクションで取得する（.part / .part.json で中断した位置から再開できる）"""
+        media_type = media.get('type')
         max_retry = 3
         backoff = 60  # 秒
+
+        # 途中までのデータはRUN_DIRを跨いで再利用できるよう OUTPUT_DIR/.partial に置く
+        part_path, meta_path = self._partial_paths(tweet_id, media_index)
         
         for attempt in range(1, max_retry + 1):
+            received = 0
             try:
                 sess = self._get_session()
                 headers = {'Referer': referer}
-                _agent_log("H2", "media_downloader.py:_download_single_media", "request", {"tweet_id": tweet_id, "type": media_type, "attempt": attempt, "url": _safe_url_tag(url), "referer": referer[:60]})
+
+                # 前回の .part が同じURLのものなら Range で続きから取得
+                offset = 0
+                meta = self._load_partial_meta(meta_path)
+                if meta and meta.get("url") == url and part_path.exists():
+                    offset = part_path.stat().st_size
+                elif meta or part_path.exists():
+                    self._clear_partial(part_path, meta_path)
+                    meta = None
+                if offset > 0:
+                    headers['Range'] = f"bytes={offset}-"
+                    if meta.get("etag"):
+                        headers['If-Range'] = meta["etag"]
+                    elif meta.get("last_modified"):
+                        headers['If-Range'] = meta["last_modified"]
+
+                # リクエストごとの記録は trace（記録内容を組み立てる前に判定する）
+                trace = agent_log_enabled("trace")
+                if trace:
+                    _agent_log("H2", "media_downloader.py:_download_single_media", "request", {"tweet_id": tweet_id, "type": media_type, "attempt": attempt, "offset": offset, "url": _safe_url_tag(url), "referer": referer[:60]}, level="trace")
                 response = sess.get(url, timeout=30, stream=True, headers=headers)
-                _agent_log("H2", "media_downloader.py:_download_single_media", "response", {"tweet_id": tweet_id, "status": response.status_code, "ctype": response.headers.get("content-type", "")[:80]})
+                if trace:
+                    _agent_log("H2", "media_downloader.py:_download_single_media", "response", {"tweet_id": tweet_id, "status": response.status_code, "ctype": response.headers.get("content-type", "")[:80]}, level="trace")
                 
                 if response.status_code == 429:
+                    response.close()
+                    if defer_retries:
+                        raise DeferredRetry("429 Too Many Requests", rate_limited=True)
                     # 429は一般的に15分ウィンドウのことが多いので、最低900秒待機に引き上げ
                     wait_for = max(backoff, 900)
                     logger.warning(f"429 Too Many Requests (media): {url} - {wait_for}秒待機してリトライ ({attempt}/{max_retry})")
+                    _RETRIES.inc(reason="rate_limited")
                     time.sleep(wait_for)
                     backoff = min(wait_for * 2, 3600)  # 最大1時間
                     continue
 
+                if response.status_code == 416 and offset > 0:
+                    # 既に全バイト取得済み（.partが完成している）か、サーバ側のファイルが変わった
+                    response.close()
+                    total = meta.get("content_length")
+                    if total and offset == total:
+                        save_path = self._media_save_dir(media_type) / f"{tweet_id}_{media_index}{meta.get('ext') or ''}"
+                        return self._finalize_partial(media, part_path, meta_path, save_path)
+                    logger.warning(f"Range要求が拒否されたため最初から取得し直します: {url}")
+                    self._clear_partial(part_path, meta_path)
+                    continue
+
                 if response.status_code in (401, 403):
                     # RefererやCookie不足、保護ツイート等
                     logger.warning(f"{response.status_code} (media): {url} - Referer/Cookieが必要な可能性があります")
@@ -359,176 +605,343 @@ class MediaDownloader:
                 
                 # ファイル拡張子を決定
                 ext = self._get_extension(url, media_type, response.headers.get('content-type'))
-                _agent_log("H4", "media_downloader.py:_download_single_media", "extension", {"tweet_id": tweet_id, "ext": ext, "type": media_type})
+                if trace:
+                    _agent_log("H4", "media_downloader.py:_download_single_media", "extension", {"tweet_id": tweet_id, "ext": ext, "type": media_type}, level="trace")
                 
                 # 保存先パスを決定
-                if media_type in ['photo', 'video_thumbnail']:
-                    save_dir = self.config.IMAGES_DIR
-                elif media_type in ['video', 'animated_gif']:
-                    save_dir = self.config.VIDEOS_DIR
-                else:
-                    save_dir = self.config.OUTPUT_DIR
-                
+                save_dir = self._media_save_dir(media_type)
                 filename = f"{tweet_id}_{media_index}{ext}"
                 save_path = save_dir / filename
 
                 # 既に存在する場合はスキップ
                 if save_path.exists() and save_path.stat().st_size > 0:
+                    response.close()
+                    self._clear_partial(part_path, meta_path)
                     return save_path
-                
-                # 原子的に保存（途中で落ちても壊れファイルを残しにくい）
-                tmp_fd, tmp_path = tempfile.mkstemp(prefix=f"{tweet_id}_{media_index}_", suffix=ext, dir=str(save_dir))
-                os.close(tmp_fd)
-                try:
-                    with open(tmp_path, 'wb') as f:
-                        for chunk in response.iter_content(chunk_size=8192):
-                            if chunk:
-                                f.write(chunk)
-                    Path(tmp_path).replace(save_path)
-                finally:
-                    try:
-                        if Path(tmp_path).exists():
-                            Path(tmp_path).unlink()
-                    except Exception:
-                        pass
-                
-                # ファイルサイズを記録
-                file_size = save_path.stat().st_size
-                media['file_size'] = file_size
-                
-                return save_path
-                
+
+                total = None
+                if response.status_code == 206 and offset > 0:
+                    start, total = self._parse_content_range(response.headers.get('Content-Range'))
+                    if start != offset:
+                        # 要求した位置と異なる範囲が返ってきた場合は作り直す
+                        response.close()
+                        self._clear_partial(part_path, meta_path)
+                        raise IOError(f"Content-Rangeが要求と一致しません: {response.headers.get('Content-Range')}")
+                    if total is None:
+                        total = meta.get("content_length")
+                    mode = 'ab'
+                    logger.info(f"途中から再開します ({offset}バイト目から): {url}")
+                else:
+                    # 200（Range非対応、またはIf-Range不一致）の場合は最初から
+                    offset = 0
+                    length = response.headers.get('Content-Length')
+                    total = int(length) if length and length.isdigit() else None
+                    meta = {
+                        "url": url,
+                        "etag": response.headers.get('ETag'),
+                        "last_modified": response.headers.get('Last-Modified'),
+                        "content_length": total,
+                        "ext": ext,
+                    }
+                    self._write_partial_meta(meta_path, meta)
+                    mode = 'wb'
+
+                # .part に追記していく（失敗しても消さずに次回の再開に使う）
+                with open(part_path, mode) as f:
+                    for chunk in response.iter_content(chunk_size=8192):
+                        if chunk:
+                            f.write(chunk)
+                            received += len(chunk)
+
+                size = part_path.stat().st_size
+                if total is not None and size != total:
+                    raise IOError(f"ファイルサイズが一致しません ({size}/{total}バイト)")
+
+                return self._finalize_partial(media, part_path, meta_path, save_path)
+
+            except DeferredRetry:
+                raise
             except Exception as e:
                 logger.error(f"メディアダウンロード失敗 ({url}): {e}")
+                if defer_retries and received == 0:
+                    # 転送が始まっていない失敗はワーカーを塞がずに後で再試行
+                    raise DeferredRetry(str(e)[:200]) from e
                 if attempt == max_retry:
+                    if part_path.exists():
+                        logger.info(f"途中までのデータを保持しました（次回実行時に再開します）: {part_path}")
                     return None
                 # 429以外でも一時的エラーの可能性があるためリトライ
                 logger.info(f"再試行します ({attempt}/{max_retry})")
-                time.sleep(backoff)
-                backoff = min(backoff * 2, 300)
+                _RETRIES.inc(reason="error")
+                if received > 0:
+                    # 転送途中の切断はレート制限ではないので、短い待機で続きから再開する
+                    time.sleep(self.resume_retry_wait)
+                else:
+                    time.sleep(backoff)
+                    backoff = min(backoff * 2, 300)
+
+    def _media_save_dir(self, media_type: Optional[str]) -> Path:
+        """メディア種別ごとの保存先ディレクトリ"""
+        if media_type in ['photo', 'video_thumbnail']:
+            return self.config.IMAGES_DIR
+        elif media_type in ['video', 'animated_gif']:
+            return self.config.VIDEOS_DIR
+        return self.config.OUTPUT_DIR
+
+    def _partial_paths(self, tweet_id: str, media_index: int) -> Tuple[Path, Path]:
+        """途中ファイル(.part)とメタデータ(.part.json)のパス"""
+        partial_dir = self.config.OUTPUT_DIR / ".partial"
+        partial_dir.mkdir(parents=True, exist_ok=True)
+        stem = f"{tweet_id}_{media_index}"
+        return partial_dir / f"{stem}.part", partial_dir / f"{stem}.part.json"
+
+    def _segment_paths(self, tweet_id: str, media_index: int) -> Tuple[Path, Path]:
+        """分割ダウンロードの途中ファイル(.seg)と取得済みレンジのメタデータ(.seg.json)のパス
+
+        逐次ダウンロードの .part / .part.json とは別に持つ（互いの再開情報を消さない）。
+        """
+        part_path, _ = self._partial_paths(tweet_id, media_index)
+        stem = part_path.stem
+        return part_path.with_name(f"{stem}.seg"), part_path.with_name(f"{stem}.seg.json")
+
+    @staticmethod
+    def _missing_ranges(total: int, done: List[List[int]], pieces: int) -> List[Tuple[int, int]]:
+        """取得済みレンジ（[start, end] のリスト）以外の部分を、およそ pieces 個のレンジに分ける"""
+        gaps = []
+        pos = 0
+        for start, end in sorted(done):
+            if start > pos:
+                gaps.append((pos, start - 1))
+            pos = max(pos, end + 1)
+        if pos < total:
+            gaps.append((pos, total - 1))
+        missing = sum(end - start + 1 for start, end in gaps)
+        if not missing:
+            return []
+        seg_size = -(-missing // max(1, pieces))
+        return [
+            (start, min(start + seg_size, gap_end + 1) - 1)
+            for gap_start, gap_end in gaps
+            for start in range(gap_start, gap_end + 1, seg_size)
+        ]
+
+    @staticmethod
+    def _load_partial_meta(meta_path: Path) -> Optional[Dict]:
+        """.part.json（URL/ETag/Content-Length）を読み込む"""
+        try:
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+            return meta if isinstance(meta, dict) else None
+        except Exception:
+            return None
+
+    @staticmethod
+    def _write_partial_meta(meta_path: Path, meta: Dict) -> None:
+        with open(meta_path, 'w', encoding='utf-8') as f:
+            json.dump(meta, f, ensure_ascii=False)
+
+    @staticmethod
+    def _clear_partial(part_path: Path, meta_path: Path) -> None:
+        for p in (part_path, meta_path):
+            try:
+                if p.exists():
+                    p.unlink()
+            except Exception:
+                pass
+
+    @staticmethod
+    def _parse_content_range(value: Optional[str]) -> Tuple[Optional[int], Optional[int]]:
+        """'bytes 100-199/1000' → (100, 1000)。全体サイズ不明(*)ならNone"""
+        m = re.match(r"bytes\s+(\d+)-(\d+)/(\d+|\*)", value or "")
+        if not m:
+            return None, None
+        total = int(m.group(3)) if m.group(3) != "*" else None
+        return int(m.group(1)), total
+
+    def _finalize_partial(self, media: Dict, part_path: Path, meta_path: Path, save_path: Path) -> Path:
+        """完成した .part を保存先へ移動してメタデータを消す"""
+        save_path.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            os.replace(part_path, save_path)
+        except OSError:
+            # OUTPUT_DIRとRUN_DIRが別ファイルシステムの場合
+            shutil.move(str(part_path), str(save_path))
+        self._clear_partial(part_path, meta_path)
+
+        # ファイルサイズを記録
+        media['file_size'] = save_path.stat().st_size
+        return save_path
+
+
+    def _download_segmented(self, media: Dict, url: str, tweet_id: str, media_index: int, referer: str) -> Optional[Path]:
+        """Content-Lengthを調べ、閾値以上ならRange分割で並行ダウンロードする
+
+        取得済みのレンジは .seg.json に記録し、失敗しても .seg と一緒に残して次回はその続きから取る。
+
+        Returns:
+            保存先パス。対象外（小さい/Range非対応）や失敗時はNone
+        """
+        sess = self._get_session()
+        headers = {'Referer': referer}
+        try:
+            head = sess.head(url, timeout=15, headers=headers, allow_redirects=True)
+            if head.status_code != 200:
+                return None
+            length = head.headers.get('Content-Length', '')
+            total = int(length) if length.isdigit() else 0
+            if total < self.segmented_threshold or 'bytes' not in head.headers.get('Accept-Ranges', '').lower():
+                return None
+            final_url = head.url or url
+            etag = head.headers.get('ETag')
+            ext = self._get_extension(url, media.get('type'), head.headers.get('content-type'))
+        except Exception as e:
+            logger.debug(f"分割ダウンロードの事前確認に失敗: {url}: {e}")
+            return None
+
+        save_path = self._media_save_dir(media.get('type')) / f"{tweet_id}_{media_index}{ext}"
+        if save_path.exists() and save_path.stat().st_size > 0:
+            return save_path
+
+        # 空き枠に応じてコネクション数を決める（自分の1本 + 借りられた分）
+        want = self.segment_connections - 1
+        if not self.download_queue.empty():
+            # 待っているメディアがある間は控えめにする
+            want //= 2
+        extra = self._segment_budget.acquire_up_to(want)
+        connections = 1 + extra
+        seg_path, seg_meta_path = self._segment_paths(tweet_id, media_index)
+        try:
+            # 前回の .seg が同じURL・同じ版なら、取得済みのレンジは取り直さない
+            meta = self._load_partial_meta(seg_meta_path)
+            if not (
+                meta and meta.get("url") == final_url and meta.get("etag") == etag and meta.get("total") == total
+                and seg_path.exists() and seg_path.stat().st_size == total
+            ):
+                # 事前に全体サイズを確保して、各レンジを所定の位置に書き込む
+                with open(seg_path, 'wb') as f:
+                    f.truncate(total)
+                meta = {"url": final_url, "etag": etag, "total": total, "ext": ext, "done": []}
+                self._write_partial_meta(seg_meta_path, meta)
+
+            ranges = self._missing_ranges(total, meta["done"], connections)
+            resumed = total - sum(end - start + 1 for start, end in ranges)
+            if resumed:
+                logger.info(f"分割ダウンロードを途中から再開します（{resumed}バイト取得済み）: {url}")
+            logger.info(f"分割ダウンロード: {url} ({total}バイト, {len(ranges)}分割)")
+            _agent_log("SEG1", "media_downloader.py:_download_segmented", "start", {"tweet_id": tweet_id, "total": total, "connections": connections})
 
+            range_headers = dict(headers)
+            if etag:
+                range_headers['If-Range'] = etag
+            failed = False
+            with ThreadPoolExecutor(max_workers=connections) as executor:
+                futures = {
+                    executor.submit(self._download_byte_range, final_url, range_headers, seg_path, start, end): (start, end)
+                    for start, end in ranges
+                }
+                for future in as_completed(futures):
+                    start, end = futures[future]
+                    # 事前確保でファイルサイズは常に total なので、レンジごとに実際に書いたバイト数で確かめる
+                    if future.result() != end - start + 1:
+                        failed = True
+                        continue
+                    meta["done"].append([start, end])
+                    self._write_partial_meta(seg_meta_path, meta)
+
+            if failed:
+                # 取得できたレンジは .seg / .seg.json に残し、次回はその続きから取る
+                logger.warning(f"分割ダウンロードに失敗したため通常ダウンロードに切り替えます: {url}")
+                return None
+
+            return self._finalize_partial(media, seg_path, seg_meta_path, save_path)
+        except Exception as e:
+            logger.warning(f"分割ダウンロードエラー ({url}): {e}")
+            return None
+        finally:
+            self._segment_budget.release(extra)
+
+    def _download_byte_range(self, url: str, headers: Dict, path: Path, start: int, end: int, max_retry: int = 3) -> Optional[int]:
+        """[start, end] のバイト範囲をpathの該当位置へ書き込む（切断時は続きから再試行）
+
+        Returns:
+            書き込んだバイト数。取得できなければNone
+        """
+        pos = start
+        for attempt in range(1, max_retry + 1):
+            try:
+                sess = self._get_session()
+                req_headers = dict(headers)
+                req_headers['Range'] = f"bytes={pos}-{end}"
+                response = sess.get(url, timeout=30, stream=True, headers=req_headers)
+                if response.status_code != 206:
+                    # 200はIf-Range不一致（途中でファイルが変わった）なので分割は諦める
+                    response.close()
+                    return None
+                got_start, _ = self._parse_content_range(response.headers.get('Content-Range'))
+                if got_start != pos:
+                    response.close()
+                    return None
+                with open(path, 'r+b') as f:
+                    f.seek(pos)
+                    for chunk in response.iter_content(chunk_size=65536):
+                        if chunk:
+                            f.write(chunk)
+                            pos += len(chunk)
+                if pos == end + 1:
+                    return pos - start
+                raise IOError(f"レンジが途中で終了しました ({pos - start}/{end - start + 1}バイト)")
+            except Exception as e:
+                logger.debug(f"レンジ取得エラー bytes={pos}-{end} ({attempt}/{max_retry}): {e}")
+                if attempt < max_retry:
+                    time.sleep(self.resume_retry_wait)
+        return None
 
-    def _parse_m3u8_playlist(self, m3u8_url: str, referer: str) -> List[str]:
-        """m3u8ファイルをダウンロードしてパースし、セグメントURLのリストを返す"""
+    def _parse_m3u8_playlist(self, m3u8_url: str, referer: str) -> List[Segment]:
+        """m3u8を取得・解析し、結合順のセグメント（#EXT-X-MAPの初期化セグメントを含む）を返す"""
         # region agent log
         _agent_log("HLS1", "media_downloader.py:_parse_m3u8_playlist", "enter", {"m3u8_url": _safe_url_tag(m3u8_url)})
         # endregion
         
-        sess = self._get_session()
-        headers = {'Referer': referer}
-        
         try:
-            response = sess.get(m3u8_url, timeout=20, headers=headers)
-            response.raise_for_status()
-            text = response.text or ""
+            # masterなら画質プロファイルに合うvariantを選択（未指定なら最高帯域）
+            variant_url, playlist = resolve_media_playlist(m3u8_url, self._get_session(), referer)
+            if playlist is None:
+                return []
+            segments = playlist.all_segments()
             
             # region agent log
-            _agent_log("HLS1", "media_downloader.py:_parse_m3u8_playlist", "downloaded", {"m3u8_url": _safe_url_tag(m3u8_url), "content_length": len(text)})
-            # endregion
-            
-            # master m3u8かどうかをチェック（#EXT-X-STREAM-INFがある場合）
-            if "#EXT-X-STREAM-INF" in text:
-                # region agent log
-                _agent_log("HLS1", "media_downloader.py:_parse_m3u8_playlist", "master_playlist", {"m3u8_url": _safe_url_tag(m3u8_url)})
-                # endregion
-                
-                # 最高帯域のvariantを選択
-                best_bw = -1
-                best_uri = None
-                lines = [ln.strip() for ln in text.splitlines() if ln.strip()]
-                for i, ln in enumerate(lines):
-                    if ln.startswith("#EXT-X-STREAM-INF"):
-                        m = None
-                        try:
-                            m = next((p for p in ln.split(",") if "BANDWIDTH=" in p), None)
-                        except Exception:
-                            m = None
-                        bw = -1
-                        if m and "BANDWIDTH=" in m:
-                            try:
-                                bw = int(m.split("BANDWIDTH=")[-1])
-                            except Exception:
-                                bw = -1
-                        # 次行がURI
-                        if i + 1 < len(lines):
-                            uri = lines[i + 1]
-                            if not uri.startswith("#"):
-                                if bw > best_bw:
-                                    best_bw = bw
-                                    best_uri = uri
-                
-                if best_uri:
-                    # 相対URL対応（/で始まる場合はオリジンからの絶対パス）
-                    if best_uri.startswith("http"):
-                        variant_url = best_uri
-                    elif best_uri.startswith("/"):
-                        from urllib.parse import urlparse
-                        parsed = urlparse(m3u8_url)
-                        origin = f"{parsed.scheme}://{parsed.netloc}"
-                        variant_url = f"{origin}{best_uri}"
-                    else:
-                        base = m3u8_url.rsplit("/", 1)[0]
-                        variant_url = f"{base}/{best_uri}"
-                    
-                    # region agent log
-                    _agent_log("HLS1", "media_downloader.py:_parse_m3u8_playlist", "selected_variant", {"variant_url": _safe_url_tag(variant_url), "bandwidth": best_bw})
-                    # endregion
-                    
-                    # 再帰的にvariantのm3u8を取得
-                    return self._parse_m3u8_playlist(variant_url, referer)
-            
-            # セグメントURLを抽出（#EXTINFの後の行）
-            segments: List[str] = []
-            lines = text.splitlines()
-            base_url = m3u8_url.rsplit("/", 1)[0]
-            
-            # オリジン抽出（/で始まる絶対パス用）
-            from urllib.parse import urlparse
-            parsed = urlparse(m3u8_url)
-            origin = f"{parsed.scheme}://{parsed.netloc}"
-            
-            for i, line in enumerate(lines):
-                line = line.strip()
-                if line.startswith("#EXTINF"):
-                    # 次の行がセグメントURL
-                    if i + 1 < len(lines):
-                        segment_url = lines[i + 1].strip()
-                        if segment_url and not segment_url.startswith("#"):
-                            # 相対URL対応（/で始まる場合はオリジンからの絶対パス）
-                            if segment_url.startswith("http"):
-                                segments.append(segment_url)
-                            elif segment_url.startswith("/"):
-                                segments.append(f"{origin}{segment_url}")
-                            else:
-                                segments.append(f"{base_url}/{segment_url}")
-            
-            # region agent log
-            _agent_log("HLS1", "media_downloader.py:_parse_m3u8_playlist", "parsed", {"segment_count": len(segments), "sample": [_safe_url_tag(s) for s in segments[:3]]})
+            _agent_log("HLS1", "media_downloader.py:_parse_m3u8_playlist", "parsed", {"variant_url": _safe_url_tag(variant_url), "segment_count": len(segments), "sample": [_safe_url_tag(s.uri) for s in segments[:3]]})
             # endregion
             
             return segments
             
         except Exception as e:
             # region agent log
-            _agent_log("HLS1", "media_downloader.py:_parse_m3u8_playlist", "error", {"error": str(e)[:200]})
+            _agent_log("HLS1", "media_downloader.py:_parse_m3u8_playlist", "error", {"error": str(e)[:200]}, level="error")
             # endregion
             logger.error(f"m3u8パースエラー: {e}")
             return []
     
-    def _download_segments(self, segment_urls: List[str], referer: str, temp_dir: Path) -> List[Path]:
-        """セグメントURLのリストから各セグメントをダウンロード"""
+    def _download_segments(self, segments: List[Segment], referer: str, temp_dir: Path) -> List[Path]:
+        """セグメントのリストから各セグメントをダウンロード（EXT-X-BYTERANGEはRangeで取得）"""
         # region agent log
-        _agent_log("HLS2", "media_downloader.py:_download_segments", "enter", {"segment_count": len(segment_urls)})
+        _agent_log("HLS2", "media_downloader.py:_download_segments", "enter", {"segment_count": len(segments)})
         # endregion
         
         sess = self._get_session()
-        headers = {'Referer': referer}
         downloaded_segments: List[Path] = []
+        # セグメントごとの記録は trace（無効ならURLの切り詰めやstatも行わない）
+        trace = agent_log_enabled("trace")
         
-        for idx, segment_url in enumerate(segment_urls):
+        for idx, segment in enumerate(segments):
+            segment_url = segment.uri
+            headers = {'Referer': referer}
+            if segment.byte_range:
+                headers['Range'] = segment.range_header()
             try:
                 # region agent log
-                _agent_log("HLS2", "media_downloader.py:_download_segments", "downloading", {"index": idx, "total": len(segment_urls), "url": _safe_url_tag(segment_url)})
+                if trace:
+                    _agent_log("HLS2", "media_downloader.py:_download_segments", "downloading", {"index": idx, "total": len(segments), "url": _safe_url_tag(segment_url)}, level="trace")
                 # endregion
                 
                 response = sess.get(segment_url, timeout=30, headers=headers, stream=True)
@@ -543,18 +956,19 @@ class MediaDownloader:
                 downloaded_segments.append(segment_path)
                 
                 # region agent log
-                _agent_log("HLS2", "media_downloader.py:_download_segments", "downloaded", {"index": idx, "size": segment_path.stat().st_size})
+                if trace:
+                    _agent_log("HLS2", "media_downloader.py:_download_segments", "downloaded", {"index": idx, "size": segment_path.stat().st_size}, level="trace")
                 # endregion
                 
             except Exception as e:
                 # region agent log
-                _agent_log("HLS2", "media_downloader.py:_download_segments", "error", {"index": idx, "error": str(e)[:200]})
+                _agent_log("HLS2", "media_downloader.py:_download_segments", "error", {"index": idx, "error": str(e)[:200]}, level="error")
                 # endregion
                 logger.error(f"セグメントダウンロードエラー ({segment_url}): {e}")
                 # エラーがあっても続行（一部セグメントが失敗しても結合は試みる）
         
         # region agent log
-        _agent_log("HLS2", "media_downloader.py:_download_segments", "complete", {"downloaded_count": len(downloaded_segments), "total": len(segment_urls)})
+        _agent_log("HLS2", "media_downloader.py:_download_segments", "complete", {"downloaded_count": len(downloaded_segments), "total": len(segments)})
         # endregion
         
         return downloaded_segments
@@ -587,7 +1001,7 @@ class MediaDownloader:
             
         except Exception as e:
             # region agent log
-            _agent_log("HLS3", "media_downloader.py:_concatenate_segments", "error", {"error": str(e)[:200]})
+            _agent_log("HLS3", "media_downloader.py:_concatenate_segments", "error", {"error": str(e)[:200]}, level="error")
             # endregion
             logger.error(f"セグメント結合エラー: {e}")
             return False
@@ -603,7 +1017,7 @@ class MediaDownloader:
             save_dir.mkdir(parents=True, exist_ok=True)
         except Exception as e:
             # region agent log
-            _agent_log("HLS0", "media_downloader.py:_download_hls_by_segments", "mkdir_failed", {"error": str(e)})
+            _agent_log("HLS0", "media_downloader.py:_download_hls_by_segments", "mkdir_failed", {"error": str(e)}, level="error")
             # endregion
             logger.error(f"保存ディレクトリの作成に失敗: {e}")
             return None
@@ -616,8 +1030,8 @@ class MediaDownloader:
             return save_path
         
         # ステップ1: m3u8ファイルをパースしてセグメントURLを取得
-        segment_urls = self._parse_m3u8_playlist(m3u8_url, referer)
-        if not segment_urls:
+        segments = self._parse_m3u8_playlist(m3u8_url, referer)
+        if not segments:
             # region agent log
             _agent_log("HLS0", "media_downloader.py:_download_hls_by_segments", "no_segments", {})
             # endregion
@@ -629,7 +1043,7 @@ class MediaDownloader:
         temp_path = Path(temp_dir)
         
         try:
-            downloaded_segments = self._download_segments(segment_urls, referer, temp_path)
+            downloaded_segments = self._download_segments(segments, referer, temp_path)
             
             if not downloaded_segments:
                 # region agent log
@@ -672,7 +1086,7 @@ class MediaDownloader:
                         return save_path
                 except Exception as e:
                     # region agent log
-                    _agent_log("HLS0", "media_downloader.py:_download_hls_by_segments", "ffmpeg_conversion_failed", {"error": str(e)[:200]})
+                    _agent_log("HLS0", "media_downloader.py:_download_hls_by_segments", "ffmpeg_conversion_failed", {"error": str(e)[:200]}, level="error")
                     # endregion
                     logger.warning(f"ffmpegでのMP4変換に失敗: {e}")
             
@@ -683,7 +1097,7 @@ class MediaDownloader:
                 _shutil.move(str(temp_ts), str(ts_save_path))
             except Exception as e:
                 # region agent log
-                _agent_log("HLS0", "media_downloader.py:_download_hls_by_segments", "move_failed", {"error": str(e)[:200]})
+                _agent_log("HLS0", "media_downloader.py:_download_hls_by_segments", "move_failed", {"error": str(e)[:200]}, level="error")
                 # endregion
                 logger.error(f".tsファイルの移動に失敗: {e}")
                 return None
@@ -767,7 +1181,7 @@ class MediaDownloader:
             save_dir.mkdir(parents=True, exist_ok=True)
         except Exception as e:
             # region agent log
-            _agent_log("H2", "media_downloader.py:_download_hls_with_ffmpeg", "mkdir_failed", {"save_dir": str(save_dir), "error": str(e), "tweet_id": tweet_id})
+            _agent_log("H2", "media_downloader.py:_download_hls_with_ffmpeg", "mkdir_failed", {"save_dir": str(save_dir), "error": str(e), "tweet_id": tweet_id}, level="error")
             # endregion
             logger.error(f"保存ディレクトリの作成に失敗: {e}")
             return None
@@ -832,7 +1246,7 @@ class MediaDownloader:
                 
         except subprocess.TimeoutExpired as e:
             # region agent log
-            _agent_log("H5", "media_downloader.py:_download_hls_with_ffmpeg", "subprocess_timeout", {"tweet_id": tweet_id, "error": str(e)})
+            _agent_log("H5", "media_downloader.py:_download_hls_with_ffmpeg", "subprocess_timeout", {"tweet_id": tweet_id, "error": str(e)}, level="error")
             # endregion
             logger.error(f"ffmpegでのm3u8保存がタイムアウトしました: {e}")
             try:
@@ -854,7 +1268,7 @@ class MediaDownloader:
             return None
         except Exception as e:
             # region agent log
-            _agent_log("H5", "media_downloader.py:_download_hls_with_ffmpeg", "exception", {"tweet_id": tweet_id, "error_type": type(e).__name__, "error": str(e)[:500]})
+            _agent_log("H5", "media_downloader.py:_download_hls_with_ffmpeg", "exception", {"tweet_id": tweet_id, "error_type": type(e).__name__, "error": str(e)[:500]}, level="error")
             # endregion
             logger.error(f"ffmpegでのm3u8保存に失敗: {e}")
             try:
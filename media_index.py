@@ -0,0 +1,230 @@
+"""ダウンロード済みメディアの索引（リクエスト前に既存ファイルを判定する）"""
+
+from __future__ import annotations
+
+import logging
+import re
+import threading
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from json_stream import JsonStream
+from media_store import media_key
+from output_files import open_input, strip_compression_suffix
+from quality_profiles import PROFILES, photo_url
+
+logger = logging.getLogger(__name__)
+
+# {tweet_id}_{media_index}{ext} 形式の保存ファイル名
+_SAVED_NAME_RE = re.compile(r"^(?P<tweet_id>[^_]+)_(?P<media_index>\d+)(?P<ext>\.[A-Za-z0-9]+)$")
+_SKIP_SUFFIXES = {".part", ".seg", ".linktmp", ".json"}
+# 正常終了時の取得結果。これがある実行ディレクトリでは途中保存（_PARTIAL_PREFIXES）を読まない
+_FINAL_RESULTS = {"tweets.json", "tweets_with_media.json"}
+_PARTIAL_PREFIXES = ("tweets_partial", "tweets_error")
+
+
+def media_category(media_type: Optional[str]) -> str:
+    """保存先の区分（動画とサムネイルが同じmedia_indexを持つため区別する）"""
+    return "video" if media_type in ("video", "animated_gif") else "image"
+
+
+def media_variant(url: Optional[str]) -> Optional[str]:
+    """取得した版の識別子（画像はサイズ指定込み、動画は選んだビットレートの版ごとに異なる）
+
+    url は実際に取得したURL（画像なら画質プロファイルでサイズを書き換えた後のもの）。
+    """
+    return media_key(url) if url else None
+
+
+def _fetched_url(media: Dict, quality: Optional[str]) -> Optional[str]:
+    """過去の実行で実際に取得したURL（画像でプロファイルが分からなければ None）
+
+    quality は実行カタログに記録した画質プロファイル名（"" はプロファイル無し、None は不明）。
+    """
+    url = media.get("url")
+    if not url or media.get("type") != "photo":
+        return url
+    if quality is None:
+        return None
+    return photo_url(url, PROFILES.get(quality))
+
+
+def _iter_media_entries(path: Path) -> Iterator[Tuple[Optional[str], Dict]]:
+    """マニフェストの media、または取得結果の各Tweetの media を (tweet_id, media) で1件ずつ返す"""
+    from media_only import iter_tweets_from_result_json
+
+    if "manifest" not in strip_compression_suffix(path).name:
+        for tweet in iter_tweets_from_result_json(path):
+            for media in tweet.get("media") or []:
+                if isinstance(media, dict):
+                    yield tweet.get("tweet_id"), media
+        return
+    with open_input(path) as f:
+        stream = JsonStream(f)
+        for key in stream.iter_object_keys():
+            if key == "media" and stream.peek() == "[":
+                for media in stream.iter_array():
+                    if isinstance(media, dict):
+                        yield media.get("tweet_id"), media
+            else:
+                stream.value()
+
+
+def skip_superseded_results(paths: Iterable[Path]) -> List[Path]:
+    """同じ実行ディレクトリに正常終了の tweets.json があれば、tweets_partial / tweets_error を除く"""
+    paths = list(paths)
+    finished = {p.parent for p in paths if strip_compression_suffix(p).name in _FINAL_RESULTS}
+    return [
+        p for p in paths
+        if not (p.parent in finished and strip_compression_suffix(p).name.startswith(_PARTIAL_PREFIXES))
+    ]
+
+
+class MediaIndex:
+    """正規化URL と (tweet_id, media_index, 区分) の両方から既存ファイルを引く索引
+
+    (tweet_id, media_index, 区分) には取得した版（media_variant）も記録し、画質プロファイルを
+    変えた後に別の版（小さい画像・低いビットレートの動画）を使い回さないようにする。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._by_url: Dict[str, Path] = {}
+        self._by_slot: Dict[Tuple[str, int, str], Tuple[Path, Optional[str]]] = {}
+
+    def __len__(self) -> int:
+        return len(self._by_slot) + len(self._by_url)
+
+    @staticmethod
+    def _usable(path: Path) -> bool:
+        try:
+            return path.is_file() and path.stat().st_size > 0
+        except OSError:
+            return False
+
+    def add(
+        self,
+        path: Path,
+        *,
+        urls: Iterable[Optional[str]] = (),
+        tweet_id: Optional[str] = None,
+        media_index: Optional[int] = None,
+        category: Optional[str] = None,
+        variant: Optional[str] = None,
+    ) -> None:
+        """ダウンロード完了したファイルを登録する
+
+        Args:
+            urls: 実際に取得したURL（正規化URLがそのまま版を表すので、別の版のURLは渡さない）
+            variant: 取得した版（media_variant。分からなければ None）
+        """
+        path = Path(path)
+        with self._lock:
+            for url in urls:
+                if url:
+                    self._by_url[media_key(url)] = path
+            if tweet_id is not None and media_index is not None and category:
+                self._by_slot[(str(tweet_id), int(media_index), category)] = (path, variant)
+
+    def lookup(
+        self,
+        urls: Iterable[Optional[str]],
+        tweet_id: Optional[str],
+        media_index: Optional[int],
+        category: str,
+        variant: Optional[str] = None,
+    ) -> Optional[Path]:
+        """既存ファイルがあれば返す（消されていれば None）
+
+        variant を渡すと、別の版として記録されたファイルは (tweet_id, media_index) が同じでも返さない
+        （版が記録されていないもの＝保存ディレクトリの走査や画質の分からない過去の実行の分は返す）。
+        """
+        candidates = [self._by_url.get(media_key(url)) for url in urls if url]
+        if tweet_id is not None and media_index is not None:
+            path, known_variant = self._by_slot.get((str(tweet_id), int(media_index), category), (None, None))
+            if variant is None or known_variant is None or known_variant == variant:
+                candidates.append(path)
+        for path in candidates:
+            if path is not None and self._usable(path):
+                return path
+        return None
+
+    def scan_dir(self, directory: Path, category: str) -> int:
+        """保存ディレクトリ内の {tweet_id}_{media_index}{ext} を登録する"""
+        directory = Path(directory)
+        if not directory.is_dir():
+            return 0
+        added = 0
+        for path in directory.iterdir():
+            if path.suffix in _SKIP_SUFFIXES:
+                continue
+            m = _SAVED_NAME_RE.match(path.name)
+            if not m or not self._usable(path):
+                continue
+            self.add(path, tweet_id=m.group("tweet_id"), media_index=int(m.group("media_index")), category=category)
+            added += 1
+        return added
+
+    def load_manifest(self, path: Path, quality: Optional[str] = None) -> int:
+        """メディアマニフェスト（{metadata, media}）またはtweets JSONのlocal_pathを登録する（1件ずつ読む）
+
+        Args:
+            quality: その実行の画質プロファイル名（"" はプロファイル無し、None は不明）。
+                画像の取得した版はこれで決まるので、不明なら版を記録しない
+        """
+        added = 0
+        try:
+            for tweet_id, media in _iter_media_entries(Path(path)):
+                local_path = media.get("local_path")
+                if not local_path or not self._usable(Path(local_path)):
+                    continue
+                fetched = _fetched_url(media, quality)
+                self.add(
+                    Path(local_path),
+                    urls=(fetched or media.get("url"),),
+                    tweet_id=tweet_id,
+                    media_index=media.get("media_index", 0),
+                    category=media_category(media.get("type")),
+                    variant=media_variant(fetched),
+                )
+                added += 1
+        except Exception as e:
+            logger.debug(f"マニフェストを読み込めませんでした: {path}: {e}")
+        return added
+
+
+def build_media_index(
+    output_dir: Path,
+    scan_dirs: Iterable[Tuple[Path, str]] = (),
+    extra_manifests: Iterable[Path] = (),
+    catalog=None,
+) -> MediaIndex:
+    """保存ディレクトリと過去の実行のマニフェスト/tweets JSONから索引を作る
+
+    catalog（run_catalog.RunCatalog）に実行が記録されていれば、記録済みの実行はそこから引き、
+    output_dir の glob はカタログに無いディレクトリ（カタログができる前の実行など）だけに絞る。
+    """
+    index = MediaIndex()
+    for directory, category in scan_dirs:
+        index.scan_dir(directory, category)
+
+    # (パス, 画質プロファイル名)。カタログに無いものは画質が分からない
+    manifests: List[Tuple[Path, Optional[str]]] = [(Path(p), None) for p in extra_manifests]
+    output_dir = Path(output_dir)
+    run_dirs = [p for p in output_dir.iterdir() if p.is_dir()] if output_dir.is_dir() else []
+    if catalog is not None and catalog.count():
+        for run in catalog.runs(limit=None):
+            quality = (run.get("options") or {}).get("quality")
+            files = [f["path"] for f in run["files"] if f["kind"] in ("manifest", "tweets") and f["path"].exists()]
+            manifests.extend((path, quality) for path in skip_superseded_results(files))
+        known = catalog.run_dirs()
+        run_dirs = [p for p in run_dirs if p.resolve() not in known]
+    for run_dir in run_dirs:
+        # 圧縮して書いたもの（.json.gz / .json.zst）も含める。読み方はカタログの分と同じ（1件ずつ・途中保存は除く）
+        found = [path for pattern in ("*manifest*.json*", "tweets*.json*") for path in sorted(run_dir.glob(pattern))]
+        manifests.extend((path, None) for path in skip_superseded_results(found))
+    loaded = 0
+    for path, quality in manifests:
+        loaded += index.load_manifest(path, quality=quality)
+    logger.info(f"ダウンロード済みメディアの索引を作成しました（マニフェスト{len(manifests)}件から{loaded}件）")
+    return index
@@ -2,88 +2,84 @@
 
 from __future__ import annotations
 
-import json
 import logging
 import re
+import threading
 import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
 from datetime import datetime
 from pathlib import Path
-from typing import Dict, Iterable, List, Optional
+from typing import Dict, Iterable, Iterator, List, Optional
 
 import requests
 
 from config import Config
+from json_stream import JsonStream
+from output_files import (
+    open_input,
+    open_output,
+    resolve_output_path,
+    strip_compression_suffix,
+    write_json_object,
+)
+from quality_profiles import get_profile, pick_video_variant
+from run_profiler import PROFILER
+from tweet_log import iter_logged_tweets
+from tweet_trace import TRACER
+from video_resolvers import ResolverRegistry
+from agent_log import agent_log as _agent_log, safe_url_tag as _safe_url_tag
 
 logger = logging.getLogger(__name__)
 
-# region agent log
-_DEBUG_LOG_PATH = r"h:\document\program\project\getTweet\.cursor\debug.log"
-_LOCAL_DEBUG_NDJSON = str((Path(__file__).resolve().parent / "debug.ndjson"))
-_LOCAL_CURSOR_DEBUG = str((Path(__file__).resolve().parent / ".cursor" / "debug.log"))
 
-
-def _agent_log(hypothesisId: str, location: str, message: str, data: Optional[Dict] = None, runId: str = "pre") -> None:
-    try:
-        import json as _json
-        import time as _time
-
-        payload = {
-            "sessionId": "debug-session",
-            "runId": runId,
-            "hypothesisId": hypothesisId,
-            "location": location,
-            "message": message,
-            "data": data or {},
-            "timestamp": int(_time.time() * 1000),
-        }
-        line = _json.dumps(payload, ensure_ascii=False) + "\n"
-
-        # 1) 指定ログパス（あれば）
-        try:
-            Path(_DEBUG_LOG_PATH).parent.mkdir(parents=True, exist_ok=True)
-            with open(_DEBUG_LOG_PATH, "a", encoding="utf-8") as f:
-                f.write(line)
-        except Exception:
-            pass
-
-        # 2) 実行中プロジェクト直下（確実に見つけられる）
-        try:
-            with open(_LOCAL_DEBUG_NDJSON, "a", encoding="utf-8") as f:
-                f.write(line)
-        except Exception:
-            pass
-
-        # 3) 実行中プロジェクトの .cursor 配下（作れれば）
-        try:
-            Path(_LOCAL_CURSOR_DEBUG).parent.mkdir(parents=True, exist_ok=True)
-            with open(_LOCAL_CURSOR_DEBUG, "a", encoding="utf-8") as f:
-                f.write(line)
-        except Exception:
-            pass
-    except Exception:
-        pass
+_NDJSON_SUFFIXES = (".ndjson", ".jsonl")
+# 1行目の先頭キーがこれならNDJSON（TweetLogの行）とみなす
+_NDJSON_FIRST_KEYS = ("tweet_id", "_record")
 
 
-def _safe_url_tag(url: Optional[str]) -> str:
-    try:
-        if not url:
-            return ""
-        return str(url)[:160]
-    except Exception:
-        return ""
+def iter_tweets_from_result_json(path: Path) -> Iterator[Dict]:
+    """取得結果からTweetを1件ずつ読む（ファイル全体を読み込まない）
 
-# endregion
+    対応形式: DataSaverの出力JSON（{metadata, tweets}）、tweets配列JSON、NDJSON（TweetLog等。1行1Tweet）
+    gzip / zstd で圧縮されていれば展開しながら読む（拡張子ではなくファイル先頭で判定）。
+    """
+    path = Path(path)
+    if strip_compression_suffix(path).suffix in _NDJSON_SUFFIXES:
+        yield from iter_logged_tweets(path)
+        return
+    with open_input(path) as f:
+        stream = JsonStream(f)
+        first = stream.peek()
+        if first == "[":
+            for tweet in stream.iter_array():
+                if isinstance(tweet, dict):
+                    yield tweet
+            return
+        if first != "{":
+            raise ValueError(f"対応していないJSON形式です: {path}")
+        found = False
+        for i, key in enumerate(stream.iter_object_keys()):
+            if i == 0 and key in _NDJSON_FIRST_KEYS:
+                break
+            if key == "tweets" and stream.peek() == "[":
+                found = True
+                for tweet in stream.iter_array():
+                    if isinstance(tweet, dict):
+                        yield tweet
+            else:
+                stream.value()
+        else:
+            if not found:
+                raise ValueError(f"対応していないJSON形式です: {path}")
+            return
+    # 拡張子が.jsonのNDJSON
+    yield from iter_logged_tweets(path)
 
 
 def load_tweets_from_result_json(path: Path) -> List[Dict]:
-    """DataSaverの出力JSON（{metadata, tweets}）またはtweets配列JSONを読み込む"""
-    with open(path, "r", encoding="utf-8") as f:
-        data = json.load(f)
-    if isinstance(data, dict) and "tweets" in data and isinstance(data["tweets"], list):
-        return data["tweets"]
-    if isinstance(data, list):
-        return data
-    raise ValueError(f"対応していないJSON形式です: {path}")
+    """DataSaverの出力JSON（{metadata, tweets}）・tweets配列JSON・NDJSONを読み込む"""
+    return list(iter_tweets_from_result_json(path))
 
 
 def ensure_media_has_tweet_url(tweets: Iterable[Dict]) -> None:
@@ -125,7 +121,7 @@ def _extract_tweet_id(url: str) -> Optional[str]:
 
 
 def _resolve_video_from_syndication(tweet_id: str, sess: requests.Session) -> Optional[str]:
-    """cdn.syndication.twimg.com/tweet-result を使って動画URLを取得（最も高画質なMP4/WebMを選択）"""
+    """cdn.syndication.twimg.com/tweet-result を使って動画URLを取得（画質プロファイルに合うMP4/WebMを選択）"""
     api = f"https://cdn.syndication.twimg.com/tweet-result?id={tweet_id}&lang=en"
     try:
         resp = sess.get(api, timeout=15)
@@ -153,23 +149,20 @@ def _resolve_video_from_syndication(tweet_id: str, sess: requests.Session) -> Op
         m3u8s = [v for v in variants if v.get("url") and ".m3u8" in v.get("url")]
         _agent_log("H1", "media_only.py:_resolve_video_from_syndication", "variants summary", {"tweet_id": tweet_id, "mp4": len(mp4s), "webm": len(webms), "m3u8": len(m3u8s)})
 
-        if mp4s:
-            mp4s.sort(key=lambda x: x.get("bitrate", 0), reverse=True)
-            picked = mp4s[0].get("url")
-            _agent_log("H1", "media_only.py:_resolve_video_from_syndication", "picked mp4", {"tweet_id": tweet_id, "bitrate": mp4s[0].get("bitrate", 0), "url": _safe_url_tag(picked)})
-            return picked
-        if webms:
-            webms.sort(key=lambda x: x.get("bitrate", 0), reverse=True)
-            picked = webms[0].get("url")
-            _agent_log("H4", "media_only.py:_resolve_video_from_syndication", "picked webm", {"tweet_id": tweet_id, "bitrate": webms[0].get("bitrate", 0), "url": _safe_url_tag(picked)})
-            return picked
-        if m3u8s:
-            picked = m3u8s[0].get("url")
+        # ビットレートは画質プロファイルに従う（既定は最高）
+        picked_variant = pick_video_variant(variants, get_profile())
+        if not picked_variant:
+            return None
+        picked = picked_variant.get("url")
+        if picked_variant in mp4s:
+            _agent_log("H1", "media_only.py:_resolve_video_from_syndication", "picked mp4", {"tweet_id": tweet_id, "bitrate": picked_variant.get("bitrate", 0), "url": _safe_url_tag(picked)})
+        elif picked_variant in webms:
+            _agent_log("H4", "media_only.py:_resolve_video_from_syndication", "picked webm", {"tweet_id": tweet_id, "bitrate": picked_variant.get("bitrate", 0), "url": _safe_url_tag(picked)})
+        else:
             _agent_log("H1", "media_only.py:_resolve_video_from_syndication", "picked m3u8", {"tweet_id": tweet_id, "url": _safe_url_tag(picked)})
-            return picked
-        return None
+        return picked
     except Exception as e:
-        _agent_log("H1", "media_only.py:_resolve_video_from_syndication", "exception", {"tweet_id": tweet_id, "err": str(e)[:160]})
+        _agent_log("H1", "media_only.py:_resolve_video_from_syndication", "exception", {"tweet_id": tweet_id, "err": str(e)[:160]}, level="error")
         return None
 
 
@@ -179,121 +172,290 @@ def _looks_like_video_thumbnail(url: str) -> bool:
     return any(k in url for k in ["ext_tw_video_thumb", "amplify_video_thumb"])
 
 
+# 解決手段ごとの最小呼び出し間隔(秒)の既定値（並行実行時もこの間隔を守る）
+DEFAULT_RESOLVER_INTERVALS: Dict[str, float] = {
+    "syndication": 0.5,
+    "playwright": 0.0,
+    "html": 0.5,
+}
+THUMBNAIL_RESOLVERS = tuple(DEFAULT_RESOLVER_INTERVALS)
+# 入力順を保つために手元に置くツイート数の上限（解決中のツイートの後ろに溜まる分）
+_ORDER_WINDOW = 256
+
+
+class _RateLimiter:
+    """呼び出し間隔の下限を守る（複数スレッドで共有）"""
+
+    def __init__(self, min_interval: float):
+        self.min_interval = max(0.0, min_interval)
+        self._lock = threading.Lock()
+        self._next_at = 0.0
+
+    def wait(self) -> None:
+        if not self.min_interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            run_at = max(now, self._next_at)
+            self._next_at = run_at + self.min_interval
+        if run_at > now:
+            time.sleep(run_at - now)
+
+
+class EnrichStats:
+    """サムネ→動画URL解決の集計（解決手段ごとの試行数・成功数）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.attempts: Dict[str, int] = {}
+        self.hits: Dict[str, int] = {}
+        self.checked = 0
+        self.resolved = 0
+
+    def record(self, resolver: str, hit: bool) -> None:
+        with self._lock:
+            self.attempts[resolver] = self.attempts.get(resolver, 0) + 1
+            if hit:
+                self.hits[resolver] = self.hits.get(resolver, 0) + 1
+
+    def add_resolved(self) -> None:
+        with self._lock:
+            self.resolved += 1
+
+    def hit_rates(self) -> Dict[str, float]:
+        with self._lock:
+            return {name: self.hits.get(name, 0) / n for name, n in self.attempts.items() if n}
+
+    def summary(self) -> str:
+        rates = self.hit_rates()
+        parts = [f"{name} {self.hits.get(name, 0)}/{self.attempts[name]} ({rate:.0%})" for name, rate in rates.items()]
+        return f"{self.resolved}/{self.checked}件解決" + (f"（{', '.join(parts)}）" if parts else "")
+
+
+def _thumbnail_candidates(tweet: Dict) -> List[Dict]:
+    """実動画URLを探す対象のサムネイル（既にvideoがあるツイートは対象外）"""
+    if not tweet.get("url"):
+        return []
+    media_list = tweet.get("media", []) or []
+    if not isinstance(media_list, list) or not media_list:
+        return []
+    # 既にvideoがあるならスキップ（重複回避）
+    if any(isinstance(m, dict) and m.get("type") == "video" for m in media_list):
+        return []
+    return [
+        m
+        for m in media_list
+        if isinstance(m, dict)
+        and m.get("url")
+        and _looks_like_video_thumbnail(str(m.get("url")))
+    ]
+
+
+class _ThumbnailEnricher:
+    """1ツイート分のサムネ→動画URL解決（ワーカースレッドから並行に呼ばれる）"""
+
+    def __init__(self, rate_limits: Dict[str, float], stats: EnrichStats, video_resolver=None, registry: Optional[ResolverRegistry] = None):
+        # requests.Sessionはスレッドセーフではないため、スレッドローカルで管理
+        self._thread_local = threading.local()
+        self._base_headers = {
+            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36",
+            "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
+            "Accept-Language": "ja,en-US;q=0.9,en;q=0.8",
+            "Connection": "keep-alive",
+        }
+        if Config.TWITTER_COOKIES:
+            self._base_headers["Cookie"] = Config.TWITTER_COOKIES
+        self.limiters = {name: _RateLimiter(rate_limits.get(name, 0.0)) for name in THUMBNAIL_RESOLVERS}
+        self.stats = stats
+        # 試す順番は過去の成功率とレイテンシで決める（ほぼ当たらない手段は間引く）
+        self.registry = registry or ResolverRegistry(namespace="thumbnail")
+        self._owns_registry = registry is None
+        for name in THUMBNAIL_RESOLVERS:
+            self.registry.register(name, getattr(self, f"_resolve_{name}"))
+        self.video_resolver = video_resolver
+        self._owns_resolver = video_resolver is None
+        self._resolver_lock = threading.Lock()
+
+    def _get_session(self) -> requests.Session:
+        """スレッドごとのSessionを返す"""
+        sess = getattr(self._thread_local, "session", None)
+        if sess is None:
+            sess = requests.Session()
+            sess.headers.update(self._base_headers)
+            self._thread_local.session = sess
+        return sess
+
+    def _get_video_resolver(self):
+        # ブラウザは必要になった時点で1つだけ起動する
+        with self._resolver_lock:
+            if self.video_resolver is None:
+                from twitter_video_api import VideoResolverService
+
+                self.video_resolver = VideoResolverService()
+            return self.video_resolver
+
+    def _resolve_syndication(self, tweet_id: Optional[str], tweet_url: str) -> Optional[str]:
+        return _resolve_video_from_syndication(tweet_id, self._get_session()) if tweet_id else None
+
+    def _resolve_playwright(self, tweet_id: Optional[str], tweet_url: str) -> Optional[str]:
+        # Syndicationが空/動画情報無しの場合はPlaywrightでネットワークから捕捉
+        from twitter_video_api import resolve_best_video_url
+
+        video_url = resolve_best_video_url(tweet_url, service=self._get_video_resolver())
+        if video_url:
+            _agent_log("H5", "media_only.py:enrich", "picked from playwright", {"tweet_id": tweet_id or "", "video_url": _safe_url_tag(video_url)})
+        return video_url
+
+    def _resolve_html(self, tweet_id: Optional[str], tweet_url: str) -> Optional[str]:
+        # Refererを付けると弾かれにくいケースがある
+        resp = self._get_session().get(tweet_url, timeout=30, headers={"Referer": "https://twitter.com/"})
+        _agent_log("H3", "media_only.py:enrich", "tweet html response", {"tweet_id": tweet_id or "", "status": resp.status_code})
+        if resp.status_code in (401, 403):
+            logger.warning(f"{resp.status_code} でツイートHTML取得に失敗（Cookie不足の可能性）: {tweet_url}")
+            return None
+        resp.raise_for_status()
+        return _pick_video_url_from_html(resp.text)
+
+    def enrich(self, tweet: Dict, thumb_candidates: List[Dict]) -> Dict:
+        """解決できたら先頭のサムネに紐付けたvideoを追加して、tweetを返す"""
+        tweet_url = tweet.get("url")
+        tweet_id = _extract_tweet_id(tweet_url)
+        _agent_log("H2", "media_only.py:enrich", "candidate", {"tweet_id": tweet_id or "", "url": _safe_url_tag(tweet_url), "thumbs": len(thumb_candidates)})
+
+        video_url = None
+        with TRACER.span("resolve", tweet_id, thumb_candidates[0].get("media_index", 0)) as span:
+            for name in self.registry.order(list(THUMBNAIL_RESOLVERS)):
+                self.limiters[name].wait()
+                start = time.perf_counter()
+                try:
+                    video_url = getattr(self, f"_resolve_{name}")(tweet_id, tweet_url)
+                except Exception as e:
+                    _agent_log("H2", "media_only.py:enrich", "exception", {"resolver": name, "err": str(e)[:160], "url": _safe_url_tag(tweet_url)}, level="error")
+                    video_url = None
+                self.registry.record(name, bool(video_url), time.perf_counter() - start)
+                self.stats.record(name, bool(video_url))
+                if video_url:
+                    span["resolver"] = name
+                    break
+
+        if not video_url:
+            _agent_log("H2", "media_only.py:enrich", "no video url", {"tweet_id": tweet_id or ""})
+            return tweet
+
+        thumb = thumb_candidates[0]
+        tweet["media"].append(
+            {
+                "type": "video",
+                "url": video_url,
+                "media_index": thumb.get("media_index", 0),
+                "thumbnail_url": thumb.get("url"),
+                "tweet_url": tweet_url,
+                "resolved_from": "resolved",
+            }
+        )
+        self.stats.add_resolved()
+        _agent_log("H2", "media_only.py:enrich", "added video", {"tweet_id": tweet_id or "", "video_url": _safe_url_tag(video_url)})
+        return tweet
+
+    def close(self) -> None:
+        if self._owns_resolver and self.video_resolver is not None:
+            self.video_resolver.close()
+        if self._owns_registry:
+            self.registry.save()
+
+
+def iter_tweets_with_resolved_videos(
+    tweets: Iterable[Dict],
+    *,
+    workers: int = 4,
+    max_resolve: int = 0,
+    rate_limits: Optional[Dict[str, float]] = None,
+    video_resolver=None,
+    stats: Optional[EnrichStats] = None,
+    registry: Optional[ResolverRegistry] = None,
+) -> Iterator[Dict]:
+    """
+    動画サムネしか無いツイートの実動画URLを並行に解決しながら、ツイートを1件ずつ返す。
+
+    入力と同じ順に、返せるようになったものから返すので、受け取った側はこの段が終わるのを
+    待たずにダウンロードを始められる（解決中のツイートより後ろのものはそれが終わるまで手元に置く。
+    先読みは解決 workers*2 件・ツイート _ORDER_WINDOW 件まで）。
+
+    Args:
+        workers: 同時に解決するツイート数の上限
+        max_resolve: 解決を試みるツイート数の上限（0で無制限）
+        rate_limits: 解決手段ごとの最小呼び出し間隔(秒)（既定は DEFAULT_RESOLVER_INTERVALS）
+        video_resolver: 起動済みの twitter_video_api.VideoResolverService（省略時は必要になった時点で起動し、終了時に閉じる）
+        stats: 解決手段ごとの成功率を集計する EnrichStats
+        registry: 試す順番を決める ResolverRegistry（省略時は OUTPUT_DIR/resolver_stats.json の thumbnail を読み書きする）
+    """
+    workers = max(1, workers)
+    stats = stats if stats is not None else EnrichStats()
+    enricher = _ThumbnailEnricher({**DEFAULT_RESOLVER_INTERVALS, **(rate_limits or {})}, stats, video_resolver, registry)
+    _agent_log("H2", "media_only.py:iter_tweets_with_resolved_videos", "enter", {"workers": workers})
+    try:
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="enrich") as pool:
+            # 入力順のツイート（解決中のものは Future）
+            window: deque = deque()
+            in_flight = 0
+            for tweet in tweets:
+                thumbs = _thumbnail_candidates(tweet)
+                if not thumbs or (max_resolve > 0 and stats.checked >= max_resolve):
+                    window.append(tweet)
+                else:
+                    stats.checked += 1
+                    window.append(pool.submit(PROFILER.wrap("enrich", enricher.enrich), tweet, thumbs))
+                    in_flight += 1
+                # 先頭から返せる分を返す。先読みしすぎないよう、溜まったら先頭の解決を待つ
+                while window:
+                    head = window[0]
+                    if isinstance(head, Future):
+                        if not head.done() and in_flight < workers * 2 and len(window) < _ORDER_WINDOW:
+                            break
+                        in_flight -= 1
+                        head = head.result()
+                    window.popleft()
+                    yield head
+            while window:
+                head = window.popleft()
+                yield head.result() if isinstance(head, Future) else head
+    finally:
+        enricher.close()
+        _agent_log("H2", "media_only.py:iter_tweets_with_resolved_videos", "exit", {"checked": stats.checked, "resolved": stats.resolved, "hit_rates": stats.hit_rates()})
+
+
 def enrich_tweets_with_resolved_videos_from_thumbnails(
     tweets: List[Dict],
     *,
     max_resolve: int = 0,
     sleep_seconds: float = 0.5,
+    video_resolver=None,
+    workers: int = 4,
+    stats: Optional[EnrichStats] = None,
 ) -> int:
     """
-    JSON内のmediaが photo でも、URLが動画サムネっぽい場合にツイートHTMLから実動画URLを探して追加する。
+    JSON内のmediaが photo でも、URLが動画サムネっぽい場合に実動画URLを探して追加する。
+
+    Syndication / Playwright / ツイートHTML を、過去の成功率から決めた順に試す。sleep_seconds は各手段の最小呼び出し間隔。
 
     Returns:
         追加できた video 件数
     """
     if not tweets:
         return 0
-
-    _agent_log("H2", "media_only.py:enrich_tweets_with_resolved_videos_from_thumbnails", "enter", {"tweets": len(tweets)})
-
-    sess = requests.Session()
-    sess.headers.update(
-        {
-            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36",
-            "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
-            "Accept-Language": "ja,en-US;q=0.9,en;q=0.8",
-            "Connection": "keep-alive",
-        }
-    )
-    if Config.TWITTER_COOKIES:
-        sess.headers["Cookie"] = Config.TWITTER_COOKIES
-
-    resolved = 0
-    checked = 0
-    for tweet in tweets:
-        if max_resolve > 0 and checked >= max_resolve:
-            break
-
-        tweet_url = tweet.get("url")
-        if not tweet_url:
-            continue
-
-        media_list = tweet.get("media", []) or []
-        if not isinstance(media_list, list) or not media_list:
-            continue
-
-        # 既にvideoがあるならスキップ（重複回避）
-        if any(isinstance(m, dict) and m.get("type") == "video" for m in media_list):
-            continue
-
-        thumb_candidates = [
-            m
-            for m in media_list
-            if isinstance(m, dict)
-            and m.get("url")
-            and _looks_like_video_thumbnail(str(m.get("url")))
-        ]
-        if not thumb_candidates:
-            continue
-
-        checked += 1
-        try:
-            tweet_id = _extract_tweet_id(tweet_url)
-            _agent_log("H2", "media_only.py:enrich", "candidate", {"tweet_id": tweet_id or "", "url": _safe_url_tag(tweet_url), "thumbs": len(thumb_candidates)})
-
-            video_url = None
-            if tweet_id:
-                video_url = _resolve_video_from_syndication(tweet_id, sess)
-
-            # 手順1.5: Syndicationが空/動画情報無しの場合はPlaywrightでネットワークから捕捉
-            if not video_url:
-                try:
-                    from twitter_video_api import resolve_best_video_url
-
-                    video_url = resolve_best_video_url(tweet_url)
-                    if video_url:
-                        _agent_log("H5", "media_only.py:enrich", "picked from playwright", {"tweet_id": tweet_id or "", "video_url": _safe_url_tag(video_url)})
-                except Exception as e:
-                    _agent_log("H5", "media_only.py:enrich", "playwright exception", {"tweet_id": tweet_id or "", "err": str(e)[:160]})
-
-            if not video_url:
-                # Refererを付けると弾かれにくいケースがある
-                resp = sess.get(tweet_url, timeout=30, headers={"Referer": "https://twitter.com/"})
-                _agent_log("H3", "media_only.py:enrich", "tweet html response", {"tweet_id": tweet_id or "", "status": resp.status_code})
-                if resp.status_code in (401, 403):
-                    logger.warning(f"{resp.status_code} でツイートHTML取得に失敗（Cookie不足の可能性）: {tweet_url}")
-                    continue
-                resp.raise_for_status()
-                video_url = _pick_video_url_from_html(resp.text)
-
-            if not video_url:
-                _agent_log("H2", "media_only.py:enrich", "no video url", {"tweet_id": tweet_id or ""})
-                continue
-
-            # 先頭のサムネを紐付け
-            thumb = thumb_candidates[0]
-            media_index = thumb.get("media_index", 0)
-            media_list.append(
-                {
-                    "type": "video",
-                    "url": video_url,
-                    "media_index": media_index,
-                    "thumbnail_url": thumb.get("url"),
-                    "tweet_url": tweet_url,
-                    "resolved_from": "resolved",
-                }
-            )
-            tweet["media"] = media_list
-            resolved += 1
-            _agent_log("H2", "media_only.py:enrich", "added video", {"tweet_id": tweet_id or "", "video_url": _safe_url_tag(video_url)})
-        except Exception as e:
-            _agent_log("H2", "media_only.py:enrich", "exception", {"err": str(e)[:160], "url": _safe_url_tag(tweet_url)})
-        finally:
-            if sleep_seconds:
-                time.sleep(sleep_seconds)
-
-    _agent_log("H2", "media_only.py:enrich_tweets_with_resolved_videos_from_thumbnails", "exit", {"checked": checked, "resolved": resolved})
-    return resolved
+    stats = stats if stats is not None else EnrichStats()
+    rate_limits = {name: sleep_seconds if interval else 0.0 for name, interval in DEFAULT_RESOLVER_INTERVALS.items()}
+    for _ in iter_tweets_with_resolved_videos(
+        tweets,
+        workers=workers,
+        max_resolve=max_resolve,
+        rate_limits=rate_limits,
+        video_resolver=video_resolver,
+        stats=stats,
+    ):
+        pass
+    logger.info(f"動画URL解決: {stats.summary()}")
+    return stats.resolved
 
 
 def normalize_username(username: Optional[str]) -> str:
@@ -318,56 +480,80 @@ def filter_tweets_by_author(tweets: Iterable[Dict], target_username: str) -> Lis
     return [t for t in tweets if is_target_author(t, target_username)]
 
 
-def build_media_manifest_from_tweets(tweets: Iterable[Dict]) -> Dict:
-    """Tweet配列からメディア一覧のマニフェストを生成"""
-    media_items: List[Dict] = []
-    tweet_count = 0
+def _iter_manifest_media(tweets: Iterable[Dict], counts: Dict[str, int]) -> Iterator[Dict]:
+    """マニフェストの media の要素を1件ずつ返す（件数は counts に数えていく）"""
     for tweet in tweets:
-        tweet_count += 1
+        counts["total_tweets_included"] += 1
         tweet_id = tweet.get("tweet_id")
         created_at = tweet.get("created_at")
         author_username = tweet.get("author_username")
         tweet_url = tweet.get("url")
         for media in tweet.get("media", []) or []:
-            media_items.append(
-                {
-                    "tweet_id": tweet_id,
-                    "created_at": created_at,
-                    "author_username": author_username,
-                    "tweet_url": tweet_url,
-                    "media_index": media.get("media_index", 0),
-                    "type": media.get("type"),
-                    "url": media.get("url"),
-                    "local_path": media.get("local_path"),
-                    "file_size": media.get("file_size"),
-                }
-            )
-
-    downloaded = sum(1 for m in media_items if m.get("local_path"))
-    return {
-        "metadata": {
-            "exported_at": datetime.now().isoformat(),
-            "total_tweets_included": tweet_count,
-            "total_media": len(media_items),
-            "downloaded_media": downloaded,
-            "run_dir": str(Config.RUN_DIR),
-        },
-        "media": media_items,
-    }
+            counts["total_media"] += 1
+            if media.get("local_path"):
+                counts["downloaded_media"] += 1
+            yield {
+                "tweet_id": tweet_id,
+                "created_at": created_at,
+                "author_username": author_username,
+                "tweet_url": tweet_url,
+                "media_index": media.get("media_index", 0),
+                "type": media.get("type"),
+                "url": media.get("url"),
+                "local_path": media.get("local_path"),
+                "file_size": media.get("file_size"),
+            }
+
+
+def _manifest_metadata(counts: Dict[str, int], dead_letters: Optional[List[Dict]]) -> Dict:
+    metadata = {"exported_at": datetime.now().isoformat(), **counts, "run_dir": str(Config.RUN_DIR)}
+    if dead_letters:
+        metadata["dead_letter_media"] = len(dead_letters)
+    return metadata
+
+
+def _new_manifest_counts() -> Dict[str, int]:
+    return {"total_tweets_included": 0, "total_media": 0, "downloaded_media": 0}
+
+
+def build_media_manifest_from_tweets(tweets: Iterable[Dict], dead_letters: Optional[List[Dict]] = None) -> Dict:
+    """Tweet配列からメディア一覧のマニフェストを生成（dictで返す。ファイルに書くなら save_media_manifest_from_tweets）
+
+    Args:
+        dead_letters: 再試行を使い切ったメディア（MediaDownloader.dead_letters）
+    """
+    counts = _new_manifest_counts()
+    media_items = list(_iter_manifest_media(tweets, counts))
+    data = {"metadata": _manifest_metadata(counts, dead_letters), "media": media_items}
+    if dead_letters:
+        data["dead_letters"] = list(dead_letters)
+    return data
 
 
 def save_media_manifest_from_tweets(
     tweets: Iterable[Dict],
     filename: str = "media_manifest.json",
     output_dir: Optional[Path] = None,
+    dead_letters: Optional[List[Dict]] = None,
 ) -> Path:
-    """メディアマニフェストをJSONで保存"""
+    """メディアマニフェストをJSONで保存（Config.OUTPUT_COMPACT / OUTPUT_COMPRESSION に従う）
+
+    media は1件ずつ書き出す（全件をメモリに載せない）。件数は書き終えるまで分からないので、
+    metadata は media / dead_letters の後ろに書く。
+    """
     out_dir = output_dir or Config.RUN_DIR
     out_dir.mkdir(parents=True, exist_ok=True)
-    output_path = out_dir / filename
-    data = build_media_manifest_from_tweets(tweets)
-    with open(output_path, "w", encoding="utf-8") as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
+    output_path = resolve_output_path(out_dir / filename)
+    counts = _new_manifest_counts()
+
+    def fields():
+        yield "media", _iter_manifest_media(tweets, counts)
+        if dead_letters:
+            yield "dead_letters", list(dead_letters)
+        yield "metadata", _manifest_metadata(counts, dead_letters)
+
+    with PROFILER.stage("save"), open_output(output_path) as f:
+        write_json_object(f, fields())
     return output_path
 
 
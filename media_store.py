@@ -0,0 +1,136 @@
+"""コンテンツアドレス方式のメディアストア（実行を跨いだ重複排除）"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+from pathlib import Path
+from typing import Dict, Optional
+from urllib.parse import parse_qs, urlparse
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+
+def media_key(url: str) -> str:
+    """URLから安定したメディアキーを作る
+
+    - pbs.twimg.com: 拡張子・format指定を除いたパス + サイズ指定（name=large / :large）
+    - video.twimg.com など: クエリ（?tag=12 等）を除いたホスト+パス
+    """
+    if not url:
+        return ""
+    parsed = urlparse(url)
+    host = parsed.netloc.lower()
+    path = parsed.path
+    if host == "pbs.twimg.com":
+        variant = ""
+        if ":" in path.rsplit("/", 1)[-1]:
+            path, variant = path.rsplit(":", 1)
+        qs = parse_qs(parsed.query)
+        variant = (qs.get("name") or [variant])[0] or "default"
+        stem = path.rsplit(".", 1)[0] if "." in path.rsplit("/", 1)[-1] else path
+        return f"{host}{stem}@{variant}"
+    return f"{host}{path}"
+
+
+def link_or_copy(src: Path, dest: Path) -> None:
+    """destをsrcへのハードリンクとして作る（不可ならコピー）。既存のdestは置き換える"""
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    tmp = dest.with_name(dest.name + ".linktmp")
+    try:
+        if tmp.exists():
+            tmp.unlink()
+        os.link(src, tmp)
+    except OSError:
+        # 別ファイルシステムやハードリンク非対応の場合
+        shutil.copy2(src, tmp)
+    os.replace(tmp, dest)
+
+
+class MediaStore:
+    """OUTPUT_DIR/media_store 配下にSHA-256で実体を1つだけ持つストア
+
+    index.ndjson に「メディアキー → ハッシュ」を追記していき、
+    既知のメディアはネットワークに触れずに各RUN_DIRへリンクする。
+    """
+
+    INDEX_NAME = "index.ndjson"
+
+    def __init__(self, root: Optional[Path] = None):
+        self.root = Path(root) if root else Config.OUTPUT_DIR / "media_store"
+        self.objects_dir = self.root / "objects"
+        self.objects_dir.mkdir(parents=True, exist_ok=True)
+        self.index_path = self.root / self.INDEX_NAME
+        self._lock = threading.Lock()
+        self._by_key: Dict[str, Dict] = {}
+        self._by_hash: Dict[str, Dict] = {}
+        self._load_index()
+
+    def _load_index(self) -> None:
+        if not self.index_path.exists():
+            return
+        with open(self.index_path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue  # 書き込み途中で落ちた行は無視
+                if entry.get("key") and entry.get("sha256"):
+                    self._by_key[entry["key"]] = entry
+                    self._by_hash[entry["sha256"]] = entry
+
+    def _object_path(self, sha256: str, ext: str) -> Path:
+        return self.objects_dir / sha256[:2] / f"{sha256}{ext}"
+
+    def lookup(self, url: str) -> Optional[Path]:
+        """URLに対応する実体ファイルを返す（未知なら None）"""
+        entry = self._by_key.get(media_key(url))
+        if not entry:
+            return None
+        path = self._object_path(entry["sha256"], entry.get("ext", ""))
+        return path if path.exists() else None
+
+    def link_existing(self, url: str, save_dir: Path, stem: str) -> Optional[Path]:
+        """既知のメディアなら save_dir/{stem}{ext} にリンクして返す"""
+        obj = self.lookup(url)
+        if not obj:
+            return None
+        dest = save_dir / f"{stem}{obj.suffix}"
+        if not (dest.exists() and dest.stat().st_size > 0):
+            link_or_copy(obj, dest)
+        return dest
+
+    def put(self, url: str, path: Path) -> Path:
+        """ダウンロード済みファイルをストアに登録し、pathを実体へのリンクに置き換える"""
+        path = Path(path)
+        h = hashlib.sha256()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1024 * 1024), b""):
+                h.update(block)
+        sha256 = h.hexdigest()
+        ext = path.suffix
+        key = media_key(url)
+
+        with self._lock:
+            known = self._by_hash.get(sha256)
+            obj = self._object_path(sha256, known.get("ext", ext) if known else ext)
+            if obj.exists():
+                # 同じ内容が既にある（RTや再アップロード）→ 実体へのリンクに差し替え
+                if not path.samefile(obj):
+                    link_or_copy(obj, path)
+            else:
+                link_or_copy(path, obj)
+
+            if self._by_key.get(key, {}).get("sha256") != sha256:
+                entry = {"key": key, "sha256": sha256, "ext": obj.suffix, "size": obj.stat().st_size}
+                self._by_key[key] = entry
+                self._by_hash.setdefault(sha256, entry)
+                with open(self.index_path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        return obj
@@ -0,0 +1,161 @@
+"""出力ファイルの圧縮・コンパクト化と、圧縮された入力の透過的な読み込み
+
+圧縮方式は gzip（標準ライブラリ）と zstd（zstandard がインストールされていれば）。
+既定値は Config.OUTPUT_COMPRESSION（""なら無圧縮）と Config.OUTPUT_COMPACT（Trueなら
+JSONをインデントせずに書く）で、main.py の --compress / --compact-output から設定する。
+"""
+
+from __future__ import annotations
+
+import gzip
+import io
+import json
+import logging
+from pathlib import Path
+from typing import IO, Iterable, Optional, Tuple
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+COMPRESSIONS = ("gzip", "zstd")
+SUFFIXES = {"gzip": ".gz", "zstd": ".zst"}
+COMPACT_SEPARATORS = (",", ":")
+
+_GZIP_MAGIC = b"\x1f\x8b"
+_ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+# 速度とサイズの釣り合い（gzipの9やzstdの19は遅い割に小さくならない）
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 10
+
+_warned_zstd = False
+
+
+def _zstandard():
+    try:
+        import zstandard
+    except ImportError:
+        return None
+    return zstandard
+
+
+def output_compression(compression: Optional[str] = None) -> str:
+    """実際に使う圧縮方式（"" / "gzip" / "zstd"）。zstdが使えなければgzipにする"""
+    global _warned_zstd
+    compression = (compression if compression is not None else getattr(Config, "OUTPUT_COMPRESSION", "")) or ""
+    compression = compression.lower()
+    if compression and compression not in COMPRESSIONS:
+        raise ValueError(f"不明な圧縮方式です: {compression}（{', '.join(COMPRESSIONS)}のいずれか）")
+    if compression == "zstd" and _zstandard() is None:
+        if not _warned_zstd:
+            logger.warning("zstandard がインストールされていないため gzip で圧縮します（pip install zstandard）")
+            _warned_zstd = True
+        return "gzip"
+    return compression
+
+
+def is_compact(compact: Optional[bool] = None) -> bool:
+    return bool(compact if compact is not None else getattr(Config, "OUTPUT_COMPACT", False))
+
+
+def resolve_output_path(path: Path, compression: Optional[str] = None) -> Path:
+    """圧縮するなら拡張子（.gz / .zst）を付けたパス"""
+    suffix = SUFFIXES.get(output_compression(compression), "")
+    path = Path(path)
+    return path.with_name(path.name + suffix) if suffix else path
+
+
+def open_output(path: Path, compression: Optional[str] = None, newline: Optional[str] = None) -> IO[str]:
+    """書き込み用に開く（path は resolve_output_path() で拡張子を付けた後のもの）"""
+    compression = output_compression(compression)
+    if compression == "gzip":
+        return gzip.open(path, "wt", encoding="utf-8", newline=newline, compresslevel=GZIP_LEVEL)
+    if compression == "zstd":
+        writer = _zstandard().ZstdCompressor(level=ZSTD_LEVEL).stream_writer(open(path, "wb"))
+        return io.TextIOWrapper(writer, encoding="utf-8", newline=newline)
+    return open(path, "w", encoding="utf-8", newline=newline)
+
+
+def _indent(text: str, spaces: int) -> str:
+    """json.dumps(indent=2)の出力を、埋め込む深さに合わせて2行目以降をずらす"""
+    return text.replace("\n", "\n" + " " * spaces)
+
+
+def write_json_object(f: IO[str], fields: Iterable[Tuple[str, object]], compact: Optional[bool] = None) -> None:
+    """{キー: 値, ...} をフィールドごとに f へ書く（全体を1つのdictにしない）
+
+    値が dict / 文字列 / 数値 / None 以外（list やジェネレータ）なら配列として1要素ずつ書く。
+    fields もジェネレータでよく、前の配列を書き終えてから次のフィールドの値を作れる（件数を後ろに書く場合など）。
+    コンパクト時は配列の要素ごとに改行だけ入れ、そうでなければ indent=2 で書く。
+    """
+    compact = is_compact(compact)
+    f.write("{")
+    for i, (key, value) in enumerate(fields):
+        name = json.dumps(key, ensure_ascii=False)
+        if compact:
+            f.write(("," if i else "") + name + ":")
+        else:
+            f.write((",\n  " if i else "\n  ") + name + ": ")
+        if value is None or isinstance(value, (dict, str, int, float)):
+            if compact:
+                f.write(json.dumps(value, ensure_ascii=False, separators=COMPACT_SEPARATORS))
+            else:
+                f.write(_indent(json.dumps(value, ensure_ascii=False, indent=2), 2))
+            continue
+        f.write("[")
+        written = False
+        for j, item in enumerate(value):
+            if compact:
+                f.write(",\n" if j else "\n")
+                f.write(json.dumps(item, ensure_ascii=False, separators=COMPACT_SEPARATORS))
+            else:
+                f.write(",\n    " if j else "\n    ")
+                f.write(_indent(json.dumps(item, ensure_ascii=False, indent=2), 4))
+            written = True
+        if written:
+            f.write("\n]" if compact else "\n  ]")
+        else:
+            f.write("]")
+    f.write("}\n" if compact else "\n}")
+
+
+def detect_compression(path: Path) -> str:
+    """ファイル先頭のマジックナンバーから圧縮方式を判定する（無圧縮なら ""）"""
+    with open(path, "rb") as f:
+        head = f.read(4)
+    if head.startswith(_GZIP_MAGIC):
+        return "gzip"
+    if head.startswith(_ZSTD_MAGIC):
+        return "zstd"
+    return ""
+
+
+def open_input(path: Path, newline: Optional[str] = None) -> IO[str]:
+    """読み込み用に開く（gzip / zstd なら展開しながら読む）"""
+    compression = detect_compression(path)
+    if compression == "gzip":
+        return gzip.open(path, "rt", encoding="utf-8", newline=newline)
+    if compression == "zstd":
+        zstandard = _zstandard()
+        if zstandard is None:
+            raise RuntimeError(f"zstd圧縮されたファイルの読み込みには zstandard が必要です（pip install zstandard）: {path}")
+        reader = zstandard.ZstdDecompressor().stream_reader(open(path, "rb"))
+        return io.TextIOWrapper(reader, encoding="utf-8", newline=newline)
+    return open(path, "r", encoding="utf-8", newline=newline)
+
+
+def strip_compression_suffix(path: Path) -> Path:
+    """tweets.ndjson.gz → tweets.ndjson（形式の判定用）"""
+    path = Path(path)
+    if path.suffix in SUFFIXES.values():
+        return path.with_suffix("")
+    return path
+
+
+def compression_from_suffix(path: Path) -> str:
+    """拡張子から書き込み時の圧縮方式を決める（.gz → gzip、.zst → zstd、それ以外は無圧縮）"""
+    suffix = Path(path).suffix
+    for compression, known in SUFFIXES.items():
+        if suffix == known:
+            return compression
+    return ""
@@ -0,0 +1,194 @@
+"""Tweetの列指向（Parquet）書き出し
+
+tweets（1Tweet1行）と media（1メディア1行）の2テーブルを、author_username と month（YYYY-MM）で
+Hive形式にパーティション分割して書き出す。batch_size件ごとに新しいパートファイルを追加するので、
+全件をメモリに載せずに逐次書き込める。
+
+pyarrow が必要（任意依存。pip install pyarrow）。読み出しは pandas.read_parquet や
+pyarrow.dataset.dataset(path, partitioning="hive") で、パーティション列による絞り込みが効く。
+"""
+
+from __future__ import annotations
+
+import importlib.util
+import logging
+import re
+import uuid
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+TWEETS_TABLE = "tweets"
+MEDIA_TABLE = "media"
+PARTITION_COLS = ["author_username", "month"]
+UNKNOWN_PARTITION = "unknown"
+
+_METRIC_FIELDS = ("like_count", "retweet_count", "reply_count", "quote_count")
+
+
+def pyarrow_available() -> bool:
+    """pyarrow がインストールされているか（読み込まずに調べる。引数チェック用）"""
+    return importlib.util.find_spec("pyarrow") is not None
+
+
+def _require_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError as e:
+        raise RuntimeError("Parquetの書き出しには pyarrow が必要です（pip install pyarrow）") from e
+    return pyarrow
+
+
+def _to_int(value) -> Optional[int]:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _parse_created_at(value) -> Optional[datetime]:
+    """ISO8601（末尾Z可）をUTCのdatetimeにする"""
+    if not value:
+        return None
+    try:
+        dt = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt.astimezone(timezone.utc)
+
+
+def _partition_value(value: Optional[str]) -> str:
+    # パスに使えない文字だけ置き換える（ユーザー名は英数字と_なので通常はそのまま）
+    return re.sub(r"[^\w.-]", "_", value) if value else UNKNOWN_PARTITION
+
+
+def tweet_row(tweet: Dict) -> Dict:
+    """Tweet辞書を型付きの1行にする（tweet_idはint64、created_atはtimestamp、メトリクスはint）"""
+    metrics = tweet.get("public_metrics") or {}
+    created_at = _parse_created_at(tweet.get("created_at"))
+    row = {
+        "tweet_id": _to_int(tweet.get("tweet_id")),
+        "created_at": created_at,
+        "text": tweet.get("text") or "",
+        "url": tweet.get("url") or "",
+        "media_count": len(tweet.get("media") or []),
+        "author_username": _partition_value(tweet.get("author_username")),
+        "month": created_at.strftime("%Y-%m") if created_at else UNKNOWN_PARTITION,
+    }
+    for key in _METRIC_FIELDS:
+        row[key] = _to_int(metrics.get(key)) or 0
+    return row
+
+
+def media_rows(tweet: Dict, row: Optional[Dict] = None) -> List[Dict]:
+    """Tweetのメディアを1メディア1行に展開する（パーティション列はTweetと同じ）"""
+    row = row or tweet_row(tweet)
+    rows = []
+    for media in tweet.get("media") or []:
+        if not isinstance(media, dict):
+            continue
+        rows.append({
+            "tweet_id": row["tweet_id"],
+            "media_index": _to_int(media.get("media_index")) or 0,
+            "type": media.get("type"),
+            "url": media.get("url"),
+            "thumbnail_url": media.get("thumbnail_url"),
+            "local_path": media.get("local_path"),
+            "file_size": _to_int(media.get("file_size")),
+            "created_at": row["created_at"],
+            "author_username": row["author_username"],
+            "month": row["month"],
+        })
+    return rows
+
+
+def _schemas(pa) -> Dict:
+    ts = pa.timestamp("ms", tz="UTC")
+    tweets = pa.schema(
+        [
+            ("tweet_id", pa.int64()),
+            ("created_at", ts),
+            ("text", pa.string()),
+            ("url", pa.string()),
+            ("media_count", pa.int32()),
+        ]
+        + [(key, pa.int64()) for key in _METRIC_FIELDS]
+        + [("author_username", pa.string()), ("month", pa.string())]
+    )
+    media = pa.schema([
+        ("tweet_id", pa.int64()),
+        ("media_index", pa.int32()),
+        ("type", pa.string()),
+        ("url", pa.string()),
+        ("thumbnail_url", pa.string()),
+        ("local_path", pa.string()),
+        ("file_size", pa.int64()),
+        ("created_at", ts),
+        ("author_username", pa.string()),
+        ("month", pa.string()),
+    ])
+    return {TWEETS_TABLE: tweets, MEDIA_TABLE: media}
+
+
+class ParquetWriter:
+    """tweets/media テーブルへの逐次書き込み
+
+    out_dir/tweets/author_username=.../month=YYYY-MM/<書き込みID>-<連番>-0.parquet のように書く。
+    書き込みIDは実行ごとに変わるので、同じ out_dir に後から追記しても既存ファイルを上書きしない。
+    """
+
+    def __init__(self, out_dir: Path, batch_size: int = 5000):
+        self.pa = _require_pyarrow()
+        self.out_dir = Path(out_dir)
+        self.batch_size = max(1, batch_size)
+        self._schemas = _schemas(self.pa)
+        self._rows: Dict[str, List[Dict]] = {TWEETS_TABLE: [], MEDIA_TABLE: []}
+        self._writer_id = uuid.uuid4().hex[:8]
+        self._batches = 0
+        self.count = 0
+        # tweet_id が数値でないため書かなかったTweet数
+        self.skipped = 0
+
+    def write(self, tweet: Dict) -> None:
+        row = tweet_row(tweet)
+        if row["tweet_id"] is None:
+            self.skipped += 1
+            return
+        self._rows[TWEETS_TABLE].append(row)
+        self._rows[MEDIA_TABLE].extend(media_rows(tweet, row))
+        self.count += 1
+        if len(self._rows[TWEETS_TABLE]) >= self.batch_size:
+            self.flush()
+
+    def flush(self) -> None:
+        if not self._rows[TWEETS_TABLE]:
+            return
+        import pyarrow.parquet as pq
+
+        for name, rows in self._rows.items():
+            if not rows:
+                continue
+            table = self.pa.Table.from_pylist(rows, schema=self._schemas[name])
+            pq.write_to_dataset(
+                table,
+                root_path=str(self.out_dir / name),
+                partition_cols=PARTITION_COLS,
+                basename_template=f"{self._writer_id}-{self._batches:05d}-{{i}}.parquet",
+                existing_data_behavior="overwrite_or_ignore",
+            )
+        self._batches += 1
+        self._rows = {TWEETS_TABLE: [], MEDIA_TABLE: []}
+
+    def close(self) -> None:
+        self.flush()
+
+    def __enter__(self) -> "ParquetWriter":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
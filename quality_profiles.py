@@ -0,0 +1,125 @@
+"""メディアの画質/帯域プロファイル（画像サイズ・動画ビットレート・サムネ保存の方針）"""
+
+from __future__ import annotations
+
+import os
+import re
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+from urllib.parse import parse_qs, urlencode, urlparse, urlunparse
+
+from config import Config
+
+
+@dataclass(frozen=True)
+class QualityProfile:
+    """画質プロファイル
+
+    Attributes:
+        name: プロファイル名
+        photo_size: pbs.twimg.com のサイズ指定（orig / large / medium / small）
+        max_video_bitrate: 動画の上限ビットレート(bps)。Noneなら最高画質
+        skip_thumbnails_with_video: 実動画が取れているツイートのサムネイルを保存しない
+    """
+
+    name: str
+    photo_size: str
+    max_video_bitrate: Optional[int]
+    skip_thumbnails_with_video: bool
+
+
+PROFILES: Dict[str, QualityProfile] = {
+    "archive": QualityProfile("archive", "orig", None, False),
+    "balanced": QualityProfile("balanced", "large", 2_200_000, False),
+    "lean": QualityProfile("lean", "medium", 900_000, True),
+}
+DEFAULT_PROFILE = "balanced"
+
+
+def get_profile(name: Optional[str] = None) -> Optional[QualityProfile]:
+    """プロファイルを返す
+
+    未指定なら Config.QUALITY_PROFILE（config.py に無ければ環境変数 QUALITY_PROFILE、既定 balanced）。
+    空文字なら None=従来動作。
+    """
+    if not name:
+        name = getattr(Config, "QUALITY_PROFILE", None)
+        if name is None:
+            name = os.getenv("QUALITY_PROFILE", DEFAULT_PROFILE)
+    if not name:
+        return None
+    try:
+        return PROFILES[name.lower()]
+    except KeyError:
+        raise ValueError(f"不明な画質プロファイルです: {name}（{', '.join(PROFILES)}のいずれか）")
+
+
+def _is_video_thumbnail_url(url: str) -> bool:
+    return any(k in (url or "") for k in ("ext_tw_video_thumb", "amplify_video_thumb"))
+
+
+def photo_url(url: str, profile: Optional[QualityProfile] = None) -> str:
+    """画像URLをプロファイルのサイズに書き換える"""
+    if not url:
+        return url
+    if profile is None:
+        # 従来動作: 旧形式(:small等)だけ :large に上げる
+        if "?format=" not in url:
+            return url.replace(":small", ":large").replace(":thumb", ":large")
+        return url
+
+    parsed = urlparse(url)
+    if parsed.netloc != "pbs.twimg.com":
+        return url
+    # 旧形式 https://pbs.twimg.com/media/XXX.jpg:small
+    path = re.sub(r":(small|medium|large|thumb|orig)$", "", parsed.path)
+    if path != parsed.path:
+        return urlunparse(parsed._replace(path=f"{path}:{profile.photo_size}"))
+    # 新形式 ?format=jpg&name=small
+    qs = parse_qs(parsed.query)
+    if "format" in qs or "name" in qs:
+        qs["name"] = [profile.photo_size]
+        return urlunparse(parsed._replace(query=urlencode({k: v[0] for k, v in qs.items()})))
+    return url
+
+
+def _bitrate_rank(bitrate: int, cap: Optional[int]) -> Tuple[int, int]:
+    """上限以下で最大のもの > 上限超えの中で最小のもの、の順に並べるためのキー"""
+    if cap is None or bitrate <= cap:
+        return (1, bitrate)
+    return (0, -bitrate)
+
+
+def pick_video_variant(variants: Iterable[Dict], profile: Optional[QualityProfile] = None) -> Optional[Dict]:
+    """Syndication APIの video_info.variants から1つ選ぶ（MP4 > WebM > m3u8）"""
+    variants = [v for v in variants or [] if isinstance(v, dict) and v.get("url")]
+    cap = profile.max_video_bitrate if profile else None
+    for content_type in ("video/mp4", "video/webm"):
+        candidates = [v for v in variants if v.get("content_type") == content_type]
+        if candidates:
+            return max(candidates, key=lambda v: _bitrate_rank(int(v.get("bitrate") or 0), cap))
+    m3u8s = [v for v in variants if ".m3u8" in v.get("url", "")]
+    return m3u8s[0] if m3u8s else None
+
+
+def pick_hls_variant(variants: Sequence[Tuple[int, str]], profile: Optional[QualityProfile] = None) -> Optional[Tuple[int, str]]:
+    """master m3u8 の (BANDWIDTH, URI) から1つ選ぶ"""
+    if not variants:
+        return None
+    cap = profile.max_video_bitrate if profile else None
+    return max(variants, key=lambda v: _bitrate_rank(v[0], cap))
+
+
+def should_skip_media(media: Dict, media_list: List[Dict], profile: Optional[QualityProfile] = None) -> bool:
+    """プロファイル上ダウンロード不要なメディアか（実動画があるツイートのサムネイル）"""
+    if not profile or not profile.skip_thumbnails_with_video or not isinstance(media, dict):
+        return False
+    is_thumb = media.get("type") == "video_thumbnail" or (
+        media.get("type") == "photo" and _is_video_thumbnail_url(str(media.get("url", "")))
+    )
+    if not is_thumb:
+        return False
+    return any(
+        isinstance(m, dict) and m.get("type") in ("video", "animated_gif") and m.get("url")
+        for m in media_list
+    )
@@ -0,0 +1,351 @@
+"""実行ごとの出力を記録するカタログ（OUTPUT_DIR/run_catalog.sqlite3）
+
+実行の終わりに、RUN_ID・対象ユーザー・モード・Tweetの日付範囲・Tweet/メディア件数・出力ファイルを
+1行ずつ記録する。過去の取得結果やマニフェストを探すときは OUTPUT_DIR を glob して mtime で
+並べる代わりにこのカタログを引く（実行数やネットワークストレージの遅さに依存しない）。
+
+カタログができる前の実行は `python run_catalog.py --rebuild` で取り込める（取り込む前でも、
+メディア索引はカタログに無い実行ディレクトリを glob して拾う）。
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import logging
+import re
+import sqlite3
+import sys
+import threading
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Set
+
+from config import Config
+from output_files import strip_compression_suffix
+from tweet_sinks import TweetSink
+
+logger = logging.getLogger(__name__)
+
+CATALOG_FILENAME = "run_catalog.sqlite3"
+# run_users に記録する作者の上限（取得結果JSONからのモードでは作者が多くなり得る）
+MAX_AUTHORS = 1000
+
+_RUN_ID_RE = re.compile(r"^\d{8}_\d{6}$")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id TEXT PRIMARY KEY,
+    run_dir TEXT NOT NULL,
+    mode TEXT,
+    username TEXT,
+    status TEXT,
+    started_at TEXT,
+    finished_at TEXT,
+    date_from TEXT,
+    date_to TEXT,
+    tweet_count INTEGER NOT NULL DEFAULT 0,
+    media_count INTEGER NOT NULL DEFAULT 0,
+    downloaded_count INTEGER NOT NULL DEFAULT 0,
+    options TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_runs_finished ON runs (finished_at);
+CREATE TABLE IF NOT EXISTS run_users (
+    run_id TEXT NOT NULL,
+    username TEXT NOT NULL,
+    PRIMARY KEY (run_id, username)
+);
+CREATE INDEX IF NOT EXISTS idx_run_users_username ON run_users (username);
+CREATE TABLE IF NOT EXISTS run_files (
+    run_id TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    path TEXT NOT NULL,
+    size INTEGER,
+    PRIMARY KEY (run_id, path)
+);
+CREATE INDEX IF NOT EXISTS idx_run_files_kind ON run_files (kind);
+"""
+
+
+def file_kind(path: Path) -> Optional[str]:
+    """出力ファイルの種類（カタログに載せないものは None）"""
+    if path.is_dir():
+        return "parquet" if path.name == "parquet" else None
+    name = strip_compression_suffix(path).name
+    if "manifest" in name and name.endswith(".json"):
+        return "manifest"
+    if name.startswith("tweets") and name.endswith(".json"):
+        return "tweets"
+    if name.endswith(".ndjson"):
+        return "tweet_log"
+    if name.endswith(".csv"):
+        return "csv"
+    return None
+
+
+class RunSummary(TweetSink):
+    """実行中に受け付けたTweetの集計（スクレイパーのsinkとしても使える）"""
+
+    def __init__(self):
+        self.tweet_count = 0
+        self.media_count = 0
+        self.downloaded_count = 0
+        self.date_from: Optional[str] = None
+        self.date_to: Optional[str] = None
+        self.authors: set = set()
+        self._lock = threading.Lock()
+
+    def accept(self, tweet: Dict) -> None:
+        created_at = tweet.get("created_at")
+        author = tweet.get("author_username")
+        with self._lock:
+            self.tweet_count += 1
+            self.media_count += len(tweet.get("media") or [])
+            if created_at:
+                if self.date_from is None or created_at < self.date_from:
+                    self.date_from = created_at
+                if self.date_to is None or created_at > self.date_to:
+                    self.date_to = created_at
+            if author and len(self.authors) < MAX_AUTHORS:
+                self.authors.add(author)
+
+    def record_media(self, tweet_id, media: Dict) -> None:
+        """メディアのダウンロード結果（MediaDownloader.on_media_downloaded から呼ぶ。成功したものだけ数える）"""
+        if media.get("local_path"):
+            with self._lock:
+                self.downloaded_count += 1
+
+
+class RunCatalog:
+    """実行カタログ（複数スレッドから使ってよい）"""
+
+    def __init__(self, db_path: Optional[Path] = None):
+        self.db_path = Path(db_path) if db_path else Config.OUTPUT_DIR / CATALOG_FILENAME
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        # ファイルのパスは OUTPUT_DIR からの相対で持つ（出力ディレクトリごと移動しても引ける）
+        self.root = self.db_path.parent
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.db_path), timeout=30, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(_SCHEMA)
+        self._conn.commit()
+
+    def _relative(self, path: Path) -> str:
+        path = Path(path)
+        try:
+            return path.resolve().relative_to(self.root.resolve()).as_posix()
+        except ValueError:
+            return str(path)
+
+    def _absolute(self, path: str) -> Path:
+        path = Path(path)
+        return path if path.is_absolute() else self.root / path
+
+    def record_run(
+        self,
+        run_id: str,
+        run_dir: Path,
+        mode: str,
+        status: str,
+        summary: Optional[RunSummary] = None,
+        username: Optional[str] = None,
+        started_at: Optional[str] = None,
+        finished_at: Optional[str] = None,
+        options: Optional[Dict] = None,
+    ) -> None:
+        """実行を記録する（同じrun_idなら置き換える）。出力ファイルは run_dir を1回だけ列挙して集める"""
+        summary = summary or RunSummary()
+        run_dir = Path(run_dir)
+        files = []
+        if run_dir.is_dir():
+            for path in sorted(run_dir.iterdir()):
+                kind = file_kind(path)
+                if kind:
+                    size = path.stat().st_size if path.is_file() else None
+                    files.append((run_id, kind, self._relative(path), size))
+        users = set(summary.authors)
+        if username:
+            users.add(username)
+
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM run_users WHERE run_id = ?", (run_id,))
+            self._conn.execute("DELETE FROM run_files WHERE run_id = ?", (run_id,))
+            self._conn.execute(
+                "INSERT OR REPLACE INTO runs VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    run_id,
+                    self._relative(run_dir),
+                    mode,
+                    username,
+                    status,
+                    started_at,
+                    finished_at or datetime.now().isoformat(timespec="seconds"),
+                    summary.date_from,
+                    summary.date_to,
+                    summary.tweet_count,
+                    summary.media_count,
+                    summary.downloaded_count,
+                    json.dumps(options or {}, ensure_ascii=False),
+                ),
+            )
+            self._conn.executemany("INSERT INTO run_users VALUES (?, ?)", [(run_id, u) for u in sorted(users)])
+            self._conn.executemany("INSERT INTO run_files VALUES (?, ?, ?, ?)", files)
+
+    def _run_dict(self, row: sqlite3.Row) -> Dict:
+        run = dict(row)
+        run["run_dir"] = self._absolute(run["run_dir"])
+        run["options"] = json.loads(run["options"] or "{}")
+        files = self._conn.execute(
+            "SELECT kind, path, size FROM run_files WHERE run_id = ? ORDER BY path", (run["run_id"],)
+        ).fetchall()
+        run["files"] = [{"kind": f["kind"], "path": self._absolute(f["path"]), "size": f["size"]} for f in files]
+        return run
+
+    def runs(self, username: Optional[str] = None, status: Optional[str] = None, limit: Optional[int] = 20) -> List[Dict]:
+        """実行を新しい順に返す（username を指定すると、その本人を対象にした実行か、その作者のTweetを含む実行）"""
+        sql = "SELECT runs.* FROM runs"
+        where, params = [], []
+        if username:
+            sql += " JOIN run_users USING (run_id)"
+            where.append("run_users.username = ?")
+            params.append(username)
+        if status:
+            where.append("runs.status = ?")
+            params.append(status)
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY runs.finished_at DESC, runs.run_id DESC"
+        if limit:
+            sql += " LIMIT ?"
+            params.append(limit)
+        with self._lock:
+            return [self._run_dict(row) for row in self._conn.execute(sql, params).fetchall()]
+
+    def latest_run(self, username: Optional[str] = None, status: Optional[str] = None) -> Optional[Dict]:
+        runs = self.runs(username=username, status=status, limit=1)
+        return runs[0] if runs else None
+
+    def files(
+        self,
+        kinds: Iterable[str] = ("tweets",),
+        username: Optional[str] = None,
+        limit: Optional[int] = None,
+        existing_only: bool = True,
+    ) -> List[Path]:
+        """指定した種類の出力ファイルを新しい実行の順に返す"""
+        kinds = list(kinds)
+        sql = (
+            "SELECT run_files.path FROM run_files JOIN runs USING (run_id)"
+            f" WHERE run_files.kind IN ({','.join('?' * len(kinds))})"
+        )
+        params: List = list(kinds)
+        if username:
+            sql += " AND run_id IN (SELECT run_id FROM run_users WHERE username = ?)"
+            params.append(username)
+        sql += " ORDER BY runs.finished_at DESC, runs.run_id DESC, run_files.path"
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+        paths = []
+        for row in rows:
+            path = self._absolute(row["path"])
+            # 消された実行の分は飛ばす（存在確認は返す件数分だけで済む）
+            if existing_only and not path.exists():
+                continue
+            paths.append(path)
+            if limit and len(paths) >= limit:
+                break
+        return paths
+
+    def count(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM runs").fetchone()[0]
+
+    def run_dirs(self) -> Set[Path]:
+        """記録済みの実行ディレクトリ（絶対パス。カタログに無い実行を見分ける用）"""
+        with self._lock:
+            rows = self._conn.execute("SELECT run_dir FROM runs").fetchall()
+        return {self._absolute(row["run_dir"]).resolve() for row in rows}
+
+    def has_run(self, run_id: str) -> bool:
+        with self._lock:
+            return self._conn.execute("SELECT 1 FROM runs WHERE run_id = ?", (run_id,)).fetchone() is not None
+
+    def rebuild(self, output_dir: Optional[Path] = None, force: bool = False) -> int:
+        """カタログに無い過去の実行を OUTPUT_DIR から取り込む（取得結果を読んで集計する。1回限りの移行用）
+
+        Returns:
+            取り込んだ実行数
+        """
+        from media_only import iter_tweets_from_result_json
+
+        output_dir = Path(output_dir) if output_dir else self.root
+        added = 0
+        for run_dir in sorted(p for p in output_dir.iterdir() if p.is_dir() and _RUN_ID_RE.match(p.name)):
+            if not force and self.has_run(run_dir.name):
+                continue
+            results = sorted(p for p in run_dir.iterdir() if file_kind(p) in ("tweets", "tweet_log"))
+            if not results:
+                continue
+            # 正常終了の tweets.json > 途中保存 > 追記ログ の順に、最初に読めたものを集計に使う
+            results.sort(key=lambda p: (strip_compression_suffix(p).name != "tweets.json", file_kind(p) == "tweet_log"))
+            summary = RunSummary()
+            for path in results:
+                try:
+                    for tweet in iter_tweets_from_result_json(path):
+                        summary.accept(tweet)
+                        for media in tweet.get("media") or []:
+                            if isinstance(media, dict):
+                                summary.record_media(tweet.get("tweet_id"), media)
+                    break
+                except (ValueError, OSError) as e:
+                    logger.warning(f"取得結果を読み込めませんでした: {path}: {e}")
+                    summary = RunSummary()
+            names = {strip_compression_suffix(p).name for p in results}
+            status = "completed" if names & {"tweets.json", "tweets_with_media.json"} else "partial"
+            if "tweets_error.json" in names:
+                status = "error"
+            mode = "json" if any(n.startswith("tweets_with_media") for n in names) else None
+            finished = datetime.fromtimestamp(max(p.stat().st_mtime for p in results)).isoformat(timespec="seconds")
+            self.record_run(
+                run_dir.name, run_dir, mode=mode, status=status, summary=summary,
+                started_at=datetime.strptime(run_dir.name, "%Y%m%d_%H%M%S").isoformat(), finished_at=finished,
+            )
+            added += 1
+        logger.info(f"実行カタログに{added}件の実行を取り込みました: {self.db_path}")
+        return added
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+    def __enter__(self) -> "RunCatalog":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="実行カタログの表示・再構築")
+    parser.add_argument("--user", default=None, help="このユーザーの実行だけ表示する")
+    parser.add_argument("--limit", type=int, default=20, help="表示する実行数")
+    parser.add_argument("--rebuild", action="store_true", help="カタログに無い過去の実行を OUTPUT_DIR から取り込む")
+    parser.add_argument("--force", action="store_true", help="--rebuild で記録済みの実行も取り込み直す")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", stream=sys.stdout)
+
+    with RunCatalog() as catalog:
+        if args.rebuild:
+            catalog.rebuild(force=args.force)
+        for run in catalog.runs(username=args.user, limit=args.limit):
+            period = f"{run['date_from'] or '-'} 〜 {run['date_to'] or '-'}"
+            print(
+                f"{run['run_id']}  {run['status'] or '-':<10} {run['mode'] or '-':<8} {run['username'] or '-':<16} "
+                f"Tweet {run['tweet_count']:>7}  メディア {run['downloaded_count']}/{run['media_count']}  {period}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,416 @@
+"""実行中の計測値（カウンタ・ゲージ・ヒストグラム）のレジストリ
+
+スクレイパー（ページ遷移・スクロール・429・待機時間）、動画URL解決、ダウンローダー、保存処理が
+モジュール共通の METRICS に記録する。記録は辞書の更新だけなので、計測しない場合もそのままでよい。
+
+- 実行中: MetricsReporter が Prometheus のテキスト形式を一定間隔でファイルに書く
+  （node_exporter の textfile collector でそのまま読める）。ポートを指定すればHTTPでも返す
+- 終了時: write_json() で run_metrics.json（ヒストグラムは件数・合計・平均・推定パーセンタイル）
+
+SCROLL_DELAY・ワーカー数・チャンクサイズの調整の根拠にする。
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+PROMETHEUS_FILENAME = "metrics.prom"
+JSON_FILENAME = "run_metrics.json"
+
+# 秒単位の所要時間用（ページ遷移・DOM抽出・ダウンロード等）
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+# 件数用（1スクロールあたりのTweet数など）
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+# バイト/秒用（ダウンロードのスループット）
+THROUGHPUT_BUCKETS = (32e3, 128e3, 512e3, 1e6, 2e6, 5e6, 10e6, 25e6, 50e6, 100e6)
+
+_PERCENTILES = (0.5, 0.9, 0.99)
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help_text: str, label_names: Sequence[str] = ()):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(label_names)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, object]) -> Tuple[str, ...]:
+        if set(labels) != set(self.label_names):
+            raise ValueError(f"{self.name} のラベルは {self.label_names} です（指定: {tuple(labels)}）")
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    def _label_text(self, key: Tuple[str, ...], extra: Sequence[Tuple[str, str]] = ()) -> str:
+        pairs = list(zip(self.label_names, key)) + list(extra)
+        if not pairs:
+            return ""
+        return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+    def _labels_dict(self, key: Tuple[str, ...]) -> Dict[str, str]:
+        return dict(zip(self.label_names, key))
+
+
+class Counter(_Metric):
+    """単調増加する値（回数・バイト数・秒数の累計）"""
+
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str, label_names: Sequence[str] = ()):
+        super().__init__(name, help_text, label_names)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def samples(self) -> List[Tuple[str, str, float]]:
+        with self._lock:
+            return [(self.name, self._label_text(k), v) for k, v in sorted(self._values.items())]
+
+    def to_dict(self) -> List[Dict]:
+        with self._lock:
+            return [{"labels": self._labels_dict(k), "value": v} for k, v in sorted(self._values.items())]
+
+
+class Gauge(_Metric):
+    """上下する値（キューの長さなど）。set_function() で読み出し時に計算させてもよい"""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, help_text: str, label_names: Sequence[str] = ()):
+        super().__init__(name, help_text, label_names)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._functions: Dict[Tuple[str, ...], Callable[[], float]] = {}
+
+    def set(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def set_function(self, func: Optional[Callable[[], float]], **labels) -> None:
+        """読み出すたびに func() を呼ぶ（None で解除し、最後の値を残す）"""
+        key = self._key(labels)
+        with self._lock:
+            if func is None:
+                old = self._functions.pop(key, None)
+                if old is not None:
+                    self._values[key] = self._call(old)
+            else:
+                self._functions[key] = func
+
+    @staticmethod
+    def _call(func: Callable[[], float]) -> float:
+        try:
+            return float(func())
+        except Exception:
+            return math.nan
+
+    def _current(self) -> Dict[Tuple[str, ...], float]:
+        with self._lock:
+            values = dict(self._values)
+            functions = dict(self._functions)
+        for key, func in functions.items():
+            values[key] = self._call(func)
+        return values
+
+    def value(self, **labels) -> float:
+        return self._current().get(self._key(labels), 0)
+
+    def samples(self) -> List[Tuple[str, str, float]]:
+        return [(self.name, self._label_text(k), v) for k, v in sorted(self._current().items())]
+
+    def to_dict(self) -> List[Dict]:
+        return [{"labels": self._labels_dict(k), "value": v} for k, v in sorted(self._current().items())]
+
+
+class _HistogramData:
+    __slots__ = ("counts", "count", "sum", "max")
+
+    def __init__(self, size: int):
+        self.counts = [0] * size
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+
+class Histogram(_Metric):
+    """分布（所要時間・件数・スループット）。バケットごとの件数と合計を持つ"""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, label_names: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, help_text, label_names)
+        self.buckets = tuple(sorted(buckets))
+        self._data: Dict[Tuple[str, ...], _HistogramData] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        # bucketsは数十個なので線形探索で十分
+        index = len(self.buckets)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                index = i
+                break
+        with self._lock:
+            data = self._data.get(key)
+            if data is None:
+                data = self._data[key] = _HistogramData(len(self.buckets) + 1)
+            data.counts[index] += 1
+            data.count += 1
+            data.sum += value
+            if value > data.max:
+                data.max = value
+
+    @contextmanager
+    def time(self, **labels) -> Iterator[None]:
+        """with ブロックの所要時間（秒）を記録する（例外で抜けても記録する）"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def _snapshot(self) -> Dict[Tuple[str, ...], _HistogramData]:
+        with self._lock:
+            snapshot = {}
+            for key, data in self._data.items():
+                copy = _HistogramData(len(data.counts))
+                copy.counts = list(data.counts)
+                copy.count, copy.sum, copy.max = data.count, data.sum, data.max
+                snapshot[key] = copy
+            return snapshot
+
+    def count(self, **labels) -> int:
+        data = self._snapshot().get(self._key(labels))
+        return data.count if data else 0
+
+    def _percentile(self, data: _HistogramData, q: float) -> float:
+        """バケット内を線形補間した推定値（最後のバケットは観測した最大値まで）"""
+        if not data.count:
+            return 0.0
+        rank = q * data.count
+        seen = 0
+        lower = 0.0
+        for i, n in enumerate(data.counts):
+            upper = self.buckets[i] if i < len(self.buckets) else max(data.max, lower)
+            if n and seen + n >= rank:
+                return lower + (upper - lower) * (rank - seen) / n
+            seen += n
+            lower = upper
+        return data.max
+
+    def samples(self) -> List[Tuple[str, str, float]]:
+        rows = []
+        for key, data in sorted(self._snapshot().items()):
+            cumulative = 0
+            for i, n in enumerate(data.counts):
+                cumulative += n
+                bound = self.buckets[i] if i < len(self.buckets) else math.inf
+                rows.append((f"{self.name}_bucket", self._label_text(key, [("le", _format_value(bound))]), cumulative))
+            rows.append((f"{self.name}_sum", self._label_text(key), data.sum))
+            rows.append((f"{self.name}_count", self._label_text(key), data.count))
+        return rows
+
+    def to_dict(self) -> List[Dict]:
+        result = []
+        for key, data in sorted(self._snapshot().items()):
+            entry = {
+                "labels": self._labels_dict(key),
+                "count": data.count,
+                "sum": data.sum,
+                "avg": data.sum / data.count if data.count else 0.0,
+                "max": data.max,
+            }
+            for q in _PERCENTILES:
+                entry[f"p{int(q * 100)}"] = self._percentile(data, q)
+            result.append(entry)
+        return result
+
+
+class MetricsRegistry:
+    """名前ごとに1つの計測値を持つ（同じ名前で取得すれば同じオブジェクトが返る）"""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+        self.started_at = datetime.now().isoformat(timespec="seconds")
+
+    def _get(self, cls, name: str, help_text: str, label_names: Sequence[str], **kwargs) -> _Metric:
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, help_text, label_names, **kwargs)
+            elif not isinstance(metric, cls) or metric.label_names != tuple(label_names):
+                raise ValueError(f"計測値 {name} は別の種類/ラベルで登録済みです")
+            return metric
+
+    def counter(self, name: str, help_text: str, label_names: Sequence[str] = ()) -> Counter:
+        return self._get(Counter, name, help_text, label_names)
+
+    def gauge(self, name: str, help_text: str, label_names: Sequence[str] = ()) -> Gauge:
+        return self._get(Gauge, name, help_text, label_names)
+
+    def histogram(
+        self, name: str, help_text: str, label_names: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS
+    ) -> Histogram:
+        return self._get(Histogram, name, help_text, label_names, buckets=buckets)
+
+    def get(self, name: str) -> Optional[_Metric]:
+        with self._lock:
+            return self._metrics.get(name)
+
+    def reset(self) -> None:
+        """値だけ消す（登録済みの計測値はそのまま使える。テスト・連続実行用）"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+            self.started_at = datetime.now().isoformat(timespec="seconds")
+        for metric in metrics:
+            with metric._lock:
+                for attr in ("_values", "_data", "_functions"):
+                    if hasattr(metric, attr):
+                        getattr(metric, attr).clear()
+
+    def render_prometheus(self) -> str:
+        with self._lock:
+            metrics = sorted(self._metrics.values(), key=lambda m: m.name)
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {_escape(metric.help)}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{labels} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+    def to_dict(self) -> Dict:
+        with self._lock:
+            metrics = sorted(self._metrics.values(), key=lambda m: m.name)
+        return {
+            "started_at": self.started_at,
+            "written_at": datetime.now().isoformat(timespec="seconds"),
+            "metrics": {
+                metric.name: {"type": metric.kind, "help": metric.help, "values": metric.to_dict()}
+                for metric in metrics
+            },
+        }
+
+    def write_prometheus(self, path: Path) -> Path:
+        """テキスト形式で書く（一時ファイルから置き換えるので、読み手が書きかけを見ることはない）"""
+        return _write_atomic(Path(path), self.render_prometheus())
+
+    def write_json(self, path: Path) -> Path:
+        return _write_atomic(Path(path), json.dumps(self.to_dict(), ensure_ascii=False, indent=2))
+
+
+def _write_atomic(path: Path, text: str) -> Path:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f".{path.name}.tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp, path)
+    return path
+
+
+# 各モジュールが記録する共通のレジストリ
+METRICS = MetricsRegistry()
+
+
+class MetricsReporter:
+    """実行中に Prometheus 形式を interval 秒ごとにファイルへ書き、port を指定すればHTTPでも返す"""
+
+    def __init__(
+        self,
+        registry: MetricsRegistry = METRICS,
+        path: Optional[Path] = None,
+        interval: float = 15.0,
+        port: Optional[int] = None,
+        host: str = "127.0.0.1",
+    ):
+        self.registry = registry
+        self.path = Path(path) if path else None
+        self.interval = max(0.1, interval)
+        self.port = port
+        self.host = host
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._server: Optional[ThreadingHTTPServer] = None
+
+    def start(self) -> "MetricsReporter":
+        if self.path is not None:
+            self._thread = threading.Thread(target=self._run, name="metrics-reporter", daemon=True)
+            self._thread.start()
+        if self.port is not None:
+            self._server = ThreadingHTTPServer((self.host, self.port), self._handler())
+            self.port = self._server.server_address[1]
+            threading.Thread(target=self._server.serve_forever, name="metrics-http", daemon=True).start()
+            logger.info(f"計測値を http://{self.host}:{self.port}/metrics で公開しています")
+        return self
+
+    def _handler(self):
+        registry = self.registry
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.rstrip("/") not in ("", "/metrics"):
+                    self.send_error(404)
+                    return
+                body = registry.render_prometheus().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            self._write()
+
+    def _write(self) -> None:
+        try:
+            self.registry.write_prometheus(self.path)
+        except Exception as e:
+            logger.debug(f"計測値の書き出しに失敗しました: {e}")
+
+    def stop(self) -> None:
+        """止めて、最後の値を書く"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._write()
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
@@ -0,0 +1,306 @@
+"""実行全体・ステージ別のプロファイル（main.py の --profile）
+
+ステージは scrape（TwitterScraper）・enrich（サムネからの動画URL解決）・download（MediaDownloader）・
+save（DataSaver / マニフェスト）の4つ。各モジュールが共通の PROFILER.stage() で処理を囲み、
+有効なステージだけ cProfile で計測する。
+
+- cProfile はスレッドごとに動くので、ワーカースレッドでは (ステージ, スレッド) ごとに Profile を持ち、
+  書き出し時にステージ単位で合算する。ステージが入れ子になったら（検索チャンクごとのダウンロード等）
+  外側を止めて内側だけ計測する
+- sample_interval を指定すると、全スレッドのスタックを一定間隔で採るサンプラーも動かす
+  （待ち時間も見える。Playwright の IPC 待ちやロック待ちは cProfile より分かりやすい）
+- Python 3.12 以降の cProfile は sys.monitoring の上で動き、インタプリタ全体で同時に1つしか
+  有効にできない（2つ目の enable() は ValueError）。スレッドごとの Profile が使えないので
+  cProfile は使わず、サンプラーだけでステージ別に計測する（間隔の指定が無ければ既定の間隔で動かす）。
+  3.11 以前でも、他のプロファイラが動いていて有効にできなければ同じくサンプラーに切り替える
+
+RUN_DIR/profile/ に <stage>.prof（pstats / snakeviz で開ける）、sampler.collapsed
+（speedscope / flamegraph.pl で開ける collapsed stack 形式）、summary.txt（上位N件の要約）を書く。
+無効なら stage() は判定1回で戻る。
+"""
+
+from __future__ import annotations
+
+import cProfile
+import functools
+import logging
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+STAGES = ("scrape", "enrich", "download", "save")
+PROFILE_DIRNAME = "profile"
+SUMMARY_FILENAME = "summary.txt"
+SAMPLER_FILENAME = "sampler.collapsed"
+
+# サンプラーで1スタックとして残す深さの上限
+_MAX_DEPTH = 64
+
+# スレッドごとに cProfile を有効にできるか（3.12 以降は1インタプリタに1つだけ）
+PER_THREAD_CPROFILE = sys.version_info < (3, 12)
+# cProfile を使えないときにサンプラーを動かす間隔（秒）
+FALLBACK_SAMPLE_INTERVAL = 0.005
+
+
+def _frame_label(code) -> str:
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def _func_label(func: Tuple[str, int, str]) -> str:
+    filename, line, name = func
+    if filename == "~":
+        return name  # 組み込み関数（{method 'read' of ...} 等）
+    return f"{name} ({os.path.basename(filename)}:{line})"
+
+
+class _Sampler:
+    """全スレッドのスタックを interval 秒ごとに採り、(ステージ, スタック) ごとに数える"""
+
+    def __init__(self, profiler: "RunProfiler", interval: float):
+        self.profiler = profiler
+        self.interval = max(0.001, interval)
+        self.samples: Counter = Counter()
+        self.ticks = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profile-sampler", daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join(timeout=5)
+
+    def _run(self) -> None:
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            self.ticks += 1
+            stages = self.profiler.active_stages()
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stage = stages.get(ident)
+                if stage is None:
+                    if self.profiler.stages != set(STAGES):
+                        continue  # 1ステージだけ計測しているときは他のスレッドを数えない
+                    stage = "other"
+                stack = []
+                while frame is not None and len(stack) < _MAX_DEPTH:
+                    stack.append(_frame_label(frame.f_code))
+                    frame = frame.f_back
+                stack.append(stage)
+                self.samples[tuple(reversed(stack))] += 1
+
+    def write_collapsed(self, path: Path) -> None:
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, count in self.samples.most_common():
+                f.write(";".join(part.replace(";", ":") for part in stack) + f" {count}\n")
+
+    def top_leaves(self, n: int) -> Dict[str, List[Tuple[str, int]]]:
+        """ステージごとに、スタックの先端（その瞬間に実行・待機していた関数）を多い順に"""
+        leaves: Dict[str, Counter] = {}
+        for stack, count in self.samples.items():
+            leaves.setdefault(stack[0], Counter())[stack[-1]] += count
+        return {stage: counter.most_common(n) for stage, counter in leaves.items()}
+
+
+class RunProfiler:
+    """ステージ単位の cProfile とサンプラー"""
+
+    def __init__(self):
+        self.enabled = False
+        # False ならステージ別の cProfile を使わずサンプラーだけで計測する
+        self.use_cprofile = PER_THREAD_CPROFILE
+        self.stages: set = set()
+        self._profiles: Dict[Tuple[str, int], cProfile.Profile] = {}
+        self._seconds: Counter = Counter()
+        self._entries: Counter = Counter()
+        self._stacks: Dict[int, List[str]] = {}
+        self._lock = threading.Lock()
+        self._sampler: Optional[_Sampler] = None
+        self._started = 0.0
+
+    def enable(self, stages: Optional[Iterable[str]] = None, sample_interval: float = 0.0) -> None:
+        """計測を始める（stages 省略時は全ステージ。sample_interval > 0 ならサンプラーも動かす）"""
+        stages = set(stages or STAGES)
+        unknown = stages - set(STAGES)
+        if unknown:
+            raise ValueError(f"不明なステージです: {', '.join(sorted(unknown))}（{', '.join(STAGES)}のいずれか）")
+        with self._lock:
+            self.stages = stages
+            self._profiles = {}
+            self._seconds = Counter()
+            self._entries = Counter()
+            self._stacks = {}
+        self._started = time.perf_counter()
+        self._sampler = None
+        self.enabled = True
+        if not self.use_cprofile and sample_interval <= 0:
+            sample_interval = FALLBACK_SAMPLE_INTERVAL
+            logger.info(
+                f"Python {sys.version_info.major}.{sys.version_info.minor} ではステージ別のcProfileを使えないため、"
+                f"サンプラー（{sample_interval * 1000:.0f}ms間隔）で計測します"
+            )
+        if sample_interval > 0:
+            self._sampler = _Sampler(self, sample_interval)
+            self._sampler.start()
+
+    def disable(self) -> None:
+        self.enabled = False
+        if self._sampler is not None:
+            self._sampler.stop()
+
+    def active_stages(self) -> Dict[int, str]:
+        """スレッドごとの実行中のステージ（一番内側）"""
+        with self._lock:
+            return {ident: stack[-1] for ident, stack in self._stacks.items() if stack}
+
+    def _fall_back_to_sampler(self, error: Exception) -> None:
+        """cProfile を有効にできなかったとき、以降はサンプラーだけで計測する"""
+        with self._lock:
+            if not self.use_cprofile:
+                return
+            self.use_cprofile = False
+            start_sampler = self._sampler is None and self.enabled
+            if start_sampler:
+                self._sampler = _Sampler(self, FALLBACK_SAMPLE_INTERVAL)
+        logger.warning(f"cProfileを有効にできないため、サンプラーで計測します: {error}")
+        if start_sampler:
+            self._sampler.start()
+
+    def _enable_profile(self, profile: Optional[cProfile.Profile]) -> Optional[cProfile.Profile]:
+        """profile を有効にする（他のプロファイラが有効で失敗したら None）"""
+        if profile is None:
+            return None
+        try:
+            profile.enable()
+        except ValueError as e:
+            self._fall_back_to_sampler(e)
+            return None
+        return profile
+
+    def _profile_for(self, stage: str, ident: int) -> cProfile.Profile:
+        with self._lock:
+            profile = self._profiles.get((stage, ident))
+            if profile is None:
+                profile = self._profiles[(stage, ident)] = cProfile.Profile()
+            return profile
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        """with ブロックを name のステージとして計測する（同じステージの入れ子はそのまま通す）"""
+        if not self.enabled:
+            yield
+            return
+        ident = threading.get_ident()
+        with self._lock:
+            stack = self._stacks.setdefault(ident, [])
+            outer = stack[-1] if stack else None
+        if outer == name:
+            yield
+            return
+
+        # 同じスレッドで有効にできる cProfile は1つなので、外側のステージは止めておく
+        use_cprofile = self.use_cprofile
+        outer_profile = self._profiles.get((outer, ident)) if use_cprofile and outer in self.stages else None
+        profile = self._profile_for(name, ident) if use_cprofile and name in self.stages else None
+        if outer_profile is not None:
+            outer_profile.disable()
+        with self._lock:
+            stack.append(name)
+        start = time.perf_counter()
+        try:
+            profile = self._enable_profile(profile)
+            yield
+        finally:
+            if profile is not None:
+                profile.disable()
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                stack.pop()
+                self._seconds[name] += elapsed
+                self._entries[name] += 1
+            self._enable_profile(outer_profile if self.use_cprofile else None)
+
+    def wrap(self, name: str, func: Callable) -> Callable:
+        """func を name のステージとして呼ぶ関数（スレッドの target やスレッドプールに渡す用）"""
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with self.stage(name):
+                return func(*args, **kwargs)
+        return wrapper
+
+    def stage_stats(self, name: str) -> Optional[pstats.Stats]:
+        """ステージの全スレッド分を合算した統計（計測していなければ None）"""
+        with self._lock:
+            profiles = [p for (stage, _), p in self._profiles.items() if stage == name]
+        stats = None
+        for profile in profiles:
+            profile.create_stats()
+            if not profile.stats:
+                continue
+            if stats is None:
+                stats = pstats.Stats(profile)
+            else:
+                stats.add(profile)
+        return stats
+
+    def write(self, output_dir: Path, top: int = 25) -> Path:
+        """<stage>.prof / sampler.collapsed / summary.txt を書き、summary.txt のパスを返す"""
+        self.disable()
+        output_dir = Path(output_dir)
+        output_dir.mkdir(parents=True, exist_ok=True)
+        total = time.perf_counter() - self._started
+        lines = [f"計測時間: {total:.1f}秒 / 対象ステージ: {', '.join(s for s in STAGES if s in self.stages)}", ""]
+
+        for name in STAGES:
+            if name not in self.stages:
+                continue
+            stats = self.stage_stats(name)
+            seconds = self._seconds.get(name, 0.0)
+            lines.append(f"== {name}: {seconds:.1f}スレッド秒（{self._entries.get(name, 0)}回）==")
+            if stats is None:
+                lines.extend(["  （記録なし）" if self.use_cprofile else "  （cProfileなし。サンプラーを参照）", ""])
+                continue
+            stats.dump_stats(str(output_dir / f"{name}.prof"))
+            lines.extend(self._top_lines(stats, top))
+            lines.append("")
+
+        if self._sampler is not None:
+            self._sampler.write_collapsed(output_dir / SAMPLER_FILENAME)
+            lines.append(f"== サンプラー: {self._sampler.ticks}回 × {self._sampler.interval * 1000:.0f}ms ==")
+            for stage, leaves in sorted(self._sampler.top_leaves(top).items()):
+                samples = sum(c for s, c in self._sampler.samples.items() if s[0] == stage)
+                lines.append(f"  [{stage}] {samples}サンプル")
+                for label, count in leaves:
+                    lines.append(f"    {count * 100 / samples:5.1f}%  {label}")
+            lines.append("")
+
+        summary = output_dir / SUMMARY_FILENAME
+        summary.write_text("\n".join(lines), encoding="utf-8")
+        return summary
+
+    @staticmethod
+    def _top_lines(stats: pstats.Stats, top: int) -> List[str]:
+        rows = [(func, cc, nc, tt, ct) for func, (cc, nc, tt, ct, _) in stats.stats.items()]
+        lines = ["  自身の時間（tottime）上位:"]
+        lines.append("    tottime   cumtime      calls  function")
+        for func, _, nc, tt, ct in sorted(rows, key=lambda r: r[3], reverse=True)[:top]:
+            lines.append(f"    {tt:7.3f}   {ct:7.3f}  {nc:9d}  {_func_label(func)}")
+        lines.append("  累積時間（cumtime）上位:")
+        lines.append("    cumtime   tottime      calls  function")
+        for func, _, nc, tt, ct in sorted(rows, key=lambda r: r[4], reverse=True)[:top]:
+            lines.append(f"    {ct:7.3f}   {tt:7.3f}  {nc:9d}  {_func_label(func)}")
+        return lines
+
+
+# 各モジュールが stage() で囲む共通のプロファイラ
+PROFILER = RunProfiler()
@@ -84,6 +84,424 @@ def test_data_saver():
         traceback.print_exc()
         return False
 
+def test_json_stream():
+    """取得結果JSONの逐次読み込み（{metadata, tweets}・配列・NDJSON）のテスト"""
+    print("\n=== JSON逐次読み込みテスト ===")
+    try:
+        import tempfile
+        from json_stream import JsonStream
+        from media_only import iter_tweets_from_result_json, load_tweets_from_result_json
+
+        tweets = [
+            {'tweet_id': str(i), 'text': '改行\nと"引用符"', 'public_metrics': {'like_count': i * 1000}, 'media': []}
+            for i in range(50)
+        ]
+        tmp = Path(tempfile.mkdtemp())
+        (tmp / 'result.json').write_text(
+            json.dumps({'metadata': {'total_tweets': 50, 'nested': [1, {'a': 2}]}, 'tweets': tweets}, ensure_ascii=False, indent=2),
+            encoding='utf-8',
+        )
+        (tmp / 'list.json').write_text(json.dumps(tweets), encoding='utf-8')
+        (tmp / 'tweets.ndjson').write_text(''.join(json.dumps(t) + '\n' for t in tweets), encoding='utf-8')
+        for name in ('result.json', 'list.json', 'tweets.ndjson'):
+            assert list(iter_tweets_from_result_json(tmp / name)) == tweets, name
+        print("[OK] 3形式とも同じTweet列")
+
+        # 要素がチャンク境界をまたいでも読める
+        with open(tmp / 'result.json', 'r', encoding='utf-8') as f:
+            stream = JsonStream(f, chunk_size=5)
+            for key in stream.iter_object_keys():
+                if key == 'tweets':
+                    assert list(stream.iter_array()) == tweets
+                else:
+                    stream.value()
+        print("[OK] 小さいチャンクでも読める")
+
+        (tmp / 'other.json').write_text('{"foo": 1}', encoding='utf-8')
+        try:
+            load_tweets_from_result_json(tmp / 'other.json')
+            assert False, "未対応の形式でValueErrorになりません"
+        except ValueError:
+            pass
+        print("[OK] 未対応の形式はValueError")
+
+        print("JSON逐次読み込みテスト: 成功")
+        return True
+    except Exception as e:
+        print(f"[ERROR] JSON逐次読み込みテスト: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+def test_output_files():
+    """出力の圧縮・コンパクト化と、圧縮された取得結果の読み込みのテスト"""
+    print("\n=== 出力圧縮テスト ===")
+    try:
+        import gzip
+        import tempfile
+        from data_saver import DataSaver
+        from media_only import load_tweets_from_result_json, save_media_manifest_from_tweets
+        from config import Config
+        from output_files import detect_compression, output_compression, resolve_output_path
+        from tweet_log import TweetLog, iter_logged_tweets
+
+        tweets = [
+            {'tweet_id': str(i), 'text': f'本文{i}', 'author_username': 'u', 'public_metrics': {'like_count': i},
+             'media': [{'type': 'photo', 'url': f'https://pbs.twimg.com/media/{i}.jpg', 'media_index': 0}]}
+            for i in range(30)
+        ]
+        old_run_dir = Config.RUN_DIR
+        Config.RUN_DIR = Path(tempfile.mkdtemp())
+        try:
+            saver = DataSaver()
+            plain = saver.save_tweets_json(tweets, filename='plain.json')
+
+            Config.OUTPUT_COMPACT = True
+            compact = saver.save_tweets_json(tweets, filename='compact.json')
+            assert compact.stat().st_size < plain.stat().st_size
+            assert json.loads(compact.read_text(encoding='utf-8'))['tweets'] == tweets
+            print(f"[OK] コンパクトJSON: {plain.stat().st_size} → {compact.stat().st_size} バイト")
+
+            Config.OUTPUT_COMPRESSION = 'gzip'
+            gz = saver.save_tweets_json(tweets, filename='tweets.json')
+            csv_path = saver.save_tweets_csv(tweets, filename='tweets.csv')
+            manifest = save_media_manifest_from_tweets(tweets)
+            assert gz.name == 'tweets.json.gz' and csv_path.name == 'tweets.csv.gz'
+            assert manifest.name == 'media_manifest.json.gz'
+            assert detect_compression(gz) == 'gzip'
+            with gzip.open(manifest, 'rt', encoding='utf-8') as f:
+                manifest_text = f.read()
+            # tweets JSONと同じ書き出し（コンパクト時はメディア1件1行）
+            assert len(manifest_text.splitlines()) == 30 + 2
+            manifest_data = json.loads(manifest_text)
+            assert len(manifest_data['media']) == 30
+            assert manifest_data['metadata']['total_media'] == 30
+            # イテレータを渡しても1件ずつ書き出す（dictで作った場合と同じ中身）
+            streamed = save_media_manifest_from_tweets(iter(tweets), filename='streamed_manifest.json')
+            with gzip.open(streamed, 'rt', encoding='utf-8') as f:
+                assert json.load(f)['media'] == manifest_data['media']
+            with gzip.open(csv_path, 'rt', encoding='utf-8-sig') as f:
+                assert len(f.read().splitlines()) == 31
+            print("[OK] JSON/CSV/マニフェストをgzipで書き出し")
+
+            # 読み込み側は拡張子ではなく中身で判定する
+            assert load_tweets_from_result_json(gz) == tweets
+            renamed = gz.with_name('renamed.json')
+            renamed.write_bytes(gz.read_bytes())
+            assert load_tweets_from_result_json(renamed) == tweets
+            log_path = Config.RUN_DIR / 'tweets.ndjson.gz'
+            with gzip.open(log_path, 'wt', encoding='utf-8') as f:
+                for tweet in tweets:
+                    f.write(json.dumps(tweet, ensure_ascii=False) + '\n')
+            assert list(iter_logged_tweets(log_path)) == tweets
+            assert load_tweets_from_result_json(log_path) == tweets
+            print("[OK] 圧縮されたJSON/NDJSONを透過的に読み込み")
+
+            # 追記ログから圧縮出力へ
+            log = TweetLog(Config.RUN_DIR / 'run.ndjson')
+            for tweet in tweets:
+                log.append(tweet)
+            log.flush()
+            saver.export_from_log(log.path, json_filename='exported.json', csv_filename=None)
+            assert load_tweets_from_result_json(saver.output_path('exported.json')) == tweets
+            print("[OK] 追記ログから圧縮JSONを書き出し")
+
+            try:
+                import zstandard  # noqa: F401
+                assert output_compression('zstd') == 'zstd'
+                assert resolve_output_path(Path('a.json'), 'zstd').name == 'a.json.zst'
+            except ImportError:
+                assert output_compression('zstd') == 'gzip'
+            print(f"[OK] zstd指定時の方式: {output_compression('zstd')}")
+        finally:
+            Config.RUN_DIR = old_run_dir
+            Config.OUTPUT_COMPACT = False
+            Config.OUTPUT_COMPRESSION = ''
+
+        print("出力圧縮テスト: 成功")
+        return True
+    except Exception as e:
+        print(f"[ERROR] 出力圧縮テスト: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+def test_consolidate():
+    """実行結果の統合（外部ソート・マージによる重複排除）のテスト"""
+    print("\n=== 実行結果統合テスト ===")
+    try:
+        import gzip
+        import os
+        import tempfile
+        from consolidate import consolidate, find_run_files
+        from media_only import load_tweets_from_result_json
+        from tweet_log import TweetLog
+
+        def tweet(i, likes, local_path=None):
+            media = {'type': 'photo', 'url': f'https://pbs.twimg.com/media/{i}.jpg', 'media_index': 0}
+            if local_path:
+                media['local_path'] = local_path
+            return {'tweet_id': str(1000 + i), 'text': f'本文{i}', 'author_username': 'u',
+                    'public_metrics': {'like_count': likes}, 'media': [media]}
+
+        out = Path(tempfile.mkdtemp())
+        old = out / '20240101_000000'
+        new = out / '20240201_000000'
+        old.mkdir()
+        new.mkdir()
+        # 古い実行: 0〜59（0〜9はダウンロード済み）
+        (old / 'tweets.json').write_text(json.dumps({'metadata': {}, 'tweets': [
+            tweet(i, 1, f'old/{i}.jpg' if i < 10 else None) for i in range(60)
+        ]}), encoding='utf-8')
+        # 新しい実行: 40〜99（gzip、メトリクスが新しい。local_pathは無い）
+        with gzip.open(new / 'tweets_partial.json.gz', 'wt', encoding='utf-8') as f:
+            json.dump([tweet(i, 2) for i in range(40, 100)], f)
+        # 新しい実行の追記ログ: 5 はメディアの結果だけ反映される
+        log = TweetLog(new / 'tweets.ndjson')
+        log.append(tweet(5, 3))
+        log.log_media('1005', {'type': 'photo', 'url': 'https://pbs.twimg.com/media/5.jpg', 'media_index': 0, 'local_path': None})
+        log.close()
+        os.utime(new / 'tweets.ndjson', (0, 0))  # mtimeではなくRUN_IDで新しさを決める
+
+        inputs = find_run_files(out)
+        assert len(inputs) == 3, inputs
+        stats = consolidate(inputs, out / 'merged.json', buffer_bytes=2000, fan_in=2)
+        assert stats.runs > 2 and stats.merge_passes >= 1, stats
+        assert stats.read == 121 and stats.written == 100 and stats.duplicates == 21, stats
+        merged = load_tweets_from_result_json(out / 'merged.json')
+        assert [t['tweet_id'] for t in merged] == [str(1000 + i) for i in range(100)]
+        by_id = {t['tweet_id']: t for t in merged}
+        assert by_id['1050']['public_metrics']['like_count'] == 2
+        assert by_id['1010']['public_metrics']['like_count'] == 1
+        assert by_id['1005']['public_metrics']['like_count'] == 3
+        assert by_id['1005']['media'][0]['local_path'] == 'old/5.jpg'
+        print(f"[OK] {stats.read}件 → {stats.written}件（ラン{stats.runs}個、多段併合{stats.merge_passes}回）")
+        print("[OK] 新しい実行のメトリクスと既存のlocal_pathを残す")
+
+        stats = consolidate(inputs, out / 'merged.ndjson.gz', buffer_bytes=1 << 20)
+        assert stats.runs == 1
+        assert load_tweets_from_result_json(out / 'merged.ndjson.gz') == merged
+        print("[OK] NDJSON（gzip）でも同じ結果")
+
+        print("実行結果統合テスト: 成功")
+        return True
+    except Exception as e:
+        print(f"[ERROR] 実行結果統合テスト: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+def test_run_catalog():
+    """実行カタログ（記録・ユーザーごとの最新の実行・過去の実行の取り込み）のテスト"""
+    print("\n=== 実行カタログテスト ===")
+    try:
+        import tempfile
+        from media_index import build_media_index
+        from run_catalog import RunCatalog, RunSummary
+
+        out = Path(tempfile.mkdtemp())
+
+        def make_run(run_id, author, days, local_path=None):
+            run_dir = out / run_id
+            run_dir.mkdir()
+            media = {'type': 'photo', 'url': f'https://pbs.twimg.com/media/{run_id}.jpg', 'media_index': 0}
+            if local_path:
+                media['local_path'] = local_path
+            tweets = [
+                {'tweet_id': f'{run_id[:8]}{d}', 'created_at': f'2024-01-{d:02d}T00:00:00.000Z',
+                 'author_username': author, 'media': [media]}
+                for d in days
+            ]
+            (run_dir / 'tweets.json').write_text(json.dumps({'metadata': {}, 'tweets': tweets}), encoding='utf-8')
+            (run_dir / 'log.txt').write_text('', encoding='utf-8')
+            return run_dir, tweets
+
+        image = out / '20240101_000000' / 'images' / 'a.jpg'
+        with RunCatalog(out / 'run_catalog.sqlite3') as catalog:
+            for run_id, author, days, status in (
+                ('20240101_000000', 'alice', (1, 2, 3), 'completed'),
+                ('20240102_000000', 'bob', (4,), 'completed'),
+                ('20240103_000000', 'alice', (5, 6), 'interrupted'),
+            ):
+                run_dir, tweets = make_run(run_id, author, days, local_path=str(image) if run_id == '20240101_000000' else None)
+                summary = RunSummary()
+                for t in tweets:
+                    summary.accept(t)
+                    summary.record_media(t['tweet_id'], t['media'][0])
+                catalog.record_run(run_id, run_dir, mode='profile', status=status, summary=summary, username=author,
+                                   finished_at=f'2024-01-0{run_id[7]}T12:00:00')
+
+            latest = catalog.latest_run('alice')
+            assert latest['run_id'] == '20240103_000000' and latest['tweet_count'] == 2
+            assert latest['date_from'] == '2024-01-05T00:00:00.000Z' and latest['date_to'] == '2024-01-06T00:00:00.000Z'
+            assert [f['kind'] for f in latest['files']] == ['tweets'], latest['files']
+            assert catalog.latest_run('alice', status='completed')['run_id'] == '20240101_000000'
+            assert catalog.latest_run('bob')['downloaded_count'] == 0
+            assert catalog.latest_run('carol') is None
+            print("[OK] ユーザーごとの最新の実行")
+
+            files = catalog.files(kinds=('tweets',))
+            assert [p.parent.name for p in files] == ['20240103_000000', '20240102_000000', '20240101_000000']
+            assert catalog.files(kinds=('tweets',), username='bob') == [out / '20240102_000000' / 'tweets.json']
+            print("[OK] 取得結果ファイルを新しい順に引ける")
+
+            # カタログ導入前の実行を取り込む
+            make_run('20231231_000000', 'alice', (9,))
+            assert catalog.rebuild(out) == 1
+            old = next(r for r in catalog.runs(username='alice', limit=None) if r['run_id'] == '20231231_000000')
+            assert old['status'] == 'completed' and old['tweet_count'] == 1 and old['started_at'] == '2023-12-31T00:00:00'
+            assert catalog.rebuild(out) == 0
+            print("[OK] 過去の実行の取り込み")
+
+            image.parent.mkdir(parents=True)
+            image.write_bytes(b'x' * 10)
+            index = build_media_index(out, catalog=catalog)
+            assert index.lookup(('https://pbs.twimg.com/media/20240101_000000.jpg',), None, None, 'image') == image
+
+            # カタログに無い実行（取り込み前）のマニフェストも索引に入る
+            legacy_image = out / 'legacy.jpg'
+            legacy_image.write_bytes(b'x' * 10)
+            legacy_dir, _ = make_run('20231230_000000', 'alice', (8,), local_path=str(legacy_image))
+            # 同じ実行の途中保存は tweets.json があれば読まない
+            stale = out / 'stale.jpg'
+            stale.write_bytes(b'x' * 10)
+            (legacy_dir / 'tweets_partial.json').write_text(json.dumps({'metadata': {}, 'tweets': [
+                {'tweet_id': '202312308', 'media': [{'type': 'photo', 'media_index': 1, 'local_path': str(stale),
+                                                     'url': 'https://pbs.twimg.com/media/stale.jpg'}]},
+            ]}), encoding='utf-8')
+            index = build_media_index(out, catalog=catalog)
+            assert index.lookup((), '202312308', 0, 'image') == legacy_image
+            assert index.lookup((), '202312308', 1, 'image') is None
+            assert index.lookup(('https://pbs.twimg.com/media/20231230_000000.jpg',), None, None, 'image') == legacy_image
+            assert index.lookup(('https://pbs.twimg.com/media/20240101_000000.jpg',), None, None, 'image') == image
+            print("[OK] メディア索引をカタログとカタログに無い実行から作成")
+
+        print("実行カタログテスト: 成功")
+        return True
+    except Exception as e:
+        print(f"[ERROR] 実行カタログテスト: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+def test_parquet_export():
+    """Parquet書き出し（型付き列・mediaテーブル・パーティション分割）のテスト"""
+    print("\n=== Parquet書き出しテスト ===")
+    try:
+        import tempfile
+        from parquet_export import media_rows, tweet_row
+
+        tweet = {
+            'tweet_id': '1750000000000000001',
+            'created_at': '2024-01-15T10:20:30.000Z',
+            'text': 'hello',
+            'author_username': 'me',
+            'public_metrics': {'like_count': 12, 'retweet_count': '3', 'reply_count': None},
+            'media': [
+                {'type': 'photo', 'url': 'https://pbs.twimg.com/media/a.jpg', 'media_index': 0, 'local_path': '/tmp/a.jpg', 'file_size': 10},
+                {'type': 'video', 'url': 'https://video.twimg.com/b.mp4', 'media_index': 1},
+            ],
+            'url': 'https://twitter.com/me/status/1750000000000000001',
+        }
+        row = tweet_row(tweet)
+        assert row['tweet_id'] == 1750000000000000001
+        assert row['created_at'].year == 2024 and row['month'] == '2024-01'
+        assert (row['like_count'], row['retweet_count'], row['reply_count']) == (12, 3, 0)
+        rows = media_rows(tweet, row)
+        assert [r['media_index'] for r in rows] == [0, 1] and rows[0]['tweet_id'] == row['tweet_id']
+        assert tweet_row({'tweet_id': '5'})['month'] == 'unknown'
+        print("[OK] 型付きの行と、メディアの展開")
+
+        try:
+            import pyarrow.dataset as ds
+        except ImportError:
+            print("[SKIP] pyarrowが無いため書き出しは省略")
+            print("Parquet書き出しテスト: 成功")
+            return True
+
+        from parquet_export import ParquetWriter
+        out_dir = Path(tempfile.mkdtemp())
+        other = dict(tweet, tweet_id='1760000000000000002', created_at='2024-02-01T00:00:00Z', author_username='other', media=[])
+        with ParquetWriter(out_dir, batch_size=1) as writer:
+            writer.write(tweet)
+            writer.write(other)
+            writer.write({'tweet_id': 'not-a-number'})
+        assert writer.count == 2 and writer.skipped == 1
+        assert (out_dir / 'tweets' / 'author_username=me' / 'month=2024-01').is_dir()
+        # 追記（別の書き込みとして同じディレクトリへ）
+        with ParquetWriter(out_dir) as writer:
+            writer.write(dict(tweet, tweet_id='1750000000000000003'))
+
+        tweets = ds.dataset(out_dir / 'tweets', partitioning='hive')
+        assert str(tweets.schema.field('tweet_id').type) == 'int64'
+        assert str(tweets.schema.field('created_at').type).startswith('timestamp')
+        assert tweets.count_rows() == 3
+        assert tweets.count_rows(filter=ds.field('author_username') == 'me') == 2
+        media = ds.dataset(out_dir / 'media', partitioning='hive').to_table().to_pylist()
+        assert len(media) == 4 and {m['local_path'] for m in media} == {'/tmp/a.jpg', None}
+        print("[OK] パーティション分割と追記、絞り込み")
+
+        print("Parquet書き出しテスト: 成功")
+        return True
+    except Exception as e:
+        print(f"[ERROR] Parquet書き出しテスト: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+def test_tweet_store():
+    """SQLiteストア（upsert・メディア状況・最新状態の読み出し）のテスト"""
+    print("\n=== SQLiteストアテスト ===")
+    try:
+        import tempfile
+        from data_saver import DataSaver
+        from tweet_store import TweetStore
+
+        db_path = Path(tempfile.mkdtemp()) / "tweets.sqlite3"
+        photo = {'type': 'photo', 'url': 'https://pbs.twimg.com/media/a.jpg', 'media_index': 0}
+        first = [
+            {'tweet_id': '1', 'created_at': '2024-01-01T00:00:00.000Z', 'author_username': 'me',
+             'text': 'one', 'public_metrics': {'like_count': 1}, 'media': [dict(photo, local_path='/tmp/a.jpg')]},
+            {'tweet_id': '2', 'created_at': '2024-01-02T00:00:00.000Z', 'author_username': 'other',
+             'text': 'two', 'public_metrics': {}, 'media': []},
+            {'tweet_id': 'x', 'text': 'broken'},
+        ]
+        with TweetStore(db_path, run_id='run1', batch_size=1) as store:
+            assert store.upsert_tweets(first) == 2
+            assert store.skipped == 1
+        print("[OK] 追加（不正なtweet_idは無視して件数を数える）")
+
+        # 2回目の実行: メトリクス更新・local_pathの無い再取得では既存のパスを残す
+        second = [
+            {'tweet_id': '1', 'created_at': '2024-01-01T00:00:00.000Z', 'author_username': 'me',
+             'text': 'one', 'public_metrics': {'like_count': 9}, 'media': [dict(photo)]},
+            {'tweet_id': '3', 'created_at': '2024-01-03T00:00:00.000Z', 'author_username': 'me',
+             'text': 'three', 'public_metrics': {}, 'media': [dict(photo, url='https://pbs.twimg.com/media/c.jpg')]},
+        ]
+        assert DataSaver().save_tweets_sqlite(second, db_path=db_path) == 2
+        with TweetStore(db_path, run_id='run2') as store:
+            assert store.count() == 3 and store.count('me') == 2
+            assert store.has_tweet('3') and not store.has_tweet('4')
+            tweet = store.get_tweet(1)
+            assert tweet['public_metrics']['like_count'] == 9
+            assert tweet['media'][0]['local_path'] == '/tmp/a.jpg'
+            assert [t['tweet_id'] for t in store.iter_tweets(chunk_size=1)] == ['3', '2', '1']
+            assert [t['tweet_id'] for t in store.iter_tweets(author_username='me', since='2024-01-02')] == ['3']
+            missing = store.media_status(missing_only=True)
+            assert [(m['tweet_id'], m['url']) for m in missing] == [(3, 'https://pbs.twimg.com/media/c.jpg')]
+            store.update_media('3', dict(photo, url='https://pbs.twimg.com/media/c.jpg', local_path='/tmp/c.jpg', file_size=5))
+            assert store.media_status(missing_only=True) == []
+            assert store.media_status(3)[0]['file_size'] == 5
+        print("[OK] upsertでメトリクス更新・既存のlocal_pathを保持・メディア状況")
+
+        print("SQLiteストアテスト: 成功")
+        return True
+    except Exception as e:
+        print(f"[ERROR] SQLiteストアテスト: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
 def test_media_downloader():
     """MediaDownloaderクラスのテスト"""
     print("\n=== MediaDownloaderテスト ===")
@@ -119,6 +537,401 @@ def test_media_downloader():
         traceback.print_exc()
         return False
 
+def test_resumable_download():
+    """途中切断からのRange再開テスト（ローカルHTTPサーバ）"""
+    print("\n=== 再開可能ダウンロードテスト ===")
+    try:
+        import os
+        import tempfile
+        import threading
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        from config import Config
+        from media_downloader import MediaDownloader
+
+        payload = os.urandom(256 * 1024)
+        requests_seen = []
+
+        class DroppingHandler(BaseHTTPRequestHandler):
+            """1回目は半分送ったところで接続を切り、Range要求には206で応答する"""
+            def do_GET(self):
+                range_header = self.headers.get('Range')
+                requests_seen.append(range_header)
+                if range_header:
+                    start = int(range_header.split('=')[1].split('-')[0])
+                    body = payload[start:]
+                    self.send_response(206)
+                    self.send_header('Content-Range', f'bytes {start}-{len(payload) - 1}/{len(payload)}')
+                else:
+                    body = payload
+                    self.send_response(200)
+                self.send_header('Content-Type', 'video/mp4')
+                self.send_header('Content-Length', str(len(body)))
+                self.send_header('ETag', '"test-etag"')
+                self.end_headers()
+                if len(requests_seen) == 1:
+                    self.wfile.write(body[:len(body) // 2])
+                    self.wfile.flush()
+                    self.close_connection = True
+                    return
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer(('127.0.0.1', 0), DroppingHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        # .part / .part.json と保存先は一時ディレクトリに向ける（実際の出力先を汚さない）
+        tmp = tempfile.TemporaryDirectory()
+        old_dirs = (Config.OUTPUT_DIR, Config.IMAGES_DIR, Config.VIDEOS_DIR)
+        Config.OUTPUT_DIR = Path(tmp.name)
+        Config.IMAGES_DIR = Config.OUTPUT_DIR / 'images'
+        Config.VIDEOS_DIR = Config.OUTPUT_DIR / 'videos'
+        try:
+            downloader = MediaDownloader()
+            downloader.resume_retry_wait = 0
+            tweet_id = f"resume_{os.getpid()}"
+            media = {'type': 'video', 'url': f'http://127.0.0.1:{server.server_port}/v.mp4', 'media_index': 0}
+            part_path, meta_path = downloader._partial_paths(tweet_id, 0)
+
+            saved = downloader._download_single_media(media, tweet_id)
+            assert saved and Path(saved).read_bytes() == payload
+            assert requests_seen[0] is None
+            assert requests_seen[1] == f'bytes={len(payload) // 2}-'
+            assert not part_path.exists() and not meta_path.exists()
+            assert media['file_size'] == len(payload)
+            print("[OK] 切断後にRangeで再開してサイズ検証")
+            Path(saved).unlink()
+
+            # 前回実行の .part が残っている場合も続きから取得する
+            requests_seen.clear()
+            requests_seen.append('(skip drop)')
+            part_path.write_bytes(payload[:1000])
+            MediaDownloader._write_partial_meta(meta_path, {
+                'url': media['url'], 'etag': '"test-etag"', 'content_length': len(payload), 'ext': '.mp4',
+            })
+            saved = downloader._download_single_media(media, tweet_id)
+            assert saved and Path(saved).read_bytes() == payload
+            assert requests_seen[1] == 'bytes=1000-'
+            print("[OK] 前回の.partから再開")
+        finally:
+            server.shutdown()
+            Config.OUTPUT_DIR, Config.IMAGES_DIR, Config.VIDEOS_DIR = old_dirs
+            tmp.cleanup()
+
+        print("再開可能ダウンロードテスト: 成功")
+        return True
+    except Exception as e:
+        print(f"[ERROR] 再開可能ダウンロードテスト: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+def test_segmented_download():
+    """Range分割による並行ダウンロードのテスト（ローカルHTTPサーバ）"""
+    print("\n=== 分割ダウンロードテスト ===")
+    try:
+        import os
+        import tempfile
+        import threading
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        from config import Config
+        from media_downloader import MediaDownloader
+
+        payload = os.urandom(512 * 1024)
+        ranges_seen = []
+        short_ranges = []
+        failing_starts = set()
+
+        class RangeHandler(BaseHTTPRequestHandler):
+            def _send_headers(self, status, length, content_range=None):
+                self.send_response(status)
+                self.send_header('Content-Type', 'video/mp4')
+                self.send_header('Content-Length', str(length))
+                self.send_header('Accept-Ranges', 'bytes')
+                if content_range:
+                    self.send_header('Content-Range', content_range)
+                self.end_headers()
+
+            def do_HEAD(self):
+                self._send_headers(200, len(payload))
+
+            def do_GET(self):
+                range_header = self.headers.get('Range')
+                ranges_seen.append(range_header)
+                start, end = (int(x) for x in range_header.split('=')[1].split('-'))
+                if start in failing_starts:
+                    self._send_headers(500, 0)
+                    return
+                body = payload[start:end + 1]
+                if short_ranges:
+                    # Content-Rangeは正しいが本文が1バイト欠ける
+                    self._send_headers(206, len(body) - 1, f'bytes {start}-{end}/{len(payload)}')
+                    self.wfile.write(body[:-1])
+                    return
+                self._send_headers(206, len(body), f'bytes {start}-{end}/{len(payload)}')
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer(('127.0.0.1', 0), RangeHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        tmp = tempfile.TemporaryDirectory()
+        old_dirs = (Config.OUTPUT_DIR, Config.IMAGES_DIR, Config.VIDEOS_DIR)
+        Config.OUTPUT_DIR = Path(tmp.name)
+        Config.IMAGES_DIR = Config.OUTPUT_DIR / 'images'
+        Config.VIDEOS_DIR = Config.OUTPUT_DIR / 'videos'
+        try:
+            # 共有の追加コネクション枠はワーカー数を超えない
+            assert MediaDownloader(max_workers=2, segment_connections=8)._segment_budget.acquire_up_to(10) == 2
+
+            downloader = MediaDownloader(segmented_threshold_mb=0.25, segment_connections=4)
+            tweet_id = f"segmented_{os.getpid()}"
+            media = {'type': 'video', 'url': f'http://127.0.0.1:{server.server_port}/big.mp4', 'media_index': 0}
+            # 逐次ダウンロードの再開情報（.part.json）には触れない
+            _, part_meta = downloader._partial_paths(tweet_id, 0)
+            part_meta.write_text('{}', encoding='utf-8')
+            saved = downloader._download_single_media(media, tweet_id)
+            assert saved and Path(saved).read_bytes() == payload
+            assert len(ranges_seen) == 4
+            assert part_meta.exists()
+            part_meta.unlink()
+            print("[OK] 4分割で取得して内容が一致")
+            Path(saved).unlink()
+
+            # 失敗したレンジだけを次回取り直す（取得済みのレンジは .seg.json に残る）
+            downloader.resume_retry_wait = 0
+            seg_path, seg_meta = downloader._segment_paths(tweet_id, 0)
+            failing_starts.add(0)
+            assert downloader._download_segmented(media, media['url'], tweet_id, 0, 'https://twitter.com/') is None
+            assert seg_path.exists() and len(json.loads(seg_meta.read_text(encoding='utf-8'))['done']) == 3
+            failing_starts.clear()
+            ranges_seen.clear()
+            saved = downloader._download_segmented(media, media['url'], tweet_id, 0, 'https://twitter.com/')
+            assert saved and Path(saved).read_bytes() == payload
+            first_end = -(-len(payload) // 4) - 1
+            assert ranges_seen and all(int(r.split('=')[1].split('-')[1]) <= first_end for r in ranges_seen), ranges_seen
+            assert not seg_path.exists() and not seg_meta.exists()
+            print("[OK] 分割ダウンロードを失敗したレンジから再開")
+            Path(saved).unlink()
+
+            # 書き込んだバイト数が足りなければ通常ダウンロードに切り替える
+            short_ranges.append(True)
+            assert downloader._download_segmented(media, media['url'], tweet_id, 0, 'https://twitter.com/') is None
+            short_ranges.clear()
+            print("[OK] 欠けたレンジを検出")
+
+            # 閾値未満は分割しない
+            ranges_seen.clear()
+            downloader.segmented_threshold = len(payload) + 1
+            assert downloader._download_segmented(media, media['url'], tweet_id, 0, 'https://twitter.com/') is None
+            assert not ranges_seen
+            print("[OK] 閾値未満は対象外")
+        finally:
+            server.shutdown()
+            Config.OUTPUT_DIR, Config.IMAGES_DIR, Config.VIDEOS_DIR = old_dirs
+            tmp.cleanup()
+
+        print("分割ダウンロードテスト: 成功")
+        return True
+    except Exception as e:
+        print(f"[ERROR] 分割ダウンロードテスト: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+def test_media_store():
+    """メディアストア（実行を跨いだ重複排除）のテスト"""
+    print("\n=== MediaStoreテスト ===")
+    try:
+        import os
+        import tempfile
+        from media_store import MediaStore, media_key
+
+        # 同じ画像のサイズ違いは別キー、format指定の書き方違いは同じキー
+        assert media_key('https://pbs.twimg.com/media/ABC.jpg:large') == media_key('https://pbs.twimg.com/media/ABC?format=jpg&name=large')
+        assert media_key('https://pbs.twimg.com/media/ABC?format=jpg&name=small') != media_key('https://pbs.twimg.com/media/ABC?format=jpg&name=large')
+        assert media_key('https://video.twimg.com/ext_tw_video/1/pu/vid/a.mp4?tag=12') == 'video.twimg.com/ext_tw_video/1/pu/vid/a.mp4'
+        print("[OK] メディアキーの正規化")
+
+        with tempfile.TemporaryDirectory() as tmp:
+            tmp = Path(tmp)
+            store = MediaStore(tmp / 'store')
+            run1 = tmp / 'run1'
+            run1.mkdir()
+            first = run1 / '1_0.jpg'
+            first.write_bytes(b'image-bytes')
+            url = 'https://pbs.twimg.com/media/ABC?format=jpg&name=large'
+            store.put(url, first)
+
+            # 別の実行ディレクトリへはリンクのみ（内容・inodeが同じ）
+            run2 = tmp / 'run2'
+            linked = MediaStore(tmp / 'store').link_existing(url, run2, '2_0')
+            assert linked and linked.read_bytes() == b'image-bytes'
+            if hasattr(os, 'link'):
+                assert os.stat(linked).st_ino == os.stat(first).st_ino
+            print("[OK] 既知メディアのリンク")
+
+            # 別URLでも同じ内容なら実体は1つ
+            dup = run1 / '3_0.jpg'
+            dup.write_bytes(b'image-bytes')
+            store.put('https://pbs.twimg.com/media/XYZ?format=jpg&name=large', dup)
+            objects = [p for p in (tmp / 'store' / 'objects').rglob('*') if p.is_file()]
+            assert len(objects) == 1
+            print("[OK] 内容ハッシュでの重複排除")
+
+        print("MediaStoreテスト: 成功")
+        return True
+    except Exception as e:
+        print(f"[ERROR] MediaStoreテスト: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+def test_media_index():
+    """ダウンロード済み索引によるリクエスト前スキップのテスト"""
+    print("\n=== MediaIndexテスト ===")
+    try:
+        import tempfile
+        from media_downloader import MediaDownloader
+        from media_index import MediaIndex, media_variant, skip_superseded_results
+
+        with tempfile.TemporaryDirectory() as tmp:
+            tmp = Path(tmp)
+            old_file = tmp / '999_0.jpg'
+            old_file.write_bytes(b'old-image')
+            # 接続できないURL（リクエストが出れば失敗する）
+            url = 'http://127.0.0.1:9/media/ABC.jpg'
+            manifest = tmp / 'media_manifest.json'
+            manifest.write_text(json.dumps({'metadata': {}, 'media': [
+                {'tweet_id': '999', 'media_index': 0, 'type': 'photo', 'url': url, 'local_path': str(old_file)},
+            ]}), encoding='utf-8')
+
+            index = MediaIndex()
+            assert index.load_manifest(manifest) == 1
+            assert index.lookup((url,), None, None, 'image') == old_file
+            assert index.lookup((), '999', 0, 'image') == old_file
+            assert index.lookup((), '999', 0, 'video') is None
+            print("[OK] マニフェストからの索引作成")
+
+            downloader = MediaDownloader(media_index=index)
+            media = {'type': 'photo', 'url': url, 'media_index': 0}
+            saved = downloader._download_single_media(media, '1000')
+            assert saved and saved.read_bytes() == b'old-image'
+            assert saved.name == '1000_0.jpg'
+            assert media['file_size'] == len(b'old-image')
+            assert index.lookup((), '1000', 0, 'image') == saved
+            print("[OK] リクエストなしで再利用・索引更新")
+            saved.unlink()
+
+            # 取得した版（画像サイズ）が違えば、同じ tweet_id/media_index でも使い回さない
+            photo = 'https://pbs.twimg.com/media/XYZ?format=jpg&name=small'
+            large = tmp / '555_0.jpg'
+            large.write_bytes(b'large-image')
+            balanced = tmp / 'balanced_manifest.json'
+            # metadata が後ろにあるマニフェスト（1件ずつ書き出したもの）も読める
+            balanced.write_text(json.dumps({'media': [
+                {'tweet_id': '555', 'media_index': 0, 'type': 'photo', 'url': photo, 'local_path': str(large)},
+            ], 'metadata': {}}), encoding='utf-8')
+            index = MediaIndex()
+            assert index.load_manifest(balanced, quality='balanced') == 1
+            as_large = media_variant(photo.replace('name=small', 'name=large'))
+            as_orig = media_variant(photo.replace('name=small', 'name=orig'))
+            assert index.lookup((), '555', 0, 'image', variant=as_large) == large
+            assert index.lookup((), '555', 0, 'image', variant=as_orig) is None
+            assert index.lookup((photo.replace('name=small', 'name=orig'),), None, None, 'image') is None
+            # 画質の分からない過去の実行の分は版を問わない
+            index = MediaIndex()
+            index.load_manifest(balanced)
+            assert index.lookup((), '555', 0, 'image', variant=as_orig) == large
+            print("[OK] 画質プロファイルを変えた後は別の版を使い回さない")
+
+            run = tmp / '20240101_000000'
+            run.mkdir()
+            names = ['tweets.json', 'tweets_partial.json.gz', 'tweets_error.json', 'media_manifest.json']
+            other = tmp / '20240102_000000' / 'tweets_partial.json'
+            kept = skip_superseded_results([run / n for n in names] + [other])
+            assert kept == [run / 'tweets.json', run / 'media_manifest.json', other]
+            print("[OK] tweets.json がある実行の途中保存は読まない")
+
+        print("MediaIndexテスト: 成功")
+        return True
+    except Exception as e:
+        print(f"[ERROR] MediaIndexテスト: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+def test_quality_profiles():
+    """画質プロファイルのテスト"""
+    print("\n=== 画質プロファイルテスト ===")
+    try:
+        from quality_profiles import get_profile, photo_url, pick_video_variant, pick_hls_variant, should_skip_media
+
+        archive = get_profile('archive')
+        lean = get_profile('lean')
+
+        # 画像サイズ
+        assert photo_url('https://pbs.twimg.com/media/A.jpg:small') == 'https://pbs.twimg.com/media/A.jpg:large'
+        assert photo_url('https://pbs.twimg.com/media/A?format=jpg&name=small') == 'https://pbs.twimg.com/media/A?format=jpg&name=small'
+        assert photo_url('https://pbs.twimg.com/media/A?format=jpg&name=small', archive) == 'https://pbs.twimg.com/media/A?format=jpg&name=orig'
+        assert photo_url('https://pbs.twimg.com/media/A.jpg:small', lean) == 'https://pbs.twimg.com/media/A.jpg:medium'
+        print("[OK] 画像サイズの書き換え")
+
+        # 動画ビットレート
+        variants = [
+            {'content_type': 'video/mp4', 'bitrate': 256000, 'url': 'low.mp4'},
+            {'content_type': 'video/mp4', 'bitrate': 2176000, 'url': 'high.mp4'},
+            {'content_type': 'video/mp4', 'bitrate': 832000, 'url': 'mid.mp4'},
+            {'content_type': 'application/x-mpegURL', 'url': 'pl.m3u8'},
+        ]
+        assert pick_video_variant(variants)['url'] == 'high.mp4'
+        assert pick_video_variant(variants, archive)['url'] == 'high.mp4'
+        assert pick_video_variant(variants, lean)['url'] == 'mid.mp4'
+        assert pick_video_variant(variants[3:])['url'] == 'pl.m3u8'
+        hls = [(2500000, 'hi.m3u8'), (950000, 'mid.m3u8'), (300000, 'lo.m3u8')]
+        assert pick_hls_variant(hls)[1] == 'hi.m3u8'
+        assert pick_hls_variant(hls, lean)[1] == 'lo.m3u8'
+        assert pick_hls_variant(hls[:1], lean)[1] == 'hi.m3u8'  # 上限以下が無ければ最小
+        print("[OK] 動画variantの選択")
+
+        # サムネイル
+        media_list = [
+            {'type': 'video_thumbnail', 'url': 'https://pbs.twimg.com/ext_tw_video_thumb/1/pu/img/a.jpg'},
+            {'type': 'video', 'url': 'https://video.twimg.com/a.mp4'},
+        ]
+        assert should_skip_media(media_list[0], media_list, lean)
+        assert not should_skip_media(media_list[0], media_list, archive)
+        assert not should_skip_media(media_list[0], media_list[:1], lean)
+        print("[OK] 動画があるツイートのサムネ除外")
+
+        # 既定値: Config.QUALITY_PROFILE → 環境変数 QUALITY_PROFILE → balanced（空なら従来動作）
+        import os
+        from config import Config
+        old_quality = getattr(Config, 'QUALITY_PROFILE', None)
+        old_env = os.environ.pop('QUALITY_PROFILE', None)
+        try:
+            Config.QUALITY_PROFILE = None
+            assert get_profile().name == 'balanced'
+            os.environ['QUALITY_PROFILE'] = 'lean'
+            assert get_profile().name == 'lean'
+            Config.QUALITY_PROFILE = ''
+            assert get_profile() is None
+        finally:
+            Config.QUALITY_PROFILE = old_quality
+            os.environ.pop('QUALITY_PROFILE', None)
+            if old_env is not None:
+                os.environ['QUALITY_PROFILE'] = old_env
+        print("[OK] 既定のプロファイル")
+
+        print("画質プロファイルテスト: 成功")
+        return True
+    except Exception as e:
+        print(f"[ERROR] 画質プロファイルテスト: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
 def test_twitter_scraper():
     """TwitterScraperクラスの基本テスト"""
     print("\n=== TwitterScraperテスト ===")
@@ -190,6 +1003,8 @@ def test_parallel_media_download():
         import time
         
         downloader = MediaDownloader(max_workers=2)
+        # 接続できないURLは再試行待ちに回るので、完了待ちが長くならないよう待ち時間を縮める
+        downloader.host_backoff.TRANSIENT_MIN = downloader.host_backoff.TRANSIENT_MAX = 0.1
         
         # 並行ダウンロードを開始
         downloader.start_parallel_download()
@@ -222,6 +1037,1113 @@ def test_parallel_media_download():
         traceback.print_exc()
         return False
 
+def test_download_scheduler():
+    """サイズ見積もりスケジューラのテスト"""
+    print("\n=== ダウンロードスケジューラテスト ===")
+    try:
+        from download_scheduler import DownloadScheduler, estimate_cost, media_pool, PHOTO_POOL, VIDEO_POOL
+
+        small = {'type': 'photo', 'url': 'https://pbs.twimg.com/media/A?format=jpg&name=small'}
+        orig = {'type': 'photo', 'url': 'https://pbs.twimg.com/media/B?format=jpg&name=orig'}
+        hd = {'type': 'video', 'url': 'https://video.twimg.com/ext_tw_video/1/pu/vid/1280x720/a.mp4'}
+        sd = {'type': 'video', 'url': 'https://video.twimg.com/ext_tw_video/2/pu/vid/480x270/b.mp4'}
+        assert media_pool(small) == PHOTO_POOL and media_pool(hd) == VIDEO_POOL
+        assert estimate_cost(orig) > estimate_cost(small)
+        assert estimate_cost(hd) > estimate_cost(sd)
+        assert estimate_cost(sd, probe=lambda url: 123) == 123
+        print("[OK] サイズ見積もりとプール振り分け")
+
+        sched = DownloadScheduler()
+        for tid, media in (('1', small), ('2', sd), ('3', orig), ('4', hd)):
+            sched.put(tid, media)
+        assert sched.qsize(PHOTO_POOL) == 2 and sched.qsize(VIDEO_POOL) == 2
+        assert sched.get(PHOTO_POOL)[0] == '3'
+        assert sched.get(VIDEO_POOL)[0] == '4'
+        print("[OK] 大きいものから処理")
+
+        sched = DownloadScheduler(priority='newest')
+        for tid in ('100', '300', '200'):
+            sched.put(tid, small)
+        assert [sched.get(PHOTO_POOL)[0] for _ in range(3)] == ['300', '200', '100']
+        print("[OK] 新しい順")
+
+        sched = DownloadScheduler(priority='author', target_username='me')
+        sched.put('1', orig, {'author_username': 'other'})
+        sched.put('2', small, {'author_username': 'Me'})
+        assert sched.get(PHOTO_POOL)[0] == '2'
+        print("[OK] 本人投稿優先")
+
+        # 取り出しただけでは終わらず、再試行待ちに戻しても終わらない
+        sched = DownloadScheduler()
+        sched.put('1', small)
+        sched.put('2', hd)
+        tid, media = sched.get(PHOTO_POOL)
+        sched.defer(tid, media, 60)
+        assert sched.empty(PHOTO_POOL) is False and not sched.join(timeout=0)
+        sched.get(VIDEO_POOL)
+        assert sched.unfinished() == 2
+        sched.task_done()
+        assert [(t, deferred) for t, _, deferred in sched.drain()] == [('1', True)]
+        assert sched.join(timeout=0) and sched.empty()
+        print("[OK] 処理中・再試行待ちも含めた完了待ち")
+
+        # 再試行回数は id() ではなくメディアの中身で数え、終わったら消す
+        sched = DownloadScheduler()
+        sched.defer('1', dict(small), 0)
+        sched.defer('1', dict(small), 0)
+        assert sched.attempts('1', dict(small)) == 2 and sched.attempts('2', small) == 0
+        sched.forget('1', small)
+        assert sched.attempts('1', small) == 0 and not sched._attempts
+        print("[OK] 再試行回数はメディアごと・終わったら消す")
+
+        print("ダウンロードスケジューラテスト: 成功")
+        return True
+    except Exception as e:
+        print(f"[ERROR] ダウンロードスケジューラテスト: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+def test_deferred_retry():
+    """429/一時的エラーの再試行待ちとdead letterのテスト（ローカルHTTPサーバ）"""
+    print("\n=== 再試行待ちキューテスト ===")
+    try:
+        import os
+        import threading
+        import time
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        from download_scheduler import HostBackoff
+        from media_downloader import MediaDownloader
+        from media_only import build_media_manifest_from_tweets
+
+        payload = os.urandom(4096)
+        hits = {}
+
+        class FlakyHandler(BaseHTTPRequestHandler):
+            """/limited は1回目だけ429、/throttled は常に429、/broken は常に503、/slow は1秒後に返す"""
+            def do_GET(self):
+                hits[self.path] = hits.get(self.path, 0) + 1
+                if self.path == '/slow':
+                    time.sleep(1)
+                if self.path in ('/broken', '/throttled') or (self.path == '/limited' and hits[self.path] == 1):
+                    self.send_response(503 if self.path == '/broken' else 429)
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', 'image/jpeg')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, *args):
+                pass
+
+        backoff = HostBackoff()
+        assert backoff.penalize('h', rate_limited=True) == HostBackoff.RATE_LIMIT_MIN
+        assert backoff.remaining('h') > 0
+        assert backoff.penalize('h', rate_limited=True) == HostBackoff.RATE_LIMIT_MIN * 2
+        backoff.reset('h')
+        assert backoff.remaining('h') == 0
+        assert backoff.penalize('h', rate_limited=False) == HostBackoff.TRANSIENT_MIN
+        assert backoff.remaining('h') == 0
+        print("[OK] 429はホスト全体、一時的エラーはメディア単位でバックオフ")
+
+        server = ThreadingHTTPServer(('127.0.0.1', 0), FlakyHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            base = f'http://127.0.0.1:{server.server_port}'
+            downloader = MediaDownloader(max_workers=1, video_workers=1)
+            downloader.host_backoff.RATE_LIMIT_MIN = downloader.host_backoff.RATE_LIMIT_MAX = 0.2
+            downloader.host_backoff.TRANSIENT_MIN = downloader.host_backoff.TRANSIENT_MAX = 0.1
+            tweet = {
+                'tweet_id': f'deferred_{os.getpid()}',
+                'media': [
+                    {'type': 'photo', 'url': f'{base}/limited', 'media_index': 0},
+                    {'type': 'photo', 'url': f'{base}/broken', 'media_index': 1},
+                ],
+            }
+            downloader.start_parallel_download()
+            downloader.add_tweet_for_download(tweet)
+            downloader.stop_parallel_download(wait_for_completion=True)
+
+            limited, broken = tweet['media']
+            assert limited.get('local_path') and Path(limited['local_path']).read_bytes() == payload
+            assert hits['/limited'] == 2
+            assert broken.get('local_path') is None
+            assert hits['/broken'] == downloader.max_attempts
+            assert [d['url'] for d in downloader.dead_letters] == [broken['url']]
+            assert downloader.dead_letters[0]['attempts'] == downloader.max_attempts
+            assert not downloader.download_queue._attempts
+            print("[OK] 429後に再試行して取得、失敗し続けるものはdead letterへ")
+
+            manifest = build_media_manifest_from_tweets([tweet], dead_letters=downloader.dead_letters)
+            assert manifest['metadata']['dead_letter_media'] == 1
+            assert manifest['dead_letters'][0]['media_index'] == 1
+            print("[OK] マニフェストにdead_lettersを出力")
+            Path(limited['local_path']).unlink()
+
+            # 中断時（wait_for_completion=False）は長い再試行待ちを待たずにdead letterへ
+            # 失敗も local_path=None で書き戻す（保持しているTweetにも反映される）
+            from tweet_records import CompactTweets
+            downloader = MediaDownloader(max_workers=1, video_workers=1)
+            throttled = {'type': 'photo', 'url': f'{base}/throttled', 'media_index': 0}
+            kept = CompactTweets()
+            kept.append({'tweet_id': '1790000000000000042', 'media': [dict(throttled)]})
+            downloader.on_media_downloaded = kept.update_media
+            downloader.start_parallel_download()
+            downloader.add_tweet_for_download({'tweet_id': '1790000000000000042', 'media': [throttled]})
+            deadline = time.time() + 10
+            while not downloader.download_queue.deferred_size() and time.time() < deadline:
+                time.sleep(0.05)
+            started = time.time()
+            downloader.stop_parallel_download(wait_for_completion=False)
+            assert time.time() - started < 10
+            assert throttled['local_path'] is None and hits['/throttled'] == 1
+            assert [d['reason'] for d in downloader.dead_letters] == ['停止時に再試行待ちでした']
+            assert not downloader.download_queue._attempts
+            kept_media = next(iter(kept))['media'][0]
+            assert 'local_path' in kept_media and kept_media['local_path'] is None
+            print("[OK] 中断時は再試行待ちをdead letterに残し、失敗として書き戻す")
+
+            # 完了待ちはワーカーが処理中のメディア（書き戻しまで）も待つ
+            downloader = MediaDownloader(max_workers=1, video_workers=1)
+            written_back = []
+            downloader.on_media_downloaded = lambda tweet_id, media: written_back.append(media['url'])
+            slow = {'type': 'photo', 'url': f'{base}/slow', 'media_index': 0}
+            downloader.start_parallel_download()
+            downloader.add_tweet_for_download({'tweet_id': f'slow_{os.getpid()}', 'media': [slow]})
+            while downloader.download_queue.qsize():
+                time.sleep(0.01)
+            downloader.stop_parallel_download(wait_for_completion=True)
+            assert slow.get('local_path') and written_back == [slow['url']]
+            assert not any(t.is_alive() for t in downloader.download_threads)
+            print("[OK] 処理中のメディアの完了と書き戻しを待つ")
+            Path(slow['local_path']).unlink()
+        finally:
+            server.shutdown()
+            server.server_close()
+
+        print("再試行待ちキューテスト: 成功")
+        return True
+    except Exception as e:
+        print(f"[ERROR] 再試行待ちキューテスト: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+def test_hls_playlist():
+    """HLSプレイリスト解析・variant選択・キャッシュのテスト（fixtures/hls）"""
+    print("\n=== HLSプレイリストテスト ===")
+    try:
+        import threading
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        from config import Config
+        from hls_playlist import MasterPlaylist, MediaPlaylist, PlaylistCache, parse_playlist, resolve_media_playlist, select_variant
+        from media_downloader import MediaDownloader
+        from quality_profiles import PROFILES
+
+        fixtures = Path(__file__).resolve().parent / "fixtures" / "hls"
+        base = "https://video.twimg.com/ext_tw_video/1234567890/pu/pl/master.m3u8"
+
+        master = parse_playlist((fixtures / "master.m3u8").read_text(encoding="utf-8"), base)
+        assert isinstance(master, MasterPlaylist) and len(master.variants) == 3
+        assert master.variants[0].resolution == (480, 270)
+        assert master.variants[0].codecs == "mp4a.40.2,avc1.4d001e"
+        assert master.variants[2].uri == "https://video.twimg.com/ext_tw_video/1234567890/pu/pl/1280x720/ghi.m3u8"
+        assert select_variant(master.variants, "highest").bandwidth == 2500000
+        assert select_variant(master.variants, "lowest").bandwidth == 288000
+        assert select_variant(master.variants, "profile", PROFILES["lean"]).bandwidth == 288000
+        assert select_variant(master.variants, "profile", PROFILES["balanced"]).bandwidth == 950000
+        print("[OK] masterのvariantと選択方針")
+
+        media = parse_playlist((fixtures / "media_fmp4.m3u8").read_text(encoding="utf-8"), base)
+        assert isinstance(media, MediaPlaylist) and len(media.segments) == 3
+        assert media.init_segment.uri.endswith("/1280x720/init.mp4")
+        assert media.all_segments()[0] is media.init_segment
+        assert media.target_duration == 3 and abs(media.total_duration - 7.5) < 1e-9
+        print("[OK] EXT-X-MAPと再生時間")
+
+        ranged = parse_playlist((fixtures / "media_byterange.m3u8").read_text(encoding="utf-8"), "https://example.com/v/index.m3u8")
+        assert ranged.init_segment.byte_range == (0, 720)
+        assert [s.byte_range for s in ranged.segments] == [(720, 10000), (10720, 12000), (22720, 5000)]
+        assert ranged.segments[1].range_header() == "bytes=10720-22719"
+        assert ranged.segments[0].uri == "https://example.com/v/video.mp4"
+        print("[OK] EXT-X-BYTERANGE（offset省略時は直前の続き）")
+
+        files = {
+            "/pl/master.m3u8": (fixtures / "master.m3u8").read_text(encoding="utf-8").replace("/ext_tw_video/1234567890/pu/pl/", "/pl/"),
+            "/pl/1280x720/ghi.m3u8": (fixtures / "media_fmp4.m3u8").read_text(encoding="utf-8"),
+        }
+        hits = {}
+
+        class PlaylistHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                hits[self.path] = hits.get(self.path, 0) + 1
+                body = files.get(self.path, "").encode("utf-8")
+                self.send_response(200 if body else 404)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer(("127.0.0.1", 0), PlaylistHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            url = f"http://127.0.0.1:{server.server_port}/pl/master.m3u8"
+            cache = PlaylistCache()
+            variant_url, playlist = resolve_media_playlist(url, referer="https://x.com/", policy="highest", cache=cache)
+            assert variant_url.endswith("/pl/1280x720/ghi.m3u8") and len(playlist.segments) == 3
+            resolve_media_playlist(url, policy="highest", cache=cache)
+            assert hits == {"/pl/master.m3u8": 1, "/pl/1280x720/ghi.m3u8": 1}
+            assert cache.hits == 2
+            print("[OK] 同じURLは再取得しない")
+
+            # 上限を超えたら最も長く使っていないものから捨てる
+            small = PlaylistCache(max_entries=2)
+            for name in ("a", "b"):
+                small.put(name, MediaPlaylist(url=name))
+            small.get("a")
+            small.put("c", MediaPlaylist(url="c"))
+            assert len(small) == 2 and small.get("b") is None and small.get("a") is not None
+            print("[OK] キャッシュは件数の上限を超えない")
+
+            # 既定のプロファイル（balanced）では720pが上限を超えるので、最高画質を選ばせる
+            old_quality = getattr(Config, "QUALITY_PROFILE", None)
+            Config.QUALITY_PROFILE = "archive"
+            try:
+                segments = MediaDownloader()._parse_m3u8_playlist(url, "https://x.com/")
+            finally:
+                Config.QUALITY_PROFILE = old_quality
+            assert len(segments) == 4 and segments[0].uri.endswith("/init.mp4")
+            print("[OK] ダウンローダーも共通モジュールを使う")
+        finally:
+            server.shutdown()
+            server.server_close()
+
+        print("HLSプレイリストテスト: 成功")
+        return True
+    except Exception as e:
+        print(f"[ERROR] HLSプレイリストテスト: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+def test_video_resolver():
+    """動画URL解決サービスの補助関数テスト（ブラウザは起動しない）"""
+    print("\n=== 動画URL解決サービステスト ===")
+    try:
+        from twitter_video_api import VideoResolverService, _is_video_request_url, _parse_cookie_header, pick_best_video_url
+
+        assert _is_video_request_url("https://video.twimg.com/ext_tw_video/1/pu/vid/1280x720/a.mp4?tag=12")
+        assert _is_video_request_url("https://video.twimg.com/ext_tw_video/1/pu/pl/a.m3u8")
+        assert not _is_video_request_url("https://pbs.twimg.com/ext_tw_video_thumb/1/pu/img/a.jpg")
+        assert not _is_video_request_url("https://video.twimg.com/ext_tw_video/1/pu/img/a.jpg")
+        print("[OK] 動画リクエストの判定")
+
+        assert _parse_cookie_header("auth_token=abc; ct0=def=1; broken") == [
+            {"name": "auth_token", "value": "abc", "domain": "twitter.com", "path": "/"},
+            {"name": "ct0", "value": "def=1", "domain": "twitter.com", "path": "/"},
+        ]
+        print("[OK] Cookieの変換")
+
+        urls = ["https://video.twimg.com/a.m3u8", "https://video.twimg.com/b.webm", "https://video.twimg.com/c.mp4"]
+        assert pick_best_video_url(urls, "https://x.com/u/status/1") == urls[2]
+        assert pick_best_video_url(urls[:2], "https://x.com/u/status/1") == urls[1]
+        assert pick_best_video_url([], "https://x.com/u/status/1") is None
+        print("[OK] MP4 > WebM > m3u8 の選択")
+
+        service = VideoResolverService(pages=2)
+        assert service.pages == 2 and service._thread is None
+        service.close()  # 未起動でも安全に閉じられる
+        print("[OK] 未起動のサービスは何もしない")
+
+        print("動画URL解決サービステスト: 成功")
+        return True
+    except Exception as e:
+        print(f"[ERROR] 動画URL解決サービステスト: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+def test_thumbnail_enrichment():
+    """サムネ→動画URL解決の並行処理テスト（解決手段は差し替え）"""
+    print("\n=== サムネ動画解決テスト ===")
+    import media_only
+    orig = (
+        media_only._ThumbnailEnricher._resolve_syndication,
+        media_only._ThumbnailEnricher._resolve_playwright,
+        media_only._ThumbnailEnricher._resolve_html,
+    )
+    try:
+        import threading
+        import time
+
+        active = []
+        peak = []
+        lock = threading.Lock()
+
+        def fake_syndication(self, tweet_id, tweet_url):
+            with lock:
+                active.append(tweet_id)
+                peak.append(len(active))
+            time.sleep(0.05)
+            with lock:
+                active.remove(tweet_id)
+            return f"https://video.twimg.com/{tweet_id}.mp4" if int(tweet_id) % 2 == 0 else None
+
+        def fake_html(self, tweet_id, tweet_url):
+            return f"https://video.twimg.com/{tweet_id}.m3u8" if tweet_id == "3" else None
+
+        media_only._ThumbnailEnricher._resolve_syndication = fake_syndication
+        media_only._ThumbnailEnricher._resolve_playwright = lambda self, tweet_id, tweet_url: None
+        media_only._ThumbnailEnricher._resolve_html = fake_html
+
+        thumb = "https://pbs.twimg.com/ext_tw_video_thumb/1/pu/img/a.jpg"
+        tweets = [
+            {"tweet_id": str(i), "url": f"https://x.com/u/status/{i}", "media": [{"type": "photo", "url": thumb, "media_index": 0}]}
+            for i in range(1, 9)
+        ]
+        tweets.insert(3, {"tweet_id": "99", "url": "https://x.com/u/status/99", "media": [{"type": "photo", "url": "https://pbs.twimg.com/media/x.jpg"}]})
+
+        import tempfile
+        from video_resolvers import ResolverRegistry
+
+        stats = media_only.EnrichStats()
+        registry = ResolverRegistry(stats_path=Path(tempfile.mkdtemp()) / "resolver_stats.json")
+        stream = media_only.iter_tweets_with_resolved_videos(
+            tweets, workers=3, rate_limits={name: 0.0 for name in media_only.THUMBNAIL_RESOLVERS}, stats=stats, registry=registry
+        )
+        order = [t["tweet_id"] for t in stream]
+        assert order == [t["tweet_id"] for t in tweets]  # 解決が終わった順ではなく入力順
+        assert max(peak) <= 3 and max(peak) > 1
+        print("[OK] 上限付きで並行に解決し、入力順に返す")
+
+        enricher = media_only._ThumbnailEnricher({}, media_only.EnrichStats(), video_resolver=object(), registry=registry)
+        sessions = []
+        worker = threading.Thread(target=lambda: sessions.append(enricher._get_session()))
+        worker.start()
+        worker.join()
+        assert enricher._get_session() is enricher._get_session() and enricher._get_session() is not sessions[0]
+        print("[OK] Sessionはスレッドごと")
+
+        videos = {t["tweet_id"]: m["url"] for t in tweets for m in t["media"] if m["type"] == "video"}
+        assert set(videos) == {"2", "3", "4", "6", "8"}
+        assert videos["3"].endswith(".m3u8")
+        assert stats.checked == 8 and stats.resolved == 5
+        assert stats.hits == {"syndication": 4, "html": 1}
+        assert set(stats.hit_rates()) == set(media_only.THUMBNAIL_RESOLVERS)
+        assert "syndication 4/" in stats.summary()
+        assert registry.stats("playwright").attempts == stats.attempts["playwright"]
+        print("[OK] 解決手段ごとの成功率")
+
+        limiter = media_only._RateLimiter(0.05)
+        start = time.monotonic()
+        for _ in range(4):
+            limiter.wait()
+        assert time.monotonic() - start >= 0.14
+        print("[OK] 解決手段ごとの呼び出し間隔")
+
+        print("サムネ動画解決テスト: 成功")
+        return True
+    except Exception as e:
+        print(f"[ERROR] サムネ動画解決テスト: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+    finally:
+        (
+            media_only._ThumbnailEnricher._resolve_syndication,
+            media_only._ThumbnailEnricher._resolve_playwright,
+            media_only._ThumbnailEnricher._resolve_html,
+        ) = orig
+
+def test_resolver_registry():
+    """解決手段レジストリの順番決め・スキップ・永続化のテスト"""
+    print("\n=== 解決手段レジストリテスト ===")
+    try:
+        import tempfile
+        from video_resolvers import ResolverRegistry
+
+        stats_path = Path(tempfile.mkdtemp()) / "resolver_stats.json"
+        calls = []
+
+        def make(name, result):
+            def resolver(tweet_id):
+                calls.append(name)
+                return result(tweet_id)
+            return resolver
+
+        registry = ResolverRegistry(stats_path=stats_path, min_samples=10, skip_below=0.1, explore_every=1000)
+        registry.register("html", make("html", lambda tid: None))
+        registry.register("syndication", make("syndication", lambda tid: f"https://video.twimg.com/{tid}.mp4" if int(tid) % 2 == 0 else None))
+        assert registry.order() == ["html", "syndication"]  # 統計が無いうちは登録順
+
+        resolved = [registry.resolve(str(i)) for i in range(24)]
+        assert all(name == "syndication" for url, name in resolved if url)
+        assert sum(1 for url, _ in resolved if url) == 12
+        assert registry.stats("html").attempts >= 10
+        assert registry.order() == ["syndication"]
+        print("[OK] 当たらない手段は後回しにし、十分な試行の後はスキップ")
+
+        calls.clear()
+        registry.resolve("101")
+        assert calls == ["syndication"]
+        registry.save()
+
+        reloaded = ResolverRegistry(stats_path=stats_path, min_samples=10, skip_below=0.1, explore_every=1000)
+        reloaded.register("html", lambda tid: None)
+        reloaded.register("syndication", lambda tid: None)
+        assert reloaded.stats("html").attempts == registry.stats("html").attempts
+        assert reloaded.stats("syndication").hits == 12
+        assert reloaded.order() == ["syndication"]
+        print("[OK] 統計を保存して次回の実行に引き継ぐ")
+
+        explorer = ResolverRegistry(stats_path=stats_path, min_samples=10, skip_below=0.1, explore_every=2)
+        explorer.register("html", lambda tid: None)
+        explorer.register("syndication", lambda tid: None)
+        assert [explorer.order() for _ in range(2)] == [["syndication"], ["syndication", "html"]]
+        print("[OK] 一定回数ごとにスキップ中の手段も試す")
+
+        # namespace ごとに分けて保存し、同じ namespace の並行するレジストリは増分を足し合わせる
+        shared_path = stats_path.with_name("shared_stats.json")
+        scraper_a = ResolverRegistry(stats_path=shared_path, namespace="scraper")
+        scraper_b = ResolverRegistry(stats_path=shared_path, namespace="scraper")
+        thumbnail = ResolverRegistry(stats_path=shared_path, namespace="thumbnail")
+        for _ in range(2):
+            scraper_a.record("syndication", True, 0.1)
+        for _ in range(3):
+            scraper_b.record("syndication", False, 0.1)
+        thumbnail.record("syndication", True, 0.5)
+        scraper_a.save()
+        thumbnail.save()
+        scraper_b.save()
+        scraper_a.save()  # 保存済みの増分を二重に足さない
+        data = json.loads(shared_path.read_text(encoding="utf-8"))
+        assert data["namespaces"]["scraper"]["syndication"]["attempts"] == 5
+        assert data["namespaces"]["scraper"]["syndication"]["hits"] == 2
+        assert data["namespaces"]["thumbnail"]["syndication"] == {"attempts": 1, "hits": 1, "latency_total": 0.5}
+        assert ResolverRegistry(stats_path=shared_path, namespace="scraper").stats("syndication").attempts == 5
+        assert not shared_path.with_name("shared_stats.json.lock").exists()
+
+        # namespace を分ける前の形式は初期値として読む
+        legacy_path = stats_path.with_name("legacy_stats.json")
+        legacy_path.write_text(json.dumps({"resolvers": {"dom_html": {"attempts": 4, "hits": 1, "latency_total": 0.4}}}), encoding="utf-8")
+        legacy = ResolverRegistry(stats_path=legacy_path, namespace="scraper")
+        assert legacy.stats("dom_html").attempts == 4
+        legacy.save()
+        assert json.loads(legacy_path.read_text(encoding="utf-8"))["namespaces"]["scraper"]["dom_html"]["attempts"] == 4
+        print("[OK] 呼び出し元ごとに分けて保存し、他のレジストリの記録を消さない")
+
+        # 手元で縮めても他のレジストリの記録は減らさない（縮めるのは足し合わせた後）
+        decay_path = stats_path.with_name("decay_stats.json")
+        busy = ResolverRegistry(stats_path=decay_path, max_history=10)
+        other = ResolverRegistry(stats_path=decay_path, max_history=10)
+        for _ in range(6):
+            other.record("dom_html", True, 0.1)
+        other.save()
+        for _ in range(11):
+            busy.record("dom_html", False, 0.1)
+        assert busy.stats("dom_html").attempts == 5
+        busy.save()
+        saved = json.loads(decay_path.read_text(encoding="utf-8"))["namespaces"]["default"]["dom_html"]
+        # 6 + 11 = 17 → 8（他のレジストリの成功6件は半分の3件として残る）
+        assert saved["attempts"] == 8 and saved["hits"] == 3, saved
+        print("[OK] 試行数の縮小は保存時に足し合わせてから行う")
+
+        print("解決手段レジストリテスト: 成功")
+        return True
+    except Exception as e:
+        print(f"[ERROR] 解決手段レジストリテスト: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+def test_tweet_log():
+    """Tweet追記ログとログからの書き出しのテスト"""
+    print("\n=== Tweet追記ログテスト ===")
+    try:
+        import csv
+        import tempfile
+        from data_saver import DataSaver
+        from config import Config
+        from tweet_log import TweetLog, iter_logged_tweets
+
+        log_path = Path(tempfile.mkdtemp()) / "tweets.ndjson"
+        log = TweetLog(log_path, flush_every=2)
+        media = {'type': 'photo', 'url': 'https://pbs.twimg.com/media/a.jpg', 'media_index': 0}
+        log.append({'tweet_id': '1', 'text': 'one', 'media': [dict(media)], 'public_metrics': {'like_count': 1}})
+        log.append({'tweet_id': '2', 'text': 'two', 'media': []})
+        assert len(log_path.read_text(encoding='utf-8').splitlines()) == 2  # flush_everyごとにディスクへ
+        log.append({'tweet_id': '1', 'text': 'one', 'media': [dict(media)], 'public_metrics': {'like_count': 5}})
+        log.log_media('1', dict(media, local_path='/tmp/1_0.jpg', file_size=123))
+        log.close()
+        with open(log_path, 'a', encoding='utf-8') as f:
+            f.write('{"tweet_id": "3", "text": "途中で落ち')  # 強制終了で途切れた行
+        print("[OK] 追記とflush")
+
+        tweets = list(iter_logged_tweets(log_path))
+        assert [t['tweet_id'] for t in tweets] == ['2', '1']
+        assert tweets[1]['public_metrics']['like_count'] == 5
+        assert tweets[1]['media'][0]['local_path'] == '/tmp/1_0.jpg'
+        assert tweets[1]['media'][0]['file_size'] == 123
+        print("[OK] 重複は最後の行・メディアの結果を反映・途切れた行は無視")
+
+        saver = DataSaver()
+        assert saver.export_from_log(log_path, json_filename='test_log_tweets.json', csv_filename='test_log_tweets.csv') == 2
+        with open(Config.RUN_DIR / 'test_log_tweets.json', 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        assert data['metadata']['total_tweets'] == 2
+        assert [t['tweet_id'] for t in data['tweets']] == ['2', '1']
+        with open(Config.RUN_DIR / 'test_log_tweets.csv', 'r', encoding='utf-8') as f:
+            rows = list(csv.DictReader(f))
+        assert [r['tweet_id'] for r in rows] == ['2', '1'] and rows[1]['like_count'] == '5'
+        (Config.RUN_DIR / 'test_log_tweets.json').unlink()
+        (Config.RUN_DIR / 'test_log_tweets.csv').unlink()
+        print("[OK] ログからJSON/CSVを書き出し")
+
+        print("Tweet追記ログテスト: 成功")
+        return True
+    except Exception as e:
+        print(f"[ERROR] Tweet追記ログテスト: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+def test_tweet_sinks():
+    """Tweetのsinkとダウンロード待ちの上限（バックプレッシャー）のテスト"""
+    print("\n=== Tweet sinkテスト ===")
+    try:
+        import threading
+        from download_scheduler import DownloadScheduler, PHOTO_POOL
+        from tweet_sinks import CallbackSink, DownloadSink, TweetSink
+        from twitter_scraper import TwitterScraper
+
+        received = []
+        scraper = TwitterScraper()
+        scraper.keep_tweets = False
+        scraper.add_sink(CallbackSink(received.append))
+        for i in range(3):
+            scraper._accept_tweet({'tweet_id': str(i)})
+        assert scraper.tweet_count == 3 and len(scraper.tweets) == 0
+        assert [t['tweet_id'] for t in received] == ['0', '1', '2']
+        print("[OK] Tweetを保持せずsinkに流す")
+
+        class FakeDownloader:
+            def __init__(self):
+                self.added = []
+
+            def add_tweet_for_download(self, tweet):
+                self.added.append(tweet['tweet_id'])
+
+        fake = FakeDownloader()
+        sink = DownloadSink(fake, author_filter='me')
+        sink.accept({'tweet_id': '1', 'author_username': 'me'})
+        sink.accept({'tweet_id': '2', 'author_username': 'other'})
+        assert fake.added == ['1'] and isinstance(sink, TweetSink)
+        try:
+            TweetSink()
+            raise AssertionError("accept() の無いsinkを作れてしまいました")
+        except TypeError:
+            pass
+        print("[OK] ダウンロードsinkの作者フィルタ")
+
+        media = {'type': 'photo', 'url': 'https://pbs.twimg.com/media/A?format=jpg&name=small'}
+        sched = DownloadScheduler(max_pending=2)
+        sched.put('1', dict(media))
+        sched.put('2', dict(media))
+        done = threading.Event()
+
+        def producer():
+            sched.put('3', dict(media))
+            done.set()
+
+        t = threading.Thread(target=producer, daemon=True)
+        t.start()
+        assert not done.wait(0.3), "上限に達しているのにputが戻りました"
+        sched.get(PHOTO_POOL)
+        assert done.wait(3), "空きができてもputが戻りません"
+        t.join(timeout=1)
+        assert sched.qsize() == 2 and sched.blocked_seconds > 0
+        print("[OK] 待ちが上限ならputが空くまで待つ")
+
+        print("Tweet sinkテスト: 成功")
+        return True
+    except Exception as e:
+        print(f"[ERROR] Tweet sinkテスト: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+def test_agent_log():
+    """デバッグ計測ログ（バックグラウンド書き込み・レベル・サンプリング・ローテーション）のテスト"""
+    print("\n=== デバッグ計測ログテスト ===")
+    try:
+        import tempfile
+        import time
+        import agent_log
+
+        tmp = Path(tempfile.mkdtemp())
+        path = tmp / 'debug.ndjson'
+        try:
+            agent_log.configure(level='off', paths=[path])
+            start = time.perf_counter()
+            for i in range(100000):
+                agent_log.agent_log('T', 'test', 'off', {'i': i})
+            off_time = time.perf_counter() - start
+            agent_log.flush()
+            assert agent_log._writer is None and not path.exists()
+            print(f"[OK] 無効時は何もしない（10万回 {off_time * 1000:.1f}ms）")
+
+            agent_log.configure(level='debug', paths=[path])
+            start = time.perf_counter()
+            for i in range(1000):
+                agent_log.agent_log('T', 'test', 'debug', {'i': i})
+                agent_log.agent_log('T', 'test', 'trace', {'i': i}, level='trace')
+            on_time = time.perf_counter() - start
+            agent_log.flush()
+            records = [json.loads(line) for line in path.read_text(encoding='utf-8').splitlines()]
+            assert [r['data']['i'] for r in records] == list(range(1000))
+            assert records[0]['hypothesisId'] == 'T' and records[0]['message'] == 'debug'
+            print(f"[OK] レベルで絞ってバックグラウンドで書き込み（1000件 {on_time * 1000:.1f}ms）")
+
+            path.unlink()
+            agent_log.configure(level='debug', sample=0.1, paths=[path])
+            for i in range(2000):
+                agent_log.agent_log('T', 'test', 'sampled', {'i': i})
+            agent_log.agent_log('T', 'test', 'error', level='error')
+            agent_log.flush()
+            lines = path.read_text(encoding='utf-8').splitlines()
+            assert 50 < len(lines) < 400, len(lines)
+            assert json.loads(lines[-1])['message'] == 'error'
+            print(f"[OK] サンプリング（2000件中{len(lines) - 1}件、errorは常に記録）")
+
+            path.unlink()
+            agent_log.configure(level='debug', paths=[path], max_bytes=2000, backups=2)
+            for i in range(3):
+                for j in range(20):
+                    agent_log.agent_log('T', 'test', 'rotate', {'i': i, 'pad': 'x' * 50})
+                agent_log.flush()
+            assert path.with_name('debug.ndjson.1').exists() and path.with_name('debug.ndjson.2').exists()
+            assert not path.with_name('debug.ndjson.3').exists()
+            print("[OK] サイズでローテーション")
+        finally:
+            agent_log.configure()
+
+        print("デバッグ計測ログテスト: 成功")
+        return True
+    except Exception as e:
+        print(f"[ERROR] デバッグ計測ログテスト: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+def test_run_metrics():
+    """実行中の計測値（レジストリ・Prometheus形式・run_metrics.json・各モジュールの記録）のテスト"""
+    print("\n=== 計測値レジストリテスト ===")
+    try:
+        import tempfile
+        import urllib.request
+        from run_metrics import METRICS, MetricsRegistry, MetricsReporter
+        from video_resolvers import ResolverRegistry
+        from data_saver import DataSaver
+        from config import Config
+
+        registry = MetricsRegistry()
+        pages = registry.counter('pages_total', 'ページ数', ('result',))
+        pages.inc(result='ok')
+        pages.inc(2, result='ok')
+        pages.inc(result='error')
+        assert pages.value(result='ok') == 3 and pages.value(result='error') == 1
+        assert registry.counter('pages_total', 'ページ数', ('result',)) is pages
+        try:
+            pages.inc(kind='x')
+            raise AssertionError('ラベル違いが通ってしまいました')
+        except ValueError:
+            pass
+        depth = [5]
+        queue_depth = registry.gauge('queue_depth', 'キュー長')
+        queue_depth.set_function(lambda: depth[0])
+        depth[0] = 7
+        assert queue_depth.value() == 7
+        queue_depth.set_function(None)
+        depth[0] = 0
+        assert queue_depth.value() == 7
+        latency = registry.histogram('latency_seconds', '所要時間', buckets=(0.1, 1.0, 10.0))
+        for value in [0.05] * 50 + [0.5] * 40 + [5.0] * 10:
+            latency.observe(value)
+        with latency.time():
+            pass
+        summary = registry.to_dict()['metrics']['latency_seconds']['values'][0]
+        assert summary['count'] == 101 and summary['max'] == 5.0
+        assert summary['p50'] <= 0.1 < summary['p90'] <= 1.0 < summary['p99'] <= 10.0, summary
+        print(f"[OK] カウンタ・ゲージ・ヒストグラム（p50={summary['p50']:.3f} p90={summary['p90']:.3f} p99={summary['p99']:.3f}）")
+
+        text = registry.render_prometheus()
+        assert '# TYPE pages_total counter' in text
+        assert 'pages_total{result="ok"} 3' in text
+        assert 'latency_seconds_bucket{le="0.1"} 51' in text
+        assert 'latency_seconds_bucket{le="+Inf"} 101' in text
+        assert 'latency_seconds_count 101' in text
+        assert 'queue_depth 7' in text
+        print("[OK] Prometheusテキスト形式")
+
+        tmp = Path(tempfile.mkdtemp())
+        reporter = MetricsReporter(registry, path=tmp / 'metrics.prom', interval=0.05, port=0).start()
+        try:
+            with urllib.request.urlopen(f'http://127.0.0.1:{reporter.port}/metrics', timeout=5) as response:
+                assert 'pages_total{result="ok"} 3' in response.read().decode('utf-8')
+        finally:
+            reporter.stop()
+        assert (tmp / 'metrics.prom').read_text(encoding='utf-8') == registry.render_prometheus()
+        data = json.loads(registry.write_json(tmp / 'run_metrics.json').read_text(encoding='utf-8'))
+        assert data['metrics']['pages_total']['values'][0] == {'labels': {'result': 'error'}, 'value': 1}
+        print("[OK] metrics.prom / HTTP / run_metrics.json")
+
+        resolvers = ResolverRegistry(stats_path=None)
+        resolvers.register('hit', lambda *a: 'https://video.twimg.com/a.mp4')
+        attempts = METRICS.get('resolver_attempts_total')
+        before = attempts.value(resolver='hit', result='hit')
+        assert resolvers.resolve('1', None, names=['hit'])[1] == 'hit'
+        assert attempts.value(resolver='hit', result='hit') == before + 1
+        assert METRICS.get('resolver_latency_seconds').count(resolver='hit') >= 1
+
+        old_run_dir = Config.RUN_DIR
+        Config.RUN_DIR = tmp
+        try:
+            saved = METRICS.get('saver_tweets_total')
+            before = saved.value(format='json')
+            DataSaver().save_tweets_json([{'tweet_id': '1'}, {'tweet_id': '2'}], filename='metrics_test.json')
+            assert saved.value(format='json') == before + 2
+            assert METRICS.get('saver_bytes_total').value(format='json') > 0
+        finally:
+            Config.RUN_DIR = old_run_dir
+        print("[OK] 動画URL解決・保存処理が共通レジストリに記録")
+
+        print("計測値レジストリテスト: 成功")
+        return True
+    except Exception as e:
+        print(f"[ERROR] 計測値レジストリテスト: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+def test_tweet_trace():
+    """Tweet/メディアごとのライフサイクル追跡（Chrome Trace Event形式・ステージ別集計）のテスト"""
+    print("\n=== ライフサイクル追跡テスト ===")
+    try:
+        import tempfile
+        import time
+        from tweet_trace import TRACER, Tracer, trace_id
+        from media_downloader import MediaDownloader
+        from twitter_scraper import TwitterScraper
+
+        tracer = Tracer()
+        with tracer.span('resolve', '1', 0):
+            pass
+        tracer.begin('queue', '1', 0)
+        assert tracer.events() == [] and tracer.end('queue', '1', 0) is None
+        print("[OK] 無効時は記録しない")
+
+        tmp = Path(tempfile.mkdtemp())
+        TRACER.enable()
+        try:
+            scraper = TwitterScraper()
+            tweet = {
+                'tweet_id': '100',
+                'media': [
+                    {'type': 'photo', 'url': 'https://pbs.twimg.com/media/A.jpg', 'media_index': 0},
+                    {'type': 'video', 'url': 'https://video.twimg.com/a.mp4', 'media_index': 1},
+                    {'type': 'video_thumbnail', 'url': 'https://pbs.twimg.com/ext_tw_video_thumb/a.jpg', 'media_index': 1},
+                ],
+            }
+            scraper._accept_tweet(tweet)
+            with TRACER.span('resolve', '100', 1) as span:
+                span['resolver'] = 'syndication'
+
+            downloader = MediaDownloader(max_workers=1)
+
+            def fake_download(media, tweet_id, defer_retries=False):
+                time.sleep(0.02)
+                path = tmp / f"{tweet_id}_{media['media_index']}_{media['type']}"
+                path.write_bytes(b'x')
+                return path
+
+            written = []
+            downloader._download_single_media = fake_download
+            downloader.on_media_downloaded = lambda tweet_id, media: written.append((tweet_id, media['media_index']))
+            downloader.start_parallel_download()
+            downloader.add_tweet_for_download(tweet)
+            downloader.stop_parallel_download()
+            assert len(written) == downloader.total_media >= 2, written
+
+            path = TRACER.export_chrome(tmp / 'trace.json')
+        finally:
+            TRACER.disable()
+
+        data = json.loads(path.read_text(encoding='utf-8'))
+        events = data['traceEvents']
+        by_id = {}
+        for event in events:
+            if event.get('ph') in ('b', 'e', 'n'):
+                by_id.setdefault(event['id'], []).append(event)
+        assert [e['name'] for e in by_id['100'] if e['ph'] == 'n'] == ['discover']
+        names = {e['name'] for e in by_id[trace_id('100', 1)] if e['ph'] == 'b'}
+        assert {'resolve', 'queue', 'transfer', 'writeback'} <= names, names
+        begins = sum(1 for e in events if e.get('ph') == 'b')
+        assert begins == sum(1 for e in events if e.get('ph') == 'e')
+        assert not any(e.get('args', {}).get('unfinished') for e in events)
+        print(f"[OK] tweet_id:media_index ごとの非同期スパン（{begins}スパン）")
+
+        stages = data['otherData']['stages']
+        assert list(stages)[:2] == ['resolve', 'queue'] and stages['transfer']['count'] == len(written)
+        assert stages['transfer']['p50'] >= 0.01
+        print(f"[OK] ステージ別集計（transfer p50={stages['transfer']['p50']:.3f}秒）")
+
+        print("ライフサイクル追跡テスト: 成功")
+        return True
+    except Exception as e:
+        print(f"[ERROR] ライフサイクル追跡テスト: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+def test_run_profiler():
+    """ステージ別プロファイル（cProfile・入れ子・ワーカースレッド・サンプラー・要約）のテスト"""
+    print("\n=== ステージ別プロファイルテスト ===")
+    try:
+        import pstats
+        import tempfile
+        import threading
+        import time
+        import cProfile
+        import sys
+        from run_profiler import PER_THREAD_CPROFILE, PROFILER, RunProfiler
+        from data_saver import DataSaver
+        from config import Config
+
+        def busy_scrape():
+            return sum(i * i for i in range(200000))
+
+        def busy_download():
+            return sorted(str(i) for i in range(50000))
+
+        def busy_enrich():
+            deadline = time.perf_counter() + 0.1
+            while time.perf_counter() < deadline:
+                sum(range(1000))
+
+        tmp = Path(tempfile.mkdtemp())
+        old_run_dir = Config.RUN_DIR
+        Config.RUN_DIR = tmp
+        PROFILER.enable(sample_interval=0.002)
+        try:
+            with PROFILER.stage('scrape'):
+                busy_scrape()
+                with PROFILER.stage('download'):
+                    busy_download()
+                busy_scrape()
+            worker = threading.Thread(target=PROFILER.wrap('enrich', busy_enrich))
+            worker.start()
+            worker.join()
+            DataSaver().save_tweets_json([{'tweet_id': str(i)} for i in range(100)], filename='profile_test.json')
+            summary = PROFILER.write(tmp / 'profile', top=10)
+        finally:
+            PROFILER.disable()
+            Config.RUN_DIR = old_run_dir
+
+        if PER_THREAD_CPROFILE:
+            for stage in ('scrape', 'download', 'enrich', 'save'):
+                assert (tmp / 'profile' / f'{stage}.prof').exists(), stage
+            functions = {func[2] for func in pstats.Stats(str(tmp / 'profile' / 'scrape.prof')).stats}
+            assert 'busy_scrape' in functions and 'busy_download' not in functions
+            functions = {func[2] for func in pstats.Stats(str(tmp / 'profile' / 'download.prof')).stats}
+            assert 'busy_download' in functions and 'busy_scrape' not in functions
+            functions = {func[2] for func in pstats.Stats(str(tmp / 'profile' / 'save.prof')).stats}
+            assert 'write_tweets_json' in functions
+            print("[OK] ステージごとのcProfile（入れ子は内側だけ・ワーカースレッドも計測）")
+        else:
+            assert not list((tmp / 'profile').glob('*.prof'))
+            print("[OK] Python 3.12以降はcProfileを使わない")
+
+        text = summary.read_text(encoding='utf-8')
+        assert '== scrape:' in text and 'サンプラー' in text
+        assert 'busy_scrape' in text if PER_THREAD_CPROFILE else 'サンプラーを参照' in text
+        collapsed = (tmp / 'profile' / 'sampler.collapsed').read_text(encoding='utf-8').splitlines()
+        assert any(line.startswith('enrich;') and 'busy_enrich' in line for line in collapsed)
+        assert all(line.rsplit(' ', 1)[1].isdigit() for line in collapsed)
+        print(f"[OK] 要約とサンプラー（{len(collapsed)}スタック）")
+
+        single = RunProfiler()
+        single.enable(stages=['download'])
+        with single.stage('scrape'):
+            busy_scrape()
+            with single.stage('download'):
+                busy_download()
+        single.write(tmp / 'single')
+        assert (tmp / 'single' / 'download.prof').exists() == PER_THREAD_CPROFILE
+        assert not (tmp / 'single' / 'scrape.prof').exists()
+        try:
+            single.enable(stages=['unknown'])
+            raise AssertionError('不明なステージが通ってしまいました')
+        except ValueError:
+            pass
+        print("[OK] 1ステージだけの計測")
+
+        # 3.12 以降の動作（cProfileを使わない）: 既定の間隔のサンプラーで、ワーカースレッドも計測できる
+        sampled = RunProfiler()
+        sampled.use_cprofile = False
+        sampled.enable()
+        workers = [threading.Thread(target=sampled.wrap('download', busy_enrich)) for _ in range(2)]
+        for w in workers:
+            w.start()
+        for w in workers:
+            w.join()
+        sampled.write(tmp / 'sampled')
+        assert not list((tmp / 'sampled').glob('*.prof'))
+        collapsed = (tmp / 'sampled' / 'sampler.collapsed').read_text(encoding='utf-8').splitlines()
+        assert any(line.startswith('download;') and 'busy_enrich' in line for line in collapsed)
+        assert sampled.active_stages() == {}
+        print("[OK] cProfileを使わずサンプラーでステージ別に計測")
+
+        # 他のプロファイラが有効で enable() が失敗しても、ステージは動いてスタックも残らない
+        class ActiveElsewhere:
+            def enable(self):
+                raise ValueError('Another profiling tool is already active')
+
+            def disable(self):
+                pass
+
+        blocked = RunProfiler()
+        blocked.use_cprofile = True
+        blocked._profile_for = lambda stage, ident: ActiveElsewhere()
+        blocked.enable()
+        results = []
+        worker = threading.Thread(target=blocked.wrap('download', lambda: results.append(busy_scrape())))
+        worker.start()
+        worker.join()
+        assert results and blocked.active_stages() == {} and not blocked.use_cprofile
+        assert blocked._sampler is not None
+        blocked.write(tmp / 'blocked')
+        print("[OK] cProfileを有効にできなければサンプラーに切り替える")
+
+        if sys.version_info >= (3, 12):
+            # 実際に別のcProfileが動いている状態（3.12ではインタプリタに1つだけ）
+            outer = cProfile.Profile()
+            outer.enable()
+            try:
+                real = RunProfiler()
+                real.use_cprofile = True
+                real.enable()
+                worker = threading.Thread(target=real.wrap('download', busy_scrape))
+                worker.start()
+                worker.join()
+                with real.stage('save'):
+                    busy_scrape()
+            finally:
+                outer.disable()
+            assert real.active_stages() == {} and not real.use_cprofile
+            real.write(tmp / 'real')
+            print("[OK] 別のcProfileが有効でもステージが動く（Python 3.12以降）")
+
+        print("ステージ別プロファイルテスト: 成功")
+        return True
+    except Exception as e:
+        print(f"[ERROR] ステージ別プロファイルテスト: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+def test_tweet_parsing_fixture():
+    """保存済みタイムラインHTMLの解析（ヘッドレスChromium・fixtures/timeline）のスモークテスト"""
+    print("\n=== タイムラインHTML解析テスト ===")
+    try:
+        import tempfile
+        from playwright.sync_api import sync_playwright
+        from bench_tweet_parsing import FIXTURES, _diff, _golden_path, _offline_scraper, launch_offline_page
+
+        fixture = FIXTURES / 'timeline.html'
+        expected = json.loads(_golden_path(fixture).read_text(encoding='utf-8'))
+        with sync_playwright() as p, tempfile.TemporaryDirectory() as tmp:
+            try:
+                browser, page = launch_offline_page(p)
+            except Exception as e:
+                print(f"[SKIP] Chromiumを起動できないため省略（CHROMIUM_EXECUTABLE_PATH で指定可）: {str(e).splitlines()[0]}")
+                print("タイムラインHTML解析テスト: 成功")
+                return True
+            try:
+                page.goto(fixture.as_uri())
+                tweets = _offline_scraper(page, Path(tmp))._extract_tweets()
+            finally:
+                browser.close()
+
+        differences = _diff(expected, tweets)
+        assert not differences, differences
+        print(f"[OK] 期待値と一致（{len(tweets)}件）")
+
+        by_id = {t['tweet_id']: t for t in tweets}
+        assert by_id['1790000000000000007']['media'] == []
+        assert [m['media_index'] for m in by_id['1790000000000000002']['media']] == [0, 1, 2, 3]
+        print("[OK] 引用先のメディアとプロフィール画像はメディアにしない")
+
+        print("タイムラインHTML解析テスト: 成功")
+        return True
+    except Exception as e:
+        print(f"[ERROR] タイムラインHTML解析テスト: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+def test_tweet_records():
+    """コンパクトなTweet保持（CompactTweets）のテスト"""
+    print("\n=== CompactTweetsテスト ===")
+    try:
+        from data_saver import DataSaver
+        from config import Config
+        from tweet_records import CompactTweets
+
+        url = 'https://twitter.com/me/status/1750000000000000001'
+        tweets = [
+            {
+                'tweet_id': '1750000000000000001', 'created_at': '2024-01-15T10:20:30.123Z', 'text': '本文',
+                'author_username': 'me',
+                'public_metrics': {'like_count': 1, 'retweet_count': 2, 'reply_count': 3, 'quote_count': 4},
+                'media': [
+                    {'type': 'photo', 'url': 'https://pbs.twimg.com/media/a.jpg', 'media_index': 0, 'tweet_url': url},
+                    {'type': 'video', 'url': 'https://video.twimg.com/b.mp4', 'media_index': 1, 'thumbnail_url': 'https://pbs.twimg.com/t.jpg'},
+                ],
+                'url': url,
+            },
+            # 想定外の形（文字列のID・欠けたキー・独自キー）もそのまま戻る
+            {'tweet_id': 'abc', 'text': '', 'public_metrics': {'like_count': 1}, 'media': ['x'], 'url': None, 'lang': 'ja'},
+        ]
+        compact = CompactTweets(tweets)
+        assert len(compact) == 2 and list(compact) == tweets
+        assert compact[0]['media'][0]['tweet_url'] == url
+        print("[OK] dictに戻すと元と同じ")
+
+        assert compact.update_media('1750000000000000001', {'media_index': 1, 'url': 'https://video.twimg.com/b.mp4', 'local_path': '/tmp/b.mp4', 'file_size': 10})
+        assert not compact.update_media('999', {'media_index': 0, 'url': 'x'})
+        assert compact[0]['media'][1]['local_path'] == '/tmp/b.mp4' and compact[0]['media'][1]['file_size'] == 10
+        print("[OK] ダウンロード結果の反映")
+
+        path = DataSaver().save_tweets_json(compact, filename='test_compact.json')
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        assert data['metadata']['total_tweets'] == 2 and data['tweets'][0]['media'][1]['local_path'] == '/tmp/b.mp4'
+        (Config.RUN_DIR / 'test_compact.json').unlink()
+        print("[OK] そのままJSONに書き出せる")
+
+        print("CompactTweetsテスト: 成功")
+        return True
+    except Exception as e:
+        print(f"[ERROR] CompactTweetsテスト: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
 def main():
     """メインテスト"""
     print("=" * 60)
@@ -231,9 +2153,34 @@ def main():
     results = []
     results.append(test_config())
     results.append(test_data_saver())
+    results.append(test_tweet_log())
+    results.append(test_json_stream())
+    results.append(test_output_files())
+    results.append(test_consolidate())
+    results.append(test_run_catalog())
+    results.append(test_parquet_export())
+    results.append(test_tweet_store())
     results.append(test_media_downloader())
+    results.append(test_resumable_download())
+    results.append(test_segmented_download())
+    results.append(test_media_store())
+    results.append(test_media_index())
+    results.append(test_quality_profiles())
+    results.append(test_hls_playlist())
+    results.append(test_video_resolver())
+    results.append(test_thumbnail_enrichment())
+    results.append(test_resolver_registry())
     results.append(test_twitter_scraper())
     results.append(test_parallel_media_download())
+    results.append(test_download_scheduler())
+    results.append(test_deferred_retry())
+    results.append(test_tweet_sinks())
+    results.append(test_tweet_records())
+    results.append(test_agent_log())
+    results.append(test_run_metrics())
+    results.append(test_tweet_trace())
+    results.append(test_run_profiler())
+    results.append(test_tweet_parsing_fixture())
     
     print("\n" + "=" * 60)
     print("テスト結果")
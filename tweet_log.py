@@ -0,0 +1,149 @@
+"""取得したTweetの追記専用ログ（NDJSON）
+
+Tweetを受け付けた時点で RUN_DIR/tweets.ndjson に1行ずつ追記し、一定件数ごとにflushする。
+強制終了やOOMで落ちても、それまでのTweetはログに残る。最終的なJSON/CSVはログから逐次読み出して作る。
+
+メディアのダウンロード結果（local_path等）は {"_record": "media", ...} の行として後から追記し、
+読み出し時にTweetへ反映する。同じtweet_idが複数回書かれた場合は最後の行を採用する。
+
+読み出しは2パス。Tweet本体は1件ずつしか持たないが、1パス目で tweet_id ごとの最終行番号と
+メディアごとの最新結果（local_path, file_size）を集めるので、その分はTweet数・メディア数に比例する
+（1件あたり数百バイト程度。本体を全件載せるよりはずっと小さいが、定数ではない）。
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+import os
+import threading
+from pathlib import Path
+from typing import Dict, Iterator, Optional, Tuple
+
+from output_files import open_input
+
+logger = logging.getLogger(__name__)
+
+LOG_FILENAME = "tweets.ndjson"
+MEDIA_RECORD = "media"
+_MEDIA_FIELDS = ("local_path", "file_size")
+
+
+class TweetLog:
+    """NDJSONの追記ログ（複数スレッドから追記してよい）"""
+
+    def __init__(self, path: Path, flush_every: int = 20, fsync: bool = False):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.flush_every = max(1, flush_every)
+        self.fsync = fsync
+        self._lock = threading.Lock()
+        self._file = open(self.path, "a", encoding="utf-8")
+        self._pending = 0
+        self.count = 0
+
+    def _write(self, record: Dict) -> None:
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        with self._lock:
+            if self._file.closed:
+                return
+            self._file.write(line)
+            if "_record" not in record:
+                self.count += 1
+            self._pending += 1
+            if self._pending >= self.flush_every:
+                self._flush_locked()
+
+    def _flush_locked(self) -> None:
+        self._file.flush()
+        if self.fsync:
+            os.fsync(self._file.fileno())
+        self._pending = 0
+
+    def append(self, tweet: Dict) -> None:
+        """受け付けたTweetを追記する"""
+        self._write(tweet)
+
+    def log_media(self, tweet_id: Optional[str], media: Dict) -> None:
+        """メディアのダウンロード結果を追記する"""
+        record = {
+            "_record": MEDIA_RECORD,
+            "tweet_id": tweet_id,
+            "media_index": media.get("media_index", 0),
+            "type": media.get("type"),
+            "url": media.get("url"),
+        }
+        for key in _MEDIA_FIELDS:
+            record[key] = media.get(key)
+        self._write(record)
+
+    def flush(self) -> None:
+        with self._lock:
+            if not self._file.closed:
+                self._flush_locked()
+
+    def close(self) -> None:
+        with self._lock:
+            if not self._file.closed:
+                self._flush_locked()
+                self._file.close()
+
+    def __enter__(self) -> "TweetLog":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+def _iter_records(path: Path) -> Iterator[Tuple[int, Dict]]:
+    with open_input(path) as f:
+        for line_no, line in enumerate(f):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue  # 書き込み途中で落ちた最終行
+            if isinstance(record, dict):
+                yield line_no, record
+
+
+def _media_key(tweet_id, media: Dict) -> Tuple[str, int, Optional[str], Optional[str]]:
+    return (str(tweet_id), int(media.get("media_index", 0) or 0), media.get("type"), media.get("url"))
+
+
+def scan_log(path: Path) -> Tuple[Dict[str, int], Dict[Tuple, Tuple]]:
+    """1パス目: tweet_idごとの最終行番号と、メディアの最新のダウンロード結果を集める
+
+    戻り値はTweet本体を含まないが、tweet_id数・メディア数に比例した大きさになる（モジュールの説明を参照）。
+    メディアの結果は _MEDIA_FIELDS の順のタプルで持つ（dictより小さい）。
+    """
+    last_line: Dict[str, int] = {}
+    media_updates: Dict[Tuple, Tuple] = {}
+    for line_no, record in _iter_records(path):
+        if record.get("_record") == MEDIA_RECORD:
+            media_updates[_media_key(record.get("tweet_id"), record)] = tuple(record.get(k) for k in _MEDIA_FIELDS)
+        elif record.get("tweet_id"):
+            last_line[str(record["tweet_id"])] = line_no
+    return last_line, media_updates
+
+
+def iter_logged_tweets(path: Path, scanned: Optional[Tuple[Dict[str, int], Dict[Tuple, Tuple]]] = None) -> Iterator[Dict]:
+    """ログからTweetを書き込み順に1件ずつ返す（重複は最後の行、メディアは最新の結果を反映）
+
+    Tweet本体は1件ずつ読むが、scan_log() の結果（tweet_id・メディアごとの小さな記録）は全件分を保持する。
+    """
+    path = Path(path)
+    if not path.exists():
+        return
+    last_line, media_updates = scanned or scan_log(path)
+    for line_no, record in _iter_records(path):
+        if record.get("_record") or last_line.get(str(record.get("tweet_id"))) != line_no:
+            continue
+        tweet_id = record.get("tweet_id")
+        for media in record.get("media") or []:
+            if isinstance(media, dict):
+                update = media_updates.get(_media_key(tweet_id, media))
+                if update:
+                    media.update({k: v for k, v in zip(_MEDIA_FIELDS, update) if v is not None})
+        yield record
@@ -0,0 +1,269 @@
+"""メモリに保持するTweetのコンパクトな表現
+
+Tweetはdictのまま持つと、public_metrics/mediaの入れ子dict・同じ作者名・"https://twitter.com" の
+URLが1件ごとに重複し、100万件で数GBになる。CompactTweets は
+
+- Tweet: __slots__ のレコード（tweet_idはint、作者名はintern、created_atはUTCミリ秒、URLは導出）
+- メディア: 全Tweet分を列ごとの配列（array / list）に詰めたテーブル
+
+として保持し、取り出すとき（JSON/CSVへの書き出し等）だけ従来のdict形式に戻す。
+dictに戻した結果は元のdictと同じ内容になる（対応していないキーはそのまま残す）。
+"""
+
+from __future__ import annotations
+
+import sys
+from array import array
+from datetime import datetime, timezone
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+TWITTER_BASE = "https://twitter.com"
+
+_METRIC_FIELDS = ("like_count", "retweet_count", "reply_count", "quote_count")
+_TWEET_FIELDS = ("tweet_id", "created_at", "text", "author_username", "public_metrics", "media", "url")
+_MEDIA_FIELDS = ("media_index", "type", "url", "thumbnail_url", "local_path", "file_size", "tweet_url")
+_MEDIA_TYPES = ("photo", "video", "animated_gif")
+_MISSING = -1
+_INT32_MAX = 2 ** 31 - 1
+
+# メディアテーブルのフラグ列
+_FLAG_TWEET_URL = 1  # tweet_url がTweetのurlと同じ（値は持たずTweetから復元）
+_FLAG_NO_TYPE = 2
+_FLAG_NO_URL = 4
+
+
+def _encode_created_at(value) -> Tuple[int, Optional[str]]:
+    """X の <time datetime> 形式（2024-01-01T00:00:00.000Z）ならミリ秒に、それ以外は文字列のまま"""
+    if isinstance(value, str) and len(value) == 24 and value.endswith("Z"):
+        try:
+            dt = datetime.fromisoformat(value[:-1]).replace(tzinfo=timezone.utc)
+        except ValueError:
+            return _MISSING, value
+        ms = int(dt.timestamp() * 1000)
+        if _decode_created_at(ms) == value:
+            return ms, None
+    return _MISSING, value
+
+
+def _decode_created_at(ms: int) -> str:
+    dt = datetime.fromtimestamp(ms / 1000, tz=timezone.utc)
+    return dt.strftime("%Y-%m-%dT%H:%M:%S.") + f"{dt.microsecond // 1000:03d}Z"
+
+
+def _tweet_url(author: Optional[str], tweet_id) -> str:
+    return f"{TWITTER_BASE}/{author}/status/{tweet_id}"
+
+
+class TweetRecord:
+    """Tweet1件（メディアは CompactTweets のメディアテーブルの [media_start, media_end) 行）"""
+
+    __slots__ = (
+        "tweet_id", "created_ms", "created_raw", "text", "author",
+        "metrics", "media_start", "media_end", "url", "extra",
+    )
+
+    def __init__(self, tweet_id, created_ms, created_raw, text, author, metrics, media_start, media_end, url, extra):
+        self.tweet_id = tweet_id      # int（数字でなければ元の値）
+        self.created_ms = created_ms  # UTCミリ秒（-1なら created_raw を使う）
+        self.created_raw = created_raw
+        self.text = text
+        self.author = author          # sys.intern済み
+        self.metrics = metrics        # array('q')（メトリクスが無ければ None）
+        self.media_start = media_start
+        self.media_end = media_end
+        self.url = url                # 作者とIDから導出できるなら None
+        self.extra = extra            # 上記以外のキー（無ければ None）
+
+
+class CompactTweets:
+    """TweetRecord の列とメディアテーブル（listの代わりに使える。取り出すとdictになる）"""
+
+    def __init__(self, tweets: Iterable[Dict] = ()):
+        self._records: List[TweetRecord] = []
+        self._index: Dict[object, int] = {}
+        # メディアテーブル（1行=メディア1件）
+        self._m_index = array("i")
+        self._m_type = array("b")          # _MEDIA_TYPES の位置（-1なら _m_type_raw）
+        self._m_type_raw: Dict[int, object] = {}
+        self._m_url: List[Optional[str]] = []
+        self._m_thumb: Dict[int, str] = {}     # 動画のみなので疎に持つ
+        self._m_local: Dict[int, Optional[str]] = {}
+        self._m_size = array("q")
+        self._m_flags = bytearray()
+        self._m_extra: Dict[int, Dict] = {}
+        for tweet in tweets:
+            self.append(tweet)
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+    def __bool__(self) -> bool:
+        return bool(self._records)
+
+    def __iter__(self) -> Iterator[Dict]:
+        for record in self._records:
+            yield self._to_dict(record)
+
+    def __getitem__(self, i: int) -> Dict:
+        return self._to_dict(self._records[i])
+
+    def append(self, tweet: Dict) -> None:
+        raw_id = tweet.get("tweet_id")
+        tweet_id = int(raw_id) if isinstance(raw_id, str) and raw_id.isdigit() and raw_id[0] != "0" else raw_id
+        author = tweet.get("author_username")
+        if isinstance(author, str):
+            author = sys.intern(author)
+        created_ms, created_raw = _encode_created_at(tweet.get("created_at"))
+
+        metrics = None
+        raw_metrics = tweet.get("public_metrics")
+        if isinstance(raw_metrics, dict) and set(raw_metrics) == set(_METRIC_FIELDS) and all(
+            type(raw_metrics[k]) is int for k in _METRIC_FIELDS
+        ):
+            metrics = array("q", (raw_metrics[k] for k in _METRIC_FIELDS))
+
+        extra = {k: v for k, v in tweet.items() if k not in _TWEET_FIELDS}
+        if raw_metrics is not None and metrics is None:
+            extra["public_metrics"] = raw_metrics
+        missing = tuple(k for k in _TWEET_FIELDS if k not in tweet)
+        if missing:
+            extra["_missing"] = missing
+        url = tweet.get("url")
+        if url == _tweet_url(author, raw_id):
+            url = None
+        elif url is None:
+            extra["_url_none"] = True
+
+        media_start = len(self._m_size)
+        media = tweet.get("media")
+        if isinstance(media, list) or "media" not in tweet:
+            tweet_url = tweet.get("url")
+            for item in media or []:
+                self._append_media(item, tweet_url)
+        else:
+            extra["_media"] = media
+        record = TweetRecord(
+            tweet_id, created_ms, created_raw, tweet.get("text"), author,
+            metrics, media_start, len(self._m_size), url, extra or None,
+        )
+        self._index[tweet_id] = len(self._records)
+        self._records.append(record)
+
+    def _append_media(self, media, tweet_url: Optional[str]) -> None:
+        row = len(self._m_size)
+        if not isinstance(media, dict):
+            self._m_index.append(_MISSING)
+            self._m_type.append(_MISSING)
+            self._m_url.append(None)
+            self._m_size.append(_MISSING)
+            self._m_flags.append(0)
+            self._m_extra[row] = {"_value": media}
+            return
+        index = media.get("media_index")
+        self._m_index.append(index if type(index) is int and 0 <= index <= _INT32_MAX else _MISSING)
+        media_type = media.get("type")
+        if media_type in _MEDIA_TYPES:
+            self._m_type.append(_MEDIA_TYPES.index(media_type))
+        else:
+            self._m_type.append(_MISSING)
+            self._m_type_raw[row] = media_type
+        self._m_url.append(media.get("url"))
+        if "thumbnail_url" in media:
+            self._m_thumb[row] = media["thumbnail_url"]
+        if "local_path" in media:
+            self._m_local[row] = media["local_path"]
+        size = media.get("file_size")
+        self._m_size.append(size if type(size) is int and size >= 0 else _MISSING)
+
+        flags = 0
+        extra = {k: v for k, v in media.items() if k not in _MEDIA_FIELDS}
+        if "media_index" in media and self._m_index[row] == _MISSING:
+            extra["media_index"] = index
+        if "type" not in media:
+            flags |= _FLAG_NO_TYPE
+        if "url" not in media:
+            flags |= _FLAG_NO_URL
+        if "file_size" in media and self._m_size[row] == _MISSING:
+            extra["file_size"] = size
+        if "tweet_url" in media:
+            if media["tweet_url"] == tweet_url:
+                flags |= _FLAG_TWEET_URL
+            else:
+                extra["tweet_url"] = media["tweet_url"]
+        self._m_flags.append(flags)
+        if extra:
+            self._m_extra[row] = extra
+
+    def _media_dict(self, row: int, tweet_url: Optional[str]) -> object:
+        extra = self._m_extra.get(row)
+        if extra and "_value" in extra:
+            return extra["_value"]
+        flags = self._m_flags[row]
+        media: Dict = {}
+        media_type = self._m_type[row]
+        if not flags & _FLAG_NO_TYPE:
+            media["type"] = _MEDIA_TYPES[media_type] if media_type != _MISSING else self._m_type_raw.get(row)
+        if not flags & _FLAG_NO_URL:
+            media["url"] = self._m_url[row]
+        if self._m_index[row] != _MISSING:
+            media["media_index"] = self._m_index[row]
+        if row in self._m_thumb:
+            media["thumbnail_url"] = self._m_thumb[row]
+        if flags & _FLAG_TWEET_URL:
+            media["tweet_url"] = tweet_url
+        if row in self._m_local:
+            media["local_path"] = self._m_local[row]
+        if self._m_size[row] != _MISSING:
+            media["file_size"] = self._m_size[row]
+        if extra:
+            media.update(extra)
+        return media
+
+    def _to_dict(self, record: TweetRecord) -> Dict:
+        extra = record.extra or {}
+        tweet_id = str(record.tweet_id) if type(record.tweet_id) is int else record.tweet_id
+        if record.url is not None:
+            url = record.url
+        elif extra.get("_url_none") or "url" in extra.get("_missing", ()):
+            url = None
+        else:
+            url = _tweet_url(record.author, tweet_id)
+        tweet: Dict = {
+            "tweet_id": tweet_id,
+            "created_at": _decode_created_at(record.created_ms) if record.created_ms != _MISSING else record.created_raw,
+            "text": record.text,
+            "author_username": record.author,
+        }
+        if record.metrics is not None:
+            tweet["public_metrics"] = dict(zip(_METRIC_FIELDS, record.metrics))
+        else:
+            tweet["public_metrics"] = extra.get("public_metrics")
+        if "_media" in extra:
+            tweet["media"] = extra["_media"]
+        else:
+            tweet["media"] = [self._media_dict(row, url) for row in range(record.media_start, record.media_end)]
+        tweet["url"] = url
+        for key in extra.get("_missing", ()):
+            del tweet[key]
+        for key, value in extra.items():
+            if key != "public_metrics" and not key.startswith("_"):
+                tweet[key] = value
+        return tweet
+
+    def update_media(self, tweet_id, media: Dict) -> bool:
+        """ダウンロード結果（local_path/file_size）を反映する（MediaDownloader.on_media_downloaded 用）"""
+        key = int(tweet_id) if isinstance(tweet_id, str) and tweet_id.isdigit() and tweet_id[0] != "0" else tweet_id
+        i = self._index.get(key)
+        if i is None:
+            return False
+        record = self._records[i]
+        index = media.get("media_index", 0)
+        for row in range(record.media_start, record.media_end):
+            if self._m_index[row] == index and self._m_url[row] == media.get("url"):
+                if "local_path" in media:
+                    self._m_local[row] = media["local_path"]
+                size = media.get("file_size")
+                if type(size) is int and size >= 0:
+                    self._m_size[row] = size
+                return True
+        return False
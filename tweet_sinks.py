@@ -0,0 +1,66 @@
+"""スクレイパーが受け付けたTweetの送り先（保存・ダウンロード・コールバック）
+
+スクレイパーはTweetを受け付けるたびに登録済みの各sinkの accept() を呼ぶ。
+accept() が戻るまで次のスクロールに進まないので、下流（ダウンロード待ちの上限など）が
+詰まればスクレイピングもその分だけ遅くなる（バックプレッシャー）。
+"""
+
+from __future__ import annotations
+
+import logging
+from abc import ABC, abstractmethod
+from typing import Callable, Dict, Optional
+
+from media_only import is_target_author
+
+logger = logging.getLogger(__name__)
+
+
+class TweetSink(ABC):
+    """Tweetの送り先の基底クラス"""
+
+    @abstractmethod
+    def accept(self, tweet: Dict) -> None:
+        """受け付けたTweetを1件受け取る"""
+
+    def close(self) -> None:
+        pass
+
+
+class LogSink(TweetSink):
+    """追記ログ（tweet_log.TweetLog）に書き込む"""
+
+    def __init__(self, tweet_log):
+        self.tweet_log = tweet_log
+
+    def accept(self, tweet: Dict) -> None:
+        self.tweet_log.append(tweet)
+
+    def close(self) -> None:
+        self.tweet_log.close()
+
+
+class DownloadSink(TweetSink):
+    """並行ダウンロードのキューに積む（キューが上限なら空くまで待つ）
+
+    author_filter を指定すると、その作者の投稿だけを対象にする（RT等の除外）。
+    """
+
+    def __init__(self, downloader, author_filter: Optional[str] = None):
+        self.downloader = downloader
+        self.author_filter = author_filter
+
+    def accept(self, tweet: Dict) -> None:
+        if self.author_filter and not is_target_author(tweet, self.author_filter):
+            return
+        self.downloader.add_tweet_for_download(tweet)
+
+
+class CallbackSink(TweetSink):
+    """任意の関数を呼ぶ（get_user_tweets の on_tweet_fetched 相当）"""
+
+    def __init__(self, func: Callable[[Dict], None]):
+        self.func = func
+
+    def accept(self, tweet: Dict) -> None:
+        self.func(tweet)
@@ -0,0 +1,298 @@
+"""実行を跨いでTweetとメディアを蓄積するSQLiteストア
+
+tweets（tweet_idが主キー）と media（tweet_id, media_index, type で一意）の2テーブル。
+同じTweetを再取得したらメトリクス等をその場で更新し（upsert）、メディアのlocal_pathは
+新しい値が無ければ既存の値を残す。書き込みは batch_size 件ごとに1トランザクションにまとめる。
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+import sqlite3
+import threading
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+DB_FILENAME = "tweets.sqlite3"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS tweets (
+    tweet_id INTEGER PRIMARY KEY,
+    author_username TEXT,
+    created_at TEXT,
+    text TEXT,
+    url TEXT,
+    like_count INTEGER NOT NULL DEFAULT 0,
+    retweet_count INTEGER NOT NULL DEFAULT 0,
+    reply_count INTEGER NOT NULL DEFAULT 0,
+    quote_count INTEGER NOT NULL DEFAULT 0,
+    media_count INTEGER NOT NULL DEFAULT 0,
+    data TEXT NOT NULL,
+    first_seen_run TEXT,
+    last_seen_run TEXT,
+    updated_at TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_tweets_author_created ON tweets (author_username, created_at);
+CREATE INDEX IF NOT EXISTS idx_tweets_created ON tweets (created_at);
+CREATE TABLE IF NOT EXISTS media (
+    tweet_id INTEGER NOT NULL,
+    media_index INTEGER NOT NULL,
+    type TEXT NOT NULL DEFAULT '',
+    url TEXT,
+    thumbnail_url TEXT,
+    local_path TEXT,
+    file_size INTEGER,
+    updated_at TEXT,
+    PRIMARY KEY (tweet_id, media_index, type)
+);
+CREATE INDEX IF NOT EXISTS idx_media_url ON media (url);
+"""
+
+_UPSERT_TWEET = """
+INSERT INTO tweets (
+    tweet_id, author_username, created_at, text, url,
+    like_count, retweet_count, reply_count, quote_count, media_count,
+    data, first_seen_run, last_seen_run, updated_at
+) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (tweet_id) DO UPDATE SET
+    author_username = COALESCE(NULLIF(excluded.author_username, ''), tweets.author_username),
+    created_at = COALESCE(NULLIF(excluded.created_at, ''), tweets.created_at),
+    text = excluded.text,
+    url = excluded.url,
+    like_count = excluded.like_count,
+    retweet_count = excluded.retweet_count,
+    reply_count = excluded.reply_count,
+    quote_count = excluded.quote_count,
+    media_count = excluded.media_count,
+    data = excluded.data,
+    last_seen_run = excluded.last_seen_run,
+    updated_at = excluded.updated_at
+"""
+
+_UPSERT_MEDIA = """
+INSERT INTO media (tweet_id, media_index, type, url, thumbnail_url, local_path, file_size, updated_at)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (tweet_id, media_index, type) DO UPDATE SET
+    url = COALESCE(excluded.url, media.url),
+    thumbnail_url = COALESCE(excluded.thumbnail_url, media.thumbnail_url),
+    local_path = COALESCE(excluded.local_path, media.local_path),
+    file_size = COALESCE(excluded.file_size, media.file_size),
+    updated_at = excluded.updated_at
+"""
+
+_METRIC_FIELDS = ("like_count", "retweet_count", "reply_count", "quote_count")
+
+
+def _to_int(value) -> Optional[int]:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class TweetStore:
+    """SQLiteのTweetストア（複数スレッドから使ってよい）"""
+
+    def __init__(self, db_path: Optional[Path] = None, run_id: Optional[str] = None, batch_size: int = 500):
+        self.db_path = Path(db_path) if db_path else Config.OUTPUT_DIR / DB_FILENAME
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.run_id = run_id or getattr(Config, "RUN_ID", None)
+        self.batch_size = max(1, batch_size)
+        # tweet_id が数値でないため書かなかったTweet数
+        self.skipped = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.db_path), check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        # WALにすると書き込み中も読み出しが待たされない
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+        self._conn.commit()
+
+    def _tweet_params(self, tweet: Dict, tweet_id: int, now: str) -> tuple:
+        metrics = tweet.get("public_metrics") or {}
+        return (
+            tweet_id,
+            tweet.get("author_username") or "",
+            tweet.get("created_at") or "",
+            tweet.get("text") or "",
+            tweet.get("url") or "",
+            *[_to_int(metrics.get(key)) or 0 for key in _METRIC_FIELDS],
+            len(tweet.get("media") or []),
+            json.dumps(tweet, ensure_ascii=False),
+            self.run_id,
+            self.run_id,
+            now,
+        )
+
+    def _media_params(self, tweet: Dict, tweet_id: int, now: str) -> List[tuple]:
+        params = []
+        for media in tweet.get("media") or []:
+            if not isinstance(media, dict):
+                continue
+            params.append((
+                tweet_id,
+                _to_int(media.get("media_index")) or 0,
+                media.get("type") or "",
+                media.get("url"),
+                media.get("thumbnail_url"),
+                media.get("local_path"),
+                _to_int(media.get("file_size")),
+                now,
+            ))
+        return params
+
+    def _write_batch(self, tweet_rows: List[tuple], media_rows: List[tuple]) -> None:
+        with self._lock, self._conn:
+            self._conn.executemany(_UPSERT_TWEET, tweet_rows)
+            if media_rows:
+                self._conn.executemany(_UPSERT_MEDIA, media_rows)
+
+    def upsert_tweets(self, tweets: Iterable[Dict]) -> int:
+        """Tweetを追加/更新する（batch_size件ごとに1トランザクション）。書き込んだ件数を返す"""
+        now = datetime.now().isoformat(timespec="seconds")
+        tweet_rows: List[tuple] = []
+        media_rows: List[tuple] = []
+        count = 0
+        for tweet in tweets:
+            tweet_id = _to_int(tweet.get("tweet_id"))
+            if tweet_id is None:
+                self.skipped += 1
+                continue
+            tweet_rows.append(self._tweet_params(tweet, tweet_id, now))
+            media_rows.extend(self._media_params(tweet, tweet_id, now))
+            count += 1
+            if len(tweet_rows) >= self.batch_size:
+                self._write_batch(tweet_rows, media_rows)
+                tweet_rows, media_rows = [], []
+        if tweet_rows:
+            self._write_batch(tweet_rows, media_rows)
+        return count
+
+    def update_media(self, tweet_id, media: Dict) -> None:
+        """1件のメディアのダウンロード結果を反映する（MediaDownloader.on_media_downloaded 用）"""
+        tweet_id = _to_int(tweet_id)
+        if tweet_id is None:
+            return
+        now = datetime.now().isoformat(timespec="seconds")
+        with self._lock, self._conn:
+            self._conn.executemany(_UPSERT_MEDIA, self._media_params({"media": [media]}, tweet_id, now))
+
+    def count(self, author_username: Optional[str] = None) -> int:
+        with self._lock:
+            if author_username:
+                row = self._conn.execute("SELECT COUNT(*) FROM tweets WHERE author_username = ?", (author_username,)).fetchone()
+            else:
+                row = self._conn.execute("SELECT COUNT(*) FROM tweets").fetchone()
+        return row[0]
+
+    def has_tweet(self, tweet_id) -> bool:
+        with self._lock:
+            row = self._conn.execute("SELECT 1 FROM tweets WHERE tweet_id = ?", (_to_int(tweet_id),)).fetchone()
+        return row is not None
+
+    def _media_for(self, tweet_ids: List[int]) -> Dict[int, List[Dict]]:
+        placeholders = ",".join("?" * len(tweet_ids))
+        rows = self._conn.execute(
+            f"SELECT * FROM media WHERE tweet_id IN ({placeholders}) ORDER BY tweet_id, media_index, type",
+            tweet_ids,
+        ).fetchall()
+        result: Dict[int, List[Dict]] = {}
+        for row in rows:
+            result.setdefault(row["tweet_id"], []).append(dict(row))
+        return result
+
+    def _with_media(self, rows: List[sqlite3.Row]) -> List[Dict]:
+        """保存したTweetに、mediaテーブルのlocal_path/file_sizeを反映して返す"""
+        media = self._media_for([row["tweet_id"] for row in rows]) if rows else {}
+        tweets = []
+        for row in rows:
+            tweet = json.loads(row["data"])
+            stored = {(m["media_index"], m["type"]): m for m in media.get(row["tweet_id"], [])}
+            for item in tweet.get("media") or []:
+                if not isinstance(item, dict):
+                    continue
+                entry = stored.get((_to_int(item.get("media_index")) or 0, item.get("type") or ""))
+                if entry:
+                    for key in ("local_path", "file_size"):
+                        if entry[key] is not None:
+                            item[key] = entry[key]
+            tweets.append(tweet)
+        return tweets
+
+    def iter_tweets(
+        self,
+        author_username: Optional[str] = None,
+        since: Optional[str] = None,
+        until: Optional[str] = None,
+        chunk_size: int = 500,
+    ) -> Iterator[Dict]:
+        """各Tweetの最新の状態を新しい順に返す（メディアのlocal_path等はmediaテーブルの値を反映）
+
+        since/until は created_at と比較する（ISO8601の文字列。until は含まない）。
+        """
+        where, params = [], []
+        if author_username:
+            where.append("author_username = ?")
+            params.append(author_username)
+        if since:
+            where.append("created_at >= ?")
+            params.append(since)
+        if until:
+            where.append("created_at < ?")
+            params.append(until)
+        last = None
+        while True:
+            # OFFSETは読み飛ばしが件数に比例するので、直前の (created_at, tweet_id) から続きを読む
+            page_where, page_params = list(where), list(params)
+            if last is not None:
+                page_where.append("(created_at < ? OR (created_at = ? AND tweet_id < ?))")
+                page_params += [last[0], last[0], last[1]]
+            sql = "SELECT tweet_id, created_at, data FROM tweets"
+            if page_where:
+                sql += " WHERE " + " AND ".join(page_where)
+            sql += " ORDER BY created_at DESC, tweet_id DESC LIMIT ?"
+            with self._lock:
+                rows = self._conn.execute(sql, page_params + [chunk_size]).fetchall()
+                tweets = self._with_media(rows)
+            if not rows:
+                return
+            yield from tweets
+            last = (rows[-1]["created_at"], rows[-1]["tweet_id"])
+
+    def get_tweet(self, tweet_id) -> Optional[Dict]:
+        with self._lock:
+            rows = self._conn.execute("SELECT tweet_id, data FROM tweets WHERE tweet_id = ?", (_to_int(tweet_id),)).fetchall()
+            tweets = self._with_media(rows)
+        return tweets[0] if tweets else None
+
+    def media_status(self, tweet_id=None, missing_only: bool = False) -> List[Dict]:
+        """メディアのダウンロード状況（missing_only=Trueならlocal_pathが無いものだけ）"""
+        where, params = [], []
+        if tweet_id is not None:
+            where.append("tweet_id = ?")
+            params.append(_to_int(tweet_id))
+        if missing_only:
+            where.append("local_path IS NULL")
+        sql = "SELECT tweet_id, media_index, type, url, local_path, file_size FROM media"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY tweet_id, media_index"
+        with self._lock:
+            return [dict(row) for row in self._conn.execute(sql, params).fetchall()]
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+    def __enter__(self) -> "TweetStore":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
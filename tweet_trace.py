@@ -0,0 +1,190 @@
+"""Tweet/メディアごとのライフサイクル追跡（発見 → 動画URL解決 → キュー待ち → 転送 → local_path反映）
+
+スクレイパー・動画URL解決・MediaDownloader が共通の TRACER にスパンを記録し、終了時に
+Chrome Trace Event 形式（chrome://tracing / Perfetto で開ける JSON）で書き出す。
+スパンは tweet_id と media_index をキーにした非同期イベント（同じメディアは同じ行に並ぶ）で、
+ステージごとの所要時間は run_metrics の trace_stage_seconds にも記録する。
+
+既定は無効で、無効なら span() / begin() / end() は判定1回で戻る（main.py の --trace で有効にする）。
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from run_metrics import METRICS, Histogram
+
+logger = logging.getLogger(__name__)
+
+TRACE_FILENAME = "trace.json"
+
+# ステージ名（args の stage 以外も使えるが、集計・表示はこの順）
+STAGES = ("discover", "resolve", "queue", "transfer", "writeback")
+
+_STAGE_HELP = "Tweet/メディアごとのステージの所要時間（--trace 時のみ）"
+_STAGE_SECONDS = METRICS.histogram("trace_stage_seconds", _STAGE_HELP, ("stage",))
+
+_Key = Tuple[str, str, Optional[int], Optional[str]]
+
+
+def trace_id(tweet_id: Optional[str], media_index: Optional[int] = None) -> str:
+    """イベントのID（同じメディアのスパンは同じ行にまとまる）"""
+    tweet_id = str(tweet_id or "")
+    return tweet_id if media_index is None else f"{tweet_id}:{media_index}"
+
+
+class Tracer:
+    """スパンを溜めて Chrome Trace Event 形式で書き出す"""
+
+    def __init__(self, max_events: int = 1_000_000):
+        self.enabled = False
+        self.max_events = max_events
+        self.dropped = 0
+        self._events: List[Dict] = []
+        self._open: Dict[_Key, Tuple[float, Dict]] = {}
+        self._lock = threading.Lock()
+        self._origin = time.perf_counter()
+        self._pid = os.getpid()
+        # 今回の記録分だけのステージ別集計（METRICS側は実行全体の累計）
+        self._stages = Histogram("trace_stage_seconds", _STAGE_HELP, ("stage",))
+
+    def enable(self, max_events: Optional[int] = None) -> None:
+        """記録を始める（それまでの記録は消す）"""
+        with self._lock:
+            if max_events is not None:
+                self.max_events = max_events
+            self._events = []
+            self._open = {}
+            self.dropped = 0
+            self._origin = time.perf_counter()
+            self._stages = Histogram("trace_stage_seconds", _STAGE_HELP, ("stage",))
+            self.enabled = True
+
+    def disable(self) -> None:
+        self.enabled = False
+
+    def _ts(self, t: float) -> float:
+        return round((t - self._origin) * 1e6, 1)
+
+    def _append(self, events: List[Dict]) -> None:
+        with self._lock:
+            if len(self._events) + len(events) > self.max_events:
+                self.dropped += len(events)
+                return
+            self._events.extend(events)
+
+    def _record(self, stage: str, tweet_id, media_index, start: float, end: float, args: Dict) -> None:
+        _STAGE_SECONDS.observe(end - start, stage=stage)
+        self._stages.observe(end - start, stage=stage)
+        event_id = trace_id(tweet_id, media_index)
+        base = {"cat": "tweet", "name": stage, "id": event_id, "pid": self._pid, "tid": threading.get_ident()}
+        args = dict(args, tweet_id=str(tweet_id or ""))
+        if media_index is not None:
+            args["media_index"] = media_index
+        self._append([
+            dict(base, ph="b", ts=self._ts(start), args=args),
+            dict(base, ph="e", ts=self._ts(end)),
+        ])
+
+    def instant(self, stage: str, tweet_id, media_index: Optional[int] = None, **args) -> None:
+        """時点だけのイベント（Tweetの発見など）"""
+        if not self.enabled:
+            return
+        args = dict(args, tweet_id=str(tweet_id or ""))
+        if media_index is not None:
+            args["media_index"] = media_index
+        self._append([{
+            "cat": "tweet", "name": stage, "id": trace_id(tweet_id, media_index), "ph": "n",
+            "ts": self._ts(time.perf_counter()), "pid": self._pid, "tid": threading.get_ident(), "args": args,
+        }])
+
+    @contextmanager
+    def span(self, stage: str, tweet_id, media_index: Optional[int] = None, **args) -> Iterator[Dict]:
+        """with ブロックをスパンとして記録する（返す dict に入れた値は args に載る）"""
+        if not self.enabled:
+            yield args
+            return
+        start = time.perf_counter()
+        try:
+            yield args
+        finally:
+            self._record(stage, tweet_id, media_index, start, time.perf_counter(), args)
+
+    def begin(self, stage: str, tweet_id, media_index: Optional[int] = None, media_type: Optional[str] = None, **args) -> None:
+        """別スレッドで end() するスパンを始める（キュー待ちなど）
+
+        動画とそのサムネイルは media_index が同じなので、media_type も合わせて対応を取る。
+        """
+        if not self.enabled:
+            return
+        if media_type is not None:
+            args["type"] = media_type
+        with self._lock:
+            self._open[(stage, str(tweet_id or ""), media_index, media_type)] = (time.perf_counter(), args)
+
+    def end(self, stage: str, tweet_id, media_index: Optional[int] = None, media_type: Optional[str] = None, **args) -> Optional[float]:
+        """begin() したスパンを閉じて秒数を返す（begin が無ければ何もしない）"""
+        if not self.enabled:
+            return None
+        with self._lock:
+            opened = self._open.pop((stage, str(tweet_id or ""), media_index, media_type), None)
+        if opened is None:
+            return None
+        start, begin_args = opened
+        end = time.perf_counter()
+        self._record(stage, tweet_id, media_index, start, end, dict(begin_args, **args))
+        return end - start
+
+    def events(self) -> List[Dict]:
+        with self._lock:
+            return list(self._events)
+
+    def stage_summary(self) -> Dict[str, Dict]:
+        """ステージごとの件数・平均・推定パーセンタイル（秒）"""
+        summary = {}
+        for entry in self._stages.to_dict():
+            summary[entry["labels"]["stage"]] = {k: v for k, v in entry.items() if k != "labels"}
+        ordered = {stage: summary.pop(stage) for stage in STAGES if stage in summary}
+        ordered.update(summary)
+        return ordered
+
+    def export_chrome(self, path: Path) -> Path:
+        """Chrome Trace Event 形式で書く（閉じていないスパンは書き出し時点で閉じる）"""
+        with self._lock:
+            unfinished = list(self._open.items())
+            self._open = {}
+        now = time.perf_counter()
+        for (stage, tweet_id, media_index, _), (start, args) in unfinished:
+            self._record(stage, tweet_id, media_index, start, now, dict(args, unfinished=True))
+
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        events = self.events()
+        events.append({"name": "process_name", "ph": "M", "pid": self._pid, "args": {"name": "getTweet"}})
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({
+                "traceEvents": events,
+                "displayTimeUnit": "ms",
+                "otherData": {"stages": self.stage_summary(), "dropped_events": self.dropped},
+            }, f, ensure_ascii=False)
+        return path
+
+    def log_summary(self) -> None:
+        for stage, s in self.stage_summary().items():
+            logger.info(
+                f"ステージ {stage}: {s['count']}件 平均{s['avg']:.3f}秒 "
+                f"p50={s['p50']:.3f} p90={s['p90']:.3f} p99={s['p99']:.3f} 最大{s['max']:.3f}"
+            )
+        if self.dropped:
+            logger.warning(f"記録上限（{self.max_events}件）を超えたため {self.dropped}件のイベントを捨てました")
+
+
+# スクレイパー / 動画URL解決 / MediaDownloader が記録する共通のトレーサー
+TRACER = Tracer()
@@ -2,6 +2,7 @@
 import time
 import json
 import re
+import threading
 import requests
 from pathlib import Path
 from datetime import datetime, timedelta
@@ -13,9 +14,40 @@ from tqdm import tqdm
 
 from config import Config
 from media_only import is_target_author
+from quality_profiles import get_profile, pick_video_variant
+from run_metrics import COUNT_BUCKETS, METRICS
+from run_profiler import PROFILER
+from tweet_records import CompactTweets
+from tweet_sinks import TweetSink
+from tweet_trace import TRACER
+from video_resolvers import ResolverRegistry
 
 logger = logging.getLogger(__name__)
 
+_PAGE_LOAD_SECONDS = METRICS.histogram("scraper_page_load_seconds", "ページ遷移（domcontentloadedまで）の所要時間")
+_PAGE_LOADS = METRICS.counter("scraper_page_loads_total", "ページ遷移の回数（result=ok/error）", ("result",))
+_SCROLL_SECONDS = METRICS.histogram("scraper_scroll_seconds", "スクロール1回の所要時間（待機を除く）")
+_TWEETS_PER_SCROLL = METRICS.histogram("scraper_tweets_per_scroll", "スクロール1回あたりの新規Tweet数", buckets=COUNT_BUCKETS)
+_EXTRACT_SECONDS = METRICS.histogram("scraper_extract_seconds", "表示中のTweetの抽出にかかった時間")
+_RATE_LIMITED = METRICS.counter("scraper_rate_limited_total", "429/問題発生ページを検知した回数")
+_SLEEP_SECONDS = METRICS.counter("scraper_sleep_seconds_total", "待機に使った秒数（reason=scroll/action/rate_limit/retry/scroll_pause）", ("reason",))
+
+# 引用ツイートの埋め込み（この中のメディアは引用先のもの。写真へのリンクは a[role="link"] なので div に限る）
+_QUOTED_TWEET_SELECTOR = 'div[role="link"]'
+# article 自身の画像のsrc（引用先とプロフィール画像を除く）。media_index はこの並びで振る
+_OWN_IMAGE_SRCS_JS = """(article, quoted) => Array.from(article.querySelectorAll('img[src*="pbs.twimg.com"]'))
+    .filter(img => {
+        const container = img.closest(quoted);
+        return !(container && article.contains(container)) && !(img.getAttribute('src') || '').includes('profile_images');
+    })
+    .map(img => img.getAttribute('src'))"""
+# article 内の各 video が引用先のものでないか（query_selector_all('video') と同じ順）
+_OWN_VIDEO_MASK_JS = """(article, quoted) => Array.from(article.querySelectorAll('video'))
+    .map(video => {
+        const container = video.closest(quoted);
+        return !(container && article.contains(container));
+    })"""
+
 
 class TwitterScraper:
     """Twitter Tweetスクレイパー"""
@@ -26,11 +58,22 @@ class TwitterScraper:
         self.context: Optional[BrowserContext] = None
         self.page: Optional[Page] = None
         self.playwright = None
-        self.tweets: List[Dict] = []
+        # 取得したTweet（コンパクトな形で保持し、取り出すとdictになる）
+        self.tweets = CompactTweets()
+        # Falseなら取得したTweetをself.tweetsに保持しない（sinkに流すだけにしてメモリを一定に保つ）
+        self.keep_tweets = True
+        self.tweet_count = 0
+        self._accept_lock = threading.Lock()
         # メディアダウンロード対象の作者フィルタ（RT等で別作者になるケース対策）
         self.media_author_filter: Optional[str] = None
+        # 受け付けたTweetの送り先（tweet_sinks.TweetSink。追記ログ・ダウンロードキュー等）
+        self.sinks: List[TweetSink] = []
         # 429対策: 初回は15分待機をデフォルトに（Twitterの一般的な制限ウィンドウに合わせる）
         self.rate_limit_wait = 900  # 15分（秒）
+        # 動画URLの解決手段（過去の成功率とレイテンシから試す順番を決める）
+        self.video_resolvers = ResolverRegistry(namespace="scraper")
+        self.video_resolvers.register("syndication", lambda tweet_id, element: self._resolve_video_from_api(tweet_id))
+        self.video_resolvers.register("dom_html", lambda tweet_id, element: self._pick_video_url_from_html(element.inner_html() or ""))
         
     def _setup_browser(self):
         """ブラウザをセットアップ"""
@@ -109,6 +152,30 @@ class TwitterScraper:
         
         return cookies
     
+    def _goto(self, page: Page, url: str) -> None:
+        """ページ遷移（所要時間と成否を計測する）"""
+        start = time.perf_counter()
+        try:
+            page.goto(url, wait_until="domcontentloaded")
+        except Exception:
+            _PAGE_LOADS.inc(result="error")
+            raise
+        finally:
+            _PAGE_LOAD_SECONDS.observe(time.perf_counter() - start)
+        _PAGE_LOADS.inc(result="ok")
+
+    def _sleep(self, seconds: float, reason: str) -> None:
+        """待機（理由ごとに待った秒数を計測する）"""
+        _SLEEP_SECONDS.inc(seconds, reason=reason)
+        time.sleep(seconds)
+
+    def _scroll(self, page: Page, added: int) -> None:
+        """最下部までスクロールして SCROLL_DELAY 待つ（added は直前の抽出で増えたTweet数）"""
+        _TWEETS_PER_SCROLL.observe(added)
+        with _SCROLL_SECONDS.time():
+            page.evaluate("window.scrollTo(0, document.body.scrollHeight)")
+        self._sleep(self.config.SCROLL_DELAY, "scroll")
+
     def _wait_for_page_load(self, timeout: int = 30000):
         """ページの読み込みを待つ"""
         try:
@@ -169,7 +236,7 @@ class TwitterScraper:
                 
                 # リロード
                 self.page.reload(wait_until="domcontentloaded")
-                time.sleep(self.config.ACTION_DELAY)
+                self._sleep(self.config.ACTION_DELAY, "action")
                 self._wait_for_page_load()
                 
                 # 再度チェック
@@ -198,8 +265,8 @@ class TwitterScraper:
             logger.info("ユーザー名+パスワードでログインを試行します...")
             
             # ログインページに移動
-            self.page.goto("https://twitter.com/i/flow/login", wait_until="domcontentloaded")
-            time.sleep(self.config.ACTION_DELAY)
+            self._goto(self.page, "https://twitter.com/i/flow/login")
+            self._sleep(self.config.ACTION_DELAY, "action")
             self._wait_for_page_load()
             
             # ユーザー名/メールアドレス入力欄を探す
@@ -307,7 +374,7 @@ class TwitterScraper:
         days_per_chunk: int = 7,
         on_tweet_fetched: Optional[Callable[[Dict], None]] = None,
         parallel_chunks: Optional[bool] = None,
-    ) -> List[Dict]:
+    ) -> CompactTweets:
         """指定ユーザーのTweetを取得（他人のアカウントも可）
         
         Args:
@@ -320,17 +387,18 @@ class TwitterScraper:
             parallel_chunks: 検索モード時にチャンクを並行処理するか（NoneならConfigを使用）
             
         Returns:
-            Tweetデータのリスト
+            Tweetデータ（CompactTweets。反復するとdictを返す。keep_tweets=Falseなら空）
         """
-        if not self.browser:
-            self._setup_browser()
-        
-        if use_search:
-            return self._get_tweets_by_search(username, since, until, days_per_chunk, on_tweet_fetched, parallel_chunks=parallel_chunks)
-        else:
-            return self._get_tweets_by_scroll(username, on_tweet_fetched)
+        with PROFILER.stage("scrape"):
+            if not self.browser:
+                self._setup_browser()
+
+            if use_search:
+                return self._get_tweets_by_search(username, since, until, days_per_chunk, on_tweet_fetched, parallel_chunks=parallel_chunks)
+            else:
+                return self._get_tweets_by_scroll(username, on_tweet_fetched)
 
-    def _get_tweets_by_scroll(self, username: str, on_tweet_fetched: Optional[Callable[[Dict], None]] = None) -> List[Dict]:
+    def _get_tweets_by_scroll(self, username: str, on_tweet_fetched: Optional[Callable[[Dict], None]] = None) -> CompactTweets:
         """プロフィール画面をスクロールして取得"""
         url = f"https://twitter.com/{username}"
         logger.info(f"ユーザーページにアクセス: {url}")
@@ -342,8 +410,8 @@ class TwitterScraper:
             access_success = False
             
             while retry_count < max_retries and not access_success:
-                self.page.goto(url, wait_until="domcontentloaded")
-                time.sleep(self.config.ACTION_DELAY)
+                self._goto(self.page, url)
+                self._sleep(self.config.ACTION_DELAY, "action")
                 self._wait_for_page_load()
                 
                 # 429エラーチェック
@@ -355,7 +423,7 @@ class TwitterScraper:
                         if retry_count <= 2:
                             wait_time = 10  # 10秒待機
                             logger.info(f"{wait_time}秒待機して再試行します...")
-                            time.sleep(wait_time)
+                            self._sleep(wait_time, "rate_limit")
                         else:
                             # 3回目以降は長い待機
                             self._handle_rate_limit()
@@ -396,16 +464,13 @@ class TwitterScraper:
                     for tweet in new_tweets:
                         tweet_id = tweet.get('tweet_id')
                         if tweet_id and tweet_id not in seen_tweet_ids:
-                            self.tweets.append(tweet)
                             seen_tweet_ids.add(tweet_id)
                             added_count += 1
-                            
-                            # コールバックを呼び出し（メディアダウンロード用）
-                            if on_tweet_fetched:
-                                on_tweet_fetched(tweet)
+                            # sink（メディアダウンロード等）が詰まっていればここで待つ
+                            self._accept_tweet(tweet, on_tweet_fetched)
                     
                     pbar.update(added_count)
-                    pbar.set_postfix({"取得済み": len(self.tweets)})
+                    pbar.set_postfix({"取得済み": self.tweet_count})
                     
                     # 新しいTweetがなければカウント
                     if added_count == 0:
@@ -417,7 +482,7 @@ class TwitterScraper:
                         no_new_tweets_count = 0
                     
                     # 最大Tweet数チェック
-                    if self.config.MAX_TWEETS > 0 and len(self.tweets) >= self.config.MAX_TWEETS:
+                    if self.config.MAX_TWEETS > 0 and self.tweet_count >= self.config.MAX_TWEETS:
                         logger.info(f"最大Tweet数({self.config.MAX_TWEETS})に達しました。")
                         break
 
@@ -434,8 +499,8 @@ class TwitterScraper:
                         while retry_count < max_retries and not retry_success:
                             retry_count += 1
                             try:
-                                self.page.goto(url, wait_until="domcontentloaded")
-                                time.sleep(self.config.ACTION_DELAY)
+                                self._goto(self.page, url)
+                                self._sleep(self.config.ACTION_DELAY, "action")
                                 self._wait_for_page_load()
                                 
                                 # 429エラーがまだ続いているかチェック
@@ -461,7 +526,7 @@ class TwitterScraper:
                             except Exception as e:
                                 if retry_count < max_retries:
                                     logger.warning(f"再試行 {retry_count}/{max_retries} 中にエラー: {e}。再試行します。")
-                                    time.sleep(5)  # 短い待機時間
+                                    self._sleep(5, "retry")  # 短い待機時間
                                     continue
                                 else:
                                     logger.error(f"再試行上限に達しました。エラー: {e}")
@@ -472,16 +537,15 @@ class TwitterScraper:
                         continue
                     
                     # スクロール
-                    self.page.evaluate("window.scrollTo(0, document.body.scrollHeight)")
-                    time.sleep(self.config.SCROLL_DELAY)
+                    self._scroll(self.page, added_count)
                     
                     scroll_count += 1
                     # 100回スクロールごとに待機時間を長くする
                     if scroll_count % 100 == 0:
                         logger.info(f"{scroll_count}回スクロールしました。少し待機します...")
-                        time.sleep(5)
+                        self._sleep(5, "scroll_pause")
             
-            logger.info(f"合計 {len(self.tweets)} 件のTweetを取得しました")
+            logger.info(f"合計 {self.tweet_count} 件のTweetを取得しました")
             return self.tweets
             
         except Exception as e:
@@ -496,7 +560,7 @@ class TwitterScraper:
         days_per_chunk: int,
         on_tweet_fetched: Optional[Callable[[Dict], None]] = None,
         parallel_chunks: Optional[bool] = None,
-    ) -> List[Dict]:
+    ) -> CompactTweets:
         """検索クエリで期間分割しながら取得
         
         Args:
@@ -533,7 +597,7 @@ class TwitterScraper:
         ranges: List[tuple],
         on_tweet_fetched: Optional[Callable[[Dict], None]] = None,
         downloader: Optional[object] = None,
-    ) -> List[Dict]:
+    ) -> CompactTweets:
         """検索チャンクを順次処理
         
         Args:
@@ -553,8 +617,8 @@ class TwitterScraper:
                     search_success = False
                     
                     while retry_count < max_retries and not search_success:
-                        self.page.goto(search_url, wait_until="domcontentloaded")
-                        time.sleep(self.config.ACTION_DELAY)
+                        self._goto(self.page, search_url)
+                        self._sleep(self.config.ACTION_DELAY, "action")
                         self._wait_for_page_load()
                         
                         # 429エラーチェック
@@ -566,7 +630,7 @@ class TwitterScraper:
                                 if retry_count <= 2:
                                     wait_time = 10  # 10秒待機
                                     logger.info(f"{wait_time}秒待機して再試行します...")
-                                    time.sleep(wait_time)
+                                    self._sleep(wait_time, "rate_limit")
                                 else:
                                     # 3回目以降は長い待機
                                     self._handle_rate_limit()
@@ -594,16 +658,12 @@ class TwitterScraper:
                         for tweet in new_tweets:
                             tweet_id = tweet.get("tweet_id")
                             if tweet_id and tweet_id not in seen_tweet_ids:
-                                self.tweets.append(tweet)
-                                chunk_tweets.append(tweet)  # チャンク用にも保存
+                                chunk_tweets.append(tweet)  # チャンクごとのダウンロード用
                                 seen_tweet_ids.add(tweet_id)
                                 added += 1
-                                
-                                # コールバックを呼び出し（メディアダウンロード用）
-                                if on_tweet_fetched:
-                                    on_tweet_fetched(tweet)
+                                self._accept_tweet(tweet, on_tweet_fetched)
                         pbar.update(added)
-                        pbar.set_postfix({"取得済み": len(self.tweets)})
+                        pbar.set_postfix({"取得済み": self.tweet_count})
 
                         if added == 0:
                             no_new_tweets_count += 1
@@ -612,7 +672,7 @@ class TwitterScraper:
                         else:
                             no_new_tweets_count = 0
 
-                        if self.config.MAX_TWEETS > 0 and len(self.tweets) >= self.config.MAX_TWEETS:
+                        if self.config.MAX_TWEETS > 0 and self.tweet_count >= self.config.MAX_TWEETS:
                             logger.info(f"最大Tweet数({self.config.MAX_TWEETS})に達しました。")
                             # チャンクごとのメディアダウンロード
                             if downloader and chunk_tweets:
@@ -621,12 +681,8 @@ class TwitterScraper:
                                 if self.media_author_filter:
                                     tweets_for_media = [t for t in chunk_tweets if is_target_author(t, self.media_author_filter)]
                                 if tweets_for_media:
-                                    downloaded_chunk = downloader.download_media(tweets_for_media)
-                                    downloaded_map = {t.get("tweet_id"): t for t in downloaded_chunk}
-                                    for tweet in self.tweets:
-                                        tid = tweet.get("tweet_id")
-                                        if tid in downloaded_map:
-                                            tweet["media"] = downloaded_map[tid].get("media", [])
+                                    # download_media はTweetのmediaをその場で更新する
+                                    downloader.download_media(tweets_for_media)
                             return self.tweets
 
                         if self._is_rate_limited():
@@ -642,8 +698,8 @@ class TwitterScraper:
                                 retry_count += 1
                                 try:
                                     # 検索URLに再度アクセス
-                                    self.page.goto(search_url, wait_until="domcontentloaded")
-                                    time.sleep(self.config.ACTION_DELAY)
+                                    self._goto(self.page, search_url)
+                                    self._sleep(self.config.ACTION_DELAY, "action")
                                     self._wait_for_page_load()
                                     
                                     # 429エラーがまだ続いているかチェック
@@ -667,7 +723,7 @@ class TwitterScraper:
                                 except Exception as e:
                                     if retry_count < max_retries:
                                         logger.warning(f"再試行 {retry_count}/{max_retries} 中にエラー: {e}。再試行します。")
-                                        time.sleep(5)  # 短い待機時間
+                                        self._sleep(5, "retry")  # 短い待機時間
                                         continue
                                     else:
                                         logger.warning(f"再試行上限に達しました。チャンク {since_d} - {until_d} をスキップします。エラー: {e}")
@@ -679,8 +735,7 @@ class TwitterScraper:
                             continue
 
                         # スクロール
-                        self.page.evaluate("window.scrollTo(0, document.body.scrollHeight)")
-                        time.sleep(self.config.SCROLL_DELAY)
+                        self._scroll(self.page, added)
                     
                     # チャンクごとのメディアダウンロード
                     if downloader and chunk_tweets:
@@ -689,18 +744,14 @@ class TwitterScraper:
                         if self.media_author_filter:
                             tweets_for_media = [t for t in chunk_tweets if is_target_author(t, self.media_author_filter)]
                         if tweets_for_media:
-                            downloaded_chunk = downloader.download_media(tweets_for_media)
-                            downloaded_map = {t.get("tweet_id"): t for t in downloaded_chunk}
-                            for tweet in self.tweets:
-                                tid = tweet.get("tweet_id")
-                                if tid in downloaded_map:
-                                    tweet["media"] = downloaded_map[tid].get("media", [])
+                            # download_media はTweetのmediaをその場で更新する
+                            downloader.download_media(tweets_for_media)
                         
                 except Exception as e:
                     logger.error(f"検索チャンク取得中にエラー: {e}", exc_info=True)
                     continue
 
-        logger.info(f"合計 {len(self.tweets)} 件のTweetを取得しました（検索モード）")
+        logger.info(f"合計 {self.tweet_count} 件のTweetを取得しました（検索モード）")
         return self.tweets
     
     def _get_tweets_by_search_parallel(
@@ -708,19 +759,17 @@ class TwitterScraper:
         username: str,
         ranges: List[tuple],
         on_tweet_fetched: Optional[Callable[[Dict], None]] = None,
-    ) -> List[Dict]:
+    ) -> CompactTweets:
         """検索チャンクを並行処理"""
         from concurrent.futures import ThreadPoolExecutor, as_completed
         import threading
         
         seen_tweet_ids = set()
         seen_lock = threading.Lock()
-        all_tweets = []
-        tweets_lock = threading.Lock()
         
-        def process_chunk(since_d: str, until_d: str) -> List[Dict]:
-            """単一チャンクを処理"""
-            chunk_tweets = []
+        def process_chunk(since_d: str, until_d: str) -> int:
+            """単一チャンクを処理（受け付けた件数を返す）"""
+            chunk_count = 0
             chunk_seen_ids = set()
             
             # 各スレッドで独立したPlaywrightインスタンスを作成
@@ -768,8 +817,8 @@ class TwitterScraper:
                 search_success = False
                 
                 while retry_count < max_retries and not search_success:
-                    page.goto(search_url, wait_until="domcontentloaded")
-                    time.sleep(self.config.ACTION_DELAY)
+                    self._goto(page, search_url)
+                    self._sleep(self.config.ACTION_DELAY, "action")
                     
                     # ページ読み込み待機
                     try:
@@ -781,6 +830,7 @@ class TwitterScraper:
                     try:
                         body_text = page.inner_text("body")
                         if any(k in body_text for k in ["Too Many Requests", "429", "問題が発生しました"]):
+                            _RATE_LIMITED.inc()
                             retry_count += 1
                             if retry_count < max_retries:
                                 logger.warning(f"[並行] 検索アクセス時に429エラーを検知。リトライ {retry_count}/{max_retries}: {since_d} - {until_d}")
@@ -788,10 +838,10 @@ class TwitterScraper:
                                 if retry_count <= 2:
                                     wait_time = 10  # 10秒待機
                                     logger.info(f"[並行] {wait_time}秒待機して再試行します...")
-                                    time.sleep(wait_time)
+                                    self._sleep(wait_time, "rate_limit")
                                 else:
                                     # 3回目以降は長い待機
-                                    time.sleep(60)  # 1分待機
+                                    self._sleep(60, "rate_limit")  # 1分待機
                                 continue
                             else:
                                 logger.error(f"[並行] 検索アクセスのリトライ上限に達しました。チャンク {since_d} - {until_d} をスキップします。")
@@ -809,15 +859,16 @@ class TwitterScraper:
                 
                 for _ in range(scroll_limit):
                     # Tweet抽出
-                    tweet_elements = page.query_selector_all('article[data-testid="tweet"]')
-                    new_tweets = []
-                    for element in tweet_elements:
-                        try:
-                            tweet = self._parse_tweet_element(element)
-                            if tweet:
-                                new_tweets.append(tweet)
-                        except:
-                            continue
+                    with _EXTRACT_SECONDS.time():
+                        tweet_elements = page.query_selector_all('article[data-testid="tweet"]')
+                        new_tweets = []
+                        for element in tweet_elements:
+                            try:
+                                tweet = self._parse_tweet_element(element)
+                                if tweet:
+                                    new_tweets.append(tweet)
+                            except:
+                                continue
                     
                     added = 0
                     for tweet in new_tweets:
@@ -827,14 +878,13 @@ class TwitterScraper:
                             
                             # グローバルな重複チェック
                             with seen_lock:
-                                if tweet_id not in seen_tweet_ids:
-                                    seen_tweet_ids.add(tweet_id)
-                                    chunk_tweets.append(tweet)
-                                    added += 1
-                                    
-                                    # コールバックを呼び出し
-                                    if on_tweet_fetched:
-                                        on_tweet_fetched(tweet)
+                                is_new = tweet_id not in seen_tweet_ids
+                                seen_tweet_ids.add(tweet_id)
+                            if is_new:
+                                added += 1
+                                # sinkが詰まっていれば待つ（ロックの外で待ち、他のチャンクを止めない）
+                                self._accept_tweet(tweet, on_tweet_fetched)
+                    chunk_count += added
                     
                     if added == 0:
                         no_new_tweets_count += 1
@@ -843,17 +893,16 @@ class TwitterScraper:
                     else:
                         no_new_tweets_count = 0
                     
-                    if self.config.MAX_TWEETS > 0:
-                        with tweets_lock:
-                            if len(all_tweets) >= self.config.MAX_TWEETS:
-                                break
+                    if self.config.MAX_TWEETS > 0 and self.tweet_count >= self.config.MAX_TWEETS:
+                        break
                     
                     # レートリミットチェック
                     try:
                         body_text = page.inner_text("body")
                         if any(k in body_text for k in ["Too Many Requests", "429", "問題が発生しました"]):
+                            _RATE_LIMITED.inc()
                             logger.warning(f"[並行] スクロール中に429エラーを検知。検索を再試行します: {since_d} - {until_d}")
-                            time.sleep(60)  # 1分待機
+                            self._sleep(60, "rate_limit")  # 1分待機
                             
                             # 検索URLに再度アクセス（最大3回リトライ）
                             retry_count = 0
@@ -864,8 +913,8 @@ class TwitterScraper:
                                 retry_count += 1
                                 try:
                                     # 検索URLに再度アクセス
-                                    page.goto(search_url, wait_until="domcontentloaded")
-                                    time.sleep(self.config.ACTION_DELAY)
+                                    self._goto(page, search_url)
+                                    self._sleep(self.config.ACTION_DELAY, "action")
                                     try:
                                         page.wait_for_load_state("networkidle", timeout=30000)
                                     except:
@@ -875,9 +924,10 @@ class TwitterScraper:
                                     try:
                                         body_text = page.inner_text("body")
                                         if any(k in body_text for k in ["Too Many Requests", "429", "問題が発生しました"]):
+                                            _RATE_LIMITED.inc()
                                             if retry_count < max_retries:
                                                 logger.warning(f"[並行] 再試行 {retry_count}/{max_retries} でも429エラーが続いています。待機後に再試行します: {since_d} - {until_d}")
-                                                time.sleep(60)  # 1分待機
+                                                self._sleep(60, "rate_limit")  # 1分待機
                                                 continue
                                             else:
                                                 logger.error(f"[並行] 再試行上限に達しました。チャンク {since_d} - {until_d} をスキップします。")
@@ -891,7 +941,7 @@ class TwitterScraper:
                                 except Exception as e:
                                     if retry_count < max_retries:
                                         logger.warning(f"[並行] 再試行 {retry_count}/{max_retries} 中にエラー: {e}。再試行します: {since_d} - {until_d}")
-                                        time.sleep(5)  # 短い待機時間
+                                        self._sleep(5, "retry")  # 短い待機時間
                                         continue
                                     else:
                                         logger.error(f"[並行] 再試行上限に達しました。チャンク {since_d} - {until_d} をスキップします。エラー: {e}")
@@ -905,15 +955,14 @@ class TwitterScraper:
                         pass
                     
                     # スクロール
-                    page.evaluate("window.scrollTo(0, document.body.scrollHeight)")
-                    time.sleep(self.config.SCROLL_DELAY)
+                    self._scroll(page, added)
                 
-                logger.info(f"[並行] 完了: {since_d} - {until_d} ({len(chunk_tweets)}件)")
-                return chunk_tweets
+                logger.info(f"[並行] 完了: {since_d} - {until_d} ({chunk_count}件)")
+                return chunk_count
                 
             except Exception as e:
                 logger.error(f"[並行] チャンク取得エラー ({since_d} - {until_d}): {e}", exc_info=True)
-                return []
+                return chunk_count
             finally:
                 # リソースを確実にクリーンアップ
                 try:
@@ -937,28 +986,25 @@ class TwitterScraper:
         logger.info(f"検索チャンクを並行処理します（{len(ranges)}チャンク、最大{max_workers}並行）")
         
         with ThreadPoolExecutor(max_workers=max_workers) as executor:
-            futures = {executor.submit(process_chunk, since_d, until_d): (since_d, until_d) 
+            futures = {executor.submit(PROFILER.wrap("scrape", process_chunk), since_d, until_d): (since_d, until_d) 
                       for since_d, until_d in ranges}
             
             with tqdm(desc="検索で取得中（並行）", unit="件", total=len(ranges)) as pbar:
                 for future in as_completed(futures):
                     since_d, until_d = futures[future]
                     try:
-                        chunk_tweets = future.result()
-                        with tweets_lock:
-                            all_tweets.extend(chunk_tweets)
-                            pbar.update(1)
-                            pbar.set_postfix({"取得済み": len(all_tweets)})
+                        future.result()
+                        pbar.update(1)
+                        pbar.set_postfix({"取得済み": self.tweet_count})
                     except Exception as e:
                         logger.error(f"チャンク処理エラー ({since_d} - {until_d}): {e}")
                         pbar.update(1)
                     
-                    if self.config.MAX_TWEETS > 0 and len(all_tweets) >= self.config.MAX_TWEETS:
+                    if self.config.MAX_TWEETS > 0 and self.tweet_count >= self.config.MAX_TWEETS:
                         logger.info(f"最大Tweet数({self.config.MAX_TWEETS})に達しました。")
                         break
         
-        self.tweets = all_tweets
-        logger.info(f"合計 {len(self.tweets)} 件のTweetを取得しました（検索モード・並行処理）")
+        logger.info(f"合計 {self.tweet_count} 件のTweetを取得しました（検索モード・並行処理）")
         return self.tweets
 
     def _generate_date_ranges(self, start: datetime.date, end: datetime.date, days: int):
@@ -974,6 +1020,10 @@ class TwitterScraper:
     
     def _extract_tweets(self) -> List[Dict]:
         """現在のページからTweetを抽出"""
+        with _EXTRACT_SECONDS.time():
+            return self._extract_tweets_from_page()
+
+    def _extract_tweets_from_page(self) -> List[Dict]:
         tweets = []
         
         try:
@@ -1169,13 +1219,12 @@ class TwitterScraper:
         seen_urls = set()
         
         try:
-            # 画像を取得
+            # 画像を取得（引用先ツイートのものとプロフィール画像は除き、1回の呼び出しでsrcをまとめて取る）
             try:
-                img_elements = element.query_selector_all('img[src*="pbs.twimg.com"]')
-                for idx, img in enumerate(img_elements):
+                img_srcs = element.evaluate(_OWN_IMAGE_SRCS_JS, _QUOTED_TWEET_SELECTOR)
+                for idx, src in enumerate(img_srcs):
                     try:
-                        src = img.get_attribute('src')
-                        if src and 'profile_images' not in src:  # プロフィール画像を除外
+                        if src:
                             # 動画ツイートの場合、サムネイル画像（ext_tw_video_thumb等）が混ざることがある
                             # これをphoto扱いすると「動画なのにphoto」問題が発生するため、別タイプで保持する
                             media_type = 'photo'
@@ -1184,10 +1233,8 @@ class TwitterScraper:
 
                                 # 可能なら実動画URLを拾ってvideoも追加する
                                 try:
-                                    video_src = self._resolve_video_from_api(tweet_id)
-                                    if not video_src:
-                                        html = element.inner_html() or ""
-                                        video_src = self._pick_video_url_from_html(html)
+                                    with TRACER.span("resolve", tweet_id, idx) as span:
+                                        video_src, span["resolver"] = self.video_resolvers.resolve(tweet_id, element)
 
                                     if video_src and not video_src.startswith("blob:") and video_src not in seen_urls:
                                         media_list.append({
@@ -1212,9 +1259,12 @@ class TwitterScraper:
             except Exception:
                 pass  # 画像取得に失敗しても続行
             
-            # 動画を取得
+            # 動画を取得（引用先ツイートのものは除く）
             try:
                 video_elements = element.query_selector_all('video')
+                if video_elements:
+                    own = element.evaluate(_OWN_VIDEO_MASK_JS, _QUOTED_TWEET_SELECTOR)
+                    video_elements = [v for v, keep in zip(video_elements, own) if keep]
                 for idx, video in enumerate(video_elements):
                     try:
                         # 1) video[src] を優先（稀に直MP4が入る）
@@ -1233,17 +1283,10 @@ class TwitterScraper:
                             except Exception:
                                 pass
 
-                        # 3) element内HTMLから video.twimg.com のURLを正規表現で拾う（blob対策）
-                        if not src or (isinstance(src, str) and src.startswith("blob:")):
-                            try:
-                                html = element.inner_html() or ""
-                                src = self._pick_video_url_from_html(html)
-                            except Exception:
-                                pass
-
-                        # 4) それでもダメなら Syndication API を試す（最も確実）
+                        # 3) element内HTMLの正規表現 / Syndication API を、成功率の高い順に試す（blob対策）
                         if not src or (isinstance(src, str) and src.startswith("blob:")):
-                            src = self._resolve_video_from_api(tweet_id)
+                            with TRACER.span("resolve", tweet_id, idx) as span:
+                                src, span["resolver"] = self.video_resolvers.resolve(tweet_id, element)
 
                         # URLが取得できた場合のみ追加
                         if src and not src.startswith("blob:") and src not in seen_urls:
@@ -1284,7 +1327,7 @@ class TwitterScraper:
         return None
 
     def _resolve_video_from_api(self, tweet_id: str) -> Optional[str]:
-        """Syndication APIを使って動画URLを取得（最も高画質なMP4/WebMを選択）"""
+        """Syndication APIを使って動画URLを取得（画質プロファイルに合うMP4/WebMを選択）"""
         url = f"https://cdn.syndication.twimg.com/tweet-result?id={tweet_id}&lang=en"
         try:
             # ログイン不要のエンドポイント
@@ -1305,21 +1348,34 @@ class TwitterScraper:
                 return None
                 
             variants = video_info.get("variants", [])
-            # 最もビットレートが高いMP4を優先。無ければWebM。最後にm3u8。
-            mp4s = [v for v in variants if v.get("content_type") == "video/mp4" and v.get("url")]
-            webms = [v for v in variants if v.get("content_type") == "video/webm" and v.get("url")]
-            if mp4s:
-                mp4s.sort(key=lambda x: x.get("bitrate", 0), reverse=True)
-                return mp4s[0].get("url")
-            if webms:
-                webms.sort(key=lambda x: x.get("bitrate", 0), reverse=True)
-                return webms[0].get("url")
-
-            m3u8s = [v for v in variants if v.get("url") and ".m3u8" in v.get("url")]
-            return m3u8s[0].get("url") if m3u8s else None
+            # MP4優先。無ければWebM。最後にm3u8。ビットレートは画質プロファイルに従う（既定は最高）
+            picked = pick_video_variant(variants, get_profile())
+            return picked.get("url") if picked else None
         except Exception:
             return None
 
+    def add_sink(self, sink: TweetSink) -> None:
+        """受け付けたTweetの送り先を追加する"""
+        self.sinks.append(sink)
+
+    def _accept_tweet(self, tweet: Dict, on_tweet_fetched: Optional[Callable[[Dict], None]] = None) -> None:
+        """新しいTweetを受け付け、各sinkとコールバックに渡す（戻るまで次のスクロールに進まない）"""
+        TRACER.instant("discover", tweet.get('tweet_id'), media=len(tweet.get('media') or []))
+        with self._accept_lock:
+            self.tweet_count += 1
+            if self.keep_tweets:
+                self.tweets.append(tweet)
+        for sink in self.sinks:
+            sink.accept(tweet)
+        if on_tweet_fetched:
+            on_tweet_fetched(tweet)
+
+    def record_media(self, tweet_id: Optional[str], media: Dict) -> None:
+        """保持しているTweetにメディアのダウンロード結果を反映する（MediaDownloader.on_media_downloaded 用）"""
+        if self.keep_tweets:
+            with self._accept_lock:
+                self.tweets.update_media(tweet_id, media)
+
     def _is_rate_limited(self) -> bool:
         """429/問題発生ページを検知"""
         try:
@@ -1331,19 +1387,23 @@ class TwitterScraper:
                 "再読み込みしてください",
                 "やりなおす",
             ]
-            return any(k in body_text for k in keywords)
+            limited = any(k in body_text for k in keywords)
         except Exception:
             return False
+        if limited:
+            _RATE_LIMITED.inc()
+        return limited
 
     def _handle_rate_limit(self):
         """レートリミット検知時の待機"""
         logger.warning(f"429/レートリミットを検知。{self.rate_limit_wait}秒（約{self.rate_limit_wait//60}分）待機します。")
-        time.sleep(self.rate_limit_wait)
+        self._sleep(self.rate_limit_wait, "rate_limit")
         # 連続で当たる場合は待機時間を伸ばす（上限1時間）
         self.rate_limit_wait = min(self.rate_limit_wait * 2, 3600)
     
     def close(self):
         """ブラウザを閉じる"""
+        self.video_resolvers.save()
         if self.context:
             self.context.close()
             logger.info("ブラウザコンテキストを閉じました")
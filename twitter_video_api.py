@@ -2,194 +2,267 @@
 
 from __future__ import annotations
 
-import json
-import time
-from pathlib import Path
+import asyncio
+import threading
+from concurrent.futures import Future
 from typing import Dict, List, Optional
 
 import requests
-from playwright.sync_api import sync_playwright
+from playwright.async_api import async_playwright
 
 from config import Config
-
-# region agent log
-_DEBUG_LOG_PATH = r"h:\document\program\project\getTweet\.cursor\debug.log"
-_LOCAL_DEBUG_NDJSON = str((Path(__file__).resolve().parent / "debug.ndjson"))
-_LOCAL_CURSOR_DEBUG = str((Path(__file__).resolve().parent / ".cursor" / "debug.log"))
-
-
-def _agent_log(hypothesisId: str, location: str, message: str, data: Optional[Dict] = None, runId: str = "pre") -> None:
-    try:
-        payload = {
-            "sessionId": "debug-session",
-            "runId": runId,
-            "hypothesisId": hypothesisId,
-            "location": location,
-            "message": message,
-            "data": data or {},
-            "timestamp": int(time.time() * 1000),
-        }
-        line = json.dumps(payload, ensure_ascii=False) + "\n"
-        for p in (_DEBUG_LOG_PATH, _LOCAL_DEBUG_NDJSON, _LOCAL_CURSOR_DEBUG):
-            try:
-                Path(p).parent.mkdir(parents=True, exist_ok=True)
-                with open(p, "a", encoding="utf-8") as f:
-                    f.write(line)
-            except Exception:
-                pass
-    except Exception:
-        pass
-
-
-def _safe_url_tag(url: Optional[str]) -> str:
-    try:
-        return (url or "")[:200]
-    except Exception:
-        return ""
-
-# endregion
+from hls_playlist import MasterPlaylist, fetch_playlist, select_variant
+from agent_log import agent_log as _agent_log, safe_url_tag as _safe_url_tag
 
 
 def _best_m3u8_from_master(m3u8_url: str, sess: requests.Session, referer: str) -> str:
-    """master m3u8なら最高帯域のvariantを選び、そうでなければそのまま返す"""
+    """master m3u8なら画質プロファイルに合うvariant（既定は最高帯域）を選び、そうでなければそのまま返す
+
+    解析結果は hls_playlist のキャッシュに残るので、後段のダウンロードでmasterを再取得しない。
+    """
     try:
         _agent_log("URL-FIX-1", "twitter_video_api.py:_best_m3u8_from_master", "enter", {"m3u8_url": _safe_url_tag(m3u8_url)})
-        r = sess.get(m3u8_url, timeout=20, headers={"Referer": referer})
-        if r.status_code != 200:
-            _agent_log("URL-FIX-1", "twitter_video_api.py:_best_m3u8_from_master", "status_not_200", {"status": r.status_code})
-            return m3u8_url
-        text = r.text or ""
-        if "#EXT-X-STREAM-INF" not in text:
+        playlist = fetch_playlist(m3u8_url, sess, referer)
+        if not isinstance(playlist, MasterPlaylist):
             _agent_log("URL-FIX-1", "twitter_video_api.py:_best_m3u8_from_master", "not_master_playlist", {})
             return m3u8_url
 
-        best_bw = -1
-        best_uri = None
-        lines = [ln.strip() for ln in text.splitlines() if ln.strip()]
-        for i, ln in enumerate(lines):
-            if ln.startswith("#EXT-X-STREAM-INF"):
-                bw = -1
-                try:
-                    for part in ln.split(","):
-                        if "BANDWIDTH=" in part:
-                            bw = int(part.split("BANDWIDTH=")[-1])
-                            break
-                except Exception:
-                    bw = -1
-                if i + 1 < len(lines):
-                    uri = lines[i + 1]
-                    if not uri.startswith("#") and bw > best_bw:
-                        best_bw = bw
-                        best_uri = uri
-
-        if not best_uri:
+        variant = select_variant(playlist.variants)
+        if variant is None:
             _agent_log("URL-FIX-1", "twitter_video_api.py:_best_m3u8_from_master", "no_best_uri", {})
             return m3u8_url
 
-        if best_uri.startswith("http"):
-            _agent_log("URL-FIX-1", "twitter_video_api.py:_best_m3u8_from_master", "absolute_uri", {"best_uri": _safe_url_tag(best_uri)})
-            return best_uri
-        
-        # region agent log - URL resolution fix
-        # URIが/で始まる場合はオリジン（プロトコル+ドメイン）からの絶対パス
-        # URIが/で始まらない場合は相対パス
-        if best_uri.startswith("/"):
-            # 絶対パス: オリジンと結合
-            from urllib.parse import urlparse
-            parsed = urlparse(m3u8_url)
-            origin = f"{parsed.scheme}://{parsed.netloc}"
-            resolved_url = f"{origin}{best_uri}"
-        else:
-            # 相対パス: ベースディレクトリと結合
-            base = m3u8_url.rsplit("/", 1)[0]
-            resolved_url = f"{base}/{best_uri}"
-        
-        _agent_log("URL-FIX-1", "twitter_video_api.py:_best_m3u8_from_master", "resolving_relative", {
+        _agent_log("URL-FIX-1", "twitter_video_api.py:_best_m3u8_from_master", "selected_variant", {
             "m3u8_url": _safe_url_tag(m3u8_url),
-            "best_uri": _safe_url_tag(best_uri),
-            "resolved_url": _safe_url_tag(resolved_url),
-            "is_absolute_path": best_uri.startswith("/")
+            "resolved_url": _safe_url_tag(variant.uri),
+            "bandwidth": variant.bandwidth,
         })
-        # endregion
-        return resolved_url
+        return variant.uri
     except Exception as e:
-        _agent_log("URL-FIX-1", "twitter_video_api.py:_best_m3u8_from_master", "exception", {"err": str(e)[:160]})
+        _agent_log("URL-FIX-1", "twitter_video_api.py:_best_m3u8_from_master", "exception", {"err": str(e)[:160]}, level="error")
         return m3u8_url
 
 
-def resolve_video_urls_with_playwright(tweet_url: str, max_wait_ms: int = 20000) -> List[str]:
-    """ツイートURLを開き、再生に使われるm3u8/mp4/webm URLをネットワークから捕捉する"""
-    found: List[str] = []
-    seen = set()
+_VIDEO_EXTS = (".m3u8", ".mp4", ".webm")
+# 動画URLの捕捉に不要なリソース（画像・フォント・CSS・動画本体）は読み込まない
+_BLOCKED_RESOURCE_TYPES = {"image", "font", "stylesheet", "media"}
+_USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
+
+
+def _is_video_request_url(url: str) -> bool:
+    return "video.twimg.com" in (url or "") and any(ext in url for ext in _VIDEO_EXTS)
+
+
+def _parse_cookie_header(cookie_header: str) -> List[Dict]:
+    """TWITTER_COOKIES（"k=v; k2=v2"）をPlaywrightのcookie形式にする"""
+    cookies = []
+    for item in (cookie_header or "").split(";"):
+        item = item.strip()
+        if "=" in item:
+            k, v = item.split("=", 1)
+            cookies.append({"name": k.strip(), "value": v.strip(), "domain": "twitter.com", "path": "/"})
+    return cookies
+
+
+class VideoResolverService:
+    """ブラウザを1つだけ起動し、ページのプールで複数ツイートの動画URLを並行解決するサービス
+
+    Playwrightは専用スレッドのイベントループ上で動かし、各スレッドからは submit()/resolve() で依頼する。
+    動画URLのリクエストが1件でも発生した時点で、そのツイートの解決を終える。
+
+    使い方:
+        with VideoResolverService(pages=3) as service:
+            urls = service.resolve(tweet_url)
+    """
+
+    def __init__(self, pages: int = 3, max_wait_ms: int = 20000, block_resources: bool = True):
+        self.pages = max(1, pages)
+        self.max_wait_ms = max_wait_ms
+        self.block_resources = block_resources
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._ready = threading.Event()
+        self._start_error: Optional[BaseException] = None
+        self._page_pool: Optional[asyncio.Queue] = None
+        self._stopped: Optional[asyncio.Event] = None
+        self.resolved = 0
+        self.failed = 0
+
+    def __enter__(self) -> "VideoResolverService":
+        self.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def start(self) -> None:
+        """ブラウザを起動する（起動済みなら何もしない。起動に失敗していれば同じ例外を送出）"""
+        if self._thread is not None:
+            return
+        if self._start_error is not None:
+            raise self._start_error
+        self._thread = threading.Thread(target=self._run_loop, name="video-resolver", daemon=True)
+        self._thread.start()
+        self._ready.wait()
+        if self._start_error is not None:
+            self._thread = None
+            raise self._start_error
+
+    def _run_loop(self) -> None:
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        try:
+            self._loop.run_until_complete(self._serve())
+        finally:
+            self._loop.close()
 
-    def on_request(req):
+    async def _serve(self) -> None:
+        self._stopped = asyncio.Event()
         try:
+            async with async_playwright() as p:
+                launch_opts = dict(headless=True, args=["--disable-blink-features=AutomationControlled"])
+                if Config.USE_SYSTEM_CHROME:
+                    launch_opts["channel"] = "chrome"
+                browser = await p.chromium.launch(**launch_opts)
+                context = await browser.new_context(viewport={"width": 1280, "height": 720}, user_agent=_USER_AGENT)
+                cookies = _parse_cookie_header(Config.TWITTER_COOKIES)
+                if cookies:
+                    try:
+                        await context.add_cookies(cookies)
+                    except Exception:
+                        pass
+                if self.block_resources:
+                    await context.route("**/*", self._route)
+
+                self._page_pool = asyncio.Queue()
+                for _ in range(self.pages):
+                    self._page_pool.put_nowait(await context.new_page())
+                _agent_log("H5", "twitter_video_api.py:VideoResolverService", "started", {"pages": self.pages})
+                self._ready.set()
+
+                await self._stopped.wait()
+                await context.close()
+                await browser.close()
+        except BaseException as e:
+            self._start_error = e
+            _agent_log("H5", "twitter_video_api.py:VideoResolverService", "start_failed", {"err": str(e)[:160]}, level="error")
+        finally:
+            self._ready.set()
+
+    @staticmethod
+    async def _route(route) -> None:
+        request = route.request
+        if _is_video_request_url(request.url):
+            # URLは request イベントで捕捉済み。動画本体は読み込まない
+            await route.abort()
+        elif request.resource_type in _BLOCKED_RESOURCE_TYPES:
+            await route.abort()
+        else:
+            await route.continue_()
+
+    async def _resolve(self, tweet_url: str) -> List[str]:
+        page = await self._page_pool.get()
+        found: List[str] = []
+        first = asyncio.get_running_loop().create_future()
+
+        def on_request(req):
             u = req.url
-            if "video.twimg.com" not in u:
-                return
-            if any(ext in u for ext in (".m3u8", ".mp4", ".webm")):
-                if u not in seen:
-                    seen.add(u)
-                    found.append(u)
-        except Exception:
-            return
+            if _is_video_request_url(u) and u not in found:
+                found.append(u)
+                if not first.done():
+                    first.set_result(u)
 
-    _agent_log("H5", "twitter_video_api.py:resolve_video_urls_with_playwright", "enter", {"tweet_url": _safe_url_tag(tweet_url)})
-
-    with sync_playwright() as p:
-        launch_opts = dict(headless=True, args=["--disable-blink-features=AutomationControlled"])
-        if Config.USE_SYSTEM_CHROME:
-            launch_opts["channel"] = "chrome"
-        browser = p.chromium.launch(**launch_opts)
-        context = browser.new_context(
-            viewport={"width": 1280, "height": 720},
-            user_agent="Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
-        )
-        if Config.TWITTER_COOKIES:
-            cookies = []
-            for item in Config.TWITTER_COOKIES.split(";"):
-                item = item.strip()
-                if "=" in item:
-                    k, v = item.split("=", 1)
-                    cookies.append({"name": k.strip(), "value": v.strip(), "domain": "twitter.com", "path": "/"})
-            if cookies:
-                try:
-                    context.add_cookies(cookies)
-                except Exception:
-                    pass
-
-        page = context.new_page()
         page.on("request", on_request)
-        page.goto(tweet_url, wait_until="domcontentloaded")
+        navigation = asyncio.ensure_future(self._open_and_play(page, tweet_url))
+        try:
+            await asyncio.wait_for(asyncio.shield(first), self.max_wait_ms / 1000.0)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            navigation.cancel()
+            page.remove_listener("request", on_request)
+            try:
+                # 読み込み中のページを止めて次の依頼に備える
+                await page.goto("about:blank")
+            except Exception:
+                pass
+            self._page_pool.put_nowait(page)
+        return found
 
-        # 動画再生を誘発
+    @staticmethod
+    async def _open_and_play(page, tweet_url: str) -> None:
         try:
-            btn = page.query_selector('button[data-testid="playButton"]')
+            await page.goto(tweet_url, wait_until="domcontentloaded")
+            # 動画再生を誘発
+            btn = await page.query_selector('button[data-testid="playButton"]')
             if btn:
-                btn.click(timeout=2000)
+                await btn.click(timeout=2000)
             else:
-                v = page.query_selector("video")
+                v = await page.query_selector("video")
                 if v:
-                    v.click(timeout=2000)
+                    await v.click(timeout=2000)
         except Exception:
             pass
 
-        deadline = time.time() + (max_wait_ms / 1000.0)
-        while time.time() < deadline:
-            if found:
-                break
-            time.sleep(0.2)
-
-        context.close()
-        browser.close()
-
-    _agent_log("H5", "twitter_video_api.py:resolve_video_urls_with_playwright", "exit", {"found": len(found), "sample": [_safe_url_tag(u) for u in found[:3]]})
-    return found
+    def submit(self, tweet_url: str) -> "Future[List[str]]":
+        """解決を依頼する（結果は concurrent.futures.Future）"""
+        self.start()
+        return asyncio.run_coroutine_threadsafe(self._resolve(tweet_url), self._loop)
 
+    def resolve(self, tweet_url: str) -> List[str]:
+        """ツイートの動画URL（m3u8/mp4/webm）を返す。見つからなければ空リスト"""
+        _agent_log("H5", "twitter_video_api.py:VideoResolverService.resolve", "enter", {"tweet_url": _safe_url_tag(tweet_url)})
+        try:
+            found = self.submit(tweet_url).result()
+        except Exception as e:
+            _agent_log("H5", "twitter_video_api.py:VideoResolverService.resolve", "exception", {"err": str(e)[:160]}, level="error")
+            found = []
+        if found:
+            self.resolved += 1
+        else:
+            self.failed += 1
+        _agent_log("H5", "twitter_video_api.py:VideoResolverService.resolve", "exit", {"found": len(found), "sample": [_safe_url_tag(u) for u in found[:3]]})
+        return found
+
+    def resolve_many(self, tweet_urls: List[str]) -> Dict[str, List[str]]:
+        """複数ツイートをページ数ぶん並行に解決する"""
+        futures = {url: self.submit(url) for url in dict.fromkeys(tweet_urls)}
+        results: Dict[str, List[str]] = {}
+        for url, future in futures.items():
+            try:
+                results[url] = future.result()
+            except Exception:
+                results[url] = []
+        return results
 
-def resolve_best_video_url(tweet_url: str) -> Optional[str]:
-    """ツイートURLから最適な動画URL（MP4優先、次にWebM、最後にm3u8）を返す"""
-    urls = resolve_video_urls_with_playwright(tweet_url)
+    def close(self) -> None:
+        """ブラウザを閉じる"""
+        if self._thread is None:
+            return
+        if self._loop is not None and self._stopped is not None:
+            self._loop.call_soon_threadsafe(self._stopped.set)
+        self._thread.join(timeout=30)
+        self._thread = None
+        _agent_log("H5", "twitter_video_api.py:VideoResolverService", "closed", {"resolved": self.resolved, "failed": self.failed})
+
+
+def resolve_video_urls_with_playwright(
+    tweet_url: str,
+    max_wait_ms: int = 20000,
+    service: Optional[VideoResolverService] = None,
+) -> List[str]:
+    """ツイートURLを開き、再生に使われるm3u8/mp4/webm URLをネットワークから捕捉する
+
+    service を渡せば起動済みのブラウザを使い回す（渡さなければこの1件のために起動する）。
+    """
+    if service is not None:
+        return service.resolve(tweet_url)
+    with VideoResolverService(pages=1, max_wait_ms=max_wait_ms) as one_shot:
+        return one_shot.resolve(tweet_url)
+
+
+def pick_best_video_url(urls: List[str], tweet_url: str) -> Optional[str]:
+    """捕捉したURLから最適な動画URL（MP4優先、次にWebM、最後にm3u8のvariant）を選ぶ"""
     if not urls:
         return None
 
@@ -203,29 +276,18 @@ def resolve_best_video_url(tweet_url: str) -> Optional[str]:
     if not m3u8s:
         return None
 
-    # region agent log
-    _agent_log("URL-FIX-2", "twitter_video_api.py:resolve_best_video_url", "calling_best_m3u8", {
-        "tweet_url": _safe_url_tag(tweet_url),
-        "m3u8_url": _safe_url_tag(m3u8s[0])
-    })
-    # endregion
-
     sess = requests.Session()
     if Config.TWITTER_COOKIES:
         sess.headers["Cookie"] = Config.TWITTER_COOKIES
     result = _best_m3u8_from_master(m3u8s[0], sess, referer=tweet_url)
-    
-    # region agent log
-    _agent_log("URL-FIX-2", "twitter_video_api.py:resolve_best_video_url", "returning_result", {
+    _agent_log("URL-FIX-2", "twitter_video_api.py:pick_best_video_url", "best_m3u8", {
+        "tweet_url": _safe_url_tag(tweet_url),
         "input_m3u8": _safe_url_tag(m3u8s[0]),
-        "result": _safe_url_tag(result)
+        "result": _safe_url_tag(result),
     })
-    # endregion
-    
     return result
 
 
-
-
-
-
+def resolve_best_video_url(tweet_url: str, service: Optional[VideoResolverService] = None) -> Optional[str]:
+    """ツイートURLから最適な動画URL（MP4優先、次にWebM、最後にm3u8）を返す"""
+    return pick_best_video_url(resolve_video_urls_with_playwright(tweet_url, service=service), tweet_url)
@@ -0,0 +1,255 @@
+"""動画URL解決手段のレジストリ（成功率とレイテンシから試す順番を決め、実行を跨いで統計を保存する）"""
+
+from __future__ import annotations
+
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from config import Config
+from run_metrics import METRICS
+
+logger = logging.getLogger(__name__)
+
+STATS_FILENAME = "resolver_stats.json"
+
+# 同じプロセス内の複数のレジストリが同時に保存しないように
+_SAVE_LOCK = threading.Lock()
+
+_RESOLVE_SECONDS = METRICS.histogram("resolver_latency_seconds", "動画URL解決1回の所要時間", ("resolver",))
+_RESOLVE_TOTAL = METRICS.counter("resolver_attempts_total", "動画URL解決の試行数（result=hit/miss）", ("resolver", "result"))
+
+
+class ResolverStats:
+    """1つの解決手段の累計（試行数・成功数・所要時間）"""
+
+    # 統計が少ないうちの事前分布（成功率1/2・1秒相当）
+    PRIOR_ATTEMPTS = 2
+    PRIOR_HITS = 1
+    PRIOR_LATENCY = 1.0
+
+    def __init__(self, attempts: int = 0, hits: int = 0, latency_total: float = 0.0):
+        self.attempts = attempts
+        self.hits = hits
+        self.latency_total = latency_total
+
+    @property
+    def success_rate(self) -> float:
+        return (self.hits + self.PRIOR_HITS) / (self.attempts + self.PRIOR_ATTEMPTS)
+
+    @property
+    def mean_latency(self) -> float:
+        return (self.latency_total + self.PRIOR_LATENCY) / (self.attempts + 1)
+
+    @property
+    def expected_cost(self) -> float:
+        """1件解決するまでに見込まれる秒数（順番はこれが小さい順が最適）"""
+        return self.mean_latency / self.success_rate
+
+    def to_dict(self) -> Dict:
+        return {"attempts": self.attempts, "hits": self.hits, "latency_total": round(self.latency_total, 3)}
+
+    def copy(self) -> "ResolverStats":
+        return ResolverStats(self.attempts, self.hits, self.latency_total)
+
+
+@contextmanager
+def _stats_file_lock(path: Path, timeout: float = 10.0, stale: float = 60.0) -> Iterator[None]:
+    """統計ファイルを別プロセスと同時に書き換えないためのロックファイル
+
+    timeout 秒待っても取れなければロック無しで進める（統計が多少ずれるだけなので止めない）。
+    stale 秒より古いロックファイルは落ちたプロセスの残骸とみなして消す。
+    """
+    lock_path = path.with_name(path.name + ".lock")
+    deadline = time.time() + timeout
+    fd = None
+    with _SAVE_LOCK:
+        while fd is None:
+            try:
+                fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                try:
+                    if time.time() - lock_path.stat().st_mtime > stale:
+                        lock_path.unlink()
+                        continue
+                except OSError:
+                    continue
+                if time.time() >= deadline:
+                    logger.warning(f"統計ファイルのロックを取得できないため、ロック無しで保存します: {lock_path}")
+                    break
+                time.sleep(0.05)
+        try:
+            yield
+        finally:
+            if fd is not None:
+                os.close(fd)
+                try:
+                    lock_path.unlink()
+                except OSError:
+                    pass
+
+
+class ResolverRegistry:
+    """解決手段を登録し、期待コストの小さい順に試すレジストリ
+
+    十分な試行があって成功率が skip_below 未満の手段は通常スキップし、
+    explore_every 回に1回だけ試して統計を更新する（状況が変われば戻ってこられるように）。
+    統計は stats_path（既定: OUTPUT_DIR/resolver_stats.json）に保存し、次回の実行で引き継ぐ。
+    呼び出し元ごとに namespace を分け（スクレイパーとサムネ解決では同じ名前の手段でも条件が違う）、
+    保存時はファイル上の最新値に前回の保存以降の増分を足して書く（他のレジストリの記録を消さない）。
+    """
+
+    def __init__(
+        self,
+        stats_path: Optional[Path] = None,
+        namespace: str = "default",
+        min_samples: int = 20,
+        skip_below: float = 0.05,
+        explore_every: int = 25,
+        max_history: int = 500,
+    ):
+        self.stats_path = Path(stats_path) if stats_path else Config.OUTPUT_DIR / STATS_FILENAME
+        self.namespace = namespace
+        self.min_samples = min_samples
+        self.skip_below = skip_below
+        self.explore_every = max(1, explore_every)
+        # 古い統計の重みを下げるため、試行数がこれを超えたら半分に縮める（_decay）
+        self.max_history = max_history
+        self._lock = threading.Lock()
+        self._resolvers: Dict[str, Callable[..., Optional[str]]] = {}
+        self._stats: Dict[str, ResolverStats] = {}
+        # 前回の読み込み/保存以降にこのレジストリで記録した分（縮める前の増分。保存時にファイルの値へ足す）
+        self._pending: Dict[str, ResolverStats] = {}
+        self._calls = 0
+        self.load()
+
+    def register(self, name: str, func: Callable[..., Optional[str]]) -> None:
+        """解決手段を登録する（func は動画URLか None を返す）。登録順は統計が無いときの順番"""
+        self._resolvers[name] = func
+        self._stats.setdefault(name, ResolverStats())
+
+    def stats(self, name: str) -> ResolverStats:
+        return self._stats.setdefault(name, ResolverStats())
+
+    def order(self, names: Optional[List[str]] = None) -> List[str]:
+        """今回試す順番（スキップ対象は除く）"""
+        names = [n for n in (names or list(self._resolvers)) if n in self._resolvers]
+        with self._lock:
+            self._calls += 1
+            explore = self._calls % self.explore_every == 0
+            registered = {n: i for i, n in enumerate(self._resolvers)}
+            ranked = sorted(names, key=lambda n: (self._stats[n].expected_cost, registered[n]))
+            if explore:
+                return ranked
+            kept = [
+                n for n in ranked
+                if self._stats[n].attempts < self.min_samples or self._stats[n].success_rate >= self.skip_below
+            ]
+            # 全部スキップ対象なら、最も期待コストの小さいものだけは試す
+            return kept or ranked[:1]
+
+    def record(self, name: str, hit: bool, latency: float) -> None:
+        _RESOLVE_SECONDS.observe(max(0.0, latency), resolver=name)
+        _RESOLVE_TOTAL.inc(resolver=name, result="hit" if hit else "miss")
+        with self._lock:
+            for stats in (self._stats.setdefault(name, ResolverStats()), self._pending.setdefault(name, ResolverStats())):
+                stats.attempts += 1
+                stats.hits += 1 if hit else 0
+                stats.latency_total += max(0.0, latency)
+            # 縮めるのは手元の値だけ（増分には含めない。ファイルの値は保存時に足してから縮める）
+            self._decay(self._stats[name])
+
+    def _decay(self, stats: ResolverStats) -> None:
+        """試行数が max_history を超えたら半分に縮める（古い統計の重みを下げる）"""
+        while stats.attempts > self.max_history:
+            stats.attempts //= 2
+            stats.hits //= 2
+            stats.latency_total /= 2
+
+    def resolve(self, *args, names: Optional[List[str]] = None) -> Tuple[Optional[str], Optional[str]]:
+        """順番に試し、(動画URL, 解決できた手段名) を返す。解決できなければ (None, None)"""
+        for name in self.order(names):
+            start = time.perf_counter()
+            try:
+                url = self._resolvers[name](*args)
+            except Exception as e:
+                logger.debug(f"動画URL解決エラー ({name}): {e}")
+                url = None
+            self.record(name, bool(url), time.perf_counter() - start)
+            if url:
+                return url, name
+        return None, None
+
+    def _read_file(self) -> Dict:
+        try:
+            with open(self.stats_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return {}
+        except Exception as e:
+            logger.debug(f"解決手段の統計を読み込めませんでした: {self.stats_path}: {e}")
+            return {}
+        return data if isinstance(data, dict) else {}
+
+    def _namespace_stats(self, data: Dict) -> Dict[str, ResolverStats]:
+        entries = (data.get("namespaces") or {}).get(self.namespace)
+        if entries is None:
+            # namespace を分ける前の形式（全体で1つ）。まだ自分の namespace が無ければ初期値として使う
+            entries = data.get("resolvers") or {}
+        return {
+            name: ResolverStats(int(entry.get("attempts", 0)), int(entry.get("hits", 0)), float(entry.get("latency_total", 0.0)))
+            for name, entry in entries.items()
+            if isinstance(entry, dict)
+        }
+
+    def load(self) -> None:
+        stats = self._namespace_stats(self._read_file())
+        with self._lock:
+            self._stats.update({name: s.copy() for name, s in stats.items()})
+            self._pending = {}
+
+    def save(self) -> None:
+        """統計を保存する（ファイル上の最新値 + 前回以降の増分を縮めたもの。他の namespace はそのまま残す）"""
+        try:
+            self.stats_path.parent.mkdir(parents=True, exist_ok=True)
+            with _stats_file_lock(self.stats_path):
+                data = self._read_file()
+                current = self._namespace_stats(data)
+                with self._lock:
+                    merged = {}
+                    for name in sorted(set(current) | set(self._stats)):
+                        cur = current.get(name, ResolverStats())
+                        added = self._pending.get(name, ResolverStats())
+                        stats = ResolverStats(
+                            cur.attempts + added.attempts,
+                            min(cur.attempts + added.attempts, cur.hits + added.hits),
+                            cur.latency_total + added.latency_total,
+                        )
+                        # 縮めるのは足し合わせた後（他のプロセスの記録を負の増分で減らさない）
+                        self._decay(stats)
+                        merged[name] = stats
+                    # 他のレジストリの記録も取り込んだ値を手元の値にし、増分は空に戻す
+                    self._stats.update({name: s.copy() for name, s in merged.items()})
+                    self._pending = {}
+                data.setdefault("namespaces", {})[self.namespace] = {name: s.to_dict() for name, s in merged.items()}
+                data["updated_at"] = time.strftime("%Y-%m-%dT%H:%M:%S")
+                tmp = self.stats_path.with_name(self.stats_path.name + ".tmp")
+                with open(tmp, "w", encoding="utf-8") as f:
+                    json.dump(data, f, ensure_ascii=False, indent=2)
+                os.replace(tmp, self.stats_path)
+        except Exception as e:
+            logger.warning(f"解決手段の統計を保存できませんでした: {e}")
+
+    def summary(self) -> str:
+        with self._lock:
+            parts = [
+                f"{name} {stats.hits}/{stats.attempts} 平均{stats.mean_latency:.2f}秒"
+                for name, stats in sorted(self._stats.items(), key=lambda kv: kv[1].expected_cost)
+                if stats.attempts
+            ]
+        return ", ".join(parts)